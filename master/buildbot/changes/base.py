@@ -42,6 +42,12 @@ class PollingChangeSource(ChangeSource):
     The rest is taken care of.
 
     Any subclass will be available via the "poller" webhook.
+
+    When the source is a child of the L{ChangeManager}, its polls are
+    scheduled by the manager's L{PollScheduler}, which uses
+    C{lastPollChanges} and C{lastPollFailed} to adjust the interval between
+    them.  Subclasses should add their changes with C{addChange} or
+    C{addChanges}, so that they are counted.
     """
 
     pollInterval = 60
@@ -50,7 +56,14 @@ class PollingChangeSource(ChangeSource):
     pollAtLaunch = False
     "determines when the first poll occurs. True = immediately on launch, False = wait for one pollInterval."
 
+    lastPollChanges = 0
+    "the number of changes added by the last poll"
+
+    lastPollFailed = False
+    "true if the last poll failed"
+
     _loop = None
+    _scheduler = None
 
     def __init__(self, name=None, pollInterval=60 * 10, pollAtLaunch=False):
         if name:
@@ -67,10 +80,32 @@ class PollingChangeSource(ChangeSource):
         It is serialiazed - if you call it while a poll is in progress
         then the 2nd invocation won't start until the 1st has finished.
         """
+        self.lastPollChanges = 0
+        self.lastPollFailed = False
         d = defer.maybeDeferred(self.poll)
-        d.addErrback(log.err, 'while polling for changes')
+
+        @d.addErrback
+        def failed(f):
+            self.lastPollFailed = True
+            log.err(f, 'while polling for changes')
         return d
 
+    def addChange(self, **kwargs):
+        """
+        Add a change with the master's C{addChange}, counting it in
+        C{lastPollChanges}.
+        """
+        self.lastPollChanges += 1
+        return self.master.addChange(**kwargs)
+
+    def addChanges(self, changes):
+        """
+        Add several changes with the master's C{addChanges}, counting them in
+        C{lastPollChanges}.
+        """
+        self.lastPollChanges += len(changes)
+        return self.master.addChanges(changes)
+
     def poll(self):
         """
         Perform the polling operation, and return a deferred that will fire
@@ -93,11 +128,17 @@ class PollingChangeSource(ChangeSource):
         # delay starting doing anything until the reactor is running - if
         # services are still starting up, they may miss an initial flood of
         # changes
-        if self.pollInterval:
+        self._scheduler = getattr(self.parent, 'pollScheduler', None)
+        if self._scheduler:
+            reactor.callWhenRunning(self._scheduler.addSource, self)
+        elif self.pollInterval:
             reactor.callWhenRunning(self.startLoop)
         else:
             reactor.callWhenRunning(self.doPoll)
 
     def stopService(self):
+        if self._scheduler:
+            self._scheduler.removeSource(self)
+            self._scheduler = None
         self.stopLoop()
         return ChangeSource.stopService(self)
@@ -132,7 +132,7 @@ class BitbucketPullrequestPoller(base.PollingChangeSource):
                     # update database
                     yield self._setCurrentRev(nr, revision)
                     # emit the change
-                    yield self.master.addChange(
+                    yield self.addChange(
                         author=author,
                         revision=revision,
                         revlink=revlink,
@@ -287,8 +287,8 @@ class BonsaiPoller(base.PollingChangeSource):
             files = [file.filename + ' (revision ' + file.revision + ')'
                      for file in cinode.files]
             self.lastChange = self.lastPoll
-            yield self.master.addChange(author=cinode.who,
-                                        files=files,
-                                        comments=cinode.log,
-                                        when_timestamp=epoch2datetime(cinode.date),
-                                        branch=self.branch)
+            yield self.addChange(author=cinode.who,
+                                 files=files,
+                                 comments=cinode.log,
+                                 when_timestamp=epoch2datetime(cinode.date),
+                                 branch=self.branch)
@@ -13,13 +13,15 @@
 #
 # Copyright Buildbot Team Members
 
-import itertools
 import os
-import re
 import urllib
 
 from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet import protocol
+from twisted.internet import reactor
 from twisted.internet import utils
+from twisted.python import failure
 from twisted.python import log
 
 from buildbot import config
@@ -28,6 +30,72 @@ from buildbot.util import epoch2datetime
 from buildbot.util.state import StateMixin
 
 
+class _GitLogProtocol(protocol.ProcessProtocol):
+
+    # Reads the output of `git log -z --name-only` with LOG_FORMAT as it
+    # arrives, and calls commitReceived with the hash, timestamp, author and
+    # comments of each commit, and the names of the files it changed.  The
+    # output is a sequence of NUL-terminated tokens: each commit starts with
+    # an empty token (file names are never empty), then has its four
+    # fields, and then its file names, the first preceded by a newline.
+
+    LOG_FORMAT = '%x00%H%x00%ct%x00%aN <%aE>%x00%s%n%b'
+
+    def __init__(self, commitReceived, repourl):
+        self.commitReceived = commitReceived
+        self.repourl = repourl
+        self.deferred = defer.Deferred()
+        self.buffer = ''
+        self.stderr = ''
+        self.fields = None
+        self.files = None
+
+    def outReceived(self, data):
+        tokens = (self.buffer + data).split('\0')
+        self.buffer = tokens.pop()
+        for token in tokens:
+            self.tokenReceived(token)
+
+    def errReceived(self, data):
+        self.stderr += data
+
+    def tokenReceived(self, token):
+        if token == '':
+            self.commitEnded()
+            self.fields, self.files = [], []
+        elif self.fields is None:
+            # nothing is expected before the first commit
+            return
+        elif len(self.fields) < 4:
+            self.fields.append(token)
+        else:
+            if not self.files and token.startswith('\n'):
+                token = token[1:]
+            if token:
+                self.files.append(token)
+
+    def commitEnded(self):
+        if self.fields is not None:
+            fields, files = self.fields, self.files
+            self.fields = self.files = None
+            # a truncated commit is reported too, to fail on its missing
+            # fields
+            fields += [None] * (4 - len(fields))
+            self.commitReceived(*(fields + [files]))
+
+    def processEnded(self, reason):
+        if self.buffer:
+            self.tokenReceived(self.buffer)
+            self.buffer = ''
+        self.commitEnded()
+        if reason.check(error.ProcessDone):
+            self.deferred.callback(None)
+        else:
+            self.deferred.errback(EnvironmentError(
+                'command on repourl %s failed with exit code %s: %s'
+                % (self.repourl, reason.value.exitCode, self.stderr)))
+
+
 class GitPoller(base.PollingChangeSource, StateMixin):
 
     """This source will poll a remote git repo for changes and submit
@@ -35,14 +103,16 @@ class GitPoller(base.PollingChangeSource, StateMixin):
 
     compare_attrs = ["repourl", "branches", "workdir",
                      "pollInterval", "gitbin", "usetimestamps",
-                     "category", "project", "pollAtLaunch"]
+                     "category", "project", "pollAtLaunch",
+                     "onlyChangedBranches"]
 
     def __init__(self, repourl, branches=None, branch=None,
                  workdir=None, pollInterval=10 * 60,
                  gitbin='git', usetimestamps=True,
                  category=None, project=None,
                  pollinterval=-2, fetch_refspec=None,
-                 encoding='utf-8', pollAtLaunch=False):
+                 encoding='utf-8', pollAtLaunch=False,
+                 onlyChangedBranches=False):
 
         # for backward compatibility; the parameter used to be spelled with 'i'
         if pollinterval != -2:
@@ -70,6 +140,7 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         self.usetimestamps = usetimestamps
         self.category = category
         self.project = project
+        self.onlyChangedBranches = onlyChangedBranches
         self.changeCount = 0
         self.lastRev = {}
 
@@ -138,105 +209,143 @@ class GitPoller(base.PollingChangeSource, StateMixin):
             branch = branch[11:]
         return branch
 
+    def _trackerPrefix(self):
+        return "refs/buildbot/%s" % urllib.quote(self.repourl, '')
+
     def _trackerBranch(self, branch):
-        return "refs/buildbot/%s/%s" % (urllib.quote(self.repourl, ''),
-                                        self._removeHeads(branch))
+        return "%s/%s" % (self._trackerPrefix(), self._removeHeads(branch))
+
+    def _getTrackerTips(self):
+        # the revisions of all of the fetched branches, by tracker branch
+        d = self._dovccmd('for-each-ref',
+                          ['--format=%(objectname) %(refname)',
+                           self._trackerPrefix()], path=self.workdir)
+
+        @d.addCallback
+        def parseRefs(rows):
+            tips = {}
+            for row in rows.splitlines():
+                if ' ' not in row:
+                    continue
+                rev, ref = row.split(' ', 1)
+                tips[ref] = rev
+            return tips
+        return d
 
     @defer.inlineCallbacks
     def poll(self):
         yield self._dovccmd('init', ['--bare', self.workdir])
 
         branches = self.branches
-        if branches is True or callable(branches):
-            branches = yield self._getBranches()
-            if callable(self.branches):
-                branches = filter(self.branches, branches)
-            else:
-                branches = filter(self._headsFilter, branches)
-
-        refspecs = [
-            '+%s:%s' % (self._removeHeads(branch), self._trackerBranch(branch))
-            for branch in branches
-        ]
-        yield self._dovccmd('fetch',
-                            [self.repourl] + refspecs, path=self.workdir)
+        if self.onlyChangedBranches and branches is True:
+            # fetch all of the heads with a single refspec, rather than
+            # listing them first; the branches are then read from the
+            # tracker branches, and those deleted from the remote repository
+            # are pruned
+            branches = None
+            fetchArgs = ['--prune', self.repourl,
+                         '+refs/heads/*:%s/*' % self._trackerPrefix()]
+        else:
+            if branches is True or callable(branches):
+                branches = yield self._getBranches()
+                if callable(self.branches):
+                    branches = filter(self.branches, branches)
+                else:
+                    branches = filter(self._headsFilter, branches)
+
+            refspecs = [
+                '+%s:%s' % (self._removeHeads(branch),
+                            self._trackerBranch(branch))
+                for branch in branches
+            ]
+            fetchArgs = [self.repourl] + refspecs
+        yield self._dovccmd('fetch', fetchArgs, path=self.workdir)
+
+        if self.onlyChangedBranches:
+            revs = yield self._pollChangedBranches(branches)
+        else:
+            revs = {}
+            for branch in branches:
+                try:
+                    revs[branch] = rev = yield self._dovccmd(
+                        'rev-parse', [self._trackerBranch(branch)], path=self.workdir)
+                    yield self._process_changes(rev, branch)
+                except:
+                    log.err(_why="trying to poll branch %s of %s"
+                            % (branch, self.repourl))
+
+        self.lastRev.update(revs)
+        yield self.setState('lastRev', self.lastRev)
+
+    @defer.inlineCallbacks
+    def _pollChangedBranches(self, branches):
+        """
+        Read the revisions of all of the fetched branches at once, and look
+        for changes only on the branches that moved since the last poll.  If
+        C{branches} is None, poll all of the fetched heads.
+        """
+        tips = yield self._getTrackerTips()
+        if branches is None:
+            prefix = self._trackerPrefix() + '/'
+            branches = sorted('refs/heads/' + ref[len(prefix):]
+                              for ref in tips if ref.startswith(prefix))
+            # forget the branches deleted from the remote repository
+            fetched = set(branches)
+            for branch in self.lastRev.keys():
+                if branch.startswith('refs/heads/') and branch not in fetched:
+                    del self.lastRev[branch]
 
         revs = {}
         for branch in branches:
+            rev = tips.get(self._trackerBranch(branch))
+            if rev is None:
+                log.msg('gitpoller: branch %s of %s was not fetched'
+                        % (branch, self.repourl))
+                continue
+            if rev == self.lastRev.get(branch):
+                continue
+            revs[branch] = rev
             try:
-                revs[branch] = rev = yield self._dovccmd(
-                    'rev-parse', [self._trackerBranch(branch)], path=self.workdir)
                 yield self._process_changes(rev, branch)
             except:
                 log.err(_why="trying to poll branch %s of %s"
                         % (branch, self.repourl))
-
-        self.lastRev.update(revs)
-        yield self.setState('lastRev', self.lastRev)
+        defer.returnValue(revs)
 
     def _decode(self, git_output):
         return git_output.decode(self.encoding)
 
-    def _get_commit_comments(self, rev):
-        args = ['--no-walk', r'--format=%s%n%b', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
-        d.addCallback(self._decode)
-        return d
-
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['--no-walk', r'--format=%ct', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
-
-        def process(git_output):
-            if self.usetimestamps:
-                try:
-                    stamp = float(git_output)
-                except Exception, e:
-                    log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % git_output)
-                    raise e
-                return stamp
-            else:
-                return None
-        d.addCallback(process)
-        return d
-
-    def _get_commit_files(self, rev):
-        args = ['--name-only', '--no-walk', r'--format=%n', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
-
-        def decode_file(file):
-            # git use octal char sequences in quotes when non ASCII
-            match = re.match('^"(.*)"$', file)
-            if match:
-                file = match.groups()[0].decode('string_escape')
-            return self._decode(file)
-
-        def process(git_output):
-            fileList = [decode_file(file) for file in itertools.ifilter(lambda s: len(s), git_output.splitlines())]
-            return fileList
-        d.addCallback(process)
-        return d
-
-    def _get_commit_author(self, rev):
-        args = ['--no-walk', r'--format=%aN <%aE>', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
-
-        def process(git_output):
-            git_output = self._decode(git_output)
-            if len(git_output) == 0:
-                raise EnvironmentError('could not get commit author for rev')
-            return git_output
-        d.addCallback(process)
-        return d
+    def _decode_commit(self, rev, timestamp, author, comments, files):
+        """
+        Convert the fields of a commit read from `git log` into the arguments
+        to C{addChange}, but for the branch.
+        """
+        if rev is None or comments is None:
+            raise EnvironmentError('could not parse git log output')
+        if self.usetimestamps:
+            try:
+                stamp = float(timestamp)
+            except Exception, e:
+                log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % timestamp)
+                raise e
+        else:
+            stamp = None
+        author = self._decode(author)
+        if len(author) == 0:
+            raise EnvironmentError('could not get commit author for rev')
+        return dict(
+            author=author,
+            revision=rev,
+            files=[self._decode(f) for f in files],
+            comments=self._decode(comments.strip()),
+            when_timestamp=epoch2datetime(stamp))
 
     @defer.inlineCallbacks
     def _process_changes(self, newRev, branch):
         """
         Read changes since last change.
 
-        - Read list of commit hashes.
-        - Extract details from each commit.
+        - Read the details of the new commits, with a single git log.
         - Add changes to database.
         """
 
@@ -245,47 +354,53 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         if not lastRev:
             return
 
-        # get the change list
-        revListArgs = [r'--format=%H', '%s..%s' % (lastRev, newRev), '--']
+        # read the details of all of the new commits with a single git log,
+        # converting each commit as its output arrives; git lists the newest
+        # commit first
+        changes = []
+        failures = []
+
+        def commitReceived(*fields):
+            try:
+                change = self._decode_commit(*fields)
+            except Exception:
+                # keep only the commits older than this one, which come next
+                failures.append(failure.Failure())
+                del changes[:]
+                return
+            change.update(branch=self._removeHeads(branch),
+                          category=self.category,
+                          project=self.project,
+                          repository=self.repourl,
+                          src='git')
+            changes.append(change)
+
         self.changeCount = 0
-        results = yield self._dovccmd('log', revListArgs, path=self.workdir)
+        yield self._dogitlog(['%s..%s' % (lastRev, newRev), '--'],
+                             commitReceived)
 
         # process oldest change first
-        revList = results.split()
-        revList.reverse()
-        self.changeCount = len(revList)
+        changes.reverse()
+        self.changeCount = len(changes)
 
         log.msg('gitpoller: processing %d changes: %s from "%s"'
-                % (self.changeCount, revList, self.repourl))
-
-        for rev in revList:
-            dl = defer.DeferredList([
-                self._get_commit_timestamp(rev),
-                self._get_commit_author(rev),
-                self._get_commit_files(rev),
-                self._get_commit_comments(rev),
-            ], consumeErrors=True)
-
-            results = yield dl
-
-            # check for failures
-            failures = [r[1] for r in results if not r[0]]
-            if failures:
-                # just fail on the first error; they're probably all related!
-                raise failures[0]
-
-            timestamp, author, files, comments = [r[1] for r in results]
-            yield self.master.addChange(
-                author=author,
-                revision=rev,
-                files=files,
-                comments=comments,
-                when_timestamp=epoch2datetime(timestamp),
-                branch=self._removeHeads(branch),
-                category=self.category,
-                project=self.project,
-                repository=self.repourl,
-                src='git')
+                % (self.changeCount, [ch['revision'] for ch in changes],
+                   self.repourl))
+
+        # add the changes older than the oldest failure, then just fail on
+        # that error; they're probably all related!
+        if changes:
+            yield self.addChanges(changes)
+        if failures:
+            failures[-1].raiseException()
+
+    def _dogitlog(self, args, commitReceived):
+        pp = _GitLogProtocol(commitReceived, self.repourl)
+        args = ['log', '-z', '--name-only',
+                '--format=%s' % _GitLogProtocol.LOG_FORMAT] + args
+        reactor.spawnProcess(pp, self.gitbin, [self.gitbin] + args,
+                             path=self.workdir, env=os.environ)
+        return pp.deferred
 
     def _dovccmd(self, command, args, path=None):
         d = utils.getProcessOutputAndValue(self.gitbin,
@@ -18,6 +18,7 @@ import time
 
 from twisted.internet import defer
 from twisted.internet import utils
+from twisted.python import failure
 from twisted.python import log
 
 from buildbot import config
@@ -273,10 +274,19 @@ class HgPoller(base.PollingChangeSource):
 
         log.msg('hgpoller: processing %d changes: %r in %r'
                 % (len(revNodeList), revNodeList, self._absWorkdir()))
+        changes = []
+        processed = None
+        failed = None
         for rev, node in revNodeList:
-            timestamp, author, files, comments = yield self._getRevDetails(
-                node)
-            yield self.master.addChange(
+            try:
+                timestamp, author, files, comments = \
+                    yield self._getRevDetails(node)
+            except Exception:
+                # add the changes of the revisions before this one, then
+                # fail on it
+                failed = failure.Failure()
+                break
+            changes.append(dict(
                 author=author,
                 revision=node,
                 files=files,
@@ -286,10 +296,17 @@ class HgPoller(base.PollingChangeSource):
                 category=self.category,
                 project=self.project,
                 repository=self.repourl,
-                src='hg')
-            # writing after addChange so that a rev is never missed,
-            # but at once to avoid impact from later errors
-            yield self._setCurrentRev(rev, oid=oid)
+                src='hg'))
+            processed = rev
+
+        if changes:
+            yield self.addChanges(changes)
+        # writing after addChanges so that a rev is never missed; the
+        # changes are added in one transaction, so none is added twice
+        if processed is not None:
+            yield self._setCurrentRev(processed, oid=oid)
+        if failed:
+            failed.raiseException()
 
     def _processChangesFailure(self, f):
         log.msg('hgpoller: repo poll failed')
@@ -13,16 +13,223 @@
 #
 # Copyright Buildbot Team Members
 
+import random
+
 from buildbot import config
 from buildbot import interfaces
 from buildbot import util
 from buildbot.process import metrics
 from twisted.application import service
 from twisted.internet import defer
+from twisted.internet import reactor
 from twisted.python import log
 from zope.interface import implements
 
 
+class _PolledSource(object):
+
+    # the scheduling state of one polling change source
+
+    def __init__(self, source):
+        self.source = source
+        self.call = None
+        self.due = None
+        self.polling = False
+        self.timeoutCall = None
+        self.timedOut = False
+        self.backoff = 1.0
+        self.lastChanges = None
+        self.polls = 0
+        self.failures = 0
+        self.lastStarted = None
+        self.lastWait = None
+        self.lastDuration = None
+
+
+class PollScheduler(object):
+
+    """
+    Schedules the polls of the L{PollingChangeSource}s that are children of
+    the L{ChangeManager}, in place of a timer for each.
+
+    Poll times are spread by a random C{jitter}, given as a fraction of each
+    source's C{pollInterval}.  At most C{maxConcurrentPolls} polls run at
+    once; polls that are due while this many are running wait, and those of
+    the sources that most recently found changes start first.  After a poll
+    that found no changes, the interval is multiplied by C{idleBackoff}, and
+    after a failed poll by C{errorBackoff}, up to C{maxBackoff} times the
+    C{pollInterval}; a poll that finds changes returns to the
+    C{pollInterval}.  A poll that runs for longer than C{pollTimeout}
+    seconds (by default, twice the source's C{pollInterval}) is counted as
+    failed and no longer holds up the others; the source is polled again
+    once it finishes.  The defaults poll each source every C{pollInterval},
+    as its own timer would.
+    """
+
+    maxConcurrentPolls = None
+    jitter = 0.0
+    idleBackoff = 1.0
+    errorBackoff = 1.0
+    maxBackoff = 8.0
+    pollTimeout = None
+
+    def __init__(self, _reactor=reactor):
+        self._reactor = _reactor
+        # change sources compare equal when configured alike, so these are
+        # keyed by identity
+        self._sources = {}
+        self._waiting = []
+        self._active = 0
+        self._random = random.Random()
+
+    def configure(self, maxConcurrentPolls=None, jitter=0.0, idleBackoff=1.0,
+                  errorBackoff=1.0, maxBackoff=8.0, pollTimeout=None):
+        self.maxConcurrentPolls = maxConcurrentPolls
+        self.jitter = jitter
+        self.idleBackoff = idleBackoff
+        self.errorBackoff = errorBackoff
+        self.maxBackoff = maxBackoff
+        self.pollTimeout = pollTimeout
+        self._startPolls()
+
+    def addSource(self, source):
+        if not source.running or id(source) in self._sources:
+            return
+        entry = self._sources[id(source)] = _PolledSource(source)
+        if source.pollInterval and not source.pollAtLaunch:
+            self._schedule(entry)
+        else:
+            self._due(entry)
+
+    def removeSource(self, source):
+        entry = self._sources.pop(id(source), None)
+        if not entry:
+            return
+        if entry.call and entry.call.active():
+            entry.call.cancel()
+        entry.call = None
+        if entry in self._waiting:
+            self._waiting.remove(entry)
+
+    def getTimings(self):
+        """
+        Return a dictionary, keyed by source name, of dictionaries giving
+        the number of C{polls} and C{failures} of each source, the
+        C{interval} until its next poll, and the start time, C{wait} from its
+        due time and C{duration} of its last poll.
+        """
+        timings = {}
+        for entry in self._sources.itervalues():
+            source = entry.source
+            timings[source.name] = dict(
+                polls=entry.polls,
+                failures=entry.failures,
+                interval=source.pollInterval * entry.backoff,
+                lastStarted=entry.lastStarted,
+                wait=entry.lastWait,
+                duration=entry.lastDuration)
+        return timings
+
+    def _schedule(self, entry):
+        delay = entry.source.pollInterval * entry.backoff
+        if self.jitter:
+            delay *= self._random.uniform(1 - self.jitter, 1 + self.jitter)
+        entry.call = self._reactor.callLater(delay, self._due, entry)
+
+    def _due(self, entry):
+        entry.call = None
+        entry.due = util.now(self._reactor)
+        self._waiting.append(entry)
+        self._startPolls()
+
+    def _priority(self, entry):
+        # sources that found changes most recently first, then the longest
+        # waiting
+        if entry.lastChanges is None:
+            return (1, 0, entry.due)
+        return (0, -entry.lastChanges, entry.due)
+
+    def _startPolls(self):
+        while self._waiting:
+            if (self.maxConcurrentPolls is not None
+                    and self._active >= self.maxConcurrentPolls):
+                return
+            entry = min(self._waiting, key=self._priority)
+            self._waiting.remove(entry)
+            self._poll(entry)
+
+    def _poll(self, entry):
+        source = entry.source
+        name = source.name
+        self._active += 1
+        entry.polling = True
+        entry.polls += 1
+        entry.lastStarted = start = util.now(self._reactor)
+        entry.lastWait = start - entry.due
+        metrics.MetricTimeEvent.log('PollScheduler.wait.%s' % (name,),
+                                    entry.lastWait)
+
+        entry.timedOut = False
+        timeout = self.pollTimeout or 2 * source.pollInterval
+        if timeout:
+            entry.timeoutCall = self._reactor.callLater(
+                timeout, self._pollTimedOut, entry, timeout)
+
+        d = source.doPoll()
+
+        @d.addCallback
+        def done(_):
+            if entry.timeoutCall:
+                entry.timeoutCall.cancel()
+                entry.timeoutCall = None
+            if not entry.timedOut:
+                self._active -= 1
+            entry.polling = False
+            now = util.now(self._reactor)
+            entry.lastDuration = now - start
+            metrics.MetricTimeEvent.log('PollScheduler.poll.%s' % (name,),
+                                        entry.lastDuration)
+
+            if entry.timedOut:
+                # already counted as a failure
+                entry.backoff *= self.errorBackoff
+            elif source.lastPollFailed:
+                self._pollFailed(entry)
+                entry.backoff *= self.errorBackoff
+            elif source.lastPollChanges:
+                entry.lastChanges = now
+                entry.backoff = 1.0
+            else:
+                entry.backoff *= self.idleBackoff
+            entry.backoff = min(entry.backoff, self.maxBackoff)
+
+            if self._sources.get(id(source)) is entry:
+                if source.pollInterval:
+                    self._schedule(entry)
+                else:
+                    # polled once, as requested by a zero pollInterval
+                    del self._sources[id(source)]
+            self._startPolls()
+        d.addErrback(log.err, 'while scheduling polls')
+        return d
+
+    def _pollFailed(self, entry):
+        entry.failures += 1
+        metrics.MetricCountEvent.log(
+            'PollScheduler.failures.%s' % (entry.source.name,), 1)
+
+    def _pollTimedOut(self, entry, timeout):
+        # the poll may be stuck, e.g., on a hung subprocess; free its slot
+        # for the others, but do not poll the source again until it finishes
+        entry.timeoutCall = None
+        entry.timedOut = True
+        self._active -= 1
+        self._pollFailed(entry)
+        log.msg("PollScheduler: poll of %s has not finished after %ds; "
+                "counting it as failed" % (entry.source.name, timeout))
+        self._startPolls()
+
+
 class ChangeManager(config.ReconfigurableServiceMixin, service.MultiService):
 
     """
@@ -31,7 +238,8 @@ class ChangeManager(config.ReconfigurableServiceMixin, service.MultiService):
 
     It is a Twisted service, which has instances of
     L{buildbot.interfaces.IChangeSource} as child services. These are added by
-    the master with C{addSource}.
+    the master with C{addSource}.  The polls of its polling change sources
+    are scheduled by C{pollScheduler}, a L{PollScheduler}.
     """
 
     implements(interfaces.IEventSource)
@@ -42,12 +250,15 @@ class ChangeManager(config.ReconfigurableServiceMixin, service.MultiService):
         service.MultiService.__init__(self)
         self.setName('change_manager')
         self.master = master
+        self.pollScheduler = PollScheduler()
 
     @defer.inlineCallbacks
     def reconfigService(self, new_config):
         timer = metrics.Timer("ChangeManager.reconfigService")
         timer.start()
 
+        self.pollScheduler.configure(**new_config.pollScheduler)
+
         removed, added = util.diffSets(
             set(self),
             new_config.change_sources)
@@ -28,6 +28,7 @@ from twisted.internet import defer
 from twisted.internet import protocol
 from twisted.internet import reactor
 from twisted.internet import utils
+from twisted.python import failure
 from twisted.python import log
 
 from buildbot import config
@@ -234,71 +235,93 @@ class P4Source(base.PollingChangeSource, util.ComparableMixin):
             changelists.append(num)
         changelists.reverse()  # oldest first
 
-        # Retrieve each sequentially.
+        # Retrieve each sequentially, and add their changes together
+        changes = []
+        processed = None
+        failed = None
         for num in changelists:
-            args = []
-            if self.p4port:
-                args.extend(['-p', self.p4port])
-            if self.p4user:
-                args.extend(['-u', self.p4user])
-            if self.p4passwd:
-                args.extend(['-P', self._getPasswd()])
-            args.extend(['describe', '-s', str(num)])
-            result = yield self._get_process_output(args)
-
-            # decode the result from its designated encoding
             try:
-                result = result.decode(self.encoding)
-            except exceptions.UnicodeError, ex:
-                log.msg("P4Poller: couldn't decode changelist description: %s" % ex.encoding)
-                log.msg("P4Poller: in object: %s" % ex.object)
-                log.err("P4Poller: poll failed on %s, %s" % (self.p4port, self.p4base))
-                raise
-
-            lines = result.split('\n')
-            # SF#1555985: Wade Brainerd reports a stray ^M at the end of the date
-            # field. The rstrip() is intended to remove that.
-            lines[0] = lines[0].rstrip()
-            m = self.describe_header_re.match(lines[0])
+                num_changes = yield self._describeChangelist(num)
+            except Exception:
+                # add the changes of the changelists before this one, then
+                # fail on it
+                failed = failure.Failure()
+                break
+            changes.extend(num_changes)
+            processed = num
+
+        if changes:
+            yield self.addChanges(changes)
+        if processed is not None:
+            self.last_change = processed
+        if failed:
+            failed.raiseException()
+
+    @defer.inlineCallbacks
+    def _describeChangelist(self, num):
+        args = []
+        if self.p4port:
+            args.extend(['-p', self.p4port])
+        if self.p4user:
+            args.extend(['-u', self.p4user])
+        if self.p4passwd:
+            args.extend(['-P', self._getPasswd()])
+        args.extend(['describe', '-s', str(num)])
+        result = yield self._get_process_output(args)
+
+        # decode the result from its designated encoding
+        try:
+            result = result.decode(self.encoding)
+        except exceptions.UnicodeError, ex:
+            log.msg("P4Poller: couldn't decode changelist description: %s" % ex.encoding)
+            log.msg("P4Poller: in object: %s" % ex.object)
+            log.err("P4Poller: poll failed on %s, %s" % (self.p4port, self.p4base))
+            raise
+
+        lines = result.split('\n')
+        # SF#1555985: Wade Brainerd reports a stray ^M at the end of the date
+        # field. The rstrip() is intended to remove that.
+        lines[0] = lines[0].rstrip()
+        m = self.describe_header_re.match(lines[0])
+        if not m:
+            raise P4PollerError("Unexpected 'p4 describe -s' result: %r" % result)
+        who = m.group('who')
+        when = datetime.datetime.strptime(m.group('when'), self.datefmt)
+        if self.server_tz:
+            # Convert from the server's timezone to the local timezone.
+            when = when.replace(tzinfo=self.server_tz)
+            when = when.astimezone(dateutil.tz.tzlocal())
+        comments = ''
+        while not lines[0].startswith('Affected files'):
+            comments += lines.pop(0) + '\n'
+        lines.pop(0)  # affected files
+
+        branch_files = {}  # dict for branch mapped to file(s)
+        while lines:
+            line = lines.pop(0).strip()
+            if not line:
+                continue
+            m = self.file_re.match(line)
             if not m:
-                raise P4PollerError("Unexpected 'p4 describe -s' result: %r" % result)
-            who = m.group('who')
-            when = datetime.datetime.strptime(m.group('when'), self.datefmt)
-            if self.server_tz:
-                # Convert from the server's timezone to the local timezone.
-                when = when.replace(tzinfo=self.server_tz)
-                when = when.astimezone(dateutil.tz.tzlocal())
-            comments = ''
-            while not lines[0].startswith('Affected files'):
-                comments += lines.pop(0) + '\n'
-            lines.pop(0)  # affected files
-
-            branch_files = {}  # dict for branch mapped to file(s)
-            while lines:
-                line = lines.pop(0).strip()
-                if not line:
+                raise P4PollerError("Invalid file line: %r" % line)
+            path = m.group('path')
+            if path.startswith(self.p4base):
+                branch, file = self.split_file(path[len(self.p4base):])
+                if (branch is None and file is None):
                     continue
-                m = self.file_re.match(line)
-                if not m:
-                    raise P4PollerError("Invalid file line: %r" % line)
-                path = m.group('path')
-                if path.startswith(self.p4base):
-                    branch, file = self.split_file(path[len(self.p4base):])
-                    if (branch is None and file is None):
-                        continue
-                    if branch in branch_files:
-                        branch_files[branch].append(file)
-                    else:
-                        branch_files[branch] = [file]
-
-            for branch in branch_files:
-                yield self.master.addChange(
-                    author=who,
-                    files=branch_files[branch],
-                    comments=comments,
-                    revision=str(num),
-                    when_timestamp=when,
-                    branch=branch,
-                    project=self.project)
-
-            self.last_change = num
+                if branch in branch_files:
+                    branch_files[branch].append(file)
+                else:
+                    branch_files[branch] = [file]
+
+        changes = []
+        for branch in branch_files:
+            changes.append(dict(
+                author=who,
+                files=branch_files[branch],
+                comments=comments,
+                revision=str(num),
+                when_timestamp=when,
+                branch=branch,
+                project=self.project))
+        defer.returnValue(changes)
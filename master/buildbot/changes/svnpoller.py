@@ -21,6 +21,9 @@ from __future__ import with_statement
 # Hacked beyond recognition by Brian Warner
 
 from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet import protocol
+from twisted.internet import reactor
 from twisted.internet import utils
 from twisted.python import log
 
@@ -30,6 +33,7 @@ from buildbot.changes import base
 import os
 import urllib
 import xml.dom.minidom
+import xml.parsers.expat
 
 # these split_file_* functions are available for use as values to the
 # split_file= argument.
@@ -69,6 +73,124 @@ def split_file_projects_branches(path):
     return f
 
 
+class _StopParsing(Exception):
+    pass
+
+
+class _SVNLogParser(object):
+
+    # Parses the output of `svn log --xml --verbose` as it is fed in, and
+    # calls entryReceived with a dictionary for each <logentry>, giving its
+    # revision, author and msg (None if missing), and its paths, a list of
+    # dictionaries with the kind, action and path of each <path> (None if
+    # there is no <paths>).  Only the current entry is kept; entryReceived
+    # returns true to stop the parsing.
+
+    def __init__(self, entryReceived):
+        self.entryReceived = entryReceived
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.StartElementHandler = self.startElement
+        self.parser.EndElementHandler = self.endElement
+        self.parser.CharacterDataHandler = self.characters
+        self.entry = None
+        self.path = None
+        self.text = None
+        self.stopped = False
+
+    def feed(self, data, final=False):
+        if self.stopped:
+            return
+        try:
+            self.parser.Parse(data, final)
+        except _StopParsing:
+            self.stopped = True
+
+    def startElement(self, name, attrs):
+        if name == 'logentry':
+            self.entry = dict(revision=attrs.get('revision'), author=None,
+                              msg=None, paths=None)
+        elif self.entry is None:
+            return
+        elif name in ('author', 'msg'):
+            self.text = []
+        elif name == 'paths':
+            self.entry['paths'] = []
+        elif name == 'path' and self.entry['paths'] is not None:
+            self.path = dict(kind=attrs.get('kind', ''),
+                             action=attrs.get('action', ''))
+            self.text = []
+
+    def endElement(self, name):
+        if self.entry is None:
+            return
+        if name in ('author', 'msg') and self.text is not None:
+            self.entry[name] = ''.join(self.text)
+            self.text = None
+        elif name == 'path' and self.path is not None:
+            self.path['path'] = ''.join(self.text)
+            self.entry['paths'].append(self.path)
+            self.path = self.text = None
+        elif name == 'logentry':
+            entry, self.entry = self.entry, None
+            if self.entryReceived(entry):
+                raise _StopParsing()
+
+    def characters(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+
+class _SVNLogProtocol(protocol.ProcessProtocol):
+
+    # Feeds the output of `svn log --xml` to an _SVNLogParser as it arrives.
+    # Once the parser stops, the rest of the output is not needed, so the
+    # process is stopped.  Like getProcessOutput, this fails if anything is
+    # written to stderr.
+
+    def __init__(self, entryReceived):
+        self.parser = _SVNLogParser(entryReceived)
+        self.deferred = defer.Deferred()
+        self.stderr = ''
+
+    def outReceived(self, data):
+        if self.parser.stopped:
+            return
+        try:
+            self.parser.feed(data)
+        except xml.parsers.expat.ExpatError:
+            self.stopProcess()
+            self.deferred.errback()
+            return
+        if self.parser.stopped:
+            self.stopProcess()
+
+    def errReceived(self, data):
+        self.stderr += data
+
+    def stopProcess(self):
+        try:
+            self.transport.signalProcess('TERM')
+        except error.ProcessExitedAlready:
+            pass
+
+    def processEnded(self, reason):
+        if self.deferred.called:
+            return
+        if self.parser.stopped:
+            self.deferred.callback(None)
+        elif self.stderr:
+            self.deferred.errback(IOError("got stderr: %r" % (self.stderr,)))
+        elif not reason.check(error.ProcessDone):
+            self.deferred.errback(reason)
+        else:
+            try:
+                self.parser.feed('', final=True)
+            except xml.parsers.expat.ExpatError:
+                self.deferred.errback()
+            else:
+                self.deferred.callback(None)
+
+
 class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
 
     """
@@ -181,7 +303,6 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
             d.addCallback(set_prefix)
 
         d.addCallback(self.get_logs)
-        d.addCallback(self.parse_logs)
         d.addCallback(self.get_new_logentries)
         d.addCallback(self.create_changes)
         d.addCallback(self.submit_changes)
@@ -194,6 +315,14 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         d = utils.getProcessOutput(self.svnbin, args, self.environ)
         return d
 
+    def getProcessLog(self, args, entryReceived):
+        # run `svn log --xml`, calling entryReceived with each entry as it is
+        # parsed
+        pp = _SVNLogProtocol(entryReceived)
+        reactor.spawnProcess(pp, self.svnbin, [self.svnbin] + args,
+                             env=self.environ)
+        return pp.deferred
+
     def get_prefix(self):
         args = ["info", "--xml", "--non-interactive", self.svnurl]
         if self.svnuser:
@@ -244,17 +373,38 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         if self.extra_args:
             args.extend(self.extra_args)
         args.extend(["--limit=%d" % (self.histmax), self.svnurl])
-        d = self.getProcessOutput(args)
+
+        # the entries are newest first, so only those down to the last
+        # change are needed, or just the newest on the first poll
+        logentries = []
+
+        def entryReceived(entry):
+            logentries.append(entry)
+            if self.last_change is None:
+                return True
+            return int(entry['revision']) <= self.last_change
+        d = self.getProcessLog(args, entryReceived)
+
+        @d.addErrback
+        def parse_failed(f):
+            if f.check(xml.parsers.expat.ExpatError):
+                log.msg("SVNPoller: SVNPoller.get_logs: ExpatError after "
+                        "revision %s" % (logentries and
+                                         logentries[-1]['revision'],))
+            return f
+        d.addCallback(lambda _: logentries)
         return d
 
     def parse_logs(self, output):
-        # parse the XML output, return a list of <logentry> nodes
+        # parse complete XML output, return a list of log entries, as given
+        # by get_logs
+        logentries = []
+        parser = _SVNLogParser(logentries.append)
         try:
-            doc = xml.dom.minidom.parseString(output)
+            parser.feed(output, final=True)
         except xml.parsers.expat.ExpatError:
             log.msg("SVNPoller: SVNPoller.parse_logs: ExpatError in '%s'" % output)
             raise
-        logentries = doc.getElementsByTagName("logentry")
         return logentries
 
     def get_new_logentries(self, logentries):
@@ -267,7 +417,7 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         new_last_change = None
         new_logentries = []
         if logentries:
-            new_last_change = int(logentries[0].getAttribute("revision"))
+            new_last_change = int(logentries[0]["revision"])
 
             if last_change is None:
                 # if this is the first time we've been run, ignore any changes
@@ -279,7 +429,7 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
                 log.msg('SVNPoller: no changes')
             else:
                 for el in logentries:
-                    if last_change == int(el.getAttribute("revision")):
+                    if int(el["revision"]) <= last_change:
                         break
                     new_logentries.append(el)
                 new_logentries.reverse()  # return oldest first
@@ -289,11 +439,9 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
                 (old_last_change, new_last_change))
         return new_logentries
 
-    def _get_text(self, element, tag_name):
-        try:
-            child_nodes = element.getElementsByTagName(tag_name)[0].childNodes
-            text = "".join([t.data for t in child_nodes])
-        except:
+    def _get_text(self, entry, name):
+        text = entry.get(name)
+        if text is None:
             text = "<unknown>"
         return text
 
@@ -318,7 +466,7 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         changes = []
 
         for el in new_logentries:
-            revision = str(el.getAttribute("revision"))
+            revision = str(el["revision"])
 
             revlink = ''
 
@@ -335,16 +483,14 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
             # the Waterfall display, etc). So ignore the date field, and
             # addChange will fill in with the current time
             branches = {}
-            try:
-                pathlist = el.getElementsByTagName("paths")[0]
-            except IndexError:  # weird, we got an empty revision
+            if el["paths"] is None:  # weird, we got an empty revision
                 log.msg("ignoring commit with no paths")
                 continue
 
-            for p in pathlist.getElementsByTagName("path"):
-                kind = p.getAttribute("kind")
-                action = p.getAttribute("action")
-                path = "".join([t.data for t in p.childNodes])
+            for p in el["paths"]:
+                kind = p["kind"]
+                action = p["action"]
+                path = p["path"]
                 # the rest of buildbot is certainly not yet ready to handle
                 # unicode filenames, because they get put in RemoteCommands
                 # which get sent via PB to the buildslave, and PB doesn't
@@ -406,10 +552,12 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
 
         return changes
 
-    @defer.inlineCallbacks
     def submit_changes(self, changes):
+        if not changes:
+            return
         for chdict in changes:
-            yield self.master.addChange(src='svn', **chdict)
+            chdict['src'] = 'svn'
+        return self.addChanges(changes)
 
     def finished_ok(self, res):
         if self.cachepath:
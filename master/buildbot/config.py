@@ -73,10 +73,20 @@ class MasterConfig(object):
         self.logCompressionMethod = 'bz2'
         self.logMaxTailSize = None
         self.logMaxSize = None
+        self.buildHistory = None
         self.properties = properties.Properties()
         self.mergeRequests = None
         self.codebaseGenerator = None
         self.prioritizeBuilders = None
+        self.distributorConcurrency = 1
+        self.pollScheduler = dict(
+            maxConcurrentPolls=None,
+            jitter=0.0,
+            idleBackoff=1.0,
+            errorBackoff=1.0,
+            maxBackoff=8.0,
+            pollTimeout=None,
+        )
         self.slavePortnum = None
         self.multiMaster = False
         self.debugPassword = None
@@ -93,6 +103,7 @@ class MasterConfig(object):
             db_url='sqlite:///state.sqlite',
             db_poll_interval=None,
         )
+        self.notificationChannel = None
         self.metrics = None
         self.caches = dict(
             Builds=15,
@@ -107,12 +118,16 @@ class MasterConfig(object):
         self.revlink = default_revlink_matcher
 
     _known_config_keys = set([
-        "buildbotURL", "buildCacheSize", "builders", "buildHorizon", "caches",
+        "buildbotURL", "buildCacheSize", "buildHistory", "builders",
+        "buildHorizon", "caches",
         "change_source", "codebaseGenerator", "changeCacheSize", "changeHorizon",
-        'db', "db_poll_interval", "db_url", "debugPassword", "eventHorizon",
+        'db', "db_poll_interval", "db_url", "debugPassword",
+        "distributorConcurrency", "eventHorizon",
         "logCompressionLimit", "logCompressionMethod", "logHorizon",
         "logMaxSize", "logMaxTailSize", "manhole", "mergeRequests", "metrics",
-        "multiMaster", "prioritizeBuilders", "projectName", "projectURL",
+        "multiMaster", "notificationChannel", "pollScheduler",
+        "prioritizeBuilders",
+        "projectName", "projectURL",
         "properties", "protocols", "revlink", "schedulers", "slavePortnum",
         "slaves", "status", "title", "titleURL", "user_managers", "validation"
     ])
@@ -257,13 +272,21 @@ class MasterConfig(object):
 
         if 'logCompressionMethod' in config_dict:
             logCompressionMethod = config_dict.get('logCompressionMethod')
-            if logCompressionMethod not in ('bz2', 'gz'):
-                error("c['logCompressionMethod'] must be 'bz2' or 'gz'")
+            if logCompressionMethod not in ('bz2', 'gz', 'framed'):
+                error("c['logCompressionMethod'] must be 'bz2', 'gz' "
+                      "or 'framed'")
             self.logCompressionMethod = logCompressionMethod
 
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
 
+        buildHistory = config_dict.get('buildHistory')
+        if (buildHistory is not None and
+                not interfaces.IBuildHistory.providedBy(buildHistory)):
+            error("c['buildHistory'] must provide IBuildHistory")
+        else:
+            self.buildHistory = buildHistory
+
         properties = config_dict.get('properties', {})
         if not isinstance(properties, dict):
             error("c['properties'] must be a dictionary")
@@ -290,6 +313,45 @@ class MasterConfig(object):
         else:
             self.prioritizeBuilders = prioritizeBuilders
 
+        distributorConcurrency = config_dict.get('distributorConcurrency', 1)
+        if (not isinstance(distributorConcurrency, int)
+                or distributorConcurrency < 1):
+            error("c['distributorConcurrency'] must be a positive int")
+        else:
+            self.distributorConcurrency = distributorConcurrency
+
+        if 'pollScheduler' in config_dict:
+            pollScheduler = config_dict['pollScheduler']
+            if not isinstance(pollScheduler, dict):
+                error("c['pollScheduler'] must be a dictionary")
+            else:
+                unknown = set(pollScheduler) - set(self.pollScheduler)
+                if unknown:
+                    error("unknown c['pollScheduler'] keys %s"
+                          % (', '.join(sorted(unknown)),))
+                maxConcurrentPolls = pollScheduler.get('maxConcurrentPolls')
+                if (maxConcurrentPolls is not None
+                        and (not isinstance(maxConcurrentPolls, int)
+                             or maxConcurrentPolls < 1)):
+                    error("c['pollScheduler']['maxConcurrentPolls'] must be "
+                          "None or a positive int")
+                jitter = pollScheduler.get('jitter', 0)
+                if not isinstance(jitter, (int, float)) or not 0 <= jitter < 1:
+                    error("c['pollScheduler']['jitter'] must be at least 0 "
+                          "and less than 1")
+                for key in 'idleBackoff', 'errorBackoff', 'maxBackoff':
+                    value = pollScheduler.get(key, 1)
+                    if not isinstance(value, (int, float)) or value < 1:
+                        error("c['pollScheduler']['%s'] must be a number of "
+                              "at least 1" % (key,))
+                pollTimeout = pollScheduler.get('pollTimeout')
+                if (pollTimeout is not None
+                        and (not isinstance(pollTimeout, (int, float))
+                             or pollTimeout <= 0)):
+                    error("c['pollScheduler']['pollTimeout'] must be None or "
+                          "a positive number")
+                self.pollScheduler.update(pollScheduler)
+
         protocols = config_dict.get('protocols', {})
         if isinstance(protocols, dict):
             for proto, options in protocols.iteritems():
@@ -369,6 +431,19 @@ class MasterConfig(object):
         else:
             self.db['db_poll_interval'] = db_poll_interval
 
+        # notifications supplement polling, which remains the fallback for
+        # lost notifications
+        channel = config_dict.get('notificationChannel')
+        if channel is not None:
+            if not interfaces.INotificationChannel.providedBy(channel):
+                error("c['notificationChannel'] must provide "
+                      "INotificationChannel")
+            elif not self.db['db_poll_interval']:
+                error("c['notificationChannel'] requires "
+                      "c['db']['db_poll_interval']")
+            else:
+                self.notificationChannel = channel
+
     def load_metrics(self, filename, config_dict):
         # we don't try to validate metrics keys
         if 'metrics' in config_dict:
@@ -17,6 +17,8 @@ import itertools
 import sqlalchemy as sa
 
 from buildbot.db import base
+from buildbot.status.results import SUCCESS
+from buildbot.status.results import WARNINGS
 from buildbot.util import datetime2epoch
 from buildbot.util import epoch2datetime
 from twisted.internet import reactor
@@ -72,7 +74,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
     @with_master_objectid
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-                         bsid=None, _master_objectid=None, branch=None, repository=None):
+                         bsid=None, _master_objectid=None, branch=None, repository=None,
+                         min_brid=None):
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
@@ -111,6 +114,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     q = q.where(reqs_tbl.c.complete == 0)
             if bsid is not None:
                 q = q.where(reqs_tbl.c.buildsetid == bsid)
+            if min_brid is not None:
+                q = q.where(reqs_tbl.c.id >= min_brid)
 
             if branch is not None:
                 q = q.where(sstamps_tbls.c.branch == branch)
@@ -123,6 +128,20 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     for row in res.fetchall()]
         return self.db.pool.do(thd)
 
+    def listUnclaimedBuildRequests(self):
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            claims_tbl = self.db.model.buildrequest_claims
+            from_clause = reqs_tbl.outerjoin(claims_tbl,
+                                             reqs_tbl.c.id == claims_tbl.c.brid)
+            q = sa.select([reqs_tbl.c.id, reqs_tbl.c.buildsetid,
+                           reqs_tbl.c.buildername]).select_from(from_clause)
+            q = q.where((claims_tbl.c.claimed_at == None) &
+                        (reqs_tbl.c.complete == 0))
+            res = conn.execute(q)
+            return [tuple(row) for row in res.fetchall()]
+        return self.db.pool.do(thd)
+
     @with_master_objectid
     def claimBuildRequests(self, brids, claimed_at=None, _reactor=reactor,
                            _master_objectid=None):
@@ -148,6 +167,65 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    @with_master_objectid
+    def claimBuildRequestGroups(self, groups, claimed_at=None,
+                                _reactor=reactor, _master_objectid=None):
+        if claimed_at is not None:
+            claimed_at = datetime2epoch(claimed_at)
+        else:
+            claimed_at = _reactor.seconds()
+
+        def thd(conn):
+            tbl = self.db.model.buildrequest_claims
+
+            def findClaimed(brids):
+                # we'll need to batch the brids into groups of 100, so that
+                # the parameter lists supported by the DBAPI aren't exhausted
+                claimed = set()
+                iterator = iter(brids)
+                while True:
+                    batch = list(itertools.islice(iterator, 100))
+                    if not batch:
+                        return claimed
+                    q = sa.select([tbl.c.brid],
+                                  whereclause=(tbl.c.brid.in_(batch)))
+                    claimed.update(row.brid for row in conn.execute(q))
+
+            def insertClaims(groups):
+                rows = [dict(brid=id, objectid=_master_objectid,
+                             claimed_at=claimed_at)
+                        for group in groups for id in group]
+                if rows:
+                    conn.execute(tbl.insert(), rows)
+
+            transaction = conn.begin()
+            claimed = findClaimed([id for group in groups for id in group])
+            claimable = [group for group in groups
+                         if not claimed.intersection(group)]
+            try:
+                insertClaims(claimable)
+            except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+                transaction.rollback()
+            else:
+                transaction.commit()
+                return claimed
+
+            # another master claimed some of these requests since they were
+            # checked, so claim each group in its own transaction
+            for group in claimable:
+                transaction = conn.begin()
+                try:
+                    insertClaims([group])
+                except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+                    transaction.rollback()
+                    # make sure at least one of the group's brids is reported
+                    claimed.update(findClaimed(group) or group)
+                else:
+                    transaction.commit()
+            return claimed
+
+        return self.db.pool.do(thd)
+
     @with_master_objectid
     def reclaimBuildRequests(self, brids, _reactor=reactor,
                              _master_objectid=None):
@@ -246,6 +324,33 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                             "but only completed %d" % (len(batch), res.rowcount))
                     transaction.rollback()
                     raise NotClaimedError
+
+            # count the newly completed requests in their buildsets
+            failed = results not in (SUCCESS, WARNINGS)
+            counts = {}
+            iterator = iter(brids)
+            while True:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break
+                q = sa.select([reqs_tbl.c.buildsetid,
+                               sa.func.count(reqs_tbl.c.id)],
+                              whereclause=reqs_tbl.c.id.in_(batch))
+                q = q.group_by(reqs_tbl.c.buildsetid)
+                for bsid, count in conn.execute(q):
+                    counts[bsid] = counts.get(bsid, 0) + count
+
+            bs_tbl = self.db.model.buildsets
+            for bsid, count in counts.iteritems():
+                values = dict(requests_complete=(
+                    bs_tbl.c.requests_complete + count))
+                if failed:
+                    values['requests_failed'] = \
+                        bs_tbl.c.requests_failed + count
+                q = bs_tbl.update((bs_tbl.c.id == bsid)
+                                  & (bs_tbl.c.requests_total != None))
+                conn.execute(q.values(**values))
+
             transaction.commit()
         return self.db.pool.do(thd)
 
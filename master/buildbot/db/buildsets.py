@@ -17,6 +17,7 @@
 Support for buildsets in the database
 """
 
+import itertools
 import sqlalchemy as sa
 
 from buildbot.db import base
@@ -56,7 +57,9 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             r = conn.execute(buildsets_tbl.insert(), dict(
                 sourcestampsetid=sourcestampsetid, submitted_at=submitted_at,
                 reason=reason, complete=0, complete_at=None, results=-1,
-                external_idstring=external_idstring))
+                external_idstring=external_idstring,
+                requests_total=len(builderNames), requests_complete=0,
+                requests_failed=0))
             bsid = r.inserted_primary_key[0]
 
             # add any properties
@@ -134,6 +137,37 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return self._row2dict(row)
         return self.db.pool.do(thd)
 
+    def getBuildsetsByIds(self, bsids):
+        def thd(conn):
+            bs_tbl = self.db.model.buildsets
+            bsdicts = {}
+            # batch the bsids into groups of 100, so that the parameter
+            # lists supported by the DBAPI aren't exhausted
+            iterator = iter(set(bsids))
+            while True:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break
+                q = bs_tbl.select(whereclause=(bs_tbl.c.id.in_(batch)))
+                for row in conn.execute(q).fetchall():
+                    bsdicts[row.id] = self._row2dict(row)
+            return bsdicts
+        return self.db.pool.do(thd)
+
+    def getBuildsetRequestCounts(self, bsid):
+        def thd(conn):
+            bs_tbl = self.db.model.buildsets
+            q = sa.select([bs_tbl.c.requests_total,
+                           bs_tbl.c.requests_complete,
+                           bs_tbl.c.requests_failed],
+                          whereclause=(bs_tbl.c.id == bsid))
+            row = conn.execute(q).fetchone()
+            if not row or row.requests_total is None:
+                return None
+            return (row.requests_total, row.requests_complete,
+                    row.requests_failed)
+        return self.db.pool.do(thd)
+
     def getBuildsets(self, complete=None):
         def thd(conn):
             bs_tbl = self.db.model.buildsets
@@ -206,6 +240,36 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return BsProps(l)
         return self.db.pool.do(thd)
 
+    @defer.inlineCallbacks
+    def getBuildsetsProperties(self, bsids):
+        def thd(conn):
+            bsp_tbl = self.db.model.buildset_properties
+            props = dict((bsid, BsProps()) for bsid in bsids)
+            iterator = iter(props.keys())
+            while True:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break
+                q = sa.select(
+                    [bsp_tbl.c.buildsetid, bsp_tbl.c.property_name,
+                     bsp_tbl.c.property_value],
+                    whereclause=(bsp_tbl.c.buildsetid.in_(batch)))
+                for row in conn.execute(q):
+                    try:
+                        properties = json.loads(row.property_value)
+                        props[row.buildsetid][row.property_name] = \
+                            tuple(properties)
+                    except ValueError:
+                        pass
+            return props
+        props = yield self.db.pool.do(thd)
+
+        # seed the buildset property cache
+        for bsid, bsprops in props.iteritems():
+            self.getBuildsetProperties.cache.put(bsid, bsprops)
+
+        defer.returnValue(props)
+
     def _row2dict(self, row):
         def mkdt(epoch):
             if epoch:
@@ -38,16 +38,21 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                   revision=None, when_timestamp=None, branch=None,
                   category=None, revlink='', properties={}, repository='', codebase='',
                   project='', uid=None, _reactor=reactor):
-        assert project is not None, "project must be a string, not None"
-        assert repository is not None, "repository must be a string, not None"
-
-        if when_timestamp is None:
-            when_timestamp = epoch2datetime(_reactor.seconds())
+        d = self.addChanges([dict(author=author, files=files,
+                                  comments=comments, is_dir=is_dir,
+                                  revision=revision,
+                                  when_timestamp=when_timestamp,
+                                  branch=branch, category=category,
+                                  revlink=revlink, properties=properties,
+                                  repository=repository, codebase=codebase,
+                                  project=project, uid=uid)],
+                            _reactor=_reactor)
+        d.addCallback(lambda changeids: changeids[0])
+        return d
 
-        # verify that source is 'Change' for each property
-        for pv in properties.values():
-            assert pv[1] == 'Change', ("properties must be qualified with"
-                                       "source 'Change'")
+    def addChanges(self, changes, _reactor=reactor):
+        changes = [self._changeArgs(_reactor=_reactor, **kwargs)
+                   for kwargs in changes]
 
         def thd(conn):
             # note that in a read-uncommitted database like SQLite this
@@ -59,61 +64,90 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             transaction = conn.begin()
 
             ch_tbl = self.db.model.changes
-
-            self.check_length(ch_tbl.c.author, author)
-            self.check_length(ch_tbl.c.branch, branch)
-            self.check_length(ch_tbl.c.revision, revision)
-            self.check_length(ch_tbl.c.revlink, revlink)
-            self.check_length(ch_tbl.c.category, category)
-            self.check_length(ch_tbl.c.repository, repository)
-            self.check_length(ch_tbl.c.project, project)
-
-            r = conn.execute(ch_tbl.insert(), dict(
-                author=author,
-                comments=comments,
-                is_dir=is_dir,
-                branch=branch,
-                revision=revision,
-                revlink=revlink,
-                when_timestamp=datetime2epoch(when_timestamp),
-                category=category,
-                repository=repository,
-                codebase=codebase,
-                project=project))
-            changeid = r.inserted_primary_key[0]
-            if files:
-                tbl = self.db.model.change_files
-                for f in files:
-                    self.check_length(tbl.c.filename, f)
-                conn.execute(tbl.insert(), [
-                    dict(changeid=changeid, filename=f)
-                    for f in files
-                ])
-            if properties:
-                tbl = self.db.model.change_properties
-                inserts = [
-                    dict(changeid=changeid,
-                         property_name=k,
-                         property_value=json.dumps(v))
-                    for k, v in properties.iteritems()
-                ]
-                for i in inserts:
-                    self.check_length(tbl.c.property_name,
-                                      i['property_name'])
-                    self.check_length(tbl.c.property_value,
-                                      i['property_value'])
-
-                conn.execute(tbl.insert(), inserts)
-            if uid:
-                ins = self.db.model.change_users.insert()
-                conn.execute(ins, dict(changeid=changeid, uid=uid))
+            files_tbl = self.db.model.change_files
+            props_tbl = self.db.model.change_properties
+
+            # the changes are inserted one at a time, to learn their ids;
+            # their files, properties and users are inserted together
+            changeids = []
+            file_rows = []
+            prop_rows = []
+            user_rows = []
+            for ch in changes:
+                self.check_length(ch_tbl.c.author, ch['author'])
+                self.check_length(ch_tbl.c.branch, ch['branch'])
+                self.check_length(ch_tbl.c.revision, ch['revision'])
+                self.check_length(ch_tbl.c.revlink, ch['revlink'])
+                self.check_length(ch_tbl.c.category, ch['category'])
+                self.check_length(ch_tbl.c.repository, ch['repository'])
+                self.check_length(ch_tbl.c.project, ch['project'])
+
+                r = conn.execute(ch_tbl.insert(), dict(
+                    author=ch['author'],
+                    comments=ch['comments'],
+                    is_dir=ch['is_dir'],
+                    branch=ch['branch'],
+                    revision=ch['revision'],
+                    revlink=ch['revlink'],
+                    when_timestamp=datetime2epoch(ch['when_timestamp']),
+                    category=ch['category'],
+                    repository=ch['repository'],
+                    codebase=ch['codebase'],
+                    project=ch['project']))
+                changeid = r.inserted_primary_key[0]
+                changeids.append(changeid)
+
+                for f in ch['files'] or []:
+                    self.check_length(files_tbl.c.filename, f)
+                    file_rows.append(dict(changeid=changeid, filename=f))
+                for k, v in ch['properties'].iteritems():
+                    row = dict(changeid=changeid,
+                               property_name=k,
+                               property_value=json.dumps(v))
+                    self.check_length(props_tbl.c.property_name,
+                                      row['property_name'])
+                    self.check_length(props_tbl.c.property_value,
+                                      row['property_value'])
+                    prop_rows.append(row)
+                if ch['uid']:
+                    user_rows.append(dict(changeid=changeid, uid=ch['uid']))
+
+            if file_rows:
+                conn.execute(files_tbl.insert(), file_rows)
+            if prop_rows:
+                conn.execute(props_tbl.insert(), prop_rows)
+            if user_rows:
+                conn.execute(self.db.model.change_users.insert(), user_rows)
 
             transaction.commit()
 
-            return changeid
+            return changeids
         d = self.db.pool.do(thd)
         return d
 
+    def _changeArgs(self, author=None, files=None, comments=None, is_dir=0,
+                    revision=None, when_timestamp=None, branch=None,
+                    category=None, revlink='', properties={}, repository='',
+                    codebase='', project='', uid=None, _reactor=reactor):
+        # check the arguments of a change, and fill in the defaults
+        assert project is not None, "project must be a string, not None"
+        assert repository is not None, "repository must be a string, not None"
+
+        if when_timestamp is None:
+            when_timestamp = epoch2datetime(_reactor.seconds())
+
+        # verify that source is 'Change' for each property
+        for pv in properties.values():
+            assert pv[1] == 'Change', ("properties must be qualified with"
+                                       "source 'Change'")
+
+        return dict(author=author, files=files, comments=comments,
+                    is_dir=is_dir, revision=revision,
+                    when_timestamp=when_timestamp, branch=branch,
+                    category=category, revlink=revlink,
+                    properties=properties, repository=repository,
+                    codebase=codebase, project=project, uid=uid)
+
     @base.cached("chdicts")
     def getChange(self, changeid):
         assert changeid >= 0
@@ -131,6 +165,28 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         d = self.db.pool.do(thd)
         return d
 
+    def getChangesRange(self, from_id, limit):
+        assert from_id >= 0
+
+        def thd(conn):
+            changes_tbl = self.db.model.changes
+            q = changes_tbl.select(
+                whereclause=(changes_tbl.c.changeid >= from_id),
+                order_by=[changes_tbl.c.changeid],
+                limit=limit)
+            rows = conn.execute(q).fetchall()
+            return self._chdicts_from_change_rows_thd(conn, rows)
+        d = self.db.pool.do(thd)
+
+        # the chdicts are as good as those getChange would fetch, so cache
+        # them for the consumers of these changes
+        @d.addCallback
+        def cache(chdicts):
+            for chdict in chdicts:
+                self.getChange.cache.put(chdict['changeid'], chdict)
+            return chdicts
+        return d
+
     def getChangeUids(self, changeid):
         assert changeid >= 0
 
@@ -214,30 +270,48 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
     def _chdict_from_change_row_thd(self, conn, ch_row):
         # This method must be run in a db.pool thread, and returns a chdict
         # given a row from the 'changes' table
+        return self._chdicts_from_change_rows_thd(conn, [ch_row])[0]
+
+    def _chdicts_from_change_rows_thd(self, conn, ch_rows):
+        # This method must be run in a db.pool thread, and returns a list of
+        # chdicts given a list of rows from the 'changes' table, fetching the
+        # files and properties of all of them at once
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
 
-        chdict = ChDict(
-            changeid=ch_row.changeid,
-            author=ch_row.author,
-            files=[],  # see below
-            comments=ch_row.comments,
-            is_dir=ch_row.is_dir,
-            revision=ch_row.revision,
-            when_timestamp=epoch2datetime(ch_row.when_timestamp),
-            branch=ch_row.branch,
-            category=ch_row.category,
-            revlink=ch_row.revlink,
-            properties={},  # see below
-            repository=ch_row.repository,
-            codebase=ch_row.codebase,
-            project=ch_row.project)
-
-        query = change_files_tbl.select(
-            whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            chdict['files'].append(r.filename)
+        chdicts = []
+        by_id = {}
+        for ch_row in ch_rows:
+            chdict = ChDict(
+                changeid=ch_row.changeid,
+                author=ch_row.author,
+                files=[],  # see below
+                comments=ch_row.comments,
+                is_dir=ch_row.is_dir,
+                revision=ch_row.revision,
+                when_timestamp=epoch2datetime(ch_row.when_timestamp),
+                branch=ch_row.branch,
+                category=ch_row.category,
+                revlink=ch_row.revlink,
+                properties={},  # see below
+                repository=ch_row.repository,
+                codebase=ch_row.codebase,
+                project=ch_row.project)
+            chdicts.append(chdict)
+            by_id[ch_row.changeid] = chdict
+
+        if not chdicts:
+            return chdicts
+
+        def select_rows(tbl):
+            if len(by_id) == 1:
+                whereclause = (tbl.c.changeid == by_id.keys()[0])
+            else:
+                whereclause = tbl.c.changeid.in_(by_id.keys())
+            return conn.execute(tbl.select(whereclause=whereclause))
+
+        for r in select_rows(change_files_tbl):
+            by_id[r.changeid]['files'].append(r.filename)
 
         # and properties must be given without a source, so strip that, but
         # be flexible in case users have used a development version where the
@@ -251,14 +325,11 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 v, s = vs, "Change"
             return v, s
 
-        query = change_properties_tbl.select(
-            whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
+        for r in select_rows(change_properties_tbl):
             try:
                 v, s = split_vs(json.loads(r.property_value))
-                chdict['properties'][r.property_name] = (v, s)
+                by_id[r.changeid]['properties'][r.property_name] = (v, s)
             except ValueError:
                 pass
 
-        return chdict
+        return chdicts
@@ -138,6 +138,15 @@ class Model(base.DBConnectorComponent):
                          # buildset belongs to all sourcestamps with setid
                          sa.Column('sourcestampsetid', sa.Integer,
                                    sa.ForeignKey('sourcestampsets.id')),
+
+                         # the number of build requests in the buildset, the
+                         # number that are complete, and the number of those
+                         # that did not succeed (results other than SUCCESS or
+                         # WARNINGS).  These are NULL for buildsets created
+                         # before they were added.
+                         sa.Column('requests_total', sa.Integer),
+                         sa.Column('requests_complete', sa.Integer),
+                         sa.Column('requests_failed', sa.Integer),
                          )
 
     # buildslaves
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import base64
+import itertools
 import sqlalchemy as sa
 
 from buildbot.db import base
@@ -100,6 +101,35 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
             sslist.append(sourcestamp)
         defer.returnValue(sslist)
 
+    @defer.inlineCallbacks
+    def getSourceStampsForSets(self, sourcestampsetids):
+        def thd(conn):
+            tbl = self.db.model.sourcestamps
+            sslists = dict((setid, SsList()) for setid in sourcestampsetids)
+            rows = []
+            # batch the ids into groups of 100, so that the parameter lists
+            # supported by the DBAPI aren't exhausted
+            iterator = iter(sslists.keys())
+            while True:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break
+                q = tbl.select(whereclause=(tbl.c.sourcestampsetid.in_(batch)),
+                               order_by=[tbl.c.id])
+                rows.extend(conn.execute(q).fetchall())
+            for ssdict in self._ssdicts_from_rows_thd(conn, rows):
+                sslists[ssdict['sourcestampsetid']].append(ssdict)
+            return sslists
+        sslists = yield self.db.pool.do(thd)
+
+        # seed the caches used by getSourceStamps and getSourceStamp
+        for setid, sslist in sslists.iteritems():
+            self.getSourceStamps.cache.put(setid, sslist)
+            for ssdict in sslist:
+                self.getSourceStamp.cache.put(ssdict['ssid'], ssdict)
+
+        defer.returnValue(sslists)
+
     @base.cached("ssdicts")
     def getSourceStamp(self, ssid):
         def thd(conn):
@@ -109,22 +139,40 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
             row = res.fetchone()
             if not row:
                 return None
-            ssdict = SsDict(ssid=ssid, branch=row.branch, sourcestampsetid=row.sourcestampsetid,
-                            revision=row.revision, patch_body=None, patch_level=None,
-                            patch_author=None, patch_comment=None, patch_subdir=None,
+            return self._ssdicts_from_rows_thd(conn, [row])[0]
+        return self.db.pool.do(thd)
+
+    def _ssdicts_from_rows_thd(self, conn, rows):
+        # This method must be run in a db.pool thread, and returns a list of
+        # ssdicts given a list of rows from the 'sourcestamps' table, fetching
+        # the patches and change ids of all of them at once
+        ssdicts = []
+        by_ssid = {}
+        by_patchid = {}
+        for row in rows:
+            ssdict = SsDict(ssid=row.id, branch=row.branch,
+                            sourcestampsetid=row.sourcestampsetid,
+                            revision=row.revision, patch_body=None,
+                            patch_level=None, patch_author=None,
+                            patch_comment=None, patch_subdir=None,
                             repository=row.repository, codebase=row.codebase,
                             project=row.project,
                             changeids=set([]))
-            patchid = row.patchid
-            res.close()
-
-            # fetch the patch, if necessary
-            if patchid is not None:
-                tbl = self.db.model.patches
-                q = tbl.select(whereclause=(tbl.c.id == patchid))
-                res = conn.execute(q)
-                row = res.fetchone()
-                if row:
+            ssdicts.append(ssdict)
+            by_ssid[row.id] = ssdict
+            if row.patchid is not None:
+                by_patchid.setdefault(row.patchid, []).append(ssdict)
+
+        # fetch the patches, if necessary
+        tbl = self.db.model.patches
+        iterator = iter(by_patchid.keys())
+        while True:
+            batch = list(itertools.islice(iterator, 100))
+            if not batch:
+                break
+            q = tbl.select(whereclause=(tbl.c.id.in_(batch)))
+            for row in conn.execute(q).fetchall():
+                for ssdict in by_patchid.pop(row.id):
                     # note the subtle renaming here
                     ssdict['patch_level'] = row.patchlevel
                     ssdict['patch_subdir'] = row.subdir
@@ -132,18 +180,20 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
                     ssdict['patch_comment'] = row.patch_comment
                     body = base64.b64decode(row.patch_base64)
                     ssdict['patch_body'] = body
-                else:
-                    log.msg('patchid %d, referenced from ssid %d, not found'
-                            % (patchid, ssid))
-                res.close()
-
-            # fetch change ids
-            tbl = self.db.model.sourcestamp_changes
-            q = tbl.select(whereclause=(tbl.c.sourcestampid == ssid))
-            res = conn.execute(q)
-            for row in res:
-                ssdict['changeids'].add(row.changeid)
-            res.close()
-
-            return ssdict
-        return self.db.pool.do(thd)
+        for patchid, missing in by_patchid.iteritems():
+            for ssdict in missing:
+                log.msg('patchid %d, referenced from ssid %d, not found'
+                        % (patchid, ssdict['ssid']))
+
+        # fetch change ids
+        tbl = self.db.model.sourcestamp_changes
+        iterator = iter(by_ssid.keys())
+        while True:
+            batch = list(itertools.islice(iterator, 100))
+            if not batch:
+                break
+            q = tbl.select(whereclause=(tbl.c.sourcestampid.in_(batch)))
+            for row in conn.execute(q):
+                by_ssid[row.sourcestampid]['changeids'].add(row.changeid)
+
+        return ssdicts
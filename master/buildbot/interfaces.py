@@ -220,6 +220,73 @@ class IStatus(Interface):
         delivered."""
 
 
+class IBuildHistory(Interface):
+
+    """I store summaries of finished builds, indexed so that build history
+    can be searched without loading each build's pickle.  Configure me with
+    C{c['buildHistory']}.  All methods are synchronous."""
+
+    def start(basedir):
+        """Open the store, creating it if necessary.  Relative paths are
+        interpreted relative to C{basedir}, the master's basedir."""
+
+    def stop():
+        """Close the store."""
+
+    def addBuild(buildername, summary):
+        """Record the L{buildbot.status.buildhistory.BuildSummary} of a
+        finished build, replacing any existing summary with that number.
+        The first build recorded for a builder sets its first build
+        number."""
+
+    def getBuildSummary(buildername, number):
+        """Return the summary for the given build, or None."""
+
+    def getBuildSummaries(buildername, branches=None, results=None,
+                          min_buildnum=None, max_buildnum=None,
+                          finished_before=None, limit=None):
+        """Return a list of summaries of the builds matching the given
+        criteria, most recent first.
+
+        @param branches: if given, only builds with a sourcestamp on one of
+                         these branches
+        @param results: if not None, only builds with one of these results
+        @param min_buildnum: if given, only builds numbered at least this
+        @param max_buildnum: if given, only builds numbered at most this
+        @param finished_before: if given, only builds that finished before
+                                this timestamp
+        @param limit: if given, return at most this many summaries
+        """
+
+    def removeBuilds(buildername, before):
+        """Remove the summaries of all builds numbered below C{before}."""
+
+    def getFirstBuildNumber(buildername):
+        """Return the number from which this builder's history is complete,
+        or None if no builds have been recorded for it.  Earlier builds are
+        only available from their pickles."""
+
+    def setFirstBuildNumber(buildername, number):
+        """Set the number from which this builder's history is complete,
+        e.g., after importing existing build pickles."""
+
+
+class INotificationChannel(Interface):
+
+    """I tell the other masters in a multi-master configuration about the
+    changes and build requests that this master adds, so that they need not
+    wait to find them by polling the database.  Configure me with
+    C{c['notificationChannel']}.  I am a service, and have a C{master}
+    attribute, set by the master before I am started."""
+
+    def notifyChange(changeid):
+        """Tell the other masters that change C{changeid} was added."""
+
+    def notifyBuildRequest(bsid, brid, buildername):
+        """Tell the other masters that build request C{brid}, part of
+        buildset C{bsid}, was added for C{buildername}."""
+
+
 class IBuildSetStatus(Interface):
 
     """I represent a set of Builds, each run on a separate Builder but all
@@ -425,6 +492,17 @@ class IBuilderStatus(Interface):
                            of builds that will be examined.
         """
 
+    def generateFinishedBuildSummaries(branches=[],
+                                       num_builds=None,
+                                       max_buildnum=None,
+                                       finished_before=None,
+                                       results=None,
+                                       max_search=200):
+        """Like generateFinishedBuilds, but produce a
+        L{buildbot.status.buildhistory.BuildSummary} for each build.  The
+        summaries come from an index, so build pickles are not loaded to
+        filter on branches, results or finish time."""
+
     def subscribe(receiver):
         """Register an IStatusReceiver to receive new status events. The
         receiver will be given builderChangedState, buildStarted, and
@@ -850,6 +928,24 @@ class IStatusLog(Interface):
         0 for stdout, 1 for stderr, 2 for header. (note that stderr is merged
         into stdout if PTYs are in use)."""
 
+    def getChunksByOffset(start, end=None, channels=[], onlyText=False):
+        """Like getChunks, but only generate the text between byte offsets
+        'start' and 'end' (exclusive) of the concatenated text of the given
+        channels. Logs with a block index do not need to be read from the
+        beginning to find 'start'."""
+
+    def getChunksByLine(first, last=None, channels=[], onlyText=False):
+        """Like getChunksByOffset, but the range is given in lines, counting
+        from zero."""
+
+    def getTextLength(channels=[]):
+        """Return the length of the concatenated text of the given
+        channels."""
+
+    def getLineCount(channels=[]):
+        """Return the number of lines in the concatenated text of the given
+        channels."""
+
 
 class IStatusLogConsumer(Interface):
 
@@ -78,6 +78,19 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
     # database poll operation.
     WARNING_UNCLAIMED_COUNT = 10000
 
+    # number of changes fetched from the database at once when polling for
+    # new changes
+    CHANGES_POLL_BATCH = 100
+
+    # interval at which to compare the full set of unclaimed build requests
+    # with that tracked by the database poller; in between, the poller only
+    # looks for new build requests
+    UNCLAIMED_RECONCILE_INTERVAL = 5 * 60
+
+    # number of build request ids below the highest seen that are fetched
+    # again on each poll, for requests committed late by other masters
+    BUILDREQUESTS_POLL_WINDOW = 100
+
     def __init__(self, basedir, configFileName="master.cfg", umask=None):
         service.MultiService.__init__(self)
         self.setName("buildmaster")
@@ -96,6 +109,8 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # db configured values
         self.configured_db_url = None
         self.configured_poll_interval = None
+        # channel for notifications between masters
+        self.notificationChannel = None
 
         # configuration / reconfiguration handling
         self.config = config.MasterConfig()
@@ -120,6 +135,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # local cache for this master's object ID
         self._object_id = None
 
+        # serializes polls for new changes
+        self._changes_poll_lock = defer.DeferredLock()
+
         # Check environment is sensible
         check_functional_environment(self.config)
 
@@ -328,8 +346,27 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 self.db_loop = task.LoopingCall(self.pollDatabase)
                 self.db_loop.start(self.configured_poll_interval, now=False)
 
-        return config.ReconfigurableServiceMixin.reconfigService(self,
-                                                                 new_config)
+        d = self._reconfigNotificationChannel(new_config)
+        d.addCallback(lambda _:
+                      config.ReconfigurableServiceMixin.reconfigService(
+                          self, new_config))
+        return d
+
+    @defer.inlineCallbacks
+    def _reconfigNotificationChannel(self, new_config):
+        if new_config.notificationChannel == self.notificationChannel:
+            return
+
+        if self.notificationChannel:
+            yield defer.maybeDeferred(lambda:
+                                      self.notificationChannel.disownServiceParent())
+            self.notificationChannel.master = None
+            self.notificationChannel = None
+
+        if new_config.notificationChannel:
+            self.notificationChannel = new_config.notificationChannel
+            self.notificationChannel.master = self
+            self.notificationChannel.setServiceParent(self)
 
     # informational methods
     def allSchedulers(self):
@@ -437,6 +474,88 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         """
         metrics.MetricCountEvent.log("added_changes", 1)
 
+        chkwargs, src = self._changeArgs(
+            who=who, files=files, comments=comments, author=author,
+            isdir=isdir, is_dir=is_dir, revision=revision, when=when,
+            when_timestamp=when_timestamp, branch=branch, category=category,
+            revlink=revlink, properties=properties, repository=repository,
+            codebase=codebase, project=project, src=src)
+
+        d = defer.succeed(None)
+        if src:
+            # create user object, returning a corresponding uid
+            d.addCallback(lambda _: users.createUserObject(
+                self, chkwargs['author'], src))
+
+        # add the Change to the database
+        d.addCallback(lambda uid:
+                      self.db.changes.addChange(uid=uid, **chkwargs))
+
+        # convert the changeid to a Change instance
+        d.addCallback(lambda changeid:
+                      self.db.changes.getChange(changeid))
+        d.addCallback(lambda chdict:
+                      changes.Change.fromChdict(self, chdict))
+
+        d.addCallback(self._changeAdded)
+        return d
+
+    @defer.inlineCallbacks
+    def addChanges(self, changes_kwargs):
+        """
+        Add several changes to the buildmaster, and act on each of them in
+        order.  The user of each distinct author is found or created once;
+        the changes, with their files, properties and users, are then added
+        in a single database transaction.
+
+        @param changes_kwargs: the changes to add, each a dictionary of the
+        keyword arguments to L{addChange}
+        @type changes_kwargs: list of dictionaries
+
+        @returns: list of L{Change} instances, in the same order, via Deferred
+        """
+        if not changes_kwargs:
+            defer.returnValue([])
+        metrics.MetricCountEvent.log("added_changes", len(changes_kwargs))
+
+        db_changes = []
+        uids = {}
+        for kwargs in changes_kwargs:
+            chkwargs, src = self._changeArgs(**kwargs)
+            uid = None
+            if src:
+                # create user object, returning a corresponding uid; a batch
+                # usually has few authors, so look up each only once
+                key = (chkwargs['author'], src)
+                if key not in uids:
+                    uids[key] = yield users.createUserObject(
+                        self, chkwargs['author'], src)
+                uid = uids[key]
+            chkwargs['uid'] = uid
+            db_changes.append(chkwargs)
+
+        changeids = yield self.db.changes.addChanges(db_changes)
+
+        # the changeids are ascending, but other masters may have added
+        # changes between them, so fetch the range and pick ours
+        chdicts = yield self.db.changes.getChangesRange(
+            changeids[0], changeids[-1] - changeids[0] + 1)
+        chdicts = dict((chdict['changeid'], chdict) for chdict in chdicts)
+
+        added = []
+        for changeid in changeids:
+            change = yield changes.Change.fromChdict(self, chdicts[changeid])
+            added.append(self._changeAdded(change))
+        defer.returnValue(added)
+
+    def _changeArgs(self, who=None, files=None, comments=None, author=None,
+                    isdir=None, is_dir=None, revision=None, when=None,
+                    when_timestamp=None, branch=None, category=None,
+                    revlink='', properties={}, repository='', codebase=None,
+                    project='', src=None):
+        # translate the arguments to addChange into those of
+        # ChangesConnectorComponent.addChange (but for uid), and the source
+
         # handle translating deprecated names into new names for db.changes
         def handle_deprec(oldname, old, newname, new, default=None,
                           converter=lambda x: x):
@@ -483,37 +602,25 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             else:
                 codebase = ''
 
-        d = defer.succeed(None)
-        if src:
-            # create user object, returning a corresponding uid
-            d.addCallback(lambda _: users.createUserObject(self, author, src))
-
-        # add the Change to the database
-        d.addCallback(lambda uid:
-                      self.db.changes.addChange(author=author, files=files,
-                                                comments=comments, is_dir=is_dir,
-                                                revision=revision,
-                                                when_timestamp=when_timestamp,
-                                                branch=branch, category=category,
-                                                revlink=revlink, properties=properties,
-                                                repository=repository, codebase=codebase,
-                                                project=project, uid=uid))
-
-        # convert the changeid to a Change instance
-        d.addCallback(lambda changeid:
-                      self.db.changes.getChange(changeid))
-        d.addCallback(lambda chdict:
-                      changes.Change.fromChdict(self, chdict))
-
-        def notify(change):
-            msg = u"added change %s to database" % change
-            log.msg(msg.encode('utf-8', 'replace'))
-            # only deliver messages immediately if we're not polling
-            if not self.config.db['db_poll_interval']:
-                self._change_subs.deliver(change)
-            return change
-        d.addCallback(notify)
-        return d
+        return dict(author=author, files=files, comments=comments,
+                    is_dir=is_dir, revision=revision,
+                    when_timestamp=when_timestamp, branch=branch,
+                    category=category, revlink=revlink,
+                    properties=properties, repository=repository,
+                    codebase=codebase, project=project), src
+
+    def _changeAdded(self, change):
+        msg = u"added change %s to database" % change
+        log.msg(msg.encode('utf-8', 'replace'))
+        # only deliver messages immediately if we're not polling
+        if not self.config.db['db_poll_interval']:
+            self._change_subs.deliver(change)
+        # otherwise, tell the other masters, and poll now rather than
+        # waiting for the next interval
+        elif self.notificationChannel:
+            self.notificationChannel.notifyChange(change.number)
+            self.changeNotified(change.number)
+        return change
 
     def subscribeToChanges(self, callback):
         """
@@ -544,6 +651,12 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 for bn, brid in brids.iteritems():
                     self.buildRequestAdded(bsid=bsid, brid=brid,
                                            buildername=bn)
+            elif self.notificationChannel:
+                for bn, brid in brids.iteritems():
+                    self.notificationChannel.notifyBuildRequest(
+                        bsid=bsid, brid=brid, buildername=bn)
+                    self.buildRequestNotified(bsid=bsid, brid=brid,
+                                              buildername=bn)
             return (bsid, brids)
         d.addCallback(notify)
         return d
@@ -571,20 +684,29 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         Note that buildset completions are only reported on the master
         on which the last build request completes.
         """
-        brdicts = yield self.db.buildrequests.getBuildRequests(
-            bsid=bsid, complete=False)
+        counts = yield self.db.buildsets.getBuildsetRequestCounts(bsid)
+        if counts is not None:
+            # the buildset counts its completed and failed build requests
+            total, complete, failed = counts
+            if complete < total:
+                return
+            cumulative_results = FAILURE if failed else SUCCESS
+        else:
+            # buildsets created before the counts were added
+            brdicts = yield self.db.buildrequests.getBuildRequests(
+                bsid=bsid, complete=False)
 
-        # if there are incomplete buildrequests, bail out
-        if brdicts:
-            return
+            # if there are incomplete buildrequests, bail out
+            if brdicts:
+                return
 
-        brdicts = yield self.db.buildrequests.getBuildRequests(bsid=bsid)
+            brdicts = yield self.db.buildrequests.getBuildRequests(bsid=bsid)
 
-        # figure out the overall results of the buildset
-        cumulative_results = SUCCESS
-        for brdict in brdicts:
-            if brdict['results'] not in (SUCCESS, WARNINGS):
-                cumulative_results = FAILURE
+            # figure out the overall results of the buildset
+            cumulative_results = SUCCESS
+            for brdict in brdicts:
+                if brdict['results'] not in (SUCCESS, WARNINGS):
+                    cumulative_results = FAILURE
 
         # mark it as completed in the database
         yield self.db.buildsets.completeBuildset(bsid, cumulative_results)
@@ -629,6 +751,48 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         """
         return self._new_buildrequest_subs.subscribe(callback)
 
+    # notifications from c['notificationChannel']
+
+    def changeNotified(self, changeid):
+        """
+        Notifies the master that change C{changeid} was added to the
+        database, by this or another master.  The master polls for new
+        changes immediately, rather than waiting for the next database poll.
+        Any number of notifications that arrive while a poll is pending are
+        handled by that poll.
+
+        @param changeid: the id of the new change
+        """
+        if (self._last_processed_change is not None
+                and changeid <= self._last_processed_change):
+            return
+        if self._changes_poll_pending:
+            return
+        self._changes_poll_pending = True
+
+        def poll():
+            self._changes_poll_pending = False
+            return self._pollDatabaseChanges()
+        d = self._changes_poll_lock.run(poll)
+        d.addErrback(log.err, 'while polling for notified changes')
+
+    def buildRequestNotified(self, bsid, brid, buildername):
+        """
+        Notifies the master that build request C{brid} was added to the
+        database, by this or another master.  The request is delivered to
+        subscribers immediately, and will not be delivered again by the next
+        database poll.
+
+        @param bsid: containing buildset id
+        @param brid: buildrequest ID
+        @param buildername: builder named by the build request
+        """
+        if self._last_unclaimed_brids_set is not None:
+            if brid in self._last_unclaimed_brids_set:
+                return
+            self._last_unclaimed_brids_set.add(brid)
+        self.buildRequestAdded(bsid=bsid, brid=brid, buildername=buildername)
+
     # database polling
     def pollDatabase(self):
         # poll each of the tables that can indicate new, actionable stuff for
@@ -645,9 +809,15 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         return d
 
     _last_processed_change = None
+    _changes_poll_pending = False
 
-    @defer.inlineCallbacks
     def pollDatabaseChanges(self):
+        # change notifications also poll for changes, so serialize the polls
+        # to avoid delivering a change twice
+        return self._changes_poll_lock.run(self._pollDatabaseChanges)
+
+    @defer.inlineCallbacks
+    def _pollDatabaseChanges(self):
         # Older versions of Buildbot had each scheduler polling the database
         # independently, and storing a "last_processed" state indicating the
         # last change it had processed.  This had the advantage of allowing
@@ -682,21 +852,29 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             timer.stop()
             return
 
+        # fetch new changes in batches, processing them in order until there
+        # is a gap in the changeids (which may be a change that another
+        # master has not yet finished adding)
         while True:
-            changeid = self._last_processed_change + 1
-            chdict = yield self.db.changes.getChange(changeid)
+            chdicts = yield self.db.changes.getChangesRange(
+                self._last_processed_change + 1, self.CHANGES_POLL_BATCH)
 
-            # if there's no such change, we've reached the end and can
-            # stop polling
-            if not chdict:
-                break
+            for chdict in chdicts:
+                changeid = chdict['changeid']
+                if changeid != self._last_processed_change + 1:
+                    break
 
-            change = yield changes.Change.fromChdict(self, chdict)
+                change = yield changes.Change.fromChdict(self, chdict)
 
-            self._change_subs.deliver(change)
+                self._change_subs.deliver(change)
 
-            self._last_processed_change = changeid
-            need_setState = True
+                self._last_processed_change = changeid
+                need_setState = True
+            else:
+                # if the batch was full, there may be more
+                if len(chdicts) == self.CHANGES_POLL_BATCH:
+                    continue
+            break
 
         # write back the updated state, if it's changed
         if need_setState:
@@ -705,6 +883,8 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         timer.stop()
 
     _last_unclaimed_brids_set = None
+    _last_unclaimed_brid = 0
+    _last_unclaimed_reconcile = 0
     _last_claim_cleanup = 0
 
     @defer.inlineCallbacks
@@ -728,30 +908,66 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # the last poll, it notifies the subscribers.  It only tracks that
         # state within the master instance, though; on startup, it notifies for
         # all unclaimed requests in the database.
-
-        last_unclaimed = self._last_unclaimed_brids_set or set()
-        if len(last_unclaimed) > self.WARNING_UNCLAIMED_COUNT:
+        #
+        # Finding requests that were claimed and later unclaimed requires
+        # listing all unclaimed requests, which is expensive when many are
+        # queued, so that is only done every UNCLAIMED_RECONCILE_INTERVAL.  In
+        # between, polls only fetch requests with ids above the highest seen
+        # so far, less BUILDREQUESTS_POLL_WINDOW, so their cost is
+        # proportional to the new requests.  Ids are not committed in order
+        # when several masters add requests, so the window finds a request
+        # with a lower id that another master commits after a higher one has
+        # been seen.  A request further below that is claimed and unclaimed
+        # between two reconciliations is not noticed, so the master that
+        # unclaims a request must try to start it again itself; expired
+        # claims are much older than this interval.
+
+        last_unclaimed = self._last_unclaimed_brids_set
+        if (last_unclaimed is not None
+                and len(last_unclaimed) > self.WARNING_UNCLAIMED_COUNT):
             log.msg("WARNING: %d unclaimed buildrequests - is a scheduler "
                     "producing builds for which no builder is running?"
                     % len(last_unclaimed))
 
+        now = reactor.seconds()
+        if (last_unclaimed is None or now - self._last_unclaimed_reconcile
+                >= self.UNCLAIMED_RECONCILE_INTERVAL):
+            yield self._reconcileUnclaimedBuildRequests()
+            self._last_unclaimed_reconcile = now
+        else:
+            min_brid = max(self._last_unclaimed_brid
+                           - self.BUILDREQUESTS_POLL_WINDOW, 0) + 1
+            brdicts = yield self.db.buildrequests.getBuildRequests(
+                claimed=False, min_brid=min_brid)
+            for brd in sorted(brdicts, key=lambda brd: brd['brid']):
+                self._last_unclaimed_brid = max(self._last_unclaimed_brid,
+                                                brd['brid'])
+                if brd['brid'] in last_unclaimed:
+                    continue
+                last_unclaimed.add(brd['brid'])
+                self.buildRequestAdded(brd['buildsetid'], brd['brid'],
+                                       brd['buildername'])
+        timer.stop()
+
+    @defer.inlineCallbacks
+    def _reconcileUnclaimedBuildRequests(self):
+        last_unclaimed = self._last_unclaimed_brids_set or set()
+
         # get the current set of unclaimed buildrequests
-        now_unclaimed_brdicts = \
-            yield self.db.buildrequests.getBuildRequests(claimed=False)
-        now_unclaimed = set([brd['brid'] for brd in now_unclaimed_brdicts])
+        now_unclaimed_list = \
+            yield self.db.buildrequests.listUnclaimedBuildRequests()
+        now_unclaimed = set([brid for brid, _, _ in now_unclaimed_list])
 
         # and store that for next time
         self._last_unclaimed_brids_set = now_unclaimed
+        if now_unclaimed:
+            self._last_unclaimed_brid = max(self._last_unclaimed_brid,
+                                            max(now_unclaimed))
 
         # see what's new, and notify if anything is
-        new_unclaimed = now_unclaimed - last_unclaimed
-        if new_unclaimed:
-            brdicts = dict((brd['brid'], brd) for brd in now_unclaimed_brdicts)
-            for brid in new_unclaimed:
-                brd = brdicts[brid]
-                self.buildRequestAdded(brd['buildsetid'], brd['brid'],
-                                       brd['buildername'])
-        timer.stop()
+        for brid, bsid, buildername in now_unclaimed_list:
+            if brid not in last_unclaimed:
+                self.buildRequestAdded(bsid, brid, buildername)
 
     # state maintenance (private)
 
@@ -0,0 +1,252 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Notification channels between masters.
+
+In a multi-master configuration, each master learns of changes and build
+requests added by the other masters by polling the database.  A
+notification channel tells the other masters as soon as they are added, so
+that the polling interval can be long: it remains only as a fallback, for
+notifications that are lost.
+"""
+
+from buildbot import interfaces
+from buildbot import util
+from buildbot.util import json
+from buildbot.util.eventual import eventually
+from twisted.application import service
+from twisted.application import strports
+from twisted.internet import endpoints
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.protocols import basic
+from twisted.python import log
+from zope.interface import implements
+
+
+class NotificationChannelBase(service.MultiService, util.ComparableMixin):
+
+    """
+    Base class for notification channels.  Subclasses implement C{send},
+    and call C{messageReceived} with each message received from another
+    master.  Messages are dictionaries with a C{kind} key.
+    """
+
+    implements(interfaces.INotificationChannel)
+
+    # set by the master
+    master = None
+
+    def __init__(self):
+        service.MultiService.__init__(self)
+
+    def notifyChange(self, changeid):
+        self.send(dict(kind='change', changeid=changeid))
+
+    def notifyBuildRequest(self, bsid, brid, buildername):
+        self.send(dict(kind='buildrequest', bsid=bsid, brid=brid,
+                       buildername=buildername))
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def messageReceived(self, message):
+        if not self.master:
+            return
+        try:
+            kind = message['kind']
+            if kind == 'change':
+                self.master.changeNotified(int(message['changeid']))
+            elif kind == 'buildrequest':
+                self.master.buildRequestNotified(
+                    bsid=int(message['bsid']), brid=int(message['brid']),
+                    buildername=message['buildername'])
+            else:
+                log.msg("ignoring notification of unknown kind %r" % (kind,))
+        except (KeyError, TypeError, ValueError):
+            log.msg("ignoring malformed notification %r" % (message,))
+
+
+class LocalNotificationChannel(NotificationChannelBase):
+
+    """
+    A notification channel between masters running in the same process, and
+    configured with the same C{name}.  This stands in for a real channel in
+    tests and single-host experiments.
+    """
+
+    compare_attrs = ['name']
+
+    # channels, by name, that are currently running
+    _running = {}
+
+    def __init__(self, name='default'):
+        NotificationChannelBase.__init__(self)
+        self.name = name
+
+    def startService(self):
+        # channels with the same name compare equal, so keep a list and
+        # compare by identity
+        self._running.setdefault(self.name, []).append(self)
+        return NotificationChannelBase.startService(self)
+
+    def stopService(self):
+        channels = [c for c in self._running.get(self.name, [])
+                    if c is not self]
+        if channels:
+            self._running[self.name] = channels
+        else:
+            self._running.pop(self.name, None)
+        return NotificationChannelBase.stopService(self)
+
+    def send(self, message):
+        for channel in self._running.get(self.name, ()):
+            if channel is not self:
+                eventually(channel.messageReceived, dict(message))
+
+
+class _NotificationProtocol(basic.LineReceiver):
+
+    # messages are JSON objects, one per line
+    delimiter = '\n'
+
+    def lineReceived(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            log.msg("ignoring undecodable notification from %s"
+                    % (self.transport.getPeer(),))
+            return
+        if isinstance(message, dict):
+            self.factory.channel.messageReceived(message)
+
+    def sendMessage(self, message):
+        self.sendLine(json.dumps(message))
+
+    def connectionLost(self, reason):
+        peer = getattr(self.factory, 'peer', None)
+        if peer:
+            peer.connectionLost(self)
+        basic.LineReceiver.connectionLost(self, reason)
+
+
+class _NotificationFactory(protocol.Factory):
+
+    protocol = _NotificationProtocol
+
+    def __init__(self, channel, peer=None):
+        self.channel = channel
+        self.peer = peer
+
+
+class _Peer(object):
+
+    # a connection to another master, made when there is something to send;
+    # messages sent while it is being made are queued
+
+    def __init__(self, channel, description, _reactor):
+        self.channel = channel
+        self.description = description
+        self._reactor = _reactor
+        self.protocol = None
+        self.connecting = None
+        self.queue = []
+
+    def send(self, message):
+        if self.protocol:
+            self.protocol.sendMessage(message)
+            return
+        self.queue.append(message)
+        if not self.connecting:
+            self.connect()
+
+    def connect(self):
+        endpoint = endpoints.clientFromString(self._reactor, self.description)
+        d = self.connecting = endpoint.connect(
+            _NotificationFactory(self.channel, self))
+
+        @d.addCallback
+        def connected(proto):
+            self.connecting = None
+            self.protocol = proto
+            queue, self.queue = self.queue, []
+            for message in queue:
+                proto.sendMessage(message)
+
+        @d.addErrback
+        def failed(f):
+            # the other master will find these by polling
+            self.connecting = None
+            log.msg("could not send %d notifications to %s: %s"
+                    % (len(self.queue), self.description,
+                       f.getErrorMessage()))
+            self.queue = []
+        return d
+
+    def connectionLost(self, proto):
+        if self.protocol is proto:
+            self.protocol = None
+
+    def disconnect(self):
+        if self.connecting:
+            self.connecting.cancel()
+        if self.protocol:
+            self.protocol.transport.loseConnection()
+            self.protocol = None
+        self.queue = []
+
+
+class SocketNotificationChannel(NotificationChannelBase):
+
+    """
+    A notification channel over TCP or UNIX sockets.  Each master listens on
+    the C{port} strports description (e.g., C{'tcp:9990'} or
+    C{'unix:/var/run/buildbot/notify'}), and sends its notifications to the
+    masters described by the endpoint descriptions in C{peers} (e.g.,
+    C{'tcp:host=master2:port=9990'} or C{'unix:path=...'}).  Messages that
+    cannot be delivered are dropped, and left for the other masters to find
+    by polling.
+    """
+
+    compare_attrs = ['port', 'peers']
+
+    def __init__(self, port, peers=[], _reactor=reactor):
+        NotificationChannelBase.__init__(self)
+        if isinstance(port, int):
+            port = "tcp:%d" % port
+        self.port = port
+        self.peers = list(peers)
+        self._reactor = _reactor
+        self._peers = [_Peer(self, description, _reactor)
+                       for description in self.peers]
+        s = strports.service(self.port, _NotificationFactory(self))
+        s.setServiceParent(self)
+
+    def startService(self):
+        NotificationChannelBase.startService(self)
+        log.msg("listening for notifications from other masters on %s"
+                % (self.port,))
+
+    def stopService(self):
+        for peer in self._peers:
+            peer.disconnect()
+        return NotificationChannelBase.stopService(self)
+
+    def send(self, message):
+        if not self.running:
+            return
+        for peer in self._peers:
+            peer.send(message)
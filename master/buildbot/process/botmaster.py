@@ -164,6 +164,8 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # reconfigure builders
         yield self.reconfigServiceBuilders(new_config)
 
+        self.brd.concurrency = new_config.distributorConcurrency
+
         # call up
         yield config.ReconfigurableServiceMixin.reconfigService(self,
                                                                 new_config)
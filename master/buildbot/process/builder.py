@@ -482,7 +482,14 @@ class Builder(config.ReconfigurableServiceMixin,
 
     def _resubmit_buildreqs(self, build):
         brids = [br.id for br in build.requests]
-        return self.master.db.buildrequests.unclaimBuildRequests(brids)
+        d = self.master.db.buildrequests.unclaimBuildRequests(brids)
+
+        # the master's database poller may not notice requests that were
+        # unclaimed soon after being claimed, so try starting them here
+        @d.addCallback
+        def maybeStart(_):
+            self.botmaster.maybeStartBuildsForBuilder(self.name)
+        return d
 
     def setExpectations(self, progress):
         """Mark the build as successful and update expectations for the next
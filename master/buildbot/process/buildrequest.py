@@ -96,7 +96,47 @@ class BuildRequest(object):
 
     @classmethod
     @defer.inlineCallbacks
-    def _make_br(cls, brid, brdict, master):
+    def fromBrdicts(cls, master, brdicts):
+        """
+        Construct L{BuildRequest}s from a list of dictionaries as returned by
+        L{BuildRequestsConnectorComponent.getBuildRequests}.  This is
+        equivalent to calling L{fromBrdict} for each dictionary, but fetches
+        the buildsets, properties and sourcestamps of all of the requests in
+        a few queries.
+
+        @param master: current build master
+        @param brdicts: list of build request dictionaries
+
+        @returns: list of L{BuildRequest}s, in the same order, via Deferred
+        """
+        brdicts = list(brdicts)
+        if not brdicts:
+            defer.returnValue([])
+
+        bsids = set(brdict['buildsetid'] for brdict in brdicts)
+        buildsets = yield master.db.buildsets.getBuildsetsByIds(bsids)
+        buildsets_properties = \
+            yield master.db.buildsets.getBuildsetsProperties(bsids)
+        sslists = yield master.db.sourcestamps.getSourceStampsForSets(
+            set(bs['sourcestampsetid'] for bs in buildsets.itervalues()))
+
+        cache = master.caches.get_cache("BuildRequests", cls._make_br)
+        dlist = []
+        for brdict in brdicts:
+            buildset = buildsets.get(brdict['buildsetid'])
+            prefetched = None
+            if buildset:
+                prefetched = (buildset,
+                              buildsets_properties[brdict['buildsetid']],
+                              sslists[buildset['sourcestampsetid']])
+            dlist.append(cache.get(brdict['brid'], brdict=brdict,
+                                   master=master, prefetched=prefetched))
+        buildrequests = yield defer.gatherResults(dlist)
+        defer.returnValue(buildrequests)
+
+    @classmethod
+    @defer.inlineCallbacks
+    def _make_br(cls, brid, brdict, master, prefetched=None):
         buildrequest = cls()
         buildrequest.id = brid
         buildrequest.bsid = brdict['buildsetid']
@@ -106,18 +146,23 @@ class BuildRequest(object):
         buildrequest.submittedAt = dt and calendar.timegm(dt.utctimetuple())
         buildrequest.master = master
 
-        # fetch the buildset to get the reason
-        buildset = yield master.db.buildsets.getBuildset(brdict['buildsetid'])
-        assert buildset  # schema should guarantee this
-        buildrequest.reason = buildset['reason']
+        if prefetched:
+            # fetched in bulk by fromBrdicts
+            buildset, buildset_properties, sslist = prefetched
+        else:
+            # fetch the buildset to get the reason
+            buildset = yield master.db.buildsets.getBuildset(brdict['buildsetid'])
+            assert buildset  # schema should guarantee this
+
+            # fetch the buildset properties
+            buildset_properties = yield master.db.buildsets.getBuildsetProperties(brdict['buildsetid'])
 
-        # fetch the buildset properties, and convert to Properties
-        buildset_properties = yield master.db.buildsets.getBuildsetProperties(brdict['buildsetid'])
+            # fetch the sourcestamp dictionary
+            sslist = yield master.db.sourcestamps.getSourceStamps(buildset['sourcestampsetid'])
 
+        buildrequest.reason = buildset['reason']
         buildrequest.properties = properties.Properties.fromDict(buildset_properties)
 
-        # fetch the sourcestamp dictionary
-        sslist = yield master.db.sourcestamps.getSourceStamps(buildset['sourcestampsetid'])
         assert len(sslist) > 0, "Empty sourcestampset: db schema enforces set to exist but cannot enforce a non empty set"
 
         # and turn it into a SourceStamps
@@ -169,6 +214,16 @@ class BuildRequest(object):
         # all codebases tested, no differences found
         return True
 
+    def getMergeKey(self):
+        """
+        Returns a key that is equal for any two requests for which
+        L{canBeMergedWith} may return true, so that candidates for a merge
+        can be found without comparing every pair of requests.
+        """
+        return tuple(sorted((codebase, ss.repository, ss.branch, ss.project,
+                             bool(ss.changes))
+                            for codebase, ss in self.sources.iteritems()))
+
     def canBeMergedWith(self, other):
         """
         Returns if both requests can be merged
@@ -16,16 +16,77 @@
 
 from twisted.application import service
 from twisted.internet import defer
+from twisted.internet import reactor
 from twisted.python import log
 from twisted.python.failure import Failure
 
-from buildbot.db.buildrequests import AlreadyClaimedError
+from buildbot import util
 from buildbot.process import metrics
+from buildbot.process.builder import Builder
 from buildbot.process.buildrequest import BuildRequest
+from buildbot.util.eventual import eventually
 
+import heapq
 import random
 
 
+class UnclaimedBrdicts(object):
+
+    """
+    The unclaimed brdicts for a builder, indexed by brid and ordered by
+    priority (highest first), then by submission time (oldest first).
+    Iterating yields the brdicts in that order; C{first} and C{remove} take
+    logarithmic time, so that draining the queue does not take quadratic
+    time when many requests are waiting.
+    """
+
+    def __init__(self, brdicts):
+        self.brdicts = dict((brd['brid'], brd) for brd in brdicts)
+        self.heap = [(self._key(brd), brd['brid']) for brd in brdicts]
+        heapq.heapify(self.heap)
+        self.removed = {}
+
+    def _key(self, brdict):
+        return (-brdict['priority'], brdict['submitted_at'], brdict['brid'])
+
+    def __len__(self):
+        return len(self.brdicts)
+
+    def __contains__(self, brid):
+        return brid in self.brdicts
+
+    def __iter__(self):
+        seen = set()
+        for _, brid in sorted(self.heap):
+            if brid in self.brdicts and brid not in seen:
+                seen.add(brid)
+                yield self.brdicts[brid]
+
+    def get(self, brid):
+        return self.brdicts.get(brid)
+
+    def first(self):
+        # removed brdicts are left in the heap until they reach the top
+        heap = self.heap
+        while heap and heap[0][1] not in self.brdicts:
+            heapq.heappop(heap)
+        if heap:
+            return self.brdicts[heap[0][1]]
+        return None
+
+    def remove(self, brid):
+        brdict = self.brdicts.pop(brid, None)
+        if brdict is not None:
+            self.removed[brid] = brdict
+
+    def restore(self, brid):
+        # put back a removed brdict
+        brdict = self.removed.pop(brid, None)
+        if brdict is not None:
+            self.brdicts[brid] = brdict
+            heapq.heappush(self.heap, (self._key(brdict), brid))
+
+
 class BuildChooserBase(object):
     #
     # WARNING: This API is experimental and in active development.
@@ -39,6 +100,11 @@ class BuildChooserBase(object):
     # The entry point is:
     #    * bc.chooseNextBuild() - get the next (slave, [breqs]) or (None, None)
     #
+    # A build that was chosen but could not be claimed, because some of its
+    # requests were claimed elsewhere, is handed back with
+    #    * bc.restoreBuild(slave, breqs) - make the slave and the given breqs
+    #       available to be chosen again
+    #
     # The default implementation of this class implements a default
     # chooseNextBuild() that delegates out to two other functions:
     #   * bc.popNextBuild() - get the next (slave, breq) pair
@@ -66,6 +132,12 @@ class BuildChooserBase(object):
 
         defer.returnValue((slave, breqs))
 
+    def restoreBuild(self, slave, breqs):
+        # Subclasses that track slaves should also make the slave available
+        for breq in breqs:
+            self.unclaimedBrdicts.restore(breq.id)
+            self.breqCache[breq.id] = breq
+
     # Must be implemented by subclass
     def popNextBuild(self):
         # Pick the next (slave, breq) pair; note this is pre-merge, so
@@ -83,16 +155,15 @@ class BuildChooserBase(object):
     @defer.inlineCallbacks
     def _fetchUnclaimedBrdicts(self):
         # Sets up a cache of all the unclaimed brdicts. The cache is
-        # saved at self.unclaimedBrdicts cache. If the cache already
-        # exists, this function does nothing. If a refetch is desired, set
-        # the self.unclaimedBrdicts to None before calling."""
+        # saved at self.unclaimedBrdicts cache, an UnclaimedBrdicts instance.
+        # If the cache already exists, this function does nothing. If a
+        # refetch is desired, set the self.unclaimedBrdicts to None before
+        # calling."""
 
         if self.unclaimedBrdicts is None:
             brdicts = yield self.master.db.buildrequests.getBuildRequests(
                 buildername=self.bldr.name, claimed=False)
-            # sort by submitted_at, so the first is the oldest
-            brdicts.sort(key=lambda brd: brd['submitted_at'])
-            self.unclaimedBrdicts = brdicts
+            self.unclaimedBrdicts = UnclaimedBrdicts(brdicts)
         defer.returnValue(self.unclaimedBrdicts)
 
     @defer.inlineCallbacks
@@ -114,11 +185,7 @@ class BuildChooserBase(object):
         if breq is None:
             return None
 
-        brid = breq.id
-        for brdict in self.unclaimedBrdicts:
-            if brid == brdict['brid']:
-                return brdict
-        return None
+        return self.unclaimedBrdicts.get(breq.id)
 
     def _removeBuildRequest(self, breq):
         # Remove a BuildrRequest object (and its brdict)
@@ -127,18 +194,25 @@ class BuildChooserBase(object):
         if breq is None:
             return
 
-        brdict = self._getBrdictForBuildRequest(breq)
-        if brdict is not None:
-            self.unclaimedBrdicts.remove(brdict)
+        self.unclaimedBrdicts.remove(breq.id)
 
         if breq.id in self.breqCache:
             del self.breqCache[breq.id]
 
+    @defer.inlineCallbacks
     def _getUnclaimedBuildRequests(self):
-        # Retrieve the list of BuildRequest objects for all unclaimed builds
-        return defer.gatherResults([
-            self._getBuildRequestForBrdict(brdict)
-            for brdict in self.unclaimedBrdicts])
+        # Retrieve the list of BuildRequest objects for all unclaimed builds,
+        # constructing those not yet in the cache in bulk
+        brdicts = list(self.unclaimedBrdicts)
+        missing = [brdict for brdict in brdicts
+                   if brdict['brid'] not in self.breqCache]
+        if missing:
+            breqs = yield BuildRequest.fromBrdicts(self.master, missing)
+            for brdict, breq in zip(missing, breqs):
+                if breq:
+                    self.breqCache[brdict['brid']] = breq
+        defer.returnValue([self.breqCache.get(brdict['brid'])
+                           for brdict in brdicts])
 
 
 class BasicBuildChooser(BuildChooserBase):
@@ -184,6 +258,11 @@ class BasicBuildChooser(BuildChooserBase):
 
         self.mergeRequestsFn = self.bldr.getMergeRequestsFn()
 
+        # with the default mergeRequests function, only requests with the
+        # same merge key can be merged; this maps each key to the brids
+        # that have it, in queue order
+        self.mergeKeyIndex = None
+
     @defer.inlineCallbacks
     def popNextBuild(self):
         nextBuild = (None, None)
@@ -233,17 +312,39 @@ class BasicBuildChooser(BuildChooserBase):
             defer.returnValue(mergedRequests)
             return
 
-        # we'll need BuildRequest objects, so get those first
-        unclaimedBreqs = yield self._getUnclaimedBuildRequests()
+        if (getattr(self.mergeRequestsFn, 'im_func', self.mergeRequestsFn)
+                is Builder._defaultMergeRequestFn.im_func):
+            # only requests with the same merge key are worth trying
+            candidates = yield self._getMergeCandidates(breq)
+        else:
+            # we'll need BuildRequest objects, so get those first
+            candidates = yield self._getUnclaimedBuildRequests()
 
         # gather the mergeable requests
-        for req in unclaimedBreqs:
+        for req in candidates:
             canMerge = yield self.mergeRequestsFn(self.bldr, breq, req)
             if canMerge:
                 mergedRequests.append(req)
 
         defer.returnValue(mergedRequests)
 
+    @defer.inlineCallbacks
+    def _getMergeCandidates(self, breq):
+        if self.mergeKeyIndex is None:
+            breqs = yield self._getUnclaimedBuildRequests()
+            self.mergeKeyIndex = {}
+            for req in breqs:
+                self.mergeKeyIndex.setdefault(req.getMergeKey(), []) \
+                    .append(req.id)
+
+        brids = self.mergeKeyIndex.get(breq.getMergeKey(), [])
+        # drop the requests that have been taken since the index was built
+        brids[:] = [brid for brid in brids if brid in self.unclaimedBrdicts]
+        candidates = yield defer.gatherResults([
+            self._getBuildRequestForBrdict(self.unclaimedBrdicts.get(brid))
+            for brid in brids])
+        defer.returnValue(candidates)
+
     @defer.inlineCallbacks
     def _getNextUnclaimedBuildRequest(self):
         # ensure the cache is there
@@ -265,7 +366,7 @@ class BasicBuildChooser(BuildChooserBase):
                 nextBreq = None
         else:
             # otherwise just return the first build
-            brdict = self.unclaimedBrdicts[0]
+            brdict = self.unclaimedBrdicts.first()
             nextBreq = yield self._getBuildRequestForBrdict(brdict)
 
         defer.returnValue(nextBreq)
@@ -307,6 +408,12 @@ class BasicBuildChooser(BuildChooserBase):
 
         defer.returnValue(None)
 
+    def restoreBuild(self, slave, breqs):
+        BuildChooserBase.restoreBuild(self, slave, breqs)
+        self._unpopSlaves([slave])
+        # the merge key index drops requests as they are taken
+        self.mergeKeyIndex = None
+
     def _unpopSlaves(self, slaves):
         # push the slaves back to the front
         self.preferredSlaves[:0] = slaves
@@ -326,23 +433,47 @@ class BuildRequestDistributor(service.Service):
     are still working on the previous build request, then this class will
     correctly re-prioritize invocations of builders' C{maybeStartBuild}
     methods.
+
+    Up to C{concurrency} builders are considered at once.  Builders that
+    share a slave are never considered at the same time, and a builder is
+    never considered before a higher-priority builder that shares a slave
+    with it.
     """
 
     BuildChooser = BasicBuildChooser
 
-    def __init__(self, botmaster):
+    def __init__(self, botmaster, _reactor=reactor):
         self.botmaster = botmaster
         self.master = botmaster.master
+        self._reactor = _reactor
+
+        # maximum number of builders to consider at once; set by the botmaster
+        # from the distributorConcurrency configuration
+        self.concurrency = 1
 
         # lock to ensure builders are only sorted once at any time
         self.pending_builders_lock = defer.DeferredLock()
 
         # sorted list of names of builders that need their maybeStartBuild
-        # method invoked.
+        # method invoked, and the time at which each was added to it
         self._pending_builders = []
+        self._pending_since = {}
+
+        # lock held while choosing which builders to consider next
         self.activity_lock = defer.DeferredLock()
         self.active = False
 
+        # Deferreds for the builders currently being considered, by name, and
+        # a Deferred that wakes the activity loop when one of them finishes
+        # or more builders become pending
+        self._active_builders = {}
+        self._activity_wakeup = None
+
+        # claims waiting to be made, as (groups of brids, Deferred) pairs;
+        # they are made together once the claims in progress are complete
+        self._claim_queue = []
+        self._claiming = False
+
         self._pendingMSBOCalls = []
 
     @defer.inlineCallbacks
@@ -353,6 +484,10 @@ class BuildRequestDistributor(service.Service):
         # self.running is false.
         yield self.activity_lock.run(service.Service.stopService, self)
 
+        # wait for the builders that are already being considered
+        if self._active_builders:
+            yield defer.DeferredList(self._active_builders.values())
+
         # now let any outstanding calls to maybeStartBuildsOn to finish, so
         # they don't get interrupted in mid-stride.  This tends to be
         # particularly painful because it can occur when a generator is gc'd.
@@ -400,11 +535,16 @@ class BuildRequestDistributor(service.Service):
                 self._pending_builders = \
                     yield self._sortBuilders(
                         list(existing_pending | new_builders))
+                now = util.now(self._reactor)
+                for name in self._pending_builders:
+                    self._pending_since.setdefault(name, now)
 
                 # start the activity loop, if we aren't already
                 # working on that.
                 if not self.active:
                     self._activityLoop()
+                else:
+                    self._wakeActivityLoop()
             except Exception:
                 log.err(Failure(),
                         "while attempting to start builds on %s" % self.name)
@@ -482,34 +622,100 @@ class BuildRequestDistributor(service.Service):
         while True:
             yield self.activity_lock.acquire()
 
-            # lock pending_builders, pop an element from it, and release
+            # lock pending_builders, start as many of them as we can, and
+            # release
             yield self.pending_builders_lock.acquire()
 
             # bail out if we shouldn't keep looping
-            if not self.running or not self._pending_builders:
+            if not self.running:
                 self.pending_builders_lock.release()
                 self.activity_lock.release()
                 break
 
-            bldr_name = self._pending_builders.pop(0)
-            self.pending_builders_lock.release()
+            self._startPendingBuilders()
 
-            # get the actual builder object
-            bldr = self.botmaster.builders.get(bldr_name)
-            try:
-                if bldr:
-                    yield self._maybeStartBuildsOnBuilder(bldr)
-            except Exception:
-                log.err(Failure(),
-                        "from maybeStartBuild for builder '%s'" % (bldr_name,))
+            # if nothing could be started, then nothing was pending
+            if not self._active_builders:
+                self.pending_builders_lock.release()
+                self.activity_lock.release()
+                break
 
+            # set this up before releasing the locks, so that no wakeup is
+            # missed
+            wakeup = self._activity_wakeup = defer.Deferred()
+            self.pending_builders_lock.release()
             self.activity_lock.release()
+            yield wakeup
 
         timer.stop()
 
         self.active = False
         self._quiet()
 
+    def _startPendingBuilders(self):
+        # start considering pending builders, in order, until there are
+        # self.concurrency active builders.  A builder is skipped if it is
+        # already active, or if it shares a slave with an active builder or
+        # with a skipped builder (which has a higher priority).
+        reserved_slaves = set()
+        if self.concurrency > 1:
+            for name in self._active_builders:
+                bldr = self.botmaster.builders.get(name)
+                if bldr:
+                    reserved_slaves.update(bldr.config.slavenames)
+
+        i = 0
+        while (i < len(self._pending_builders)
+               and len(self._active_builders) < self.concurrency):
+            bldr_name = self._pending_builders[i]
+
+            # get the actual builder object
+            bldr = self.botmaster.builders.get(bldr_name)
+            if not bldr:
+                del self._pending_builders[i]
+                self._pending_since.pop(bldr_name, None)
+                continue
+
+            if self.concurrency > 1:
+                slavenames = set(bldr.config.slavenames)
+                blocked = (bldr_name in self._active_builders
+                           or slavenames & reserved_slaves)
+                reserved_slaves.update(slavenames)
+                if blocked:
+                    i += 1
+                    continue
+            elif bldr_name in self._active_builders:
+                i += 1
+                continue
+
+            del self._pending_builders[i]
+            pending_since = self._pending_since.pop(bldr_name, None)
+            if pending_since is not None:
+                metrics.MetricTimeEvent.log(
+                    'BuildRequestDistributor.builder_wait',
+                    util.now(self._reactor) - pending_since)
+            self._startBuilder(bldr)
+
+    def _startBuilder(self, bldr):
+        d = self._active_builders[bldr.name] = defer.maybeDeferred(
+            self._maybeStartBuildsOnBuilder, bldr)
+
+        @d.addErrback
+        def logErr(f):
+            log.err(f, "from maybeStartBuild for builder '%s'" % (bldr.name,))
+
+        @d.addCallback
+        def finished(_):
+            del self._active_builders[bldr.name]
+            # wake the loop once anything else waiting on this builder (such
+            # as stopService) has run
+            eventually(self._wakeActivityLoop)
+
+    def _wakeActivityLoop(self):
+        if self._activity_wakeup:
+            d, self._activity_wakeup = self._activity_wakeup, None
+            d.callback(None)
+
     @defer.inlineCallbacks
     def _maybeStartBuildsOnBuilder(self, bldr):
         # create a chooser to give us our next builds
@@ -518,27 +724,81 @@ class BuildRequestDistributor(service.Service):
         bc = self.createBuildChooser(bldr, self.master)
 
         while True:
-            slave, breqs = yield bc.chooseNextBuild()
-            if not slave or not breqs:
+            # choose the builds that can start now.  Lock availability is only
+            # checked for one build at a time, so with locks, builds are
+            # chosen one at a time.
+            choices = []
+            while True:
+                slave, breqs = yield bc.chooseNextBuild()
+                if not slave or not breqs:
+                    break
+                choices.append((slave, breqs))
+                if bldr.config.locks:
+                    break
+            if not choices:
                 break
 
-            # claim brid's
-            brids = [br.id for br in breqs]
-            try:
-                yield self.master.db.buildrequests.claimBuildRequests(brids)
-            except AlreadyClaimedError:
-                # some brids were already claimed, so start over
-                bc = self.createBuildChooser(bldr, self.master)
-                continue
-
-            buildStarted = yield bldr.maybeStartBuild(slave, breqs)
-
-            if not buildStarted:
-                yield self.master.db.buildrequests.unclaimBuildRequests(brids)
+            # claim them all at once
+            conflicts = yield self._claimBuildRequests(
+                [[br.id for br in chosen] for _, chosen in choices])
+
+            for slave, breqs in choices:
+                brids = [br.id for br in breqs]
+                if conflicts.intersection(brids):
+                    # some brids were claimed elsewhere; the slave and the
+                    # other requests can still be chosen
+                    bc.restoreBuild(slave, [br for br in breqs
+                                            if br.id not in conflicts])
+                    continue
+
+                buildStarted = yield bldr.maybeStartBuild(slave, breqs)
+
+                if buildStarted:
+                    self._logRequestLatency(breqs)
+                else:
+                    yield self.master.db.buildrequests.unclaimBuildRequests(brids)
+
+                    # and try starting builds again.  If we still have a working slave,
+                    # then this may re-claim the same buildrequests
+                    self.botmaster.maybeStartBuildsForBuilder(self.name)
+
+    def _claimBuildRequests(self, groups):
+        # Claim groups of brids, along with any other claims made while the
+        # current claims are in progress; returns the set of brids that were
+        # already claimed, via Deferred.  A group is claimed only if none of
+        # its brids were already claimed.
+        d = defer.Deferred()
+        self._claim_queue.append((groups, d))
+        if not self._claiming:
+            self._flushClaims()
+        return d
 
-                # and try starting builds again.  If we still have a working slave,
-                # then this may re-claim the same buildrequests
-                self.botmaster.maybeStartBuildsForBuilder(self.name)
+    @defer.inlineCallbacks
+    def _flushClaims(self):
+        self._claiming = True
+        while self._claim_queue:
+            queue, self._claim_queue = self._claim_queue, []
+            try:
+                conflicts = yield \
+                    self.master.db.buildrequests.claimBuildRequestGroups(
+                        [group for groups, _ in queue for group in groups])
+            except Exception:
+                f = Failure()
+                for _, d in queue:
+                    d.errback(f)
+            else:
+                for _, d in queue:
+                    d.callback(conflicts)
+        self._claiming = False
+
+    def _logRequestLatency(self, breqs):
+        # record the time each request spent queued before its build started
+        now = util.now(self._reactor)
+        for breq in breqs:
+            if breq.submittedAt is not None:
+                metrics.MetricTimeEvent.log(
+                    'BuildRequestDistributor.request_latency',
+                    now - breq.submittedAt)
 
     def createBuildChooser(self, bldr, master):
         # just instantiate the build chooser requested
@@ -13,6 +13,8 @@
 #
 # Copyright Buildbot Team Members
 
+import zlib
+
 from buildbot import interfaces
 from buildbot import util
 from buildbot.process import metrics
@@ -169,10 +171,10 @@ class RemoteCommand(pb.Referenceable):
                 if self.active and not self.ignore_updates:
                     self.remoteUpdate(update)
             except:
-                # log failure, terminate build, let slave retire the update
+                # log failure, terminate build, let slave retire the update;
+                # we are no longer active, so the rest of the batch is
+                # skipped, but still acknowledged
                 self._finished(Failure())
-                # TODO: what if multiple updates arrive? should
-                # skip the rest but ack them all
             if num > max_updatenum:
                 max_updatenum = num
         return max_updatenum
@@ -232,6 +234,8 @@ class RemoteCommand(pb.Referenceable):
         if self.debug:
             for k, v in update.items():
                 log.msg("Update[%s]: %s" % (k, v))
+        if "zlib" in update:
+            update = self._decompressUpdate(update)
         if "stdout" in update:
             # 'stdout': data
             self.addStdout(update['stdout'])
@@ -259,6 +263,31 @@ class RemoteCommand(pb.Referenceable):
                     self.updates[k] = []
                 self.updates[k].append(update[k])
 
+    def _decompressUpdate(self, update):
+        # log data the slave sent compressed, with the same keys as if it had
+        # been sent as is
+        update = update.copy()
+        compressed = update.pop('zlib')
+        start = util.now()
+        wire_bytes = log_bytes = 0
+        for k, v in compressed.items():
+            if k == 'log':
+                logname, zdata = v
+                data = zlib.decompress(zdata)
+                update[k] = (logname, data)
+            else:
+                zdata = v
+                data = update[k] = zlib.decompress(zdata)
+            wire_bytes += len(zdata)
+            log_bytes += len(data)
+        metrics.MetricTimeEvent.log("RemoteCommand.decompress",
+                                    util.now() - start)
+        metrics.MetricCountEvent.log("RemoteCommand.compressed_bytes",
+                                     wire_bytes)
+        metrics.MetricCountEvent.log("RemoteCommand.decompressed_bytes",
+                                     log_bytes)
+        return update
+
     def remoteComplete(self, maybeFailure):
         if self._startTime and self._remoteElapsed:
             delta = (util.now() - self._startTime) - self._remoteElapsed
@@ -340,6 +369,9 @@ class RemoteShellCommand(RemoteCommand):
                 self.args['dir'] = self.args['workdir']
             if self.step.slaveVersionIsOlderThan("shell", "2.16"):
                 self.args.pop('sigtermTime', None)
+            if not self.step.slaveVersionIsOlderThan("shell", "2.17"):
+                # the slave compresses the log data worth compressing
+                self.args['compress'] = 'zlib'
         what = "command '%s' in dir '%s'" % (self.fake_command,
                                              self.args['workdir'])
         log.msg(what)
@@ -16,16 +16,21 @@
 from __future__ import with_statement
 
 import os
+import re
 import sys
 import traceback
 
+from cPickle import load
+
 from buildbot import config as config_module
 from buildbot import monkeypatches
 from buildbot.db import connector
 from buildbot.master import BuildMaster
 from buildbot.scripts import base
+from buildbot.status.buildhistory import BuildSummary
 from buildbot.util import in_reactor
 from twisted.internet import defer
+from twisted.persisted import styles
 from twisted.python import runtime
 from twisted.python import util
 
@@ -168,6 +173,43 @@ def upgradeDatabase(config, master_cfg):
     yield db.model.upgrade()
 
 
+def upgradeBuildHistory(config, master_cfg):
+    history = master_cfg.buildHistory
+    if history is None:
+        return
+
+    if not config['quiet']:
+        print "importing build pickles into build history"
+
+    history.start(config['basedir'])
+    try:
+        for b in master_cfg.builders:
+            builddir = os.path.join(config['basedir'], b.builddir)
+            if not os.path.isdir(builddir):
+                continue
+            numbers = sorted(int(f) for f in os.listdir(builddir)
+                             if re.match(r"^\d+$", f))
+            if not numbers:
+                continue
+            imported = 0
+            for number in numbers:
+                try:
+                    with open(os.path.join(builddir, str(number)), "rb") as f:
+                        build = load(f)
+                    styles.doUpgrade()
+                except Exception:
+                    print "unable to load build %d of '%s', skipping" \
+                        % (number, b.name)
+                    continue
+                history.addBuild(b.name, BuildSummary.fromBuildStatus(build))
+                imported += 1
+            history.setFirstBuildNumber(b.name, numbers[0])
+            if not config['quiet']:
+                print "  %s: imported %d builds" % (b.name, imported)
+    finally:
+        history.stop()
+
+
 @in_reactor
 @defer.inlineCallbacks
 def upgradeMaster(config, _noMonkey=False):
@@ -194,6 +236,7 @@ def upgradeMaster(config, _noMonkey=False):
 
     upgradeFiles(config)
     yield upgradeDatabase(config, master_cfg)
+    upgradeBuildHistory(config, master_cfg)
 
     if not config['quiet']:
         print "upgrade complete"
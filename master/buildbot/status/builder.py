@@ -16,7 +16,7 @@
 from __future__ import with_statement
 
 
-import itertools
+import functools
 import os
 import re
 
@@ -26,6 +26,8 @@ from cPickle import load
 from buildbot import interfaces
 from buildbot import util
 from buildbot.status.build import BuildStatus
+from buildbot.status.buildhistory import BuildSummary
+from buildbot.status.buildhistory import BuildSummaryIndex
 from buildbot.status.buildrequest import BuildRequestStatus
 from buildbot.status.event import Event
 from buildbot.util.lru import LRUCache
@@ -93,6 +95,7 @@ class BuilderStatus(styles.Versioned):
         self.nextBuild = None
         self.watchers = []
         self.buildCache = LRUCache(self.cacheMiss)
+        self.summaryIndex = None
 
     # persistence
 
@@ -104,6 +107,7 @@ class BuilderStatus(styles.Versioned):
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
+        d.pop('summaryIndex', None)
         for b in self.currentBuilds:
             b.saveYourself()
             # TODO: push a 'hey, build was interrupted' event
@@ -121,6 +125,7 @@ class BuilderStatus(styles.Versioned):
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
         self.buildCache = LRUCache(self.cacheMiss)
+        self.summaryIndex = None
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
@@ -152,10 +157,15 @@ class BuilderStatus(styles.Versioned):
 
     def saveYourself(self):
         for b in self.currentBuilds:
-            if not b.isFinished:
+            if not b.isFinished():
                 # interrupted build, need to save it anyway.
                 # BuildStatus.saveYourself will mark it as interrupted.
                 b.saveYourself()
+                # it will be loaded as a finished build, so summarize it as
+                # one, or the history would lose it
+                summary = BuildSummary.fromBuildStatus(b)
+                summary.finished = util.now()
+                self._recordBuildSummary(summary)
         filename = os.path.join(self.basedir, "builder")
         tmpfilename = filename + ".tmp"
         try:
@@ -250,6 +260,15 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
+        history = self._getBuildHistory()
+        try:
+            self.getSummaryIndex().removeBuilds(earliest_build)
+            if history is not None:
+                history.removeBuilds(self.name, earliest_build)
+        except:
+            log.msg("unable to prune build summaries for %s" % self.name)
+            log.err()
+
         # skim the directory and delete anything that shouldn't be there anymore
         build_re = re.compile(r"^([0-9]+)$")
         build_log_re = re.compile(r"^([0-9]+)-.*$")
@@ -364,6 +383,74 @@ class BuilderStatus(styles.Versioned):
         return set([ss.branch
                     for ss in build.getSourceStamps()])
 
+    def _getBuildHistory(self):
+        # the IBuildHistory configured for this master, if any
+        return getattr(getattr(self, 'status', None), 'buildHistory', None)
+
+    def getSummaryIndex(self):
+        if self.summaryIndex is None:
+            self.summaryIndex = BuildSummaryIndex(
+                os.path.join(self.basedir, "summaries"))
+        return self.summaryIndex
+
+    def generateFinishedBuildSummaries(self, branches=[],
+                                       num_builds=None,
+                                       max_buildnum=None,
+                                       finished_before=None,
+                                       results=None,
+                                       max_search=200):
+        """Like generateFinishedBuilds, but produce the
+        L{buildbot.status.buildhistory.BuildSummary} of each build.  Builds
+        are found in the configured build history, or this builder's summary
+        index, without loading their pickles; only builds that finished
+        before either began recording are loaded to summarize them."""
+        got = 0
+        branches = set(branches)
+        earliest = max(self.nextBuildNumber - max_search, 0)
+        latest = self.nextBuildNumber - 1
+        if max_buildnum is not None:
+            latest = min(latest, max_buildnum)
+
+        history = self._getBuildHistory()
+        if history is not None:
+            first = history.getFirstBuildNumber(self.name)
+            query = functools.partial(history.getBuildSummaries, self.name)
+        else:
+            index = self.getSummaryIndex()
+            first = index.firstNumber
+            query = index.getBuildSummaries
+
+        if first is not None:
+            if latest >= max(first, earliest):
+                summaries = query(branches=branches, results=results,
+                                  min_buildnum=max(first, earliest),
+                                  max_buildnum=latest,
+                                  finished_before=finished_before,
+                                  limit=num_builds)
+                for summary in summaries:
+                    got += 1
+                    yield summary
+            if num_builds is not None:
+                if got >= num_builds:
+                    return
+            latest = min(latest, first - 1)
+
+        # older builds are examined one pickle at a time
+        for number in xrange(latest, earliest - 1, -1):
+            build = self.getBuild(number)
+            if build is None:
+                continue
+            if not build.isFinished():
+                continue
+            summary = BuildSummary.fromBuildStatus(build)
+            if not summary.matches(branches, results, finished_before):
+                continue
+            got += 1
+            yield summary
+            if num_builds is not None:
+                if got >= num_builds:
+                    return
+
     def generateFinishedBuilds(self, branches=[],
                                num_builds=None,
                                max_buildnum=None,
@@ -372,31 +459,19 @@ class BuilderStatus(styles.Versioned):
                                max_search=200,
                                filter_fn=None):
         got = 0
-        branches = set(branches)
-        for Nb in itertools.count(1):
-            if Nb > self.nextBuildNumber:
-                break
-            if Nb > max_search:
-                break
-            build = self.getBuild(-Nb)
+        # filter_fn needs the build itself, so the number of matching
+        # summaries can only be limited without it
+        limit = None
+        if filter_fn is None:
+            limit = num_builds
+        summaries = self.generateFinishedBuildSummaries(
+            branches, num_builds=limit, max_buildnum=max_buildnum,
+            finished_before=finished_before, results=results,
+            max_search=max_search)
+        for summary in summaries:
+            build = self.getBuild(summary.number)
             if build is None:
                 continue
-            if max_buildnum is not None:
-                if build.getNumber() > max_buildnum:
-                    continue
-            if not build.isFinished():
-                continue
-            if finished_before is not None:
-                start, end = build.getTimes()
-                if end >= finished_before:
-                    continue
-            # if we were asked to filter on branches, and none of the
-            # sourcestamps match, skip this build
-            if branches and not branches & self._getBuildBranches(build):
-                continue
-            if results is not None:
-                if build.getResults() not in results:
-                    continue
             if filter_fn is not None:
                 if not filter_fn(build):
                     continue
@@ -567,6 +642,8 @@ class BuilderStatus(styles.Versioned):
         s.saveYourself()
         self.currentBuilds.remove(s)
 
+        self._recordBuildSummary(BuildSummary.fromBuildStatus(s))
+
         name = self.getName()
         results = s.getResults()
         for w in self.watchers:
@@ -578,6 +655,17 @@ class BuilderStatus(styles.Versioned):
 
         self.prune()  # conserve disk
 
+    def _recordBuildSummary(self, summary):
+        history = self._getBuildHistory()
+        try:
+            self.getSummaryIndex().addBuild(summary)
+            if history is not None:
+                history.addBuild(self.name, summary)
+        except:
+            log.msg("unable to record summary of build %d of %s"
+                    % (summary.number, self.name))
+            log.err()
+
     def asDict(self):
         result = {}
         # Constant
@@ -0,0 +1,430 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import bisect
+import os
+import sqlalchemy as sa
+
+from buildbot import interfaces
+from buildbot import util
+from buildbot.db import enginestrategy
+from buildbot.util import json
+from twisted.python import log
+from twisted.python import runtime
+from zope.interface import implements
+
+
+class BuildSummary(util.ComparableMixin):
+
+    """
+    A summary of a finished build: enough to answer history queries (by
+    branch, result or finish time) without loading the build's pickle.
+
+    @ivar branches: tuple of the branches of the build's sourcestamps
+    @ivar revisions: tuple of the corresponding (got-)revisions
+    @ivar text: list of strings, as from L{IBuildStatus.getText}
+    """
+
+    compare_attrs = ['number', 'started', 'finished', 'results', 'branches',
+                     'revisions', 'slavename', 'text']
+
+    def __init__(self, number, started, finished, results,
+                 branches=(), revisions=(), slavename=None, text=()):
+        self.number = number
+        self.started = started
+        self.finished = finished
+        self.results = results
+        self.branches = tuple(branches)
+        self.revisions = tuple(revisions)
+        self.slavename = slavename
+        self.text = list(text)
+
+    @classmethod
+    def fromBuildStatus(cls, build):
+        started, finished = build.getTimes()
+        sourcestamps = build.getSourceStamps(absolute=True)
+        return cls(number=build.getNumber(),
+                   started=started, finished=finished,
+                   results=build.getResults(),
+                   branches=[ss.branch for ss in sourcestamps],
+                   revisions=[ss.revision for ss in sourcestamps],
+                   slavename=build.getSlavename(),
+                   text=build.getText())
+
+    def asList(self):
+        return [self.number, self.started, self.finished, self.results,
+                list(self.branches), list(self.revisions), self.slavename,
+                self.text]
+
+    @classmethod
+    def fromList(cls, l):
+        return cls(*l)
+
+    def matches(self, branches=None, results=None, finished_before=None):
+        """Return true if this build matches the given criteria, as for
+        L{IBuildHistory.getBuildSummaries}."""
+        if branches and not set(branches) & set(self.branches):
+            return False
+        if results is not None and self.results not in results:
+            return False
+        if finished_before is not None and self.finished >= finished_before:
+            return False
+        return True
+
+    def __repr__(self):
+        return "<BuildSummary #%d>" % (self.number,)
+
+
+class BuildSummaryIndex(object):
+
+    """
+    The summaries of one builder's finished builds, held in memory and
+    appended to a file in the builder's directory as each build finishes,
+    one JSON list per line.  The first line of the file gives the first
+    build number from which the index is complete.
+
+    This is the per-builder counterpart of L{IBuildHistory}, used when no
+    C{c['buildHistory']} is configured.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.firstNumber = None
+        self.numbers = []
+        self.summaries = {}
+        self._load()
+
+    def _load(self):
+        try:
+            f = open(self.filename, 'r')
+        except IOError:
+            return
+        with f:
+            try:
+                self.firstNumber = int(f.readline())
+            except ValueError:
+                log.msg("ignoring corrupt build summary index %s"
+                        % (self.filename,))
+                return
+            for line in f:
+                try:
+                    summary = BuildSummary.fromList(json.loads(line))
+                except (ValueError, TypeError):
+                    # a line cut short by a crash
+                    continue
+                self._add(summary)
+
+    def _add(self, summary):
+        if summary.number not in self.summaries:
+            bisect.insort(self.numbers, summary.number)
+        self.summaries[summary.number] = summary
+
+    def addBuild(self, summary):
+        self._add(summary)
+        if self.firstNumber is None:
+            self.firstNumber = summary.number
+            self._rewrite()
+        else:
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(summary.asList()) + '\n')
+
+    def getBuildSummary(self, number):
+        return self.summaries.get(number)
+
+    def getBuildSummaries(self, branches=None, results=None,
+                          min_buildnum=None, max_buildnum=None,
+                          finished_before=None, limit=None):
+        """Return summaries of matching builds, most recent first; the
+        arguments are as for L{IBuildHistory.getBuildSummaries}."""
+        lo = 0
+        if min_buildnum is not None:
+            lo = bisect.bisect_left(self.numbers, min_buildnum)
+        hi = len(self.numbers)
+        if max_buildnum is not None:
+            hi = bisect.bisect_right(self.numbers, max_buildnum)
+        found = []
+        for i in xrange(hi - 1, lo - 1, -1):
+            summary = self.summaries[self.numbers[i]]
+            if not summary.matches(branches, results, finished_before):
+                continue
+            found.append(summary)
+            if limit is not None and len(found) >= limit:
+                break
+        return found
+
+    def removeBuilds(self, before):
+        i = bisect.bisect_left(self.numbers, before)
+        if not i:
+            return
+        for number in self.numbers[:i]:
+            del self.summaries[number]
+        del self.numbers[:i]
+        self.firstNumber = max(self.firstNumber, before)
+        self._rewrite()
+
+    def _rewrite(self):
+        tmpfilename = self.filename + '.tmp'
+        with open(tmpfilename, 'w') as f:
+            f.write('%d\n' % self.firstNumber)
+            for number in self.numbers:
+                f.write(json.dumps(self.summaries[number].asList()) + '\n')
+        if runtime.platformType == 'win32':
+            # windows cannot rename a file on top of an existing one
+            if os.path.exists(self.filename):
+                os.unlink(self.filename)
+        os.rename(tmpfilename, self.filename)
+
+
+class BuildHistoryBase(util.ComparableMixin):
+
+    """
+    Base class for build history stores; see L{interfaces.IBuildHistory}.
+    """
+
+    implements(interfaces.IBuildHistory)
+
+    def start(self, basedir):
+        pass
+
+    def stop(self):
+        pass
+
+    def addBuild(self, buildername, summary):
+        raise NotImplementedError
+
+    def getBuildSummary(self, buildername, number):
+        raise NotImplementedError
+
+    def getBuildSummaries(self, buildername, branches=None, results=None,
+                          min_buildnum=None, max_buildnum=None,
+                          finished_before=None, limit=None):
+        raise NotImplementedError
+
+    def removeBuilds(self, buildername, before):
+        raise NotImplementedError
+
+    def getFirstBuildNumber(self, buildername):
+        raise NotImplementedError
+
+    def setFirstBuildNumber(self, buildername, number):
+        raise NotImplementedError
+
+
+class SQLBuildHistory(BuildHistoryBase):
+
+    """
+    A build history store in an SQL database, accessed through SQLAlchemy.
+    The default is an SQLite file in the master's basedir; relative SQLite
+    paths are interpreted as for C{c['db_url']}.  Queries are made
+    synchronously, so a local database is recommended.
+    """
+
+    compare_attrs = ['db_url']
+
+    metadata = sa.MetaData()
+
+    builders = sa.Table('build_history_builders', metadata,
+                        sa.Column('buildername', sa.String(256),
+                                  primary_key=True),
+                        # history is complete from this build number on
+                        sa.Column('first_number', sa.Integer,
+                                  nullable=False),
+                        )
+
+    summaries = sa.Table('build_summaries', metadata,
+                         sa.Column('id', sa.Integer, primary_key=True),
+                         sa.Column('buildername', sa.String(256),
+                                   nullable=False),
+                         sa.Column('number', sa.Integer, nullable=False),
+                         sa.Column('started', sa.Float),
+                         sa.Column('finished', sa.Float),
+                         sa.Column('results', sa.SmallInteger),
+                         sa.Column('slavename', sa.String(256)),
+                         # JSON-encoded list of strings
+                         sa.Column('text', sa.Text, nullable=False),
+                         )
+
+    sourcestamps = sa.Table('build_summary_sourcestamps', metadata,
+                            sa.Column('summaryid', sa.Integer,
+                                      sa.ForeignKey('build_summaries.id'),
+                                      nullable=False),
+                            sa.Column('idx', sa.Integer, nullable=False),
+                            sa.Column('branch', sa.String(256)),
+                            sa.Column('revision', sa.String(256)),
+                            )
+
+    sa.Index('build_summaries_number', summaries.c.buildername,
+             summaries.c.number, unique=True)
+    sa.Index('build_summaries_finished', summaries.c.buildername,
+             summaries.c.finished)
+    sa.Index('build_summary_sourcestamps_summaryid',
+             sourcestamps.c.summaryid)
+    sa.Index('build_summary_sourcestamps_branch', sourcestamps.c.branch)
+
+    def __init__(self, db_url='sqlite:///build_history.sqlite'):
+        self.db_url = db_url
+        self.engine = None
+
+    def start(self, basedir):
+        log.msg("using build history in %s" % (self.db_url,))
+        self.engine = enginestrategy.create_engine(self.db_url,
+                                                   basedir=basedir)
+        self.metadata.create_all(bind=self.engine)
+
+    def stop(self):
+        if self.engine:
+            self.engine.dispose()
+            self.engine = None
+
+    def addBuild(self, buildername, summary):
+        conn = self.engine.connect()
+        transaction = conn.begin()
+        try:
+            # replace any existing summary, e.g., after a master restart
+            # re-used a build number
+            self._removeBuilds(conn, buildername,
+                               self.summaries.c.number == summary.number)
+            r = conn.execute(self.summaries.insert(), dict(
+                buildername=buildername, number=summary.number,
+                started=summary.started, finished=summary.finished,
+                results=summary.results, slavename=summary.slavename,
+                text=json.dumps(summary.text)))
+            summaryid = r.inserted_primary_key[0]
+            if summary.branches:
+                conn.execute(self.sourcestamps.insert(), [
+                    dict(summaryid=summaryid, idx=i, branch=branch,
+                         revision=revision)
+                    for i, (branch, revision)
+                    in enumerate(zip(summary.branches, summary.revisions))])
+            q = sa.select([self.builders.c.first_number],
+                          whereclause=(self.builders.c.buildername ==
+                                       buildername))
+            if conn.execute(q).fetchone() is None:
+                conn.execute(self.builders.insert(),
+                             dict(buildername=buildername,
+                                  first_number=summary.number))
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def getBuildSummary(self, buildername, number):
+        tbl = self.summaries
+        q = tbl.select(whereclause=((tbl.c.buildername == buildername) &
+                                    (tbl.c.number == number)))
+        summaries = self._fetchSummaries(q)
+        if summaries:
+            return summaries[0]
+        return None
+
+    def getBuildSummaries(self, buildername, branches=None, results=None,
+                          min_buildnum=None, max_buildnum=None,
+                          finished_before=None, limit=None):
+        tbl = self.summaries
+        where = (tbl.c.buildername == buildername)
+        if min_buildnum is not None:
+            where &= (tbl.c.number >= min_buildnum)
+        if max_buildnum is not None:
+            where &= (tbl.c.number <= max_buildnum)
+        if finished_before is not None:
+            where &= (tbl.c.finished < finished_before)
+        if results is not None:
+            where &= tbl.c.results.in_(list(results))
+        if branches:
+            sstbl = self.sourcestamps
+            matches = []
+            named = [b for b in branches if b is not None]
+            if named:
+                matches.append(sstbl.c.branch.in_(named))
+            if None in branches:
+                matches.append(sstbl.c.branch == None)
+            branch_match = sa.or_(*matches)
+            where &= tbl.c.id.in_(sa.select([sstbl.c.summaryid],
+                                            whereclause=branch_match))
+        q = tbl.select(whereclause=where, order_by=[sa.desc(tbl.c.number)])
+        if limit is not None:
+            q = q.limit(limit)
+        return self._fetchSummaries(q)
+
+    def removeBuilds(self, buildername, before):
+        conn = self.engine.connect()
+        try:
+            self._removeBuilds(conn, buildername,
+                               self.summaries.c.number < before)
+        finally:
+            conn.close()
+
+    def getFirstBuildNumber(self, buildername):
+        q = sa.select([self.builders.c.first_number],
+                      whereclause=(self.builders.c.buildername ==
+                                   buildername))
+        row = self.engine.execute(q).fetchone()
+        if row is None:
+            return None
+        return row.first_number
+
+    def setFirstBuildNumber(self, buildername, number):
+        conn = self.engine.connect()
+        try:
+            r = conn.execute(self.builders.update(
+                whereclause=(self.builders.c.buildername == buildername)),
+                first_number=number)
+            if not r.rowcount:
+                conn.execute(self.builders.insert(),
+                             dict(buildername=buildername,
+                                  first_number=number))
+        finally:
+            conn.close()
+
+    # utilities
+
+    def _removeBuilds(self, conn, buildername, whereclause):
+        tbl = self.summaries
+        ids = sa.select([tbl.c.id],
+                        whereclause=((tbl.c.buildername == buildername) &
+                                     whereclause))
+        conn.execute(self.sourcestamps.delete(
+            whereclause=self.sourcestamps.c.summaryid.in_(ids)))
+        conn.execute(tbl.delete(
+            whereclause=((tbl.c.buildername == buildername) & whereclause)))
+
+    def _fetchSummaries(self, q):
+        rows = self.engine.execute(q).fetchall()
+        if not rows:
+            return []
+
+        sstbl = self.sourcestamps
+        sourcestamps = {}
+        ssq = sstbl.select(
+            whereclause=sstbl.c.summaryid.in_([row.id for row in rows]),
+            order_by=[sstbl.c.summaryid, sstbl.c.idx])
+        for ssrow in self.engine.execute(ssq):
+            sourcestamps.setdefault(ssrow.summaryid, []).append(
+                (ssrow.branch, ssrow.revision))
+
+        summaries = []
+        for row in rows:
+            ss = sourcestamps.get(row.id, [])
+            summaries.append(BuildSummary(
+                number=row.number, started=row.started,
+                finished=row.finished, results=row.results,
+                branches=[branch for branch, _ in ss],
+                revisions=[revision for _, revision in ss],
+                slavename=row.slavename, text=json.loads(row.text)))
+        return summaries
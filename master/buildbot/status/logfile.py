@@ -13,7 +13,11 @@
 #
 # Copyright Buildbot Team Members
 
+from __future__ import with_statement
+
+import bisect
 import os
+import struct
 
 from bz2 import BZ2File
 from cStringIO import StringIO
@@ -21,6 +25,7 @@ from gzip import GzipFile
 
 from buildbot import interfaces
 from buildbot.util import netstrings
+from buildbot.util.framedfile import FramedFile
 from buildbot.util.eventual import eventually
 from twisted.internet import defer
 from twisted.internet import reactor
@@ -48,6 +53,178 @@ class LogFileScanner(netstrings.NetstringParser):
             self.chunk_cb((channel, line[1:]))
 
 
+class LogIndex(object):
+
+    """
+    A block index for a LogFile, kept in a sidecar file next to the log
+    itself (the log's filename plus C{.idx}).  The log remains a plain
+    netstring stream; the index just records, for each netstring ("block")
+    written by L{LogFile._merge}, its byte offset in the uncompressed log
+    file, its channel, and the cumulative text offset and line number (count
+    of newlines) of all blocks before it.  This is enough to find the block
+    containing any text offset or line of any combination of channels
+    without parsing the log from the beginning.
+
+    The sidecar consists of C{MAGIC} followed by fixed-size records.  When
+    the log is finished, a final record with channel C{END} gives the total
+    file size, text length and line count; an index without it (for
+    example, one left behind by a master that was killed) is not trusted,
+    and readers fall back to scanning the log.
+    """
+
+    MAGIC = 'buildbot-log-index 1\n'
+    RECORD = struct.Struct('!QBQQ')
+    END = 0xff
+
+    def __init__(self):
+        self.offsets = []
+        self.channels = []
+        self.textOffsets = []
+        self.lineNumbers = []
+        self.fileSize = 0
+        self.textLength = 0
+        self.lineCount = 0
+        self.indexfile = None
+        self._cumulativeCache = {}
+
+    @classmethod
+    def create(cls, filename):
+        """
+        Create a new, empty index that will be written to C{filename} as
+        blocks are added.
+        """
+        idx = cls()
+        idx.indexfile = open(filename, "wb")
+        idx.indexfile.write(cls.MAGIC)
+        return idx
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a finished index from C{filename}.
+
+        @returns: L{LogIndex} instance, or None if there is no usable index
+        """
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except IOError:
+            return None
+        size = cls.RECORD.size
+        start = len(cls.MAGIC)
+        if not data.startswith(cls.MAGIC) or (len(data) - start) % size:
+            return None
+        idx = cls()
+        for pos in xrange(start, len(data), size):
+            offset, channel, textOffset, lineNumber = \
+                cls.RECORD.unpack_from(data, pos)
+            if channel == cls.END:
+                if pos + size != len(data):
+                    return None
+                idx.fileSize = offset
+                idx.textLength = textOffset
+                idx.lineCount = lineNumber
+                return idx
+            idx.offsets.append(offset)
+            idx.channels.append(channel)
+            idx.textOffsets.append(textOffset)
+            idx.lineNumbers.append(lineNumber)
+        # no END record, so the log was never finished
+        return None
+
+    def addBlock(self, offset, channel, text, size):
+        """
+        Record a block of C{text} on C{channel}, whose netstring of C{size}
+        bytes begins at C{offset} in the log file.
+        """
+        self.offsets.append(offset)
+        self.channels.append(channel)
+        self.textOffsets.append(self.textLength)
+        self.lineNumbers.append(self.lineCount)
+        if self.indexfile:
+            self.indexfile.write(self.RECORD.pack(offset, channel,
+                                                  self.textLength,
+                                                  self.lineCount))
+        self.fileSize = offset + size
+        self.textLength += len(text)
+        self.lineCount += text.count('\n')
+        self._cumulativeCache = {}
+
+    def close(self):
+        """
+        Write the END record and close the sidecar file.
+        """
+        if self.indexfile:
+            self.indexfile.write(self.RECORD.pack(self.fileSize, self.END,
+                                                  self.textLength,
+                                                  self.lineCount))
+            self.indexfile.close()
+            self.indexfile = None
+
+    def _cumulative(self, channels):
+        # return lists of cumulative text offsets and line numbers for each
+        # block, counting only the given channels
+        if not channels:
+            return self.textOffsets, self.lineNumbers
+        key = tuple(sorted(channels))
+        if key in self._cumulativeCache:
+            return self._cumulativeCache[key]
+        texts, lines = [], []
+        text = line = 0
+        n = len(self.offsets)
+        for k in xrange(n):
+            texts.append(text)
+            lines.append(line)
+            if self.channels[k] in channels:
+                if k + 1 < n:
+                    text += self.textOffsets[k + 1] - self.textOffsets[k]
+                    line += self.lineNumbers[k + 1] - self.lineNumbers[k]
+                else:
+                    text += self.textLength - self.textOffsets[k]
+                    line += self.lineCount - self.lineNumbers[k]
+        texts.append(text)
+        lines.append(line)
+        self._cumulativeCache[key] = (texts, lines)
+        return texts, lines
+
+    def getTotals(self, channels=[]):
+        """
+        Get the text length and number of newlines in the given channels.
+
+        @returns: tuple (length, newlines)
+        """
+        if not channels:
+            return self.textLength, self.lineCount
+        texts, lines = self._cumulative(channels)
+        return texts[-1], lines[-1]
+
+    def findOffset(self, position, channels=[]):
+        """
+        Find the last block at or before text offset C{position} in the
+        text of the given channels.
+
+        @returns: tuple (file offset, text offset of that block)
+        """
+        texts = self._cumulative(channels)[0]
+        k = bisect.bisect_right(texts, position, 0, len(self.offsets)) - 1
+        if k < 0:
+            return 0, 0
+        return self.offsets[k], texts[k]
+
+    def findLine(self, line, channels=[]):
+        """
+        Find the block containing the start of line C{line} (counting from
+        zero) in the text of the given channels.
+
+        @returns: tuple (file offset, line number at the start of that block)
+        """
+        lines = self._cumulative(channels)[1]
+        k = bisect.bisect_left(lines, line, 0, len(self.offsets)) - 1
+        if k < 0:
+            return 0, 0
+        return self.offsets[k], lines[k]
+
+
 class LogFileProducer:
 
     """What's the plan?
@@ -81,16 +258,24 @@ class LogFileProducer:
     except that writeChunk() takes chunks (tuples of (channel,text)) instead
     of the normal write() which takes just text. The LogFileConsumer is
     allowed to call stopProducing, pauseProducing, and resumeProducing on the
-    producer instance it is given. """
+    producer instance it is given.
+
+    If C{chunks} is given (for example, from L{LogFile.getChunksByLine}),
+    the producer sends just those chunks instead of the whole log, and
+    finishes the consumer when they are exhausted without subscribing to
+    new entries. """
 
     paused = False
     subscribed = False
     BUFFERSIZE = 2048
 
-    def __init__(self, logfile, consumer):
+    def __init__(self, logfile, consumer, chunks=None):
         self.logfile = logfile
         self.consumer = consumer
-        self.chunkGenerator = self.getChunks()
+        if chunks is None:
+            self.chunkGenerator = self.getChunks()
+        else:
+            self.chunkGenerator = self.getGivenChunks(chunks)
         consumer.registerProducer(self, True)
 
     def getChunks(self):
@@ -127,6 +312,11 @@ class LogFileProducer:
         # during the yield.
         d.addCallback(self.logfileFinished)
 
+    def getGivenChunks(self, chunks):
+        for chunk in chunks:
+            yield chunk
+        self.logfileFinished(self.logfile)
+
     def stopProducing(self):
         # TODO: should we still call consumer.finish? probably not.
         self.paused = True
@@ -212,6 +402,7 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None  # relative to the Builder's basedir
     openfile = None
+    index = None  # LogIndex, or False if the log has no usable index
     _isNewStyle = False  # set to True by new-style buildsteps
 
     def __init__(self, parent, name, logfilename):
@@ -238,6 +429,7 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        self.index = LogIndex.create(fn + ".idx")
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -264,7 +456,8 @@ class LogFile:
         return self.old_hasContents()
 
     def old_hasContents(self):
-        return os.path.exists(self.getFilename() + '.bz2') or \
+        return os.path.exists(self.getFilename() + '.framed') or \
+            os.path.exists(self.getFilename() + '.bz2') or \
             os.path.exists(self.getFilename() + '.gz') or \
             os.path.exists(self.getFilename())
 
@@ -320,7 +513,11 @@ class LogFile:
             # don't close it!
             return self.openfile
         # otherwise they get their own read-only handle
-        # try a compressed log first
+        # try a compressed log first, starting with the seekable format
+        try:
+            return FramedFile(self.getFilename() + ".framed", "r")
+        except IOError:
+            pass
         try:
             return BZ2File(self.getFilename() + ".bz2", "r")
         except IOError:
@@ -331,6 +528,17 @@ class LogFile:
             pass
         return open(self.getFilename(), "r")
 
+    def getIndex(self):
+        """
+        Get the L{LogIndex} for this log, loading it from disk if necessary.
+        Logs written by older versions of Buildbot have no index.
+
+        @returns: L{LogIndex} instance or None
+        """
+        if self.index is None and self.finished:
+            self.index = LogIndex.load(self.getFilename() + ".idx") or False
+        return self.index or None
+
     def getText(self):
         # this produces one ginormous string
         assert not self._isNewStyle, "not available in new-style steps"
@@ -414,9 +622,154 @@ class LogFile:
         """Return an iterator that produces newline-terminated lines,
         excluding header chunks."""
         assert not self._isNewStyle, "not available in new-style steps"
-        alltext = "".join(self.getChunks([STDOUT], onlyText=True))
-        io = StringIO(alltext)
-        return io.readlines()
+        return self._generateLines(self.getChunks([STDOUT], onlyText=True))
+
+    def _generateLines(self, texts):
+        partial = ''
+        for text in texts:
+            lines = (partial + text).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if partial:
+            yield partial
+
+    def getChunksByOffset(self, start, end=None, channels=[], onlyText=False):
+        """
+        Like L{getChunks}, but only generate the text between offsets
+        C{start} and C{end} (exclusive; None for the end of the log) of the
+        concatenated text of the given channels.  If the log has an index,
+        reading begins at the block containing C{start}.
+        """
+        # NOTE: this method is called by WebStatus, so it must remain available
+        # even for new-style steps
+        index = self.getIndex()
+        if index:
+            offset, position = index.findOffset(start, channels)
+        else:
+            offset, position = 0, 0
+        chunks = self._getChunksFrom(offset, channels)
+        return self._sliceChunks(chunks, position, start, end, False,
+                                 onlyText)
+
+    def getChunksByLine(self, first, last=None, channels=[], onlyText=False):
+        """
+        Like L{getChunks}, but only generate lines C{first} through C{last}
+        (exclusive; None for the end of the log), counting from zero, of the
+        concatenated text of the given channels.  If the log has an index,
+        reading begins at the block containing the start of line C{first}.
+        """
+        # NOTE: this method is called by WebStatus, so it must remain available
+        # even for new-style steps
+        index = self.getIndex()
+        if index:
+            offset, position = index.findLine(first, channels)
+        else:
+            offset, position = 0, 0
+        chunks = self._getChunksFrom(offset, channels)
+        return self._sliceChunks(chunks, position, first, last, True,
+                                 onlyText)
+
+    def getTextLength(self, channels=[]):
+        """
+        Get the length of the concatenated text of the given channels.
+
+        @returns: integer
+        """
+        return self._getTotals(channels)[0]
+
+    def getLineCount(self, channels=[]):
+        """
+        Get the number of lines in the concatenated text of the given
+        channels, including a final line without a trailing newline.
+
+        @returns: integer
+        """
+        length, lines = self._getTotals(channels)
+        if length:
+            last = "".join(self.getChunksByOffset(length - 1, None, channels,
+                                                  onlyText=True))
+            if last != '\n':
+                lines += 1
+        return lines
+
+    def _getTotals(self, channels):
+        # NOTE: this method is called by WebStatus, so it must remain available
+        # even for new-style steps
+        index = self.getIndex()
+        if not index:
+            length = lines = 0
+            for channel, text in self._getChunksFrom(0, channels):
+                length += len(text)
+                lines += text.count('\n')
+            return length, lines
+        length, lines = index.getTotals(channels)
+        if self.runEntries and (not channels or
+                                (self.runEntries[0][0] in channels)):
+            for c in self.runEntries:
+                length += len(c[1])
+                lines += c[1].count('\n')
+        return length, lines
+
+    def _getChunksFrom(self, offset, channels):
+        # like getChunks, but starting at the given offset in the file
+        f = self.getFile()
+        if not self.finished:
+            f.seek(0, 2)
+            remaining = f.tell() - offset
+        else:
+            remaining = None
+
+        leftover = None
+        if self.runEntries and (not channels or
+                                (self.runEntries[0][0] in channels)):
+            leftover = (self.runEntries[0][0],
+                        "".join([c[1] for c in self.runEntries]))
+
+        return self._generateChunks(f, offset, remaining, leftover,
+                                    channels, False)
+
+    def _sliceChunks(self, chunks, position, start, end, byLine, onlyText):
+        # trim a stream of chunks, the first of which begins at text offset
+        # (or line number) 'position', to the range [start, end)
+        for channel, text in chunks:
+            if end is not None and position >= end:
+                return
+            n = len(text)
+            if byLine:
+                i = 0
+                if position < start:
+                    newlines = text.count('\n')
+                    if position + newlines < start:
+                        position += newlines
+                        continue
+                    while position < start:
+                        i = text.index('\n', i) + 1
+                        position += 1
+                j = n
+                if end is not None:
+                    newlines = text.count('\n', i)
+                    if position + newlines >= end:
+                        j = i
+                        while position < end:
+                            j = text.index('\n', j) + 1
+                            position += 1
+                    else:
+                        position += newlines
+            else:
+                if position + n <= start:
+                    position += n
+                    continue
+                i = max(0, start - position)
+                j = n
+                if end is not None:
+                    j = min(n, end - position)
+                position += n
+            if j > i:
+                if onlyText:
+                    yield text[i:j]
+                else:
+                    yield (channel, text[i:j])
 
     def subscribe(self, receiver, catchup):
         assert not self._isNewStyle, "not available in new-style steps"
@@ -454,8 +807,13 @@ class LogFile:
         offset = 0
         while offset < len(text):
             size = min(len(text) - offset, self.chunkSize)
-            f.write("%d:%d" % (1 + size, channel))
-            f.write(text[offset:offset + size])
+            block = text[offset:offset + size]
+            header = "%d:%d" % (1 + size, channel)
+            if self.index:
+                self.index.addBlock(f.tell(), channel, block,
+                                    len(header) + size + 1)
+            f.write(header)
+            f.write(block)
             f.write(",")
             offset += size
         self.runEntries = []
@@ -582,6 +940,8 @@ class LogFile:
             # filehandle will be released and automatically closed.
             self.openfile.flush()
             self.openfile = None
+        if self.index:
+            self.index.close()
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -597,6 +957,8 @@ class LogFile:
             compressed = self.getFilename() + ".bz2.tmp"
         elif logCompressionMethod == "gz":
             compressed = self.getFilename() + ".gz.tmp"
+        elif logCompressionMethod == "framed":
+            compressed = self.getFilename() + ".framed.tmp"
         else:
             return defer.succeed(None)
 
@@ -606,6 +968,8 @@ class LogFile:
                 cf = BZ2File(compressed, 'w')
             elif logCompressionMethod == "gz":
                 cf = GzipFile(compressed, 'w')
+            elif logCompressionMethod == "framed":
+                cf = FramedFile(compressed, 'w')
             bufsize = 1024 * 1024
             while True:
                 buf = infile.read(bufsize)
@@ -616,10 +980,7 @@ class LogFile:
         d = threads.deferToThread(_compressLog)
 
         def _renameCompressedLog(rv):
-            if logCompressionMethod == "bz2":
-                filename = self.getFilename() + '.bz2'
-            else:
-                filename = self.getFilename() + '.gz'
+            filename = self.getFilename() + '.' + logCompressionMethod
             if runtime.platformType == 'win32':
                 # windows cannot rename a file on top of an existing one, so
                 # fall back to delete-first. There are ways this can fail and
@@ -646,6 +1007,8 @@ class LogFile:
         del d['watchers']
         del d['finishedWatchers']
         del d['master']
+        if "index" in d:
+            del d['index']  # reloaded from disk on demand
         d['entries'] = []  # let 0.6.4 tolerate the saved log. TODO: really?
         if "finished" in d:
             del d['finished']
@@ -15,6 +15,7 @@
 
 from __future__ import with_statement
 
+import heapq
 import os
 import urllib
 
@@ -46,6 +47,8 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         self.watchers = []
         # No default limit to the log size
         self.logMaxSize = None
+        # the configured IBuildHistory, if any
+        self.buildHistory = None
 
         self._builder_observers = bbcollections.KeyedSets()
         self._buildreq_observers = bbcollections.KeyedSets()
@@ -94,6 +97,13 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
             sr.master = self.master
             sr.setServiceParent(self)
 
+        if new_config.buildHistory != self.buildHistory:
+            if self.buildHistory:
+                self.buildHistory.stop()
+            self.buildHistory = new_config.buildHistory
+            if self.buildHistory:
+                self.buildHistory.start(self.basedir)
+
         # reconfig any newly-added change sources, as well as existing
         yield config.ReconfigurableServiceMixin.reconfigService(self,
                                                                 new_config)
@@ -111,6 +121,9 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         if self._change_sub:
             self._change_sub.unsubscribe()
             self._change_sub = None
+        if self.buildHistory:
+            self.buildHistory.stop()
+            self.buildHistory = None
 
         return service.MultiService.stopService(self)
 
@@ -274,53 +287,36 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
                          for bn in self.getBuilderNames()
                          if want_builder(bn)]
 
-        # 'sources' is a list of generators, one for each Builder we're
-        # using. When the generator is exhausted, it is replaced in this list
-        # with None.
-        sources = []
-        for bn in builder_names:
+        # merge the builders' summaries, which each come newest first, using
+        # a heap holding the next summary from each builder; so at most one
+        # summary per builder is read ahead, and builds are only loaded once
+        # they are chosen.  No builder can contribute more than num_builds
+        # builds, so that limit is pushed down along with finished_before.
+        heap = []
+
+        def push(i, bldr, g):
+            for summary in g:
+                # i breaks ties between builds that finished together
+                heapq.heappush(heap, (-summary.finished, i, summary, bldr, g))
+                break
+
+        for i, bn in enumerate(builder_names):
             bldr = self.getBuilder(bn)
-            g = bldr.generateFinishedBuilds(branches,
-                                            finished_before=finished_before,
-                                            max_search=max_search)
-            sources.append(g)
-
-        # next_build the next build from each source
-        next_build = [None] * len(sources)
-
-        def refill():
-            for i, g in enumerate(sources):
-                if next_build[i]:
-                    # already filled
-                    continue
-                if not g:
-                    # already exhausted
-                    continue
-                try:
-                    next_build[i] = g.next()
-                except StopIteration:
-                    next_build[i] = None
-                    sources[i] = None
+            push(i, bldr, iter(bldr.generateFinishedBuildSummaries(
+                branches, num_builds=num_builds,
+                finished_before=finished_before, max_search=max_search)))
 
         got = 0
-        while True:
-            refill()
-            # find the latest build among all the candidates
-            candidates = [(i, b, b.getTimes()[1])
-                          for i, b in enumerate(next_build)
-                          if b is not None]
-            candidates.sort(lambda x, y: cmp(x[2], y[2]))
-            if not candidates:
-                return
-
-            # and remove it from the list
-            i, build, finshed_time = candidates[-1]
-            next_build[i] = None
-            got += 1
-            yield build
-            if num_builds is not None:
-                if got >= num_builds:
-                    return
+        while heap:
+            _, i, summary, bldr, g = heapq.heappop(heap)
+            build = bldr.getBuild(summary.number)
+            if build is not None:
+                got += 1
+                yield build
+                if num_builds is not None:
+                    if got >= num_builds:
+                        return
+            push(i, bldr, g)
 
     def subscribe(self, target):
         self.watchers.append(target)
@@ -136,6 +136,7 @@ class ChangeHookResource(resource.Resource):
     @defer.inlineCallbacks
     def submitChanges(self, changes, request, src):
         master = request.site.buildbot_service.master
-        for chdict in changes:
-            change = yield master.addChange(src=src, **chdict)
+        added = yield master.addChanges([dict(src=src, **chdict)
+                                         for chdict in changes])
+        for change in added:
             log.msg("injected change %s" % change)
@@ -16,6 +16,7 @@
 
 from twisted.python import components
 from twisted.spread import pb
+from twisted.web import http
 from twisted.web import server
 from twisted.web.resource import NoResource
 from twisted.web.resource import Resource
@@ -50,12 +51,17 @@ class ChunkConsumer:
                 formatted = formatted.encode('utf-8')
             self.original.write(formatted)
         except pb.DeadReferenceError:
-            self.producing.stopProducing()
+            self.producer.stopProducing()
 
     def finish(self):
         self.textlog.finished()
 
 # /builders/$builder/builds/$buildnum/steps/$stepname/logs/$logname
+#
+# Both this and the /text child accept ?tail=N to show only the last N lines
+# of the log, or ?lines=A-B to show lines A through B (counting from 1;
+# either end may be omitted).  The /text child of a finished log also
+# honors a single HTTP byte range.
 
 
 class TextLog(Resource):
@@ -111,11 +117,105 @@ class TextLog(Resource):
         else:
             return self.template.module.chunks(html_entries)
 
+    def _getChannels(self):
+        # the text view omits headers; the HTML view shows everything
+        if self.asText:
+            return [logfile.STDOUT, logfile.STDERR]
+        return []
+
+    def _getLineRange(self, req):
+        """
+        Parse the 'tail' or 'lines' argument into a pair of zero-based line
+        numbers, the second exclusive or None.
+
+        @returns: (first, last) tuple, or None for the whole log
+        @raises: ValueError for malformed arguments
+        """
+        tail = req.args.get("tail", [None])[0]
+        if tail is not None:
+            tail = int(tail)
+            if tail < 0:
+                raise ValueError("tail must not be negative")
+            count = self.original.getLineCount(self._getChannels())
+            return max(0, count - tail), None
+
+        lines = req.args.get("lines", [None])[0]
+        if lines is not None:
+            first, _, last = lines.partition("-")
+            first = int(first) if first else 1
+            last = int(last) if last else None
+            if first < 1 or (last is not None and last < first):
+                raise ValueError("invalid line range")
+            return first - 1, last
+
+        return None
+
+    def _getByteRange(self, req, length):
+        """
+        Parse a Range header against a text of the given length.  Multiple
+        ranges and malformed headers are ignored, as RFC 2616 permits.
+
+        @returns: (start, end) tuple with end exclusive, or None
+        @raises: ValueError if the range is not satisfiable
+        """
+        header = req.getHeader("range")
+        if not header:
+            return None
+        units, _, spec = header.partition("=")
+        if units.strip().lower() != "bytes" or "," in spec:
+            return None
+        first, _, last = spec.strip().partition("-")
+        try:
+            if first:
+                start = int(first)
+                end = int(last) + 1 if last else length
+            else:
+                start = max(0, length - int(last))
+                end = length
+        except ValueError:
+            return None
+        if end <= start and first and last:
+            return None
+        if start >= length:
+            raise ValueError("range not satisfiable")
+        return start, min(end, length)
+
+    def _setLengthHeaders(self, req):
+        """
+        Set content-length, and handle a Range header, for the text of a
+        finished log.  Other content has no length known in advance.
+
+        @returns: (start, end) byte range to send, or None for everything
+        @raises: ValueError if the requested range is not satisfiable
+        """
+        if not self.asText or not self.original.isFinished():
+            return None
+        length = self.original.getTextLength(self._getChannels())
+        req.setHeader("accept-ranges", "bytes")
+        try:
+            byteRange = self._getByteRange(req, length)
+        except ValueError:
+            req.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            req.setHeader("content-range", "bytes */%d" % length)
+            req.setHeader("content-length", 0)
+            raise
+        if byteRange is None:
+            req.setHeader("content-length", length)
+        else:
+            start, end = byteRange
+            req.setResponseCode(http.PARTIAL_CONTENT)
+            req.setHeader("content-range",
+                          "bytes %d-%d/%d" % (start, end - 1, length))
+            req.setHeader("content-length", end - start)
+        return byteRange
+
     def render_HEAD(self, req):
         self._setContentType(req)
-
-        # vague approximation, ignores markup
-        req.setHeader("content-length", self.original.length)
+        if "tail" not in req.args and "lines" not in req.args:
+            try:
+                self._setLengthHeaders(req)
+            except ValueError:
+                pass
         return ''
 
     def render_GET(self, req):
@@ -127,6 +227,28 @@ class TextLog(Resource):
         else:
             req.setHeader("Cache-Control", "no-cache")
 
+        channels = self._getChannels()
+        chunks = None
+        try:
+            lineRange = self._getLineRange(req)
+        except ValueError:
+            req.setResponseCode(http.BAD_REQUEST)
+            req.setHeader("content-type", "text/plain; charset=utf-8")
+            self.req = None
+            return "invalid 'tail' or 'lines' argument"
+        if lineRange is not None:
+            first, last = lineRange
+            chunks = self.original.getChunksByLine(first, last, channels)
+        else:
+            try:
+                byteRange = self._setLengthHeaders(req)
+            except ValueError:
+                self.req = None
+                return ''
+            if byteRange is not None:
+                start, end = byteRange
+                chunks = self.original.getChunksByOffset(start, end, channels)
+
         if not self.asText:
             self.template = req.site.buildbot_service.templates.get_template("logs.html")
 
@@ -137,7 +259,13 @@ class TextLog(Resource):
             data = data.encode('utf-8')
             req.write(data)
 
-        self.original.subscribeConsumer(ChunkConsumer(req, self))
+        if chunks is None:
+            self.original.subscribeConsumer(ChunkConsumer(req, self))
+        else:
+            # only the requested part of the log, with no live updates
+            p = logfile.LogFileProducer(self.original,
+                                        ChunkConsumer(req, self), chunks)
+            p.resumeProducing()
         return server.NOT_DONE_YET
 
     def _setContentType(self, req):
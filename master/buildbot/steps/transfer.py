@@ -16,7 +16,10 @@
 from __future__ import with_statement
 
 
+import collections
+import hashlib
 import os.path
+import Queue
 import stat
 import tarfile
 import tempfile
@@ -35,10 +38,28 @@ from buildbot.process.buildstep import SUCCESS
 from buildbot.util import json
 from buildbot.util.eventual import eventually
 from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import threads
+from twisted.python import failure
 from twisted.python import log
+from twisted.python import threadpool
+from twisted.spread import banana
 from twisted.spread import pb
 
 
+def _fileChecksum(path):
+    # the SHA1 hex digest of a file, as compared by the slave to skip
+    # transferring unchanged files
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(64 * 1024)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
 class _FileWriter(pb.Referenceable):
 
     """
@@ -91,6 +112,18 @@ class _FileWriter(pb.Referenceable):
         if self.mode is not None:
             os.chmod(self.destfile, self.mode)
 
+    def remote_unchanged(self):
+        """
+        Called by remote slave, instead of L{remote_close}, to state that
+        L{destfile} already has the file's contents, so no data was transfered
+        """
+        self.fp.close()
+        self.fp = None
+        os.unlink(self.tmpname)
+        self.tmpname = None
+        if self.mode is not None:
+            os.chmod(self.destfile, self.mode)
+
     def cancel(self):
         # unclean shutdown, the file is probably truncated, so delete it
         # altogether rather than deliver a corrupted file
@@ -181,6 +214,149 @@ class _DirectoryWriter(_FileWriter):
         os.remove(self.tarname)
 
 
+# the most streamed directory uploads that are unpacked at once; later ones
+# wait for a thread
+MAX_STREAMING_UNPACKS = 10
+_unpackPool = None
+
+
+def _getUnpackPool():
+    # the threads unpacking streamed uploads are kept out of the reactor's
+    # thread pool, which slow uploads would otherwise use up
+    global _unpackPool
+    if _unpackPool is None:
+        _unpackPool = threadpool.ThreadPool(
+            minthreads=0, maxthreads=MAX_STREAMING_UNPACKS,
+            name='StreamingDirectoryUpload')
+        _unpackPool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', _stopUnpackPool)
+    return _unpackPool
+
+
+def _stopUnpackPool():
+    global _unpackPool
+    if _unpackPool is not None:
+        _unpackPool.stop()
+        _unpackPool = None
+
+
+class _StreamingDirectoryWriter(pb.Referenceable):
+
+    """
+    Like L{_DirectoryWriter}, but the archive is unpacked in a thread as it
+    arrives, rather than written to a temporary file and unpacked at the end.
+    The threads come from a pool of at most L{MAX_STREAMING_UNPACKS}.
+    Each write is acknowledged once the thread has taken it, so the slave can
+    only get a window of blocks ahead of the unpacking.
+    """
+
+    def __init__(self, destroot, maxsize, compress):
+        self.destroot = destroot
+        self.remaining = maxsize
+        if compress == 'bz2':
+            mode = 'r|bz2'
+        elif compress == 'gz':
+            mode = 'r|gz'
+        else:
+            mode = 'r|'
+
+        # blocks for the thread; None means the upload was cancelled, and ''
+        # that it is complete
+        self.queue = Queue.Queue()
+        self.eof = False
+        # Deferreds for the blocks in the queue
+        self.pending = collections.deque()
+        self.done = False
+        self.failure = None
+        self.waiters = []
+
+        # don't let a stalled upload hold up shutdown
+        self.shutdownTrigger = reactor.addSystemEventTrigger(
+            'before', 'shutdown', self.cancel)
+
+        d = threads.deferToThreadPool(reactor, _getUnpackPool(),
+                                      self._unpack, mode)
+        d.addBoth(self._unpacked)
+
+    def remote_write(self, data):
+        if self.failure:
+            return defer.fail(self.failure)
+        if self.remaining is not None:
+            data = data[:self.remaining]
+            self.remaining -= len(data)
+        if not data:
+            return
+        d = defer.Deferred()
+        self.pending.append(d)
+        self.queue.put(data)
+        return d
+
+    def remote_unpack(self):
+        """
+        Called by remote slave to state that no more data will be transfered;
+        fires when the archive has been unpacked
+        """
+        if not self.done:
+            self.queue.put('')
+            d = defer.Deferred()
+            self.waiters.append(d)
+            return d
+        if self.failure:
+            return defer.fail(self.failure)
+
+    def cancel(self):
+        if not self.done:
+            self.queue.put(None)
+
+    # thread methods
+
+    def _unpack(self, mode):
+        # Support old python
+        if not hasattr(tarfile.TarFile, 'extractall'):
+            tarfile.TarFile.extractall = _extractall
+
+        archive = tarfile.open(mode=mode, fileobj=self)
+        archive.extractall(path=self.destroot)
+        archive.close()
+
+        # take any padding after the end of the archive, so that its writes
+        # are acknowledged
+        while self.read(tarfile.RECORDSIZE):
+            pass
+
+    def read(self, size):
+        # called by tarfile; returns the next block, whatever its size
+        if self.eof:
+            return ''
+        data = self.queue.get()
+        if data is None:
+            raise IOError("upload cancelled")
+        if data:
+            reactor.callFromThread(self._taken)
+        else:
+            self.eof = True
+        return data
+
+    # reactor methods
+
+    def _taken(self):
+        self.pending.popleft().callback(None)
+
+    def _unpacked(self, res):
+        self.done = True
+        reactor.removeSystemEventTrigger(self.shutdownTrigger)
+        if isinstance(res, failure.Failure):
+            self.failure = res
+            while self.pending:
+                self.pending.popleft().errback(res)
+        waiters, self.waiters = self.waiters, []
+        for d in waiters:
+            if self.failure:
+                d.errback(self.failure)
+            else:
+                d.callback(None)
+
+
 def makeStatusRemoteCommand(step, remote_command, args):
     self = buildstep.RemoteCommand(remote_command, args, decodeRC={None: SUCCESS, 0: SUCCESS})
     callback = lambda arg: step.step_status.addLog('stdio')
@@ -188,6 +364,58 @@ def makeStatusRemoteCommand(step, remote_command, args):
     return self
 
 
+class _MultipleUploadWriters(pb.Referenceable):
+
+    """
+    Helper class for L{MultipleFileUpload}, when its sources are uploaded by a
+    single C{uploadMultiple} command: the slave opens the writer for each
+    source from me, and tells me when each upload is done, so that I can
+    call the step's C{uploadDone}.
+    """
+
+    def __init__(self, step, destdir):
+        self.step = step
+        self.destdir = destdir
+        # the writers of the uploads in progress
+        self.writers = {}
+
+    def _masterdest(self, source):
+        return os.path.join(self.destdir, os.path.basename(source))
+
+    def remote_open(self, source, kind):
+        """
+        Called by remote slave to get the writer of C{source}, a C{'file'} or
+        a C{'directory'}
+        """
+        masterdest = self._masterdest(source)
+        if kind == 'directory':
+            writer = self.step.makeDirectoryWriter(masterdest)
+        else:
+            writer = self.step.makeFileWriter(masterdest)
+        self.writers[source] = writer
+        return writer
+
+    def remote_done(self, source, rc):
+        """
+        Called by remote slave when the upload of C{source} is done
+        """
+        writer = self.writers.pop(source, None)
+        result = SUCCESS
+        if rc:
+            result = FAILURE
+            if writer:
+                writer.cancel()
+        d = defer.maybeDeferred(self.step.uploadDone, result, source,
+                                self._masterdest(source))
+        d.addCallback(lambda _: None)
+        return d
+
+    def cancel(self):
+        for writer in self.writers.values():
+            writer.cancel()
+        self.writers = {}
+
+
 class _TransferBuildStep(BuildStep):
 
     """
@@ -201,9 +429,18 @@ class _TransferBuildStep(BuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
-    def __init__(self, workdir=None, **buildstep_kwargs):
+    def __init__(self, workdir=None, window=1, maxblocksize=None,
+                 **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.workdir = workdir
+        if not isinstance(window, int) or window < 1:
+            config.error('window must be a positive integer')
+        self.window = window
+        # PB refuses strings larger than this
+        if maxblocksize is not None and maxblocksize > banana.SIZE_LIMIT:
+            config.error('maxblocksize must be at most %d'
+                         % banana.SIZE_LIMIT)
+        self.maxblocksize = maxblocksize
 
     # Check that buildslave version used have implementation for
     # a remote command. Raise exception if buildslave is to old.
@@ -212,6 +449,34 @@ class _TransferBuildStep(BuildStep):
             message = "slave is too old, does not know about %s" % command
             raise BuildSlaveTooOldError(message)
 
+    def addWindowArgs(self, command, args):
+        # slaves older than 2.17 wait for each block in turn, and ignore these
+        if self.window == 1 and self.maxblocksize is None:
+            return
+        if self.slaveVersionIsOlderThan(command, "2.17"):
+            log.msg("%s: slave is too old to transfer files with a window; "
+                    "sending one block at a time" % (self.name,))
+            return
+        args['window'] = self.window
+        if self.maxblocksize is not None:
+            args['maxblocksize'] = self.maxblocksize
+
+    def addChecksumArg(self, command, args, path):
+        # hash the master's copy of the file in a thread, as it may be large,
+        # so that the slave can skip the transfer if its copy is the same
+        if not os.path.isfile(path):
+            return defer.succeed(None)
+        if self.slaveVersionIsOlderThan(command, "2.17"):
+            log.msg("%s: slave is too old to compare checksums; "
+                    "transferring the whole file" % (self.name,))
+            return defer.succeed(None)
+        d = threads.deferToThread(_fileChecksum, path)
+
+        @d.addCallback
+        def setChecksum(checksum):
+            args['checksum'] = checksum
+        return d
+
     def setDefaultWorkdir(self, workdir):
         if self.workdir is None:
             self.workdir = workdir
@@ -258,7 +523,7 @@ class FileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
-                 keepstamp=False, url=None,
+                 keepstamp=False, url=None, checksum=False,
                  **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
@@ -272,6 +537,7 @@ class FileUpload(_TransferBuildStep):
         self.mode = mode
         self.keepstamp = keepstamp
         self.url = url
+        self.checksum = checksum
 
     def start(self):
         self.checkSlaveVersion("uploadFile")
@@ -308,8 +574,16 @@ class FileUpload(_TransferBuildStep):
             'keepstamp': self.keepstamp,
         }
 
-        cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
-        d = self.runTransferCommand(cmd, fileWriter)
+        self.addWindowArgs('uploadFile', args)
+        if self.checksum:
+            d = self.addChecksumArg('uploadFile', args, masterdest)
+        else:
+            d = defer.succeed(None)
+
+        @d.addCallback
+        def run(_):
+            cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
+            return self.runTransferCommand(cmd, fileWriter)
         d.addCallback(self.finished).addErrback(self.failed)
 
 
@@ -321,7 +595,7 @@ class DirectoryUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16 * 1024,
-                 compress=None, url=None, **buildstep_kwargs):
+                 compress=None, url=None, stream=False, **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
         self.slavesrc = slavesrc
@@ -333,6 +607,7 @@ class DirectoryUpload(_TransferBuildStep):
                 "'compress' must be one of None, 'gz', or 'bz2'")
         self.compress = compress
         self.url = url
+        self.stream = stream
 
     def start(self):
         self.checkSlaveVersion("uploadDirectory")
@@ -352,7 +627,11 @@ class DirectoryUpload(_TransferBuildStep):
             self.addURL(os.path.basename(masterdest), self.url)
 
         # we use maxsize to limit the amount of data on both sides
-        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
+        if self.stream:
+            dirWriter = _StreamingDirectoryWriter(masterdest, self.maxsize,
+                                                  self.compress)
+        else:
+            dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
 
         # default arguments
         args = {
@@ -364,6 +643,10 @@ class DirectoryUpload(_TransferBuildStep):
             'compress': self.compress
         }
 
+        # older slaves write the archive to a file before sending it
+        if self.stream and not self.slaveVersionIsOlderThan("uploadDirectory", "2.17"):
+            args['stream'] = True
+        self.addWindowArgs('uploadDirectory', args)
         cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         d = self.runTransferCommand(cmd, dirWriter)
         d.addCallback(self.finished).addErrback(self.failed)
@@ -377,7 +660,8 @@ class MultipleFileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrcs, masterdest,
                  workdir=None, maxsize=None, blocksize=16 * 1024,
-                 mode=None, compress=None, keepstamp=False, url=None, **buildstep_kwargs):
+                 mode=None, compress=None, keepstamp=False, url=None,
+                 stream=False, maxParallel=1, **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
         self.slavesrcs = slavesrcs
@@ -394,9 +678,22 @@ class MultipleFileUpload(_TransferBuildStep):
         self.compress = compress
         self.keepstamp = keepstamp
         self.url = url
+        self.stream = stream
+        if not isinstance(maxParallel, int) or maxParallel < 1:
+            config.error('maxParallel must be a positive integer')
+        self.maxParallel = maxParallel
+
+    def makeFileWriter(self, masterdest):
+        return _FileWriter(masterdest, self.maxsize, self.mode)
+
+    def makeDirectoryWriter(self, masterdest):
+        if self.stream:
+            return _StreamingDirectoryWriter(masterdest, self.maxsize,
+                                             self.compress)
+        return _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
 
     def uploadFile(self, source, masterdest):
-        fileWriter = _FileWriter(masterdest, self.maxsize, self.mode)
+        fileWriter = self.makeFileWriter(masterdest)
 
         args = {
             'slavesrc': source,
@@ -407,11 +704,12 @@ class MultipleFileUpload(_TransferBuildStep):
             'keepstamp': self.keepstamp,
         }
 
+        self.addWindowArgs('uploadFile', args)
         cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
         return self.runTransferCommand(cmd, fileWriter)
 
     def uploadDirectory(self, source, masterdest):
-        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
+        dirWriter = self.makeDirectoryWriter(masterdest)
 
         args = {
             'slavesrc': source,
@@ -422,6 +720,9 @@ class MultipleFileUpload(_TransferBuildStep):
             'compress': self.compress
         }
 
+        if self.stream and not self.slaveVersionIsOlderThan("uploadDirectory", "2.17"):
+            args['stream'] = True
+        self.addWindowArgs('uploadDirectory', args)
         cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         return self.runTransferCommand(cmd, dirWriter)
 
@@ -453,6 +754,28 @@ class MultipleFileUpload(_TransferBuildStep):
 
         return d
 
+    def uploadMultiple(self, sources, destdir):
+        # all of the sources are uploaded by a single command, as the slave
+        # runs only one command at a time; it opens a writer for each source
+        # from writers, up to maxParallel at once
+        writers = _MultipleUploadWriters(self, destdir)
+
+        args = {
+            'slavesrcs': sources,
+            'workdir': self._getWorkdir(),
+            'writers': writers,
+            'maxParallel': self.maxParallel,
+            'maxsize': self.maxsize,
+            'blocksize': self.blocksize,
+            'keepstamp': self.keepstamp,
+            'compress': self.compress,
+            'stream': self.stream,
+        }
+
+        self.addWindowArgs('uploadMultiple', args)
+        cmd = makeStatusRemoteCommand(self, 'uploadMultiple', args)
+        return self.runTransferCommand(cmd, writers)
+
     def uploadDone(self, result, source, masterdest):
         pass
 
@@ -484,7 +807,14 @@ class MultipleFileUpload(_TransferBuildStep):
                     yield defer.returnValue(FAILURE)
             yield defer.returnValue(SUCCESS)
 
-        d = uploadSources()
+        if (self.maxParallel > 1 and
+                not self.slaveVersionIsOlderThan("uploadMultiple", "2.17")):
+            d = self.uploadMultiple(sources, masterdest)
+        else:
+            if self.maxParallel > 1:
+                log.msg("%s: slave is too old to upload several sources at "
+                        "once; uploading them one at a time" % (self.name,))
+            d = uploadSources()
 
         @d.addCallback
         def allUploadsDone(result):
@@ -546,7 +876,7 @@ class FileDownload(_TransferBuildStep):
 
     def __init__(self, mastersrc, slavedest,
                  workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
-                 **buildstep_kwargs):
+                 checksum=False, **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
         self.mastersrc = mastersrc
@@ -557,6 +887,7 @@ class FileDownload(_TransferBuildStep):
             config.error(
                 'mode must be an integer or None')
         self.mode = mode
+        self.checksum = checksum
 
     def start(self):
         self.checkSlaveVersion("downloadFile")
@@ -594,8 +925,16 @@ class FileDownload(_TransferBuildStep):
             'mode': self.mode,
         }
 
-        cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
-        d = self.runTransferCommand(cmd)
+        self.addWindowArgs('downloadFile', args)
+        if self.checksum:
+            d = self.addChecksumArg('downloadFile', args, source)
+        else:
+            d = defer.succeed(None)
+
+        @d.addCallback
+        def run(_):
+            cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
+            return self.runTransferCommand(cmd)
         d.addCallback(self.finished).addErrback(self.failed)
 
 
@@ -646,6 +985,7 @@ class StringDownload(_TransferBuildStep):
             'mode': self.mode,
         }
 
+        self.addWindowArgs('downloadFile', args)
         cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
         d = self.runTransferCommand(cmd)
         d.addCallback(self.finished).addErrback(self.failed)
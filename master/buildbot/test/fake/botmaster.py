@@ -25,6 +25,7 @@ class FakeBotMaster(service.MultiService):
         self.locks = {}
         self.builders = {}
         self.buildsStartedForSlaves = []
+        self.buildsStartedForBuilders = []
 
     def getLockByID(self, lockid):
         if lockid not in self.locks:
@@ -43,3 +44,6 @@ class FakeBotMaster(service.MultiService):
 
     def maybeStartBuildsForSlave(self, slavename):
         self.buildsStartedForSlaves.append(slavename)
+
+    def maybeStartBuildsForBuilder(self, buildername):
+        self.buildsStartedForBuilders.append(buildername)
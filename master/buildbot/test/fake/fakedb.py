@@ -23,6 +23,8 @@ import base64
 import copy
 
 from buildbot.db import buildrequests
+from buildbot.status.results import SUCCESS
+from buildbot.status.results import WARNINGS
 from buildbot.util import datetime2epoch
 from buildbot.util import json
 from copy import deepcopy
@@ -245,6 +247,9 @@ class Buildset(Row):
         complete=0,
         complete_at=None,
         results=-1,
+        requests_total=None,
+        requests_complete=None,
+        requests_failed=None,
     )
 
     id_column = 'id'
@@ -404,10 +409,19 @@ class FakeChangesComponent(FakeDBComponent):
             project=project,
             codebase=codebase,
             files=files,
-            properties=properties)
+            properties=properties,
+            uids=[uid] if uid else [])
 
         return defer.succeed(changeid)
 
+    @defer.inlineCallbacks
+    def addChanges(self, changes):
+        changeids = []
+        for kwargs in changes:
+            changeid = yield self.addChange(**kwargs)
+            changeids.append(changeid)
+        defer.returnValue(changeids)
+
     def getLatestChangeid(self):
         if self.changes:
             return defer.succeed(max(self.changes.iterkeys()))
@@ -421,6 +435,10 @@ class FakeChangesComponent(FakeDBComponent):
 
         return defer.succeed(self._chdict(row))
 
+    def getChangesRange(self, from_id, limit):
+        ids = sorted(id for id in self.changes if id >= from_id)[:limit]
+        return defer.succeed([self._chdict(self.changes[id]) for id in ids])
+
     def getChangeUids(self, changeid):
         try:
             ch_uids = self.changes[changeid]['uids']
@@ -668,6 +686,14 @@ class FakeSourceStampsComponent(FakeDBComponent):
                 sslist.append(ssdictcpy)
         return defer.succeed(sslist)
 
+    def getSourceStampsForSets(self, sourcestampsetids):
+        sslists = dict((setid, []) for setid in sourcestampsetids)
+        for ssid in sorted(self.sourcestamps):
+            setid = self.sourcestamps[ssid]['sourcestampsetid']
+            if setid in sslists:
+                sslists[setid].append(self._getSourceStamp(ssid))
+        return defer.succeed(sslists)
+
 
 class FakeBuildsetsComponent(FakeDBComponent):
 
@@ -707,7 +733,9 @@ class FakeBuildsetsComponent(FakeDBComponent):
         self.db.buildrequests.insertTestData(br_rows)
 
         # make up a row and keep its dictionary, with the properties tacked on
-        bsrow = Buildset(sourcestampsetid=sourcestampsetid, reason=reason, external_idstring=external_idstring)
+        bsrow = Buildset(sourcestampsetid=sourcestampsetid, reason=reason, external_idstring=external_idstring,
+                         requests_total=len(builderNames),
+                         requests_complete=0, requests_failed=0)
         self.buildsets[bsid] = bsrow.values.copy()
         self.buildsets[bsid]['properties'] = properties
 
@@ -727,6 +755,11 @@ class FakeBuildsetsComponent(FakeDBComponent):
         row = self.buildsets[bsid]
         return defer.succeed(self._row2dict(row))
 
+    def getBuildsetsByIds(self, bsids):
+        return defer.succeed(dict((bsid, self._row2dict(self.buildsets[bsid]))
+                                  for bsid in bsids
+                                  if bsid in self.buildsets))
+
     def getBuildsets(self, complete=None):
         rv = []
         for bs in self.buildsets.itervalues():
@@ -750,8 +783,18 @@ class FakeBuildsetsComponent(FakeDBComponent):
         row['complete'] = bool(row['complete'])
         row['bsid'] = row['id']
         del row['id']
+        for k in 'requests_total', 'requests_complete', 'requests_failed':
+            del row[k]
         return row
 
+    def getBuildsetRequestCounts(self, bsid):
+        row = self.buildsets.get(bsid)
+        if not row or row['requests_total'] is None:
+            return defer.succeed(None)
+        return defer.succeed((row['requests_total'],
+                              row['requests_complete'],
+                              row['requests_failed']))
+
     def getBuildsetProperties(self, buildsetid):
         if buildsetid in self.buildsets:
             return defer.succeed(
@@ -759,6 +802,12 @@ class FakeBuildsetsComponent(FakeDBComponent):
         else:
             return defer.succeed({})
 
+    def getBuildsetsProperties(self, bsids):
+        return defer.succeed(
+            dict((bsid, self.buildsets[bsid]['properties']
+                  if bsid in self.buildsets else {})
+                 for bsid in bsids))
+
     # fake methods
 
     def fakeBuildsetCompletion(self, bsid, result):
@@ -806,7 +855,8 @@ class FakeBuildsetsComponent(FakeDBComponent):
             del buildset['id']
 
         # clear out some columns if the caller doesn't care
-        for col in 'complete complete_at submitted_at results'.split():
+        for col in ('complete complete_at submitted_at results '
+                    'requests_total requests_complete requests_failed').split():
             if col not in expected_buildset:
                 del buildset[col]
 
@@ -1001,11 +1051,14 @@ class FakeBuildRequestsComponent(FakeDBComponent):
 
     @defer.inlineCallbacks
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-                         bsid=None, branch=None, repository=None):
+                         bsid=None, branch=None, repository=None,
+                         min_brid=None):
         rv = []
         for br in self.reqs.itervalues():
             if buildername and br.buildername != buildername:
                 continue
+            if min_brid is not None and br.id < min_brid:
+                continue
             if complete is not None:
                 if complete and not br.complete:
                     continue
@@ -1038,6 +1091,11 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             rv.append(self._brdictFromRow(br))
         defer.returnValue(rv)
 
+    def listUnclaimedBuildRequests(self):
+        return defer.succeed([(br.id, br.buildsetid, br.buildername)
+                              for br in self.reqs.itervalues()
+                              if not br.complete and br.id not in self.claims])
+
     def claimBuildRequests(self, brids, claimed_at=None, _reactor=reactor):
         for brid in brids:
             if brid not in self.reqs or brid in self.claims:
@@ -1053,6 +1111,23 @@ class FakeBuildRequestsComponent(FakeDBComponent):
                                                   objectid=self.MASTER_ID, claimed_at=claimed_at)
         return defer.succeed(None)
 
+    def claimBuildRequestGroups(self, groups, claimed_at=None,
+                                _reactor=reactor):
+        claimed = set(brid for group in groups for brid in group
+                      if brid not in self.reqs or brid in self.claims)
+
+        claimed_at = datetime2epoch(claimed_at)
+        if not claimed_at:
+            claimed_at = _reactor.seconds()
+
+        for group in groups:
+            if not claimed.intersection(group):
+                for brid in group:
+                    self.claims[brid] = BuildRequestClaim(
+                        brid=brid, objectid=self.MASTER_ID,
+                        claimed_at=claimed_at)
+        return defer.succeed(claimed)
+
     def reclaimBuildRequests(self, brids, _reactor):
         for brid in brids:
             if brid in self.claims and self.claims[brid].objectid != self.MASTER_ID:
@@ -1085,6 +1160,13 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             self.reqs[brid].complete = 1
             self.reqs[brid].results = results
             self.reqs[brid].complete_at = complete_at
+
+            # count the request in its buildset
+            bs = self.db.buildsets.buildsets.get(self.reqs[brid].buildsetid)
+            if bs and bs['requests_total'] is not None:
+                bs['requests_complete'] += 1
+                if results not in (SUCCESS, WARNINGS):
+                    bs['requests_failed'] += 1
         return defer.succeed(None)
 
     def unclaimExpiredRequests(self, old, _reactor=reactor):
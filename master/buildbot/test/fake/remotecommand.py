@@ -158,6 +158,23 @@ class FakeLogFile(object):
                     for (ch, data) in self.chunks
                     if not channels or ch in channels]
 
+    def getChunksByOffset(self, start, end=None, channels=[],
+                          onlyText=False):
+        text = ''.join(self.getChunks(channels, onlyText=True))
+        return [text[start:end]] if onlyText else [(STDOUT, text[start:end])]
+
+    def getChunksByLine(self, first, last=None, channels=[], onlyText=False):
+        text = ''.join(self.getChunks(channels, onlyText=True))
+        text = ''.join(StringIO(text).readlines()[first:last])
+        return [text] if onlyText else [(STDOUT, text)]
+
+    def getTextLength(self, channels=[]):
+        return len(''.join(self.getChunks(channels, onlyText=True)))
+
+    def getLineCount(self, channels=[]):
+        text = ''.join(self.getChunks(channels, onlyText=True))
+        return len(StringIO(text).readlines())
+
     def finish(self):
         pass
 
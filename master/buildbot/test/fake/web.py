@@ -27,8 +27,8 @@ class FakeRequest(Mock):
 
     """
     A fake Twisted Web Request object, including some pointers to the
-    buildmaster and an addChange method on that master which will append its
-    arguments to self.addedChanges.
+    buildmaster and addChange and addChanges methods on that master which will
+    append their arguments to self.addedChanges.
     """
 
     written = ''
@@ -58,6 +58,11 @@ class FakeRequest(Mock):
             return defer.succeed(Mock())
         master.addChange = addChange
 
+        def addChanges(changes):
+            self.addedChanges.extend(changes)
+            return defer.succeed([Mock() for _ in changes])
+        master.addChanges = addChanges
+
         self.deferred = defer.Deferred()
 
     def write(self, data):
@@ -13,6 +13,8 @@
 #
 # Copyright Buildbot Team Members
 
+import mock
+
 from buildbot.changes import base
 from buildbot.test.util import changesource
 from buildbot.test.util import compat
@@ -108,3 +110,52 @@ class TestPollingChangeSource(changesource.ChangeSourceMixin, unittest.TestCase)
         d.addCallback(check)
         reactor.callWhenRunning(d.callback, None)
         return d
+
+    def test_poll_counts_changes(self):
+        def poll():
+            self.changesource.addChange(author='me', files=['a'])
+            return self.changesource.addChanges([dict(author='you'),
+                                                 dict(author='them')])
+        self.changesource.poll = poll
+        d = self.changesource.doPoll()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.changesource.lastPollChanges, 3)
+            self.assertFalse(self.changesource.lastPollFailed)
+            self.assertEqual([ch['author'] for ch in self.changes_added],
+                             ['me', 'you', 'them'])
+        return d
+
+    @compat.usesFlushLoggedErrors
+    def test_poll_failed(self):
+        def poll():
+            raise RuntimeError("oh noes")
+        self.changesource.poll = poll
+        d = self.changesource.doPoll()
+
+        @d.addCallback
+        def check(_):
+            self.assertTrue(self.changesource.lastPollFailed)
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        return d
+
+    def test_pollScheduler(self):
+        # a child of the change manager is polled by its scheduler
+        parent = mock.Mock()
+        self.changesource.parent = parent
+        self.startChangeSource()
+
+        d = defer.Deferred()
+
+        def check(_):
+            parent.pollScheduler.addSource.assert_called_with(
+                self.changesource)
+            self.assertEqual(self.changesource._loop, None)
+
+            self.changesource.stopService()
+            parent.pollScheduler.removeSource.assert_called_with(
+                self.changesource)
+        d.addCallback(check)
+        reactor.callWhenRunning(d.callback, None)
+        return d
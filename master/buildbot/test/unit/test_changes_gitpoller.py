@@ -24,126 +24,135 @@ from buildbot.test.util import config
 from buildbot.test.util import gpo
 from buildbot.util import epoch2datetime
 from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet import reactor
+from twisted.python import failure
 from twisted.trial import unittest
 
 # Test that environment variables get propagated to subprocesses (See #2116)
 os.environ['TEST_THAT_ENVIRONMENT_GETS_PASSED_TO_SUBPROCESSES'] = 'TRUE'
 
 
-class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
+def gitLog(*commits):
+    """
+    Return the output of the GitPoller's git log for the given commits, each a
+    tuple of (rev, timestamp, author, comments, files).
+    """
+    output = []
+    for rev, timestamp, author, comments, files in commits:
+        output.append('\0%s\0%s\0%s\0%s\n\0' % (rev, timestamp, author,
+                                                comments))
+        if files:
+            output.append('\n' + ''.join(f + '\0' for f in files))
+    return ''.join(output)
 
-    """Test GitPoller methods for parsing git output"""
-
-    def setUp(self):
-        self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git')
-        self.setUpGetProcessOutput()
-
-    dummyRevStr = '12345abcde'
-
-    def _perform_git_output_test(self, methodToTest, args,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
-
-        # make this call to self.patch here so that we raise a SkipTest if it
-        # is not supported
-        self.expectCommands(
-            gpo.Expect('git', *args)
-            .path('gitpoller-work'),
-        )
 
-        d = defer.succeed(None)
+def fakeCommit(rev):
+    return (rev, '1273258009', 'by:' + rev[:8], 'hello!', ['/etc/' + rev[:3]])
 
-        def call_empty(_):
-            # we should get an Exception with empty output from git
-            return methodToTest(self.dummyRevStr)
-        d.addCallback(call_empty)
 
-        def cb_empty(_):
-            if emptyRaisesException:
-                self.fail("getProcessOutput should have failed on empty output")
+class GitOutputParsing(unittest.TestCase):
 
-        def eb_empty(f):
-            if not emptyRaisesException:
-                self.fail("getProcessOutput should NOT have failed on empty output")
-        d.addCallbacks(cb_empty, eb_empty)
-        d.addCallback(lambda _: self.assertAllCommandsRan())
-
-        # and the method shouldn't supress any exceptions
-        self.expectCommands(
-            gpo.Expect('git', *args)
-            .path('gitpoller-work')
-            .exit(1),
-        )
-
-        def call_exception(_):
-            return methodToTest(self.dummyRevStr)
-        d.addCallback(call_exception)
-
-        def cb_exception(_):
-            self.fail("getProcessOutput should have failed on stderr output")
-
-        def eb_exception(f):
-            pass
-        d.addCallbacks(cb_exception, eb_exception)
-        d.addCallback(lambda _: self.assertAllCommandsRan())
-
-        # finally we should get what's expected from good output
-        self.expectCommands(
-            gpo.Expect('git', *args)
-            .path('gitpoller-work')
-            .stdout(desiredGoodOutput)
-        )
+    """Test GitPoller methods for parsing git output"""
 
-        def call_desired(_):
-            return methodToTest(self.dummyRevStr)
-        d.addCallback(call_desired)
+    def setUp(self):
+        self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git')
+        self.commits = []
+        self.pp = gitpoller._GitLogProtocol(
+            lambda *fields: self.commits.append(fields), self.poller.repourl)
+
+    def parse(self, output, chunk=1):
+        # deliver the output in small pieces, as the pipe may
+        for i in range(0, len(output), chunk):
+            self.pp.outReceived(output[i:i + chunk])
+        self.pp.processEnded(failure.Failure(error.ProcessDone(0)))
+        return self.pp.deferred
+
+    @defer.inlineCallbacks
+    def test_parse(self):
+        yield self.parse(gitLog(
+            ('12345abcde', '1273258009', 'Sammy Jankis <email@example.com>',
+             'this is a commit message\n\nthat is multiline',
+             ['file1', 'directory with space/file2', 'f\xc3\xa9', '"q"']),
+            ('12345abcdf', '1273258008', 'A U Thor <a@example.com>',
+             'merge', []),
+            ('12345abce0', '1273258007', 'A U Thor <a@example.com>',
+             'single line message', ['\nfile3'])))
+        self.assertEqual(self.commits, [
+            ('12345abcde', '1273258009', 'Sammy Jankis <email@example.com>',
+             'this is a commit message\n\nthat is multiline\n',
+             ['file1', 'directory with space/file2', 'f\xc3\xa9', '"q"']),
+            ('12345abcdf', '1273258008', 'A U Thor <a@example.com>',
+             'merge\n', []),
+            # only the newline that separates the names from the message is
+            # removed
+            ('12345abce0', '1273258007', 'A U Thor <a@example.com>',
+             'single line message\n', ['\nfile3']),
+        ])
+
+    @defer.inlineCallbacks
+    def test_parse_chunks(self):
+        output = gitLog(*[fakeCommit('%040x' % i) for i in range(10)])
+        yield self.parse(output, chunk=4096)
+        commits = self.commits
+        self.commits = []
+        self.pp = gitpoller._GitLogProtocol(
+            lambda *fields: self.commits.append(fields), self.poller.repourl)
+        yield self.parse(output, chunk=7)
+        self.assertEqual(len(commits), 10)
+        self.assertEqual(self.commits, commits)
+
+    @defer.inlineCallbacks
+    def test_parse_empty(self):
+        yield self.parse('')
+        self.assertEqual(self.commits, [])
+
+    @defer.inlineCallbacks
+    def test_parse_truncated(self):
+        yield self.parse('\x0012345abcde\x001273258009')
+        self.assertEqual(self.commits,
+                         [('12345abcde', '1273258009', None, None, [])])
+
+    def test_parse_failure(self):
+        self.pp.errReceived('fatal: bad revision')
+        self.pp.processEnded(failure.Failure(error.ProcessTerminated(128)))
+        d = self.assertFailure(self.pp.deferred, EnvironmentError)
 
-        def cb_desired(r):
-            self.assertEquals(r, desiredGoodResult)
-        d.addCallback(cb_desired)
-        d.addCallback(lambda _: self.assertAllCommandsRan())
+        @d.addCallback
+        def check(e):
+            self.assertIn('exit code 128', str(e))
+            self.assertIn('fatal: bad revision', str(e))
         return d
 
-    def test_get_commit_author(self):
-        authorStr = u'Sammy Jankis <email@example.com>'
-        return self._perform_git_output_test(self.poller._get_commit_author,
-                                             ['log', '--no-walk', '--format=%aN <%aE>', self.dummyRevStr, '--'],
-                                             authorStr, authorStr)
-
-    def _test_get_commit_comments(self, commentStr):
-        return self._perform_git_output_test(self.poller._get_commit_comments,
-                                             ['log', '--no-walk', '--format=%s%n%b', self.dummyRevStr, '--'],
-                                             commentStr, commentStr, emptyRaisesException=False)
-
-    def test_get_commit_comments(self):
-        comments = [u'this is a commit message\n\nthat is multiline',
-                    u'single line message', u'']
-        return defer.DeferredList([self._test_get_commit_comments(commentStr) for commentStr in comments])
-
-    def test_get_commit_files(self):
-        filesStr = '\n\nfile1\nfile2\n"\146ile_octal"\nfile space'
-        filesRes = ['file1', 'file2', 'file_octal', 'file space']
-        return self._perform_git_output_test(self.poller._get_commit_files,
-                                             ['log', '--name-only', '--no-walk', '--format=%n', self.dummyRevStr, '--'],
-                                             filesStr, filesRes, emptyRaisesException=False)
-
-    def test_get_commit_files_with_space_in_changed_files(self):
-        filesStr = 'normal_directory/file1\ndirectory with space/file2'
-        return self._perform_git_output_test(
-            self.poller._get_commit_files,
-            ['log', '--name-only', '--no-walk', '--format=%n', self.dummyRevStr, '--'],
-            filesStr,
-            filter(lambda x: x.strip(), filesStr.splitlines(), ),
-            emptyRaisesException=False,
-        )
-
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        return self._perform_git_output_test(self.poller._get_commit_timestamp,
-                                             ['log', '--no-walk', '--format=%ct', self.dummyRevStr, '--'],
-                                             stampStr, float(stampStr))
-
-    # _get_changes is tested in TestGitPoller, below
+    def test_decode_commit(self):
+        change = self.poller._decode_commit(
+            '12345abcde', '1273258009', 'Sammy J\xc3\xa4nkis <email@example.com>',
+            'single line message\n', ['f\xc3\xa9', 'file space'])
+        self.assertEqual(change, dict(
+            author=u'Sammy J\xe4nkis <email@example.com>',
+            revision='12345abcde',
+            files=[u'f\xe9', u'file space'],
+            comments=u'single line message',
+            when_timestamp=epoch2datetime(1273258009)))
+
+    def test_decode_commit_no_timestamps(self):
+        self.poller.usetimestamps = False
+        change = self.poller._decode_commit(
+            '12345abcde', 'x', 'me <me@example.com>', '\n', [])
+        self.assertEqual(change['when_timestamp'], None)
+        self.assertEqual(change['comments'], u'')
+
+    def test_decode_commit_bad_timestamp(self):
+        self.assertRaises(ValueError, self.poller._decode_commit,
+                          '12345abcde', 'x', 'me <me@example.com>', '', [])
+
+    def test_decode_commit_no_author(self):
+        self.assertRaises(EnvironmentError, self.poller._decode_commit,
+                          '12345abcde', '1273258009', '', '', [])
+
+    def test_decode_commit_truncated(self):
+        self.assertRaises(EnvironmentError, self.poller._decode_commit,
+                          '12345abcde', '1273258009', None, None, [])
 
 
 class TestGitPoller(gpo.GetProcessOutputMixin,
@@ -155,6 +164,8 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
 
     def setUp(self):
         self.setUpGetProcessOutput()
+        self.expected_logs = []
+        self.patch(reactor, 'spawnProcess', self.spawnProcess)
         d = self.setUpChangeSource()
 
         def create_poller(_):
@@ -166,6 +177,42 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
     def tearDown(self):
         return self.tearDownChangeSource()
 
+    def expectLog(self, revRange, revs=[], exit=0, output=None):
+        """
+        Expect the poller's git log of C{revRange}, listing the commits in
+        C{revs} with the details given by L{fakeCommit}, or printing
+        C{output}.
+        """
+        if output is None:
+            output = gitLog(*[fakeCommit(rev) for rev in revs])
+        self.expected_logs.append((revRange, output, exit))
+
+    def spawnProcess(self, pp, executable, args, path=None, env=None):
+        if not self.expected_logs:
+            self.fail("got command %s when no further logs were expected"
+                      % (args,))
+        revRange, output, exit = self.expected_logs.pop(0)
+        self.assertEqual((executable, args, path),
+                         ('git', ['git', 'log', '-z', '--name-only',
+                                  '--format=' +
+                                  gitpoller._GitLogProtocol.LOG_FORMAT,
+                                  revRange, '--'],
+                          'gitpoller-work'))
+        self._check_env(env)
+        # deliver the output in small pieces, as the pipe may
+        for i in range(0, len(output), 7):
+            pp.outReceived(output[i:i + 7])
+        if exit:
+            reason = error.ProcessTerminated(exit)
+        else:
+            reason = error.ProcessDone(0)
+        pp.processEnded(failure.Failure(reason))
+
+    def assertAllCommandsRan(self):
+        gpo.GetProcessOutputMixin.assertAllCommandsRan(self)
+        self.assertEqual(self.expected_logs, [],
+                         "assert all expected logs were run")
+
     def test_describe(self):
         self.assertSubstring("GitPoller", self.poller.describe())
 
@@ -250,13 +297,9 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       'fa3ae8ed68e664d4db24798611b352e3c6509930..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
-            .exit(1),
         )
+        self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241', exit=1)
 
         # do the poll
         self.poller.lastRev = {
@@ -272,6 +315,40 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                 'master': '4423cdbcbb89c14e50dd5f4152415afd686c5241'
             })
 
+    def test_poll_failCommit(self):
+        self.expectCommands(
+            gpo.Expect('git', 'init', '--bare', 'gitpoller-work'),
+            gpo.Expect('git', 'fetch', self.REPOURL,
+                       '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
+            .path('gitpoller-work'),
+            gpo.Expect('git', 'rev-parse',
+                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
+            .path('gitpoller-work')
+            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
+        )
+        # the middle commit has no author
+        self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                       output=gitLog(
+                           fakeCommit('4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+                           ('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                            '1273258009', '', 'hello!', []),
+                           fakeCommit('9118f4ab71963d23d02d4bdc54876ac8bf05acf2')))
+
+        self.poller.lastRev = {
+            'master': 'fa3ae8ed68e664d4db24798611b352e3c6509930'
+        }
+        d = self.poller.poll()
+
+        @d.addCallback
+        def cb(_):
+            self.assertAllCommandsRan()
+            self.assertEqual(len(self.flushLoggedErrors(EnvironmentError)), 1)
+            # the commits older than the failing one are added
+            self.assertEqual([ch['revision'] for ch in self.changes_added],
+                             ['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])
+        return d
+
     def test_poll_nothingNew(self):
         # Test that environment variables get propagated to subprocesses
         # (See #2116)
@@ -288,13 +365,9 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       '4423cdbcbb89c14e50dd5f4152415afd686c5241..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
-            .stdout(''),
         )
+        self.expectLog('4423cdbcbb89c14e50dd5f4152415afd686c5241..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241')
 
         self.poller.lastRev = {
             'master': '4423cdbcbb89c14e50dd5f4152415afd686c5241'
@@ -353,45 +426,18 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       'fa3ae8ed68e664d4db24798611b352e3c6509930..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
-                '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
             gpo.Expect('git', 'rev-parse',
                        'refs/buildbot/%s/release' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
-                       '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
-                '9118f4ab71963d23d02d4bdc54876ac8bf05acf2'
-            ])),
         )
-
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                       ['64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                        '4423cdbcbb89c14e50dd5f4152415afd686c5241'])
+        self.expectLog('bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..'
+                       '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
+                       ['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])
 
         # do the poll
         self.poller.branches = ['master', 'release']
@@ -448,34 +494,11 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'fa3ae8ed68e664d4db24798611b352e3c6509930..'
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
-                '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
         )
-
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                       ['64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                        '4423cdbcbb89c14e50dd5f4152415afd686c5241'])
 
         # do the poll
         self.poller.branches = True
@@ -527,13 +550,9 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       '4423cdbcbb89c14e50dd5f4152415afd686c5241..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
-            .stdout(''),
         )
+        self.expectLog('4423cdbcbb89c14e50dd5f4152415afd686c5241..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241')
 
         self.poller.lastRev = {
             'master': '4423cdbcbb89c14e50dd5f4152415afd686c5241'
@@ -565,46 +584,19 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'fa3ae8ed68e664d4db24798611b352e3c6509930..'
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
-                '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
             gpo.Expect(
                 'git', 'rev-parse', 'refs/buildbot/%s/release' %
                 self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..'
-                '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join(['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])),
         )
-
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                       ['64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                        '4423cdbcbb89c14e50dd5f4152415afd686c5241'])
+        self.expectLog('bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..'
+                       '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
+                       ['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])
 
         # do the poll
         self.poller.branches = True
@@ -666,34 +658,11 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'fa3ae8ed68e664d4db24798611b352e3c6509930..'
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
-                '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241']))
         )
-
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                       ['64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                        '4423cdbcbb89c14e50dd5f4152415afd686c5241'])
 
         # do the poll
         class TestCallable:
@@ -760,32 +729,10 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                 'refs/buildbot/%s/refs/pull/410/head' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..'
-                '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join(['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])),
         )
-
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        self.expectLog('bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..'
+                       '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
+                       ['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])
 
         def pullFilter(branch):
             """
@@ -827,8 +774,6 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
         self.patch(os, 'environ', {'ENVVAR': 'TRUE'})
         self.addGetProcessOutputExpectEnv({'ENVVAR': 'TRUE'})
 
-        # patch out getProcessOutput and getProcessOutputAndValue for the
-        # benefit of the _get_changes method
         self.expectCommands(
             gpo.Expect('git', 'init', '--bare', 'gitpoller-work'),
             gpo.Expect('git', 'fetch', self.REPOURL,
@@ -839,34 +784,11 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       'fa3ae8ed68e664d4db24798611b352e3c6509930..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
-                '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241'
-            ])),
         )
-
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                       ['64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                        '4423cdbcbb89c14e50dd5f4152415afd686c5241'])
 
         # do the poll
         self.poller.lastRev = {
@@ -904,6 +826,124 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
 
         return d
 
+    def expectTips(self, *tips):
+        # the for-each-ref listing the fetched branches
+        return gpo.Expect('git', 'for-each-ref',
+                          '--format=%(objectname) %(refname)',
+                          'refs/buildbot/%s' % self.REPOURL_QUOTED) \
+            .path('gitpoller-work') \
+            .stdout(''.join('%s refs/buildbot/%s/%s\n'
+                            % (rev, self.REPOURL_QUOTED, branch)
+                            for branch, rev in tips))
+
+    def test_poll_onlyChangedBranches_all(self):
+        self.expectCommands(
+            gpo.Expect('git', 'init', '--bare', 'gitpoller-work'),
+            gpo.Expect('git', 'fetch', '--prune', self.REPOURL,
+                       '+refs/heads/*:refs/buildbot/%s/*'
+                       % self.REPOURL_QUOTED)
+            .path('gitpoller-work'),
+            self.expectTips(
+                ('feature/x', '9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+                ('release', 'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5')),
+        )
+        # only master moved
+        self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930..'
+                       '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                       ['64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                        '4423cdbcbb89c14e50dd5f4152415afd686c5241'])
+
+        self.poller.branches = True
+        self.poller.onlyChangedBranches = True
+        self.poller.lastRev = {
+            'refs/heads/master': 'fa3ae8ed68e664d4db24798611b352e3c6509930',
+            'refs/heads/release': 'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
+            'refs/heads/deleted': '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+        }
+        d = self.poller.poll()
+
+        @d.addCallback
+        def cb(_):
+            self.assertAllCommandsRan()
+            lastRev = {
+                'refs/heads/feature/x':
+                '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
+                'refs/heads/master':
+                '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                'refs/heads/release':
+                'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
+            }
+            self.assertEqual(self.poller.lastRev, lastRev)
+            self.master.db.state.assertStateByClass(
+                name=self.REPOURL, class_name='GitPoller', lastRev=lastRev)
+            self.assertEqual([(ch['revision'], ch['branch'])
+                              for ch in self.changes_added], [
+                ('4423cdbcbb89c14e50dd5f4152415afd686c5241', 'master'),
+                ('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a', 'master'),
+            ])
+        return d
+
+    def test_poll_onlyChangedBranches_nothingNew(self):
+        self.expectCommands(
+            gpo.Expect('git', 'init', '--bare', 'gitpoller-work'),
+            gpo.Expect('git', 'fetch', '--prune', self.REPOURL,
+                       '+refs/heads/*:refs/buildbot/%s/*'
+                       % self.REPOURL_QUOTED)
+            .path('gitpoller-work'),
+            self.expectTips(
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241')),
+        )
+
+        self.poller.branches = True
+        self.poller.onlyChangedBranches = True
+        self.poller.lastRev = {
+            'refs/heads/master': '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+        }
+        d = self.poller.poll()
+
+        @d.addCallback
+        def cb(_):
+            # no git log is run
+            self.assertAllCommandsRan()
+            self.assertEqual(self.changes_added, [])
+        return d
+
+    def test_poll_onlyChangedBranches_list(self):
+        self.expectCommands(
+            gpo.Expect('git', 'init', '--bare', 'gitpoller-work'),
+            gpo.Expect('git', 'fetch', self.REPOURL,
+                       '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED,
+                       '+release:refs/buildbot/%s/release' % self.REPOURL_QUOTED,
+                       '+missing:refs/buildbot/%s/missing' % self.REPOURL_QUOTED)
+            .path('gitpoller-work'),
+            self.expectTips(
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+                ('release', '9118f4ab71963d23d02d4bdc54876ac8bf05acf2')),
+        )
+        self.expectLog('bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..'
+                       '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
+                       ['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])
+
+        self.poller.branches = ['master', 'release', 'missing']
+        self.poller.onlyChangedBranches = True
+        self.poller.lastRev = {
+            'master': '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+            'release': 'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
+        }
+        d = self.poller.poll()
+
+        @d.addCallback
+        def cb(_):
+            self.assertAllCommandsRan()
+            self.assertEqual(self.poller.lastRev, {
+                'master': '4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                'release': '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
+            })
+            self.assertEqual([ch['revision'] for ch in self.changes_added],
+                             ['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])
+        return d
+
     # We mock out base.PollingChangeSource.startService, since it calls
     # reactor.callWhenRunning, which leaves a dirty reactor if a synchronous
     # deferred is returned from a test method.
@@ -945,6 +985,11 @@ class TestGitPollerConstructor(unittest.TestCase, config.ConfigErrorsMixin):
                                      lambda: gitpoller.GitPoller("/tmp/git.git",
                                                                  fetch_refspec='not-supported'))
 
+    def test_onlyChangedBranches_compare(self):
+        self.assertNotEqual(
+            gitpoller.GitPoller("/tmp/git.git"),
+            gitpoller.GitPoller("/tmp/git.git", onlyChangedBranches=True))
+
     def test_oldPollInterval(self):
         poller = gitpoller.GitPoller("/tmp/git.git", pollinterval=10)
         self.assertEqual(poller.pollInterval, 10)
@@ -182,3 +182,39 @@ class TestHgPoller(gpo.GetProcessOutputMixin,
             self.assertEqual(change['revision'], '784bd')
             self.assertEqual(change['comments'], 'Comment for rev 5')
         d.addCallback(check_changes)
+
+    @defer.inlineCallbacks
+    def test_poll_failed_details(self):
+        # the details of the second new revision cannot be read: the change
+        # of the first is added, and the poller stays at it
+        template = ('--template={date|hgdate}' + os.linesep + '{author}' +
+                    os.linesep + "{files % '{file}" + os.pathsep + "'}" +
+                    os.linesep + '{desc|strip}')
+        self.expectCommands(
+            gpo.Expect('hg', 'pull', '-b', 'default',
+                       'ssh://example.com/foo/baz')
+            .path('/some/dir'),
+            gpo.Expect('hg', 'heads', 'default', '--template={rev}' + os.linesep)
+            .path('/some/dir').stdout('6' + os.linesep),
+            gpo.Expect('hg', 'log', '-b', 'default', '-r', '5:6',
+                       '--template={rev}:{node}\\n')
+            .path('/some/dir').stdout(os.linesep.join(['5:784bd', '6:0af2c',
+                                                       ''])),
+            gpo.Expect('hg', 'log', '-r', '784bd', template)
+            .path('/some/dir').stdout(os.linesep.join([
+                '1273258009.0 -7200',
+                'Joe Test <joetest@example.org>',
+                'file1 file2',
+                'Comment for rev 5',
+                ''])),
+            gpo.Expect('hg', 'log', '-r', '0af2c', template)
+            .path('/some/dir').stderr('abort: unknown revision'),
+        )
+
+        yield self.poller._setCurrentRev(4)
+
+        yield self.poller.poll()
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        self.assertEqual([ch['revision'] for ch in self.changes_added],
+                         ['784bd'])
+        yield self.check_current_rev(5)(None)
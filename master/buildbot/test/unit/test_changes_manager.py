@@ -15,8 +15,12 @@
 
 import mock
 
+from buildbot.changes import base
 from buildbot.changes import manager
+from buildbot.test.util import compat
 from twisted.application import service
+from twisted.internet import defer
+from twisted.internet import task
 from twisted.trial import unittest
 
 
@@ -24,12 +28,35 @@ class FakeChangeSource(service.Service):
     pass
 
 
+class FakePoller(base.PollingChangeSource):
+
+    def __init__(self, clock, name, pollInterval=10, pollAtLaunch=False):
+        base.PollingChangeSource.__init__(self, name=name,
+                                          pollInterval=pollInterval,
+                                          pollAtLaunch=pollAtLaunch)
+        self.clock = clock
+        self.polls = []
+        # 'changes', 'fail', a Deferred, or None for an idle poll
+        self.result = None
+        self.running = 1
+
+    def poll(self):
+        self.polls.append(self.clock.seconds())
+        if self.result == 'changes':
+            self.lastPollChanges += 1
+        elif self.result == 'fail':
+            raise RuntimeError('poll failed')
+        elif self.result is not None:
+            return self.result
+
+
 class TestChangeManager(unittest.TestCase):
 
     def setUp(self):
         self.master = mock.Mock()
         self.cm = manager.ChangeManager(self.master)
         self.new_config = mock.Mock()
+        self.new_config.pollScheduler = {}
 
     def make_sources(self, n):
         for i in range(n):
@@ -62,3 +89,179 @@ class TestChangeManager(unittest.TestCase):
             self.assertIdentical(src1.parent, None)
             self.assertIdentical(src1.master, None)
         return d
+
+    def test_reconfigService_pollScheduler(self):
+        self.new_config.change_sources = []
+        self.new_config.pollScheduler = dict(maxConcurrentPolls=5)
+
+        d = self.cm.reconfigService(self.new_config)
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.cm.pollScheduler.maxConcurrentPolls, 5)
+        return d
+
+
+class TestPollScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.scheduler = manager.PollScheduler(_reactor=self.clock)
+
+    def makePoller(self, name, **kwargs):
+        poller = FakePoller(self.clock, name, **kwargs)
+        self.scheduler.addSource(poller)
+        return poller
+
+    def test_interval(self):
+        p1 = self.makePoller('p1')
+        p2 = self.makePoller('p2', pollInterval=4)
+        self.clock.pump([1] * 25)
+        self.assertEqual(p1.polls, [10, 20])
+        self.assertEqual(p2.polls, [4, 8, 12, 16, 20, 24])
+
+    def test_pollAtLaunch(self):
+        p = self.makePoller('p', pollAtLaunch=True)
+        self.clock.pump([1] * 25)
+        self.assertEqual(p.polls, [0, 10, 20])
+
+    def test_no_pollInterval(self):
+        p = self.makePoller('p', pollInterval=0)
+        self.clock.pump([1] * 25)
+        self.assertEqual(p.polls, [0])
+        self.assertEqual(self.scheduler.getTimings(), {})
+
+    def test_not_running(self):
+        p = FakePoller(self.clock, 'p')
+        p.running = 0
+        self.scheduler.addSource(p)
+        self.clock.pump([1] * 25)
+        self.assertEqual(p.polls, [])
+
+    def test_jitter(self):
+        self.scheduler.configure(jitter=0.5)
+        pollers = [self.makePoller('p%d' % i) for i in range(20)]
+        self.clock.pump([0.5] * 30)
+        first = [p.polls[0] for p in pollers]
+        self.assertTrue(min(first) >= 5)
+        self.assertTrue(max(first) <= 15)
+        self.assertTrue(len(set(first)) > 1)
+
+    def test_maxConcurrentPolls(self):
+        self.scheduler.configure(maxConcurrentPolls=1)
+        p1 = self.makePoller('p1')
+        p2 = self.makePoller('p2')
+        p1.result = defer.Deferred()
+        p2.result = defer.Deferred()
+        self.clock.advance(10)
+        self.assertEqual((p1.polls, p2.polls), ([10], []))
+
+        self.clock.advance(3)
+        p1.result.callback(None)
+        self.assertEqual((p1.polls, p2.polls), ([10], [13]))
+        self.assertEqual(self.scheduler.getTimings()['p2']['wait'], 3)
+
+    def test_maxConcurrentPolls_changed_sources_first(self):
+        self.scheduler.configure(maxConcurrentPolls=1)
+        p1 = self.makePoller('p1')
+        p2 = self.makePoller('p2')
+        p3 = self.makePoller('p3')
+        p3.result = 'changes'
+        self.clock.advance(10)
+
+        # p1 holds up the next polls, and p3 goes before p2 once it is done,
+        # since it found changes
+        p1.result = defer.Deferred()
+        p2.result = defer.Deferred()
+        p3.result = defer.Deferred()
+        self.clock.advance(10)
+        self.assertEqual((p1.polls, p2.polls, p3.polls),
+                         ([10, 20], [10], [10]))
+        self.clock.advance(1)
+        p1.result.callback(None)
+        self.assertEqual((p2.polls, p3.polls), ([10], [10, 21]))
+        self.clock.advance(1)
+        p3.result.callback(None)
+        self.assertEqual((p2.polls, p3.polls), ([10, 22], [10, 21]))
+        self.assertEqual(self.scheduler.getTimings()['p2']['wait'], 2)
+
+    def test_idleBackoff(self):
+        self.scheduler.configure(idleBackoff=2, maxBackoff=4)
+        p = self.makePoller('p')
+        self.clock.pump([1] * 111)
+        self.assertEqual(p.polls, [10, 30, 70, 110])
+        self.assertEqual(self.scheduler.getTimings()['p']['interval'], 40)
+
+        # finding changes returns to the poll interval
+        p.result = 'changes'
+        self.clock.pump([1] * 40)
+        self.assertEqual(p.polls, [10, 30, 70, 110, 150])
+        self.assertEqual(self.scheduler.getTimings()['p']['interval'], 10)
+
+    @compat.usesFlushLoggedErrors
+    def test_errorBackoff(self):
+        self.scheduler.configure(errorBackoff=3)
+        p = self.makePoller('p')
+        p.result = 'fail'
+        self.clock.pump([1] * 41)
+        self.assertEqual(p.polls, [10, 40])
+        self.assertEqual(self.scheduler.getTimings()['p']['failures'], 2)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 2)
+
+    def test_pollTimeout(self):
+        self.scheduler.configure(maxConcurrentPolls=1)
+        p1 = self.makePoller('p1')
+        p2 = self.makePoller('p2', pollInterval=15)
+        p1.result = hung = defer.Deferred()
+        self.clock.pump([1] * 29)
+        # p1 hangs, holding up p2 until it times out after two intervals
+        self.assertEqual((p1.polls, p2.polls), ([10], []))
+        self.clock.advance(1)
+        self.assertEqual((p1.polls, p2.polls), ([10], [30]))
+        self.assertEqual(self.scheduler.getTimings()['p1']['failures'], 1)
+
+        # p1 is polled again once its poll finishes
+        self.clock.advance(5)
+        p1.result = None
+        hung.callback(None)
+        self.clock.pump([1] * 11)
+        self.assertEqual((p1.polls, p2.polls), ([10, 45], [30, 45]))
+        self.assertEqual(self.scheduler._active, 0)
+        self.assertEqual(self.scheduler.getTimings()['p1']['failures'], 1)
+
+    def test_pollTimeout_configured(self):
+        self.scheduler.configure(maxConcurrentPolls=1, pollTimeout=5)
+        p1 = self.makePoller('p1')
+        p2 = self.makePoller('p2')
+        p1.result = defer.Deferred()
+        self.clock.advance(10)
+        self.assertEqual(p2.polls, [])
+        self.clock.advance(5)
+        self.assertEqual(p2.polls, [15])
+
+    def test_removeSource(self):
+        p = self.makePoller('p')
+        self.clock.advance(10)
+        self.scheduler.removeSource(p)
+        self.clock.pump([1] * 25)
+        self.assertEqual(p.polls, [10])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_removeSource_polling(self):
+        p = self.makePoller('p')
+        p.result = d = defer.Deferred()
+        self.clock.advance(10)
+        self.scheduler.removeSource(p)
+        d.callback(None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_getTimings(self):
+        p = self.makePoller('p')
+        p.result = d = defer.Deferred()
+        self.clock.advance(10)
+        self.clock.advance(2)
+        d.callback(None)
+        self.assertEqual(self.scheduler.getTimings(), {
+            'p': dict(polls=1, failures=0, interval=10, lastStarted=10,
+                      wait=0, duration=2),
+        })
@@ -217,6 +217,9 @@ class TestP4Poller(changesource.ChangeSourceMixin,
         def check(_):
             # check that 2 was processed OK
             self.assertEquals(self.changesource.last_change, 2)
+            self.assertTrue(self.changes_added)
+            self.assertEqual(set(c['revision'] for c in self.changes_added),
+                             set(['2']))
             self.assertAllCommandsRan()
         return d
 
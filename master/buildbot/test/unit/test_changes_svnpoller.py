@@ -15,14 +15,18 @@
 
 from __future__ import with_statement
 
+import mock
 import os
-import xml.dom.minidom
+import xml.parsers.expat
 
 from buildbot.changes import svnpoller
 from buildbot.test.util import changesource
 from buildbot.test.util import compat
 from buildbot.test.util import gpo
 from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet import reactor
+from twisted.python import failure
 from twisted.trial import unittest
 
 # this is the output of "svn info --xml
@@ -239,9 +243,11 @@ def make_changes_output(maxrevision):
 
 
 def make_logentry_elements(maxrevision):
-    "return the corresponding logentry elements for the given revisions"
-    doc = xml.dom.minidom.parseString(make_changes_output(maxrevision))
-    return doc.getElementsByTagName("logentry")
+    "return the corresponding log entries for the given revisions"
+    logentries = []
+    parser = svnpoller._SVNLogParser(logentries.append)
+    parser.feed(make_changes_output(maxrevision), final=True)
+    return logentries
 
 
 def split_file(path):
@@ -259,6 +265,9 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
 
     def setUp(self):
         self.setUpGetProcessOutput()
+        self.expected_logs = []
+        self.log_transports = []
+        self.patch(reactor, 'spawnProcess', self.spawnProcess)
         return self.setUpChangeSource()
 
     def tearDown(self):
@@ -273,6 +282,40 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         self.expectCommands(
             gpo.Expect('svn', command).stdout(result))
 
+    def expectLog(self, output, password='bbrocks', stderr=''):
+        """
+        Expect the poller's svn log, printing C{output} and C{stderr}.
+        """
+        self.expected_logs.append((self.makeLogArgs(password), output,
+                                   stderr))
+
+    def spawnProcess(self, pp, executable, args, env=None):
+        if not self.expected_logs:
+            self.fail("got command %s when no further logs were expected"
+                      % (args,))
+        expected_args, output, stderr = self.expected_logs.pop(0)
+        self.assertEqual((executable, args), ('svn', expected_args))
+        transport = mock.Mock()
+        self.log_transports.append(transport)
+        pp.makeConnection(transport)
+        # deliver the output in small pieces, until the process is stopped
+        for i in range(0, len(output), 7):
+            if transport.signalProcess.called:
+                break
+            pp.outReceived(output[i:i + 7])
+        if stderr:
+            pp.errReceived(stderr)
+        if transport.signalProcess.called:
+            reason = error.ProcessTerminated(signal=15)
+        else:
+            reason = error.ProcessDone(0)
+        pp.processEnded(failure.Failure(reason))
+
+    def assertAllCommandsRan(self):
+        gpo.GetProcessOutputMixin.assertAllCommandsRan(self)
+        self.assertEqual(self.expected_logs, [],
+                         "assert all expected logs were run")
+
     # tests
     def test_describe(self):
         s = self.attachSVNPoller('file://')
@@ -319,6 +362,30 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         # no need for elaborate assertions here; this is minidom's logic
         self.assertEqual(len(entries), 4)
 
+    def test_log_parsing_details(self):
+        s = self.attachSVNPoller('file:///foo')
+        entries = s.parse_logs(make_changes_output(2))
+        self.assertEqual(entries[0], dict(
+            revision='2', author='warner', msg='make_branch',
+            paths=[dict(kind='', action='A', path='/sample/branch')]))
+        self.assertEqual([p['path'] for p in entries[1]['paths']],
+                         ['/sample', '/sample/trunk',
+                          '/sample/trunk/subdir/subdir.c',
+                          '/sample/trunk/main.c', '/sample/trunk/version.c',
+                          '/sample/trunk/subdir'])
+
+    def test_log_parsing_missing_elements(self):
+        s = self.attachSVNPoller('file:///foo')
+        entries = s.parse_logs(changes_output_template %
+                               '<logentry revision="7"><msg></msg></logentry>')
+        self.assertEqual(entries, [dict(revision='7', author=None, msg='',
+                                        paths=None)])
+
+    def test_log_parsing_error(self):
+        s = self.attachSVNPoller('file:///foo')
+        self.assertRaises(xml.parsers.expat.ExpatError,
+                          lambda: s.parse_logs('<log><logentry></log>'))
+
     def test_get_new_logentries(self):
         s = self.attachSVNPoller('file:///foo')
         entries = make_logentry_elements(4)
@@ -388,13 +455,13 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
             args.append('--password=' + password)
         return gpo.Expect(*args)
 
-    def makeLogExpect(self, password='bbrocks'):
+    def makeLogArgs(self, password='bbrocks'):
         args = ['svn', 'log', '--xml', '--verbose', '--non-interactive',
                 '--username=dustin']
         if password is not None:
             args.append('--password=' + password)
         args.extend(['--limit=100', sample_base])
-        return gpo.Expect(*args)
+        return args
 
     def test_create_changes_overriden_project(self):
         def custom_split_file(path):
@@ -436,11 +503,9 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
 
         self.expectCommands(
             self.makeInfoExpect().stdout(sample_info_output),
-            self.makeLogExpect().stdout(make_changes_output(1)),
-            self.makeLogExpect().stdout(make_changes_output(1)),
-            self.makeLogExpect().stdout(make_changes_output(2)),
-            self.makeLogExpect().stdout(make_changes_output(4)),
         )
+        for maxrevision in 1, 1, 2, 4:
+            self.expectLog(make_changes_output(maxrevision))
         # fire it the first time; it should do nothing
         d.addCallback(lambda _: s.poll())
 
@@ -498,17 +563,81 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
 
         return d
 
+    def test_poll_stops_at_last_change(self):
+        s = self.attachSVNPoller(sample_base, split_file=split_file,
+                                 svnuser='dustin', svnpasswd='bbrocks')
+        s._prefix = "sample"
+        s.last_change = 2
+        self.expectLog(make_changes_output(6))
+        d = s.poll()
+
+        @d.addCallback
+        def check(_):
+            self.assertAllCommandsRan()
+            # the log is read down to r2, and svn is stopped
+            self.log_transports[0].signalProcess.assert_called_with('TERM')
+            self.assertEqual([c['revision'] for c in self.changes_added],
+                             ['3', '4', '6'])
+            self.assertEqual(s.last_change, 6)
+        return d
+
+    def test_poll_first_reads_newest(self):
+        s = self.attachSVNPoller(sample_base, split_file=split_file,
+                                 svnuser='dustin', svnpasswd='bbrocks')
+        s._prefix = "sample"
+        self.expectLog(make_changes_output(6))
+        d = s.poll()
+
+        @d.addCallback
+        def check(_):
+            self.log_transports[0].signalProcess.assert_called_with('TERM')
+            self.assertEqual(self.changes_added, [])
+            self.assertEqual(s.last_change, 6)
+        return d
+
+    def test_poll_to_end_of_log(self):
+        s = self.attachSVNPoller(sample_base, split_file=split_file,
+                                 svnuser='dustin', svnpasswd='bbrocks')
+        s._prefix = "sample"
+        s.last_change = 1
+        # a log that does not reach the last change
+        self.expectLog(changes_output_template %
+                       ''.join(reversed(sample_logentries[1:4])))
+        d = s.poll()
+
+        @d.addCallback
+        def check(_):
+            self.assertFalse(self.log_transports[0].signalProcess.called)
+            self.assertEqual([c['revision'] for c in self.changes_added],
+                             ['2', '3', '4'])
+        return d
+
+    @compat.usesFlushLoggedErrors
+    def test_poll_bad_xml(self):
+        s = self.attachSVNPoller(sample_base, split_file=split_file,
+                                 svnuser='dustin', svnpasswd='bbrocks')
+        s._prefix = "sample"
+        s.last_change = 2
+        self.expectLog(make_changes_output(4).replace('</logentry>',
+                                                      '</entry>', 1))
+        d = s.poll()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(
+                len(self.flushLoggedErrors(xml.parsers.expat.ExpatError)), 1)
+            self.assertEqual(self.changes_added, [])
+            self.assertEqual(s.last_change, 2)
+        return d
+
     def test_poll_empty_password(self):
         s = self.attachSVNPoller(sample_base, split_file=split_file,
                                  svnuser='dustin', svnpasswd='')
 
         self.expectCommands(
             self.makeInfoExpect(password="").stdout(sample_info_output),
-            self.makeLogExpect(password="").stdout(make_changes_output(1)),
-            self.makeLogExpect(password="").stdout(make_changes_output(1)),
-            self.makeLogExpect(password="").stdout(make_changes_output(2)),
-            self.makeLogExpect(password="").stdout(make_changes_output(4)),
         )
+        self.expectLog(make_changes_output(1), password="")
         s.poll()
 
     def test_poll_no_password(self):
@@ -517,11 +646,8 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
 
         self.expectCommands(
             self.makeInfoExpect(password=None).stdout(sample_info_output),
-            self.makeLogExpect(password=None).stdout(make_changes_output(1)),
-            self.makeLogExpect(password=None).stdout(make_changes_output(1)),
-            self.makeLogExpect(password=None).stdout(make_changes_output(2)),
-            self.makeLogExpect(password=None).stdout(make_changes_output(4)),
         )
+        self.expectLog(make_changes_output(1), password=None)
         s.poll()
 
     @compat.usesFlushLoggedErrors
@@ -546,8 +672,7 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
                                  svnuser='dustin', svnpasswd='bbrocks')
         s._prefix = "abc"  # skip the get_prefix stuff
 
-        self.expectCommands(
-            self.makeLogExpect().stderr("some error"))
+        self.expectLog('', stderr="some error")
         d = s.poll()
 
         @d.addCallback
@@ -25,12 +25,14 @@ from buildbot import buildslave
 from buildbot import config
 from buildbot import interfaces
 from buildbot import locks
+from buildbot import notifications
 from buildbot import revlinks
 from buildbot.changes import base as changes_base
 from buildbot.process import factory
 from buildbot.process import properties
 from buildbot.schedulers import base as schedulers_base
 from buildbot.status import base as status_base
+from buildbot.status import buildhistory
 from buildbot.test.util import compat
 from buildbot.test.util import dirs
 from buildbot.test.util.config import ConfigErrorsMixin
@@ -51,9 +53,13 @@ global_defaults = dict(
     logCompressionMethod='bz2',
     logMaxTailSize=None,
     logMaxSize=None,
+    buildHistory=None,
     properties=properties.Properties(),
     mergeRequests=None,
     prioritizeBuilders=None,
+    distributorConcurrency=1,
+    pollScheduler=dict(maxConcurrentPolls=None, jitter=0.0, idleBackoff=1.0,
+                       errorBackoff=1.0, maxBackoff=8.0, pollTimeout=None),
     protocols={},
     slavePortnum=None,
     multiMaster=False,
@@ -173,6 +179,7 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
             db=dict(
                 db_url='sqlite:///state.sqlite',
                 db_poll_interval=None),
+            notificationChannel=None,
             metrics=None,
             caches=dict(Changes=10, Builds=15),
             schedulers={},
@@ -428,7 +435,22 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_logCompressionMethod_invalid(self):
         self.cfg.load_global(self.filename,
                              dict(logCompressionMethod='foo'))
-        self.assertConfigError(self.errors, "must be 'bz2' or 'gz'")
+        self.assertConfigError(self.errors, "must be 'bz2', 'gz' or 'framed'")
+
+    def test_load_global_logCompressionMethod_framed(self):
+        self.do_test_load_global(dict(logCompressionMethod='framed'),
+                                 logCompressionMethod='framed')
+
+    def test_load_global_buildHistory(self):
+        history = buildhistory.SQLBuildHistory()
+        self.do_test_load_global(dict(buildHistory=history),
+                                 buildHistory=history)
+
+    def test_load_global_buildHistory_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(buildHistory='sqlite:///x'))
+        self.assertConfigError(self.errors,
+                               "c['buildHistory'] must provide IBuildHistory")
 
     def test_load_global_codebaseGenerator(self):
         func = lambda _: "dummy"
@@ -483,6 +505,47 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                              dict(prioritizeBuilders='yes'))
         self.assertConfigError(self.errors, "must be a callable")
 
+    def test_load_global_distributorConcurrency(self):
+        self.do_test_load_global(dict(distributorConcurrency=4),
+                                 distributorConcurrency=4)
+
+    def test_load_global_distributorConcurrency_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(distributorConcurrency=0))
+        self.assertConfigError(self.errors, "must be a positive int")
+
+    def test_load_global_pollScheduler(self):
+        self.do_test_load_global(
+            dict(pollScheduler=dict(maxConcurrentPolls=10, jitter=0.2)),
+            pollScheduler=dict(maxConcurrentPolls=10, jitter=0.2,
+                               idleBackoff=1.0, errorBackoff=1.0,
+                               maxBackoff=8.0, pollTimeout=None))
+
+    def test_load_global_pollScheduler_invalid_concurrency(self):
+        self.cfg.load_global(self.filename,
+                             dict(pollScheduler=dict(maxConcurrentPolls=0)))
+        self.assertConfigError(self.errors, "must be None or a positive int")
+
+    def test_load_global_pollScheduler_invalid_jitter(self):
+        self.cfg.load_global(self.filename,
+                             dict(pollScheduler=dict(jitter=1)))
+        self.assertConfigError(self.errors, "less than 1")
+
+    def test_load_global_pollScheduler_invalid_backoff(self):
+        self.cfg.load_global(self.filename,
+                             dict(pollScheduler=dict(idleBackoff=0.5)))
+        self.assertConfigError(self.errors, "['idleBackoff'] must be a number")
+
+    def test_load_global_pollScheduler_invalid_timeout(self):
+        self.cfg.load_global(self.filename,
+                             dict(pollScheduler=dict(pollTimeout=0)))
+        self.assertConfigError(self.errors, "must be None or a positive number")
+
+    def test_load_global_pollScheduler_unknown_key(self):
+        self.cfg.load_global(self.filename,
+                             dict(pollScheduler=dict(interval=3)))
+        self.assertConfigError(self.errors, "unknown c['pollScheduler'] keys")
+
     def test_load_global_slavePortnum_int(self):
         self.do_test_load_global(dict(slavePortnum=123),
                                  protocols={'pb': {'port': 'tcp:123'}})
@@ -569,6 +632,26 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                          dict(db=dict(db_url='abcd', db_poll_interval='ten')))
         self.assertConfigError(self.errors, "must be an int")
 
+    def test_load_db_notificationChannel(self):
+        channel = notifications.LocalNotificationChannel()
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_poll_interval=600),
+                              notificationChannel=channel))
+        self.assertResults(notificationChannel=channel)
+
+    def test_load_db_notificationChannel_invalid(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_poll_interval=600),
+                              notificationChannel='tcp:9990'))
+        self.assertConfigError(self.errors,
+                               "must provide INotificationChannel")
+
+    def test_load_db_notificationChannel_no_polling(self):
+        channel = notifications.LocalNotificationChannel()
+        self.cfg.load_db(self.filename, dict(notificationChannel=channel))
+        self.assertConfigError(self.errors,
+                               "requires c['db']['db_poll_interval']")
+
     def test_load_metrics_defaults(self):
         self.cfg.load_metrics(self.filename, {})
         self.assertResults(metrics=None)
@@ -16,6 +16,7 @@
 import datetime
 
 from buildbot.db import buildrequests
+from buildbot.db import buildsets
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import connector_component
@@ -23,6 +24,7 @@ from buildbot.test.util import db
 from buildbot.test.util import interfaces
 from buildbot.util import UTC
 from buildbot.util import epoch2datetime
+from twisted.internet import defer
 from twisted.internet import task
 from twisted.trial import unittest
 
@@ -139,6 +141,38 @@ class Tests(interfaces.InterfaceTests):
             claimed=False,
             expected=[52])
 
+    def test_getBuildRequests_unclaimed_min_brid(self):
+        return self.do_test_getBuildRequests_claim_args(
+            claimed=False, min_brid=52,
+            expected=[52])
+
+    def test_getBuildRequests_min_brid(self):
+        return self.do_test_getBuildRequests_claim_args(
+            min_brid=51,
+            expected=[51, 52, 53])
+
+    def test_listUnclaimedBuildRequests(self):
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=50, buildsetid=self.BSID,
+                                buildername='bbb'),
+            fakedb.BuildRequestClaim(brid=50, objectid=self.MASTER_ID,
+                                     claimed_at=self.CLAIMED_AT_EPOCH),
+            fakedb.BuildRequest(id=52, buildsetid=self.BSID,
+                                buildername='bbb'),
+            fakedb.BuildRequest(id=53, buildsetid=self.BSID,
+                                buildername='bbb', complete=1),
+            fakedb.BuildRequest(id=54, buildsetid=self.BSID,
+                                buildername='ccc'),
+        ])
+        d.addCallback(lambda _:
+                      self.db.buildrequests.listUnclaimedBuildRequests())
+
+        def check(brlist):
+            self.assertEqual(sorted(brlist),
+                             [(52, self.BSID, 'bbb'), (54, self.BSID, 'ccc')])
+        d.addCallback(check)
+        return d
+
     def do_test_getBuildRequests_buildername_arg(self, **kwargs):
         expected = kwargs.pop('expected')
         d = self.insertTestData([
@@ -444,6 +478,42 @@ class Tests(interfaces.InterfaceTests):
         d.addCallback(check)
         return d
 
+    def test_claimBuildRequestGroups(self):
+        clock = task.Clock()
+        clock.advance(1300305712)
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=id, buildsetid=self.BSID)
+            for id in range(44, 50)
+        ] + [
+            fakedb.BuildRequestClaim(brid=46, objectid=self.OTHER_MASTER_ID,
+                                     claimed_at=1300103810),
+        ])
+        d.addCallback(lambda _:
+                      self.db.buildrequests.claimBuildRequestGroups(
+                          [[44, 45], [46, 47], [48]], _reactor=clock))
+
+        def check_conflicts(conflicts):
+            # only the brid claimed elsewhere is reported, and only its group
+            # is not claimed
+            self.assertEqual(conflicts, set([46]))
+        d.addCallback(check_conflicts)
+        d.addCallback(lambda _:
+                      self.db.buildrequests.getBuildRequests())
+
+        def check(results):
+            self.assertEqual(
+                sorted([(r['brid'], r['claimed'], r['mine'])
+                        for r in results]),
+                [(44, True, True), (45, True, True), (46, True, False),
+                 (47, False, False), (48, True, True), (49, False, False)])
+        d.addCallback(check)
+        return d
+
+    def test_claimBuildRequestGroups_empty(self):
+        d = self.db.buildrequests.claimBuildRequestGroups([])
+        d.addCallback(self.assertEqual, set())
+        return d
+
     def test_claimBuildRequests_sequential(self):
         now = 120350934
         clock = task.Clock()
@@ -630,6 +700,30 @@ class Tests(interfaces.InterfaceTests):
              (46, True, 7, epoch2datetime(1300305712)), ],
             brids=[44, 45, 46])
 
+    @defer.inlineCallbacks
+    def test_completeBuildRequests_buildset_counts(self):
+        clock = task.Clock()
+        yield self.insertTestData([
+            fakedb.Buildset(id=self.BSID2, sourcestampsetid=234,
+                            requests_total=3, requests_complete=0,
+                            requests_failed=0),
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID2),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID2),
+            fakedb.BuildRequest(id=46, buildsetid=self.BSID2),
+            # a buildset from before the counts were kept
+            fakedb.BuildRequest(id=47, buildsetid=self.BSID),
+        ])
+        yield self.db.buildrequests.completeBuildRequests([44, 45, 47], 0,
+                                                          _reactor=clock)
+        counts = yield self.db.buildsets.getBuildsetRequestCounts(self.BSID2)
+        self.assertEqual(counts, (3, 2, 0))
+        yield self.db.buildrequests.completeBuildRequests([46], 2,
+                                                          _reactor=clock)
+        counts = yield self.db.buildsets.getBuildsetRequestCounts(self.BSID2)
+        self.assertEqual(counts, (3, 3, 1))
+        counts = yield self.db.buildsets.getBuildsetRequestCounts(self.BSID)
+        self.assertEqual(counts, None)
+
     def test_completeBuildRequests_already_completed(self):
         return self.do_test_completeBuildRequests([
             fakedb.BuildRequest(id=44, buildsetid=self.BSID,
@@ -744,8 +838,26 @@ class TestRealDB(unittest.TestCase,
         def finish_setup(_):
             self.db.buildrequests = \
                 buildrequests.BuildRequestsConnectorComponent(self.db)
+            self.db.buildsets = \
+                buildsets.BuildsetsConnectorComponent(self.db)
         d.addCallback(lambda _: self.setUpTests())
         return d
 
     def tearDown(self):
         return self.tearDownConnectorComponent()
+
+    @db.skip_for_dialect('mysql')
+    @defer.inlineCallbacks
+    def test_claimBuildRequestGroups_conflict_on_insert(self):
+        # the groups overlap, so the conflict is only found when the claims
+        # are inserted; the groups are then claimed one at a time
+        yield self.insertTestData([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=46, buildsetid=self.BSID),
+        ])
+        conflicts = yield self.db.buildrequests.claimBuildRequestGroups(
+            [[44], [44, 45], [46]])
+        self.assertEqual(conflicts, set([44]))
+        results = yield self.db.buildrequests.getBuildRequests(claimed=True)
+        self.assertEqual(sorted(r['brid'] for r in results), [44, 46])
@@ -167,6 +167,40 @@ class TestBuildsetsConnectorComponent(
         "returns an empty dict even if no such buildset exists"
         return self.do_test_getBuildsetProperties(91, [], dict())
 
+    def test_getBuildsetRequestCounts(self):
+        d = self.db.buildsets.addBuildset(sourcestampsetid=234,
+                                          reason='because', properties={},
+                                          builderNames=['a', 'b'])
+        d.addCallback(lambda (bsid, brids):
+                      self.db.buildsets.getBuildsetRequestCounts(bsid))
+
+        def check(counts):
+            self.assertEqual(counts, (2, 0, 0))
+        d.addCallback(check)
+        return d
+
+    def test_getBuildsetRequestCounts_uncounted(self):
+        "returns None for buildsets added before the requests were counted"
+        d = self.insertTestData([
+            fakedb.Buildset(id=91, sourcestampsetid=234, complete=0,
+                            results=-1, submitted_at=0),
+        ])
+        d.addCallback(lambda _:
+                      self.db.buildsets.getBuildsetRequestCounts(91))
+
+        def check(counts):
+            self.assertEqual(counts, None)
+        d.addCallback(check)
+        return d
+
+    def test_getBuildsetRequestCounts_nosuch(self):
+        d = self.db.buildsets.getBuildsetRequestCounts(91)
+
+        def check(counts):
+            self.assertEqual(counts, None)
+        d.addCallback(check)
+        return d
+
     def test_getBuildset_incomplete_None(self):
         d = self.insertTestData([
             fakedb.Buildset(id=91, sourcestampsetid=234, complete=0,
@@ -235,6 +269,41 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_getBuildsetsByIds(self):
+        yield self.insertTestData([
+            fakedb.Buildset(id=91, sourcestampsetid=234, reason='r1'),
+            fakedb.Buildset(id=92, sourcestampsetid=234, reason='r2'),
+            fakedb.Buildset(id=93, sourcestampsetid=234, reason='r3'),
+        ])
+        bsdicts = yield self.db.buildsets.getBuildsetsByIds([91, 93, 94])
+        self.assertEqual(sorted(bsdicts), [91, 93])
+        self.assertEqual((bsdicts[91]['bsid'], bsdicts[91]['reason']),
+                         (91, 'r1'))
+        self.assertEqual((bsdicts[93]['bsid'], bsdicts[93]['reason']),
+                         (93, 'r3'))
+
+    @defer.inlineCallbacks
+    def test_getBuildsetsProperties(self):
+        yield self.insertTestData([
+            fakedb.Buildset(id=91, sourcestampsetid=234),
+            fakedb.Buildset(id=92, sourcestampsetid=234),
+            fakedb.BuildsetProperty(buildsetid=91, property_name='prop1',
+                                    property_value='["one", "fake1"]'),
+            fakedb.BuildsetProperty(buildsetid=91, property_name='prop2',
+                                    property_value='["two", "fake2"]'),
+        ])
+        self.db.buildsets.getBuildsetProperties.cache.put = put = \
+            mock.Mock()
+        props = yield self.db.buildsets.getBuildsetsProperties([91, 92, 93])
+        self.assertEqual(props, {
+            91: dict(prop1=("one", "fake1"), prop2=("two", "fake2")),
+            92: {},
+            93: {},
+        })
+        self.assertEqual(sorted(c[0][0] for c in put.call_args_list),
+                         [91, 92, 93])
+
     def insert_test_getBuildsets_data(self):
         return self.insertTestData([
             fakedb.Buildset(id=91, sourcestampsetid=234, complete=0,
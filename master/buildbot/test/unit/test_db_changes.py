@@ -383,6 +383,40 @@ class TestChangesConnectorComponent(
         d.addCallback(check_change_users)
         return d
 
+    @defer.inlineCallbacks
+    def test_addChanges(self):
+        yield self.insertTestData([
+            fakedb.User(uid=1, identifier="one"),
+        ])
+        changeids = yield self.db.changes.addChanges([
+            dict(author=u'dustin', files=[u'a', u'b'], comments=u'one',
+                 revision=u'1', when_timestamp=epoch2datetime(266738400),
+                 branch=u'master', properties={u'x': (1, 'Change')}),
+            dict(author=u'tom', files=None, comments=u'two',
+                 revision=u'2', when_timestamp=epoch2datetime(266738401),
+                 uid=1),
+            dict(author=u'dustin', files=[u'c'], comments=u'three',
+                 revision=u'3', when_timestamp=epoch2datetime(266738402),
+                 properties={u'x': (3, 'Change')}),
+        ])
+        self.assertEqual(changeids, [1, 2, 3])
+
+        chdicts = yield self.db.changes.getChangesRange(1, 10)
+        self.assertEqual([(ch['changeid'], ch['revision'], ch['author'],
+                           sorted(ch['files']), ch['properties'])
+                          for ch in chdicts], [
+            (1, u'1', u'dustin', [u'a', u'b'], {u'x': (1, u'Change')}),
+            (2, u'2', u'tom', [], {}),
+            (3, u'3', u'dustin', [u'c'], {u'x': (3, u'Change')}),
+        ])
+        uids = yield self.db.changes.getChangeUids(2)
+        self.assertEqual(uids, [1])
+
+    def test_addChanges_empty(self):
+        d = self.db.changes.addChanges([])
+        d.addCallback(self.assertEqual, [])
+        return d
+
     def test_getChangeUids_missing(self):
         d = self.db.changes.getChangeUids(1)
 
@@ -556,3 +590,33 @@ class TestChangesConnectorComponent(
                              {'notest': ('no', 'Change')})
         d.addCallback(check)
         return d
+
+    @defer.inlineCallbacks
+    def test_getChangesRange(self):
+        yield self.insertTestData([
+            fakedb.Change(changeid=8),
+            fakedb.Change(changeid=10),
+        ] + self.change13_rows + self.change14_rows)
+
+        chdicts = yield self.db.changes.getChangesRange(9, 3)
+        self.assertEqual([c['changeid'] for c in chdicts], [10, 13, 14])
+        self.assertEqual(chdicts[1]['files'],
+                         ['master/README.txt', 'slave/README.txt'])
+        self.assertEqual(chdicts[1]['properties'],
+                         {'notest': ('no', 'Change')})
+        self.assertEqual(chdicts[2], self.change14_dict)
+
+        chdicts = yield self.db.changes.getChangesRange(8, 2)
+        self.assertEqual([c['changeid'] for c in chdicts], [8, 10])
+
+        chdicts = yield self.db.changes.getChangesRange(15, 10)
+        self.assertEqual(chdicts, [])
+
+    @defer.inlineCallbacks
+    def test_getChangesRange_caches(self):
+        yield self.insertTestData(self.change14_rows)
+        self.patch(self.db.changes.getChange.cache, 'put', mock.Mock())
+        chdicts = yield self.db.changes.getChangesRange(14, 10)
+
+        # the chdicts are cached for getChange
+        self.db.changes.getChange.cache.put.assert_called_with(14, chdicts[0])
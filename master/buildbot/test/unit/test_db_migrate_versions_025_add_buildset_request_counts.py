@@ -0,0 +1,77 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+
+from buildbot.test.util import migration
+from twisted.trial import unittest
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        buildsets = sa.Table('buildsets', metadata,
+                             sa.Column('id', sa.Integer, primary_key=True),
+                             sa.Column('external_idstring', sa.String(256)),
+                             sa.Column('reason', sa.String(256)),
+                             sa.Column('submitted_at', sa.Integer,
+                                       nullable=False),
+                             sa.Column('complete', sa.SmallInteger,
+                                       nullable=False,
+                                       server_default=sa.DefaultClause("0")),
+                             sa.Column('complete_at', sa.Integer),
+                             sa.Column('results', sa.SmallInteger),
+                             sa.Column('sourcestampsetid', sa.Integer),
+                             )
+        buildsets.create()
+
+        conn.execute(buildsets.insert(), id=10, submitted_at=1300000000,
+                     sourcestampsetid=1)
+
+    # tests
+
+    def test_update(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            buildsets = sa.Table('buildsets', metadata, autoload=True)
+            self.assertIsInstance(buildsets.c.requests_total.type, sa.Integer)
+            self.assertIsInstance(buildsets.c.requests_complete.type,
+                                  sa.Integer)
+            self.assertIsInstance(buildsets.c.requests_failed.type,
+                                  sa.Integer)
+
+            # existing buildsets have no counts
+            r = conn.execute(sa.select([buildsets.c.id,
+                                        buildsets.c.requests_total,
+                                        buildsets.c.requests_complete,
+                                        buildsets.c.requests_failed]))
+            self.assertEqual(map(tuple, r.fetchall()),
+                             [(10, None, None, None)])
+
+        return self.do_test_migration(24, 25, setup_thd, verify_thd)
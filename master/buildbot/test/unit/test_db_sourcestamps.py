@@ -13,9 +13,12 @@
 #
 # Copyright Buildbot Team Members
 
+import mock
+
 from buildbot.db import sourcestamps
 from buildbot.test.fake import fakedb
 from buildbot.test.util import connector_component
+from twisted.internet import defer
 from twisted.trial import unittest
 
 
@@ -218,3 +221,50 @@ class TestSourceStampsConnectorComponent(
             self.assertEqual(ssdict, None)
         d.addCallback(check)
         return d
+
+    @defer.inlineCallbacks
+    def test_getSourceStampsForSets(self):
+        yield self.insertTestData([
+            fakedb.Change(changeid=16),
+            fakedb.Patch(id=99, patch_base64='aGVsbG8sIHdvcmxk',
+                         patch_author='bar', patch_comment='foo',
+                         subdir='/foo', patchlevel=3),
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStampSet(id=235),
+            fakedb.SourceStampSet(id=236),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234, codebase='a'),
+            fakedb.SourceStamp(id=235, sourcestampsetid=234, codebase='b',
+                               patchid=99),
+            fakedb.SourceStamp(id=236, sourcestampsetid=235, codebase='a'),
+            fakedb.SourceStampChange(sourcestampid=236, changeid=16),
+        ])
+        sslists = yield self.db.sourcestamps.getSourceStampsForSets(
+            [234, 235, 236])
+        self.assertEqual(sorted(sslists), [234, 235, 236])
+        self.assertEqual([ssdict['ssid'] for ssdict in sslists[234]],
+                         [234, 235])
+        self.assertEqual(sslists[234][1]['patch_body'], 'hello, world')
+        self.assertEqual(sslists[234][1]['patch_level'], 3)
+        self.assertEqual(sslists[234][0]['patch_body'], None)
+        self.assertEqual([ssdict['changeids'] for ssdict in sslists[235]],
+                         [set([16])])
+        self.assertEqual(sslists[236], [])
+
+        # the result is the same as fetching one set at a time
+        for setid in 234, 235:
+            sslist = yield self.db.sourcestamps.getSourceStamps(setid,
+                                                                no_cache=1)
+            self.assertEqual(sorted(sslist), sorted(sslists[setid]))
+
+    @defer.inlineCallbacks
+    def test_getSourceStampsForSets_cache(self):
+        yield self.insertTestData([
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234),
+        ])
+        self.db.sourcestamps.getSourceStamps.cache.put = sets_put = \
+            mock.Mock()
+        self.db.sourcestamps.getSourceStamp.cache.put = ss_put = mock.Mock()
+        sslists = yield self.db.sourcestamps.getSourceStampsForSets([234])
+        sets_put.assert_called_once_with(234, sslists[234])
+        ss_put.assert_called_once_with(234, sslists[234][0])
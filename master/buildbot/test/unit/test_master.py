@@ -20,9 +20,12 @@ import signal
 from buildbot import config
 from buildbot import master
 from buildbot import monkeypatches
+from buildbot import notifications
 from buildbot.changes import changes
 from buildbot.db import connector
 from buildbot.process.users import users
+from buildbot.status.results import FAILURE
+from buildbot.status.results import SUCCESS
 from buildbot.test.fake import fakedb
 from buildbot.test.util import compat
 from buildbot.test.util import dirs
@@ -195,6 +198,57 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
             kwargs=dict(who='me', src='git'),
             exp_args=(self.master, 'me', 'git'))
 
+    @defer.inlineCallbacks
+    def test_addChanges(self):
+        self.master.db = fakedb.FakeDBConnector(self)
+        cb = mock.Mock()
+        self.master.subscribeToChanges(cb)
+
+        added = yield self.master.addChanges([
+            dict(author=u'me', files=[u'a'], revision=u'1',
+                 properties={'a': 'b'}),
+            dict(who=u'you', files=[], revision=u'2', src='git'),
+        ])
+        # the changes are added, and delivered, in order
+        self.assertEqual([c.revision for c in added], [u'1', u'2'])
+        self.assertEqual([c.who for c in added], [u'me', u'you'])
+        self.assertEqual(added[0].properties.getProperty('a'), 'b')
+        self.assertEqual([args[0][0] for args in cb.call_args_list], added)
+        uids = yield self.master.db.changes.getChangeUids(added[1].number)
+        self.assertEqual(len(uids), 1)
+
+    @defer.inlineCallbacks
+    def test_addChanges_users_once(self):
+        self.master.db = fakedb.FakeDBConnector(self)
+        got = []
+
+        def fake_createUserObject(master, author, src):
+            got.append((author, src))
+            return defer.succeed(len(got))
+        self.patch(users, 'createUserObject', fake_createUserObject)
+
+        added = yield self.master.addChanges([
+            dict(author=u'me', files=[], revision=u'1', src='git'),
+            dict(author=u'you', files=[], revision=u'2', src='git'),
+            dict(author=u'me', files=[], revision=u'3', src='git'),
+            dict(author=u'me', files=[], revision=u'4', src='svn'),
+        ])
+        self.assertEqual(got, [(u'me', 'git'), (u'you', 'git'),
+                               (u'me', 'svn')])
+        uids = []
+        for change in added:
+            change_uids = yield self.master.db.changes.getChangeUids(
+                change.number)
+            uids.append(change_uids)
+        self.assertEqual(uids, [[1], [2], [1], [3]])
+
+    @defer.inlineCallbacks
+    def test_addChanges_empty(self):
+        self.master.db = mock.Mock()
+        added = yield self.master.addChanges([])
+        self.assertEqual(added, [])
+        self.assertFalse(self.master.db.changes.addChanges.called)
+
     def test_buildset_subscription(self):
         self.master.db = mock.Mock()
         self.master.db.buildsets.addBuildset.return_value = \
@@ -228,6 +282,45 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         # assert the notification sub was called correctly
         cb.assert_called_with(938593, 999)
 
+    def setUpBuildsetCompletion(self, rows):
+        self.master.db = fakedb.FakeDBConnector(self)
+        self.completions = []
+        self.master.subscribeToBuildsetCompletions(
+            lambda bsid, result: self.completions.append((bsid, result)))
+        return self.master.db.insertTestData(rows)
+
+    @defer.inlineCallbacks
+    def test_maybeBuildsetComplete_counted(self):
+        yield self.setUpBuildsetCompletion([
+            fakedb.Buildset(id=91, sourcestampsetid=234, requests_total=2,
+                            requests_complete=1, requests_failed=0),
+            fakedb.BuildRequest(id=19, buildsetid=91),
+            fakedb.BuildRequest(id=20, buildsetid=91, complete=1, results=0),
+        ])
+        yield self.master.maybeBuildsetComplete(91)
+        self.assertEqual(self.completions, [])
+
+        yield self.master.db.buildrequests.completeBuildRequests([19], 2)
+        yield self.master.maybeBuildsetComplete(91)
+        self.assertEqual(self.completions, [(91, FAILURE)])
+        self.assertEqual(self.master.db.buildsets.buildsets[91]['results'],
+                         FAILURE)
+
+    @defer.inlineCallbacks
+    def test_maybeBuildsetComplete_uncounted(self):
+        # buildsets added before the requests were counted
+        yield self.setUpBuildsetCompletion([
+            fakedb.Buildset(id=91, sourcestampsetid=234),
+            fakedb.BuildRequest(id=19, buildsetid=91),
+            fakedb.BuildRequest(id=20, buildsetid=91, complete=1, results=1),
+        ])
+        yield self.master.maybeBuildsetComplete(91)
+        self.assertEqual(self.completions, [])
+
+        yield self.master.db.buildrequests.completeBuildRequests([19], 0)
+        yield self.master.maybeBuildsetComplete(91)
+        self.assertEqual(self.completions, [(91, SUCCESS)])
+
 
 class StartupAndReconfig(dirs.DirsMixin, logging.LoggingMixin, unittest.TestCase):
 
@@ -401,6 +494,39 @@ class StartupAndReconfig(dirs.DirsMixin, logging.LoggingMixin, unittest.TestCase
         db_loop.stop.assert_called_with()
         self.assertEqual(self.master.db_loop, None)
 
+    @defer.inlineCallbacks
+    def test_reconfigService_notificationChannel(self):
+        self.master.config = config.MasterConfig()
+        old = config.MasterConfig()
+        old.notificationChannel = \
+            notifications.LocalNotificationChannel('old')
+        yield self.master.reconfigService(old)
+        self.assertIdentical(self.master.notificationChannel,
+                             old.notificationChannel)
+        self.assertIdentical(old.notificationChannel.master, self.master)
+        self.assertIdentical(old.notificationChannel.parent, self.master)
+
+        # an equal channel is left alone
+        same = config.MasterConfig()
+        same.notificationChannel = \
+            notifications.LocalNotificationChannel('old')
+        yield self.master.reconfigService(same)
+        self.assertIdentical(self.master.notificationChannel,
+                             old.notificationChannel)
+
+        new = config.MasterConfig()
+        new.notificationChannel = \
+            notifications.LocalNotificationChannel('new')
+        yield self.master.reconfigService(new)
+        self.assertIdentical(self.master.notificationChannel,
+                             new.notificationChannel)
+        self.assertEqual(old.notificationChannel.master, None)
+        self.assertEqual(old.notificationChannel.parent, None)
+
+        yield self.master.reconfigService(config.MasterConfig())
+        self.assertEqual(self.master.notificationChannel, None)
+        self.assertEqual(new.notificationChannel.parent, None)
+
 
 class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
 
@@ -510,6 +636,46 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_pollDatabaseChanges_batches(self):
+        self.patch(self.master, 'CHANGES_POLL_BATCH', 2)
+        self.patch(self.db.changes, 'getChange', mock.Mock())
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+        ] + [fakedb.Change(changeid=i) for i in range(10, 16)])
+        d = self.master.pollDatabaseChanges()
+
+        def check(_):
+            self.assertEqual([ch.number for ch in self.gotten_changes],
+                             [11, 12, 13, 14, 15])
+            self.db.state.assertState(53, last_processed_change=15)
+            # changes are not fetched one at a time
+            self.assertFalse(self.db.changes.getChange.called)
+        d.addCallback(check)
+        return d
+
+    def test_pollDatabaseChanges_gap(self):
+        # a gap may be a change that is still being added, so polling stops
+        # there
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=13),
+        ])
+        d = self.master.pollDatabaseChanges()
+
+        def check(_):
+            self.assertEqual([ch.number for ch in self.gotten_changes], [11])
+            self.db.state.assertState(53, last_processed_change=11)
+        d.addCallback(check)
+        return d
+
     def test_pollDatabaseChanges_nothing_new(self):
         self.db.insertTestData([
             fakedb.Object(id=53, name='master',
@@ -553,7 +719,9 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
-    def test_pollDatabaseBuildRequests_incremental(self):
+    def test_pollDatabaseBuildRequests_reconcile(self):
+        # compare the full set of unclaimed requests on every poll
+        self.patch(self.master, 'UNCLAIMED_RECONCILE_INTERVAL', 0)
         d = defer.succeed(None)
 
         def insert1(_):
@@ -594,3 +762,178 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
             ])
         d.addCallback(check)
         return d
+
+    def test_changeNotified(self):
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+        ])
+        self.master.changeNotified(11)
+
+        self.assertEqual([ch.number for ch in self.gotten_changes], [11])
+        self.db.state.assertState(53, last_processed_change=11)
+
+        # an old change does not poll again
+        self.patch(self.master, '_pollDatabaseChanges', mock.Mock())
+        self.master.changeNotified(11)
+        self.assertFalse(self.master._pollDatabaseChanges.called)
+
+    def test_changeNotified_coalesced(self):
+        polls = []
+
+        def poll():
+            polls.append(None)
+            return defer.succeed(None)
+        self.patch(self.master, '_pollDatabaseChanges', poll)
+
+        # while a poll holds the lock, notifications are coalesced into one
+        # more poll
+        self.master._changes_poll_lock.acquire()
+        for changeid in 11, 12, 13:
+            self.master.changeNotified(changeid)
+        self.assertEqual(polls, [])
+        self.master._changes_poll_lock.release()
+        self.assertEqual(polls, [None])
+
+    @defer.inlineCallbacks
+    def test_buildRequestNotified(self):
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=127),
+            fakedb.SourceStamp(id=127, sourcestampsetid=127),
+            fakedb.Buildset(id=99, sourcestampsetid=127),
+            fakedb.BuildRequest(id=19, buildsetid=99, buildername='9teen'),
+        ])
+        yield self.master.pollDatabaseBuildRequests()
+        self.gotten_buildrequest_additions.append('MARK')
+
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=20, buildsetid=99, buildername='twenty'),
+        ])
+        self.master.buildRequestNotified(bsid=99, brid=20,
+                                         buildername='twenty')
+        # the next poll does not deliver the notified request again
+        yield self.master.pollDatabaseBuildRequests()
+
+        self.assertEqual(self.gotten_buildrequest_additions, [
+            dict(bsid=99, brid=19, buildername='9teen'),
+            'MARK',
+            dict(bsid=99, brid=20, buildername='twenty'),
+        ])
+
+    @defer.inlineCallbacks
+    def test_addBuildset_notifies(self):
+        channel = self.master.notificationChannel = mock.Mock()
+        self.patch(self.master, 'buildRequestNotified', mock.Mock())
+        self.master.db = mock.Mock()
+        self.master.db.buildsets.addBuildset.return_value = \
+            defer.succeed((938593, dict(a=19)))
+
+        yield self.master.addBuildset(ssid=999)
+
+        channel.notifyBuildRequest.assert_called_with(
+            bsid=938593, brid=19, buildername='a')
+        self.master.buildRequestNotified.assert_called_with(
+            bsid=938593, brid=19, buildername='a')
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseBuildRequests_incremental(self):
+        clock = task.Clock()
+        self.patch(master, 'reactor', clock)
+        # without the trailing window, only reconciliation finds requests
+        # below the highest seen
+        self.patch(self.master, 'BUILDREQUESTS_POLL_WINDOW', 0)
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=127),
+            fakedb.SourceStamp(id=127, sourcestampsetid=127),
+            fakedb.Buildset(id=9, sourcestampsetid=127),
+            fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy'),
+        ])
+        yield self.master.pollDatabaseBuildRequests()
+        self.gotten_buildrequest_additions.append('MARK')
+
+        # between reconciliations, only requests above the highest seen are
+        # fetched
+        self.patch(self.db.buildrequests, 'listUnclaimedBuildRequests',
+                   mock.Mock(side_effect=AssertionError("reconciled")))
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=20, buildsetid=9, buildername='twenty'),
+        ])
+        self.db.buildrequests.fakeClaimBuildRequest(11)
+        clock.advance(10)
+        yield self.master.pollDatabaseBuildRequests()
+        self.gotten_buildrequest_additions.append('MARK')
+
+        # reconciliation finds that 11 was claimed..
+        self.patch(self.db.buildrequests, 'listUnclaimedBuildRequests',
+                   fakedb.FakeBuildRequestsComponent.listUnclaimedBuildRequests
+                   .__get__(self.db.buildrequests))
+        clock.advance(self.master.UNCLAIMED_RECONCILE_INTERVAL)
+        yield self.master.pollDatabaseBuildRequests()
+        self.assertEqual(self.master._last_unclaimed_brids_set, set([20]))
+        self.gotten_buildrequest_additions.append('MARK')
+
+        # ..so when its claim expires, the next reconciliation notifies
+        self.db.buildrequests.fakeUnclaimBuildRequest(11)
+        self.db.buildrequests.fakeClaimBuildRequest(20)
+        clock.advance(10)
+        yield self.master.pollDatabaseBuildRequests()
+        self.gotten_buildrequest_additions.append('MARK')
+        clock.advance(self.master.UNCLAIMED_RECONCILE_INTERVAL)
+        yield self.master.pollDatabaseBuildRequests()
+
+        self.assertEqual(self.gotten_buildrequest_additions, [
+            dict(bsid=9, brid=11, buildername='eleventy'),
+            'MARK',
+            dict(bsid=9, brid=20, buildername='twenty'),
+            'MARK',
+            'MARK',
+            'MARK',
+            dict(bsid=9, brid=11, buildername='eleventy'),
+        ])
+        self.assertEqual(self.master._last_unclaimed_brids_set, set([11]))
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseBuildRequests_late_commit(self):
+        clock = task.Clock()
+        self.patch(master, 'reactor', clock)
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=127),
+            fakedb.SourceStamp(id=127, sourcestampsetid=127),
+            fakedb.Buildset(id=9, sourcestampsetid=127),
+            fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy'),
+        ])
+        yield self.master.pollDatabaseBuildRequests()
+        self.gotten_buildrequest_additions.append('MARK')
+
+        self.patch(self.db.buildrequests, 'listUnclaimedBuildRequests',
+                   mock.Mock(side_effect=AssertionError("reconciled")))
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=13, buildsetid=9, buildername='thirteen'),
+        ])
+        clock.advance(10)
+        yield self.master.pollDatabaseBuildRequests()
+        self.gotten_buildrequest_additions.append('MARK')
+
+        # another master commits 12 after 13 was seen; the next poll, well
+        # before the next reconciliation, finds it
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=12, buildsetid=9, buildername='twelve'),
+        ])
+        clock.advance(10)
+        yield self.master.pollDatabaseBuildRequests()
+        self.gotten_buildrequest_additions.append('MARK')
+        clock.advance(10)
+        yield self.master.pollDatabaseBuildRequests()
+
+        self.assertEqual(self.gotten_buildrequest_additions, [
+            dict(bsid=9, brid=11, buildername='eleventy'),
+            'MARK',
+            dict(bsid=9, brid=13, buildername='thirteen'),
+            'MARK',
+            dict(bsid=9, brid=12, buildername='twelve'),
+            'MARK',
+        ])
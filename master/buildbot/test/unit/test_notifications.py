@@ -0,0 +1,180 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+
+from buildbot import interfaces
+from buildbot import notifications
+from buildbot.test.util import dirs
+from buildbot.util import eventual
+from twisted.internet import defer
+from twisted.python import runtime
+from twisted.trial import unittest
+from zope.interface import verify
+
+
+class FakeMaster(object):
+
+    def __init__(self):
+        self.notified = []
+        self.waiting = None
+
+    def changeNotified(self, changeid):
+        self._notified(('change', changeid))
+
+    def buildRequestNotified(self, bsid, brid, buildername):
+        self._notified(('buildrequest', bsid, brid, buildername))
+
+    def _notified(self, notification):
+        self.notified.append(notification)
+        if self.waiting:
+            d, self.waiting = self.waiting, None
+            d.callback(None)
+
+    def waitForNotification(self):
+        self.waiting = defer.Deferred()
+        return self.waiting
+
+
+class NotificationChannelBase(unittest.TestCase):
+
+    def setUp(self):
+        self.channel = notifications.NotificationChannelBase()
+        self.channel.master = self.master = FakeMaster()
+
+    def test_provides_interface(self):
+        self.assertTrue(
+            interfaces.INotificationChannel.providedBy(self.channel))
+
+    def test_messageReceived(self):
+        self.channel.messageReceived(dict(kind='change', changeid='13'))
+        self.channel.messageReceived(dict(kind='buildrequest', bsid=2,
+                                          brid=3, buildername='b'))
+        self.assertEqual(self.master.notified,
+                         [('change', 13), ('buildrequest', 2, 3, 'b')])
+
+    def test_messageReceived_malformed(self):
+        self.channel.messageReceived(dict(kind='change'))
+        self.channel.messageReceived(dict(kind='change', changeid='x'))
+        self.channel.messageReceived(dict(kind='buildset', bsid=2))
+        self.channel.messageReceived(dict(changeid=2))
+        self.assertEqual(self.master.notified, [])
+
+
+class LocalNotificationChannel(unittest.TestCase):
+
+    def setUp(self):
+        self.channels = []
+        for name in 'a', 'a', 'b':
+            channel = notifications.LocalNotificationChannel(name)
+            channel.master = FakeMaster()
+            channel.startService()
+            self.channels.append(channel)
+
+    def tearDown(self):
+        for channel in self.channels:
+            if channel.running:
+                channel.stopService()
+
+    def test_implements(self):
+        verify.verifyClass(interfaces.INotificationChannel,
+                           notifications.LocalNotificationChannel)
+        verify.verifyObject(interfaces.INotificationChannel,
+                            self.channels[0])
+
+    def test_compare(self):
+        self.assertEqual(notifications.LocalNotificationChannel('a'),
+                         self.channels[0])
+        self.assertNotEqual(self.channels[0], self.channels[2])
+
+    @defer.inlineCallbacks
+    def test_notify(self):
+        a1, a2, b = self.channels
+        a1.notifyChange(10)
+        a2.notifyBuildRequest(bsid=1, brid=2, buildername='bldr')
+        yield eventual.flushEventualQueue()
+        self.assertEqual(a1.master.notified, [('buildrequest', 1, 2, 'bldr')])
+        self.assertEqual(a2.master.notified, [('change', 10)])
+        self.assertEqual(b.master.notified, [])
+
+    @defer.inlineCallbacks
+    def test_notify_stopped(self):
+        a1, a2, b = self.channels
+        a2.stopService()
+        a1.notifyChange(10)
+        yield eventual.flushEventualQueue()
+        self.assertEqual(a2.master.notified, [])
+
+
+class SocketNotificationChannel(dirs.DirsMixin, unittest.TestCase):
+
+    if not runtime.platformType == 'posix':
+        skip = "UNIX sockets are not available on this platform"
+
+    def setUp(self):
+        self.setUpDirs('basedir')
+        self.channels = []
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for channel in self.channels:
+            if channel.running:
+                yield channel.stopService()
+        self.tearDownDirs()
+
+    def makeChannel(self, name, peers=[]):
+        path = os.path.abspath(os.path.join('basedir', name))
+        channel = notifications.SocketNotificationChannel(
+            'unix:%s' % path,
+            ['unix:path=%s' % os.path.abspath(os.path.join('basedir', peer))
+             for peer in peers])
+        channel.master = FakeMaster()
+        self.channels.append(channel)
+        return channel
+
+    def test_int_port(self):
+        channel = notifications.SocketNotificationChannel(9990)
+        self.assertEqual(channel.port, 'tcp:9990')
+
+    @defer.inlineCallbacks
+    def test_notify(self):
+        a = self.makeChannel('a', peers=['b'])
+        b = self.makeChannel('b', peers=['a'])
+        a.startService()
+        b.startService()
+
+        d = b.master.waitForNotification()
+        a.notifyChange(10)
+        yield d
+        d = b.master.waitForNotification()
+        a.notifyBuildRequest(bsid=1, brid=2, buildername='bldr')
+        yield d
+        self.assertEqual(b.master.notified,
+                         [('change', 10), ('buildrequest', 1, 2, 'bldr')])
+
+        d = a.master.waitForNotification()
+        b.notifyChange(11)
+        yield d
+        self.assertEqual(a.master.notified, [('change', 11)])
+
+    @defer.inlineCallbacks
+    def test_notify_unreachable_peer(self):
+        a = self.makeChannel('a', peers=['nobody'])
+        a.startService()
+        a.notifyChange(10)
+        # the notification is dropped, leaving polling to find the change
+        yield a._peers[0].connecting
+        self.assertEqual(a._peers[0].queue, [])
+        self.assertEqual(a._peers[0].protocol, None)
@@ -151,6 +151,7 @@ class TestBotMaster(unittest.TestCase):
                    mock.Mock())
 
         new_config = mock.Mock()
+        new_config.distributorConcurrency = 3
         d = self.botmaster.reconfigService(new_config)
 
         @d.addCallback
@@ -159,6 +160,7 @@ class TestBotMaster(unittest.TestCase):
                 new_config)
             self.botmaster.reconfigServiceSlaves.assert_called_with(
                 new_config)
+            self.assertEqual(self.botmaster.brd.concurrency, 3)
             self.assertTrue(
                 self.botmaster.maybeStartBuildsForAllBuilders.called)
         return d
@@ -303,6 +303,24 @@ class TestBuilderBuildCreation(BuilderMixin, unittest.TestCase):
         result = yield self.bldr.canStartBuild(slave, breq)
         self.assertIdentical(True, result)
 
+    @defer.inlineCallbacks
+    def test_resubmit_buildreqs(self):
+        yield self.makeBuilder()
+        self.db.insertTestData(self.base_rows + [
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr"),
+        ])
+        self.db.buildrequests.fakeClaimBuildRequest(11)
+        self.bldr.botmaster = mock.Mock()
+        build = mock.Mock()
+        build.requests = [mock.Mock(id=11)]
+
+        yield self.bldr._resubmit_buildreqs(build)
+
+        brdict = yield self.db.buildrequests.getBuildRequest(11)
+        self.assertFalse(brdict['claimed'])
+        self.bldr.botmaster.maybeStartBuildsForBuilder.assert_called_with(
+            'bldr')
+
 
 class TestGetOldestRequestTime(BuilderMixin, unittest.TestCase):
 
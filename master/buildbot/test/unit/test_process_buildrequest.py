@@ -13,9 +13,12 @@
 #
 # Copyright Buildbot Team Members
 
+import mock
+
 from buildbot.process import buildrequest
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
+from twisted.internet import defer
 from twisted.trial import unittest
 
 
@@ -176,6 +179,54 @@ class TestBuildRequest(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_fromBrdicts(self):
+        master = fakemaster.make_master()
+        master.db = fakedb.FakeDBConnector(self)
+        master.db.insertTestData([
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234, codebase='A',
+                               revision='9283'),
+            fakedb.SourceStamp(id=235, sourcestampsetid=234, codebase='B',
+                               revision='9284'),
+            fakedb.SourceStampSet(id=236),
+            fakedb.SourceStamp(id=236, sourcestampsetid=236, codebase='A',
+                               revision='9285'),
+            fakedb.Buildset(id=539, reason='triggered', sourcestampsetid=234),
+            fakedb.BuildsetProperty(buildsetid=539, property_name='x',
+                                    property_value='[1, "X"]'),
+            fakedb.Buildset(id=540, reason='forced', sourcestampsetid=236),
+            fakedb.BuildRequest(id=288, buildsetid=539, buildername='bldr'),
+            fakedb.BuildRequest(id=289, buildsetid=540, buildername='bldr'),
+            fakedb.BuildRequest(id=290, buildsetid=539, buildername='bldr',
+                                priority=13),
+        ])
+        # the one-at-a-time methods are not used
+        for meth in 'getBuildset', 'getBuildsetProperties':
+            setattr(master.db.buildsets, meth, mock.Mock())
+        master.db.sourcestamps.getSourceStamps = mock.Mock()
+
+        brdicts = yield master.db.buildrequests.getBuildRequests()
+        brdicts.sort(key=lambda brdict: -brdict['brid'])
+        brs = yield buildrequest.BuildRequest.fromBrdicts(master, brdicts)
+
+        self.assertEqual([br.id for br in brs], [290, 289, 288])
+        self.assertEqual([br.reason for br in brs],
+                         ['triggered', 'forced', 'triggered'])
+        self.assertEqual([br.properties.getProperty('x') for br in brs],
+                         [1, None, 1])
+        self.assertEqual(brs[0].priority, 13)
+        self.assertEqual(dict((cb, ss.revision)
+                              for cb, ss in brs[0].sources.iteritems()),
+                         dict(A='9283', B='9284'))
+        self.assertEqual(brs[1].source.revision, '9285')
+
+    def test_fromBrdicts_empty(self):
+        master = fakemaster.make_master()
+        d = buildrequest.BuildRequest.fromBrdicts(master, [])
+        d.addCallback(self.assertEqual, [])
+        return d
+
     def test_mergeSourceStampsWith_common_codebases(self):
         """ This testcase has two buildrequests
             Request Change Codebase Revision Comment
@@ -351,3 +402,33 @@ class TestBuildRequest(unittest.TestCase):
         mergeable = r1.canBeMergedWith(r2)
         self.assertFalse(mergeable, "Request containing different codebases " +
                                     "should never be able to merge")
+
+    def makeRequest(self, **sources):
+        r = buildrequest.BuildRequest()
+        r.sources = {}
+        for codebase, (repository, branch, changes) in sources.iteritems():
+            ss = FakeSource()
+            ss.codebase = codebase
+            ss.repository = repository
+            ss.branch = branch
+            ss.project = ''
+            ss.changes = changes
+            r.sources[codebase] = ss
+        return r
+
+    def test_getMergeKey_equal(self):
+        r1 = self.makeRequest(A=('repoA', 'master', [1]),
+                              B=('repoB', 'master', []))
+        r2 = self.makeRequest(B=('repoB', 'master', []),
+                              A=('repoA', 'master', [2, 3]))
+        self.assertEqual(r1.getMergeKey(), r2.getMergeKey())
+
+    def test_getMergeKey_different(self):
+        r = self.makeRequest(A=('repoA', 'master', [1]))
+        for other in [self.makeRequest(A=('repoA', 'stable', [1])),
+                      self.makeRequest(A=('repoB', 'master', [1])),
+                      self.makeRequest(A=('repoA', 'master', [])),
+                      self.makeRequest(B=('repoA', 'master', [1])),
+                      self.makeRequest(A=('repoA', 'master', [1]),
+                                       B=('repoB', 'master', []))]:
+            self.assertNotEqual(r.getMergeKey(), other.getMergeKey())
@@ -15,8 +15,10 @@
 
 import mock
 
-from buildbot.db import buildrequests
+from buildbot.process import builder
+from buildbot.process import buildrequest
 from buildbot.process import buildrequestdistributor
+from buildbot.process import metrics
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import compat
@@ -24,6 +26,7 @@ from buildbot.util import epoch2datetime
 from buildbot.util.eventual import fireEventually
 from twisted.internet import defer
 from twisted.internet import reactor
+from twisted.internet import task
 from twisted.python import failure
 from twisted.trial import unittest
 
@@ -45,6 +48,62 @@ class SkipSlavesThatCantGetLock(buildrequestdistributor.BasicBuildChooser):
         self.rejectedSlaves = None  # disable this feature
 
 
+class TestUnclaimedBrdicts(unittest.TestCase):
+
+    def makeBrdict(self, brid, submitted_at, priority=0):
+        return dict(brid=brid, submitted_at=submitted_at, priority=priority)
+
+    def setUp(self):
+        self.brdicts = buildrequestdistributor.UnclaimedBrdicts([
+            self.makeBrdict(10, 300),
+            self.makeBrdict(11, 100),
+            self.makeBrdict(12, 200),
+            self.makeBrdict(13, 400, priority=5),
+            self.makeBrdict(14, 100),
+        ])
+
+    def brids(self):
+        return [brd['brid'] for brd in self.brdicts]
+
+    def test_order(self):
+        self.assertEqual(self.brids(), [13, 11, 14, 12, 10])
+        self.assertEqual(self.brdicts.first()['brid'], 13)
+        self.assertEqual(len(self.brdicts), 5)
+
+    def test_get(self):
+        self.assertEqual(self.brdicts.get(12), self.makeBrdict(12, 200))
+        self.assertEqual(self.brdicts.get(99), None)
+        self.assertTrue(12 in self.brdicts)
+        self.assertFalse(99 in self.brdicts)
+
+    def test_remove(self):
+        self.brdicts.remove(13)
+        self.brdicts.remove(14)
+        self.brdicts.remove(99)
+        self.assertEqual(self.brids(), [11, 12, 10])
+        self.assertEqual(self.brdicts.first()['brid'], 11)
+        self.assertEqual(len(self.brdicts), 3)
+        self.assertFalse(13 in self.brdicts)
+
+    def test_restore(self):
+        self.brdicts.remove(13)
+        self.brdicts.remove(11)
+        self.brdicts.restore(13)
+        self.brdicts.restore(99)
+        self.assertEqual(self.brids(), [13, 14, 12, 10])
+        self.assertEqual(self.brdicts.first()['brid'], 13)
+        self.assertEqual(len(self.brdicts), 4)
+
+    def test_drain(self):
+        drained = []
+        while self.brdicts:
+            brid = self.brdicts.first()['brid']
+            drained.append(brid)
+            self.brdicts.remove(brid)
+        self.assertEqual(drained, [13, 11, 14, 12, 10])
+        self.assertEqual(self.brdicts.first(), None)
+
+
 class Test(unittest.TestCase):
 
     def setUp(self):
@@ -327,6 +386,123 @@ class Test(unittest.TestCase):
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    def test_maybeStartBuildsOn_concurrent(self):
+        self.brd.concurrency = 3
+        self.addBuilders(['A', 'B', 'C', 'D', 'E'])
+        slavenames = dict(A=['s1'], B=['s2'], C=['s1', 's3'], D=['s3'],
+                          E=['s4'])
+        for name, bldr in self.builders.iteritems():
+            bldr.config.slavenames = slavenames[name]
+
+        running = {}
+        calls = []
+
+        def maybeStartBuildsOnBuilder(bldr):
+            calls.append(bldr.name)
+            d = running[bldr.name] = defer.Deferred()
+            return d
+        self.brd._maybeStartBuildsOnBuilder = maybeStartBuildsOnBuilder
+
+        @defer.inlineCallbacks
+        def finish(name):
+            running.pop(name).callback(None)
+            yield fireEventually()
+
+        @defer.inlineCallbacks
+        def run():
+            self.brd.maybeStartBuildsOn(['A', 'B', 'C', 'D', 'E'])
+            yield fireEventually()
+            # C shares a slave with A, and D with C, which comes first
+            self.assertEqual(calls, ['A', 'B', 'E'])
+            yield finish('B')
+            self.assertEqual(calls, ['A', 'B', 'E'])
+            yield finish('A')
+            self.assertEqual(calls, ['A', 'B', 'E', 'C'])
+            yield finish('C')
+            self.assertEqual(calls, ['A', 'B', 'E', 'C', 'D'])
+            yield finish('D')
+            yield finish('E')
+            yield self.quiet_deferred
+            self.checkAllCleanedUp()
+        return run()
+
+    def test_maybeStartBuildsOn_concurrent_same_builder(self):
+        # a builder that becomes pending while it is active waits for itself
+        self.brd.concurrency = 3
+        self.addBuilders(['A'])
+        self.builders['A'].config.slavenames = ['s1']
+
+        running = []
+        calls = []
+
+        def maybeStartBuildsOnBuilder(bldr):
+            calls.append(bldr.name)
+            d = defer.Deferred()
+            running.append(d)
+            return d
+        self.brd._maybeStartBuildsOnBuilder = maybeStartBuildsOnBuilder
+
+        @defer.inlineCallbacks
+        def run():
+            self.brd.maybeStartBuildsOn(['A'])
+            yield fireEventually()
+            self.brd.maybeStartBuildsOn(['A'])
+            yield fireEventually()
+            self.assertEqual(calls, ['A'])
+            running.pop(0).callback(None)
+            yield fireEventually()
+            self.assertEqual(calls, ['A', 'A'])
+            running.pop(0).callback(None)
+            yield self.quiet_deferred
+            self.checkAllCleanedUp()
+        return run()
+
+    def test_claimBuildRequests_pipelined(self):
+        # claims made while another claim is in progress are made together
+        calls = []
+
+        def claimBuildRequestGroups(groups):
+            d = defer.Deferred()
+            calls.append((groups, d))
+            return d
+        self.master.db.buildrequests.claimBuildRequestGroups = \
+            claimBuildRequestGroups
+
+        results = []
+        for groups in [[1]], [[2], [3]], [[4]]:
+            d = self.brd._claimBuildRequests(groups)
+            d.addCallback(results.append)
+        self.assertEqual([groups for groups, _ in calls], [[[1]]])
+
+        calls[0][1].callback(set())
+        self.assertEqual([groups for groups, _ in calls],
+                         [[[1]], [[2], [3], [4]]])
+        calls[1][1].callback(set([3]))
+        self.assertEqual(results, [set(), set([3]), set([3])])
+        self.assertFalse(self.brd._claiming)
+
+    def test_builder_wait_metric(self):
+        clock = task.Clock()
+        self.brd._reactor = clock
+        self.useMock_maybeStartBuildsOnBuilder()
+        self.addBuilders(['A'])
+        events = []
+        self.patch(metrics.MetricTimeEvent, 'log',
+                   classmethod(lambda cls, timer, elapsed:
+                               events.append((timer, elapsed))))
+
+        # hold the activity lock, so that the builder waits
+        d = self.brd.activity_lock.acquire()
+        d.addCallback(lambda _: self.brd.maybeStartBuildsOn(['A']))
+        d.addCallback(lambda _: clock.advance(5))
+        d.addCallback(lambda _: self.brd.activity_lock.release())
+        d.addCallback(lambda _: self.quiet_deferred)
+
+        @d.addCallback
+        def check(_):
+            self.assertIn(('BuildRequestDistributor.builder_wait', 5), events)
+        return d
+
 
 class TestMaybeStartBuilds(unittest.TestCase):
 
@@ -392,6 +568,7 @@ class TestMaybeStartBuilds(unittest.TestCase):
         bldr.getAvailableSlaves = lambda: [s for s in bldr.slaves if s.isAvailable()]
         bldr.config.nextSlave = None
         bldr.config.nextBuild = None
+        bldr.config.locks = []
 
         def canStartBuild(*args):
             can = bldr.config.canStartBuild
@@ -786,18 +963,20 @@ class TestMaybeStartBuilds(unittest.TestCase):
     @defer.inlineCallbacks
     def test_claim_race(self):
         # fake a race condition on the buildrequests table
-        old_claimBuildRequests = self.master.db.buildrequests.claimBuildRequests
+        old_claimBuildRequestGroups = \
+            self.master.db.buildrequests.claimBuildRequestGroups
 
-        def claimBuildRequests(brids):
+        def claimBuildRequestGroups(groups):
             # first, ensure this only happens the first time
-            self.master.db.buildrequests.claimBuildRequests = old_claimBuildRequests
+            self.master.db.buildrequests.claimBuildRequestGroups = \
+                old_claimBuildRequestGroups
             # claim brid 10 for some other master
-            assert 10 in brids
+            self.assertEqual(groups, [[10], [11]])
             self.master.db.buildrequests.fakeClaimBuildRequest(10, 136000,
                                                                objectid=9999)  # some other objectid
-            # ..and fail
-            return defer.fail(buildrequests.AlreadyClaimedError())
-        self.master.db.buildrequests.claimBuildRequests = claimBuildRequests
+            return old_claimBuildRequestGroups(groups)
+        self.master.db.buildrequests.claimBuildRequestGroups = \
+            claimBuildRequestGroups
 
         self.addSlaves({'test-slave1': 1, 'test-slave2': 1})
         rows = self.base_rows + [
@@ -806,8 +985,94 @@ class TestMaybeStartBuilds(unittest.TestCase):
             fakedb.BuildRequest(id=11, buildsetid=11, buildername="A",
                                 submitted_at=135000),
         ]
+        # both builds are claimed together, and only the build for brid 10
+        # is abandoned
         yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
-                                                     exp_claims=[11], exp_builds=[('test-slave1', [11])])
+                                                     exp_claims=[11], exp_builds=[('test-slave2', [11])])
+
+    @mock.patch('random.choice', nth_slave(0))
+    @defer.inlineCallbacks
+    def test_claim_race_merged(self):
+        # a conflict on one of a set of merged requests leaves the others to
+        # be chosen again
+        self.master.config.mergeRequests = True
+        self.bldr.getMergeRequestsFn = lambda: lambda bldr, br1, br2: True
+        old_claimBuildRequestGroups = \
+            self.master.db.buildrequests.claimBuildRequestGroups
+
+        def claimBuildRequestGroups(groups):
+            self.master.db.buildrequests.claimBuildRequestGroups = \
+                old_claimBuildRequestGroups
+            self.assertEqual(groups, [[10, 11, 12]])
+            self.master.db.buildrequests.fakeClaimBuildRequest(11, 136000,
+                                                               objectid=9999)
+            return old_claimBuildRequestGroups(groups)
+        self.master.db.buildrequests.claimBuildRequestGroups = \
+            claimBuildRequestGroups
+
+        self.addSlaves({'test-slave1': 1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="A",
+                                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="A",
+                                submitted_at=135000),
+            fakedb.BuildRequest(id=12, buildsetid=11, buildername="A",
+                                submitted_at=136000),
+        ]
+        yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
+                                                     exp_claims=[10, 12], exp_builds=[('test-slave1', [10, 12])])
+
+    @mock.patch('random.choice', nth_slave(0))
+    @defer.inlineCallbacks
+    def test_claims_batched(self):
+        # the builds chosen in one pass are claimed in one call
+        calls = []
+        old_claimBuildRequestGroups = \
+            self.master.db.buildrequests.claimBuildRequestGroups
+
+        def claimBuildRequestGroups(groups):
+            calls.append(groups)
+            return old_claimBuildRequestGroups(groups)
+        self.master.db.buildrequests.claimBuildRequestGroups = \
+            claimBuildRequestGroups
+
+        self.addSlaves({'test-slave1': 1, 'test-slave2': 1,
+                        'test-slave3': 1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="A"),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="A"),
+        ]
+        yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
+                                                     exp_claims=[10, 11],
+                                                     exp_builds=[('test-slave1', [10]),
+                                                                 ('test-slave2', [11])])
+        self.assertEqual(calls, [[[10], [11]]])
+
+    @mock.patch('random.choice', nth_slave(0))
+    @defer.inlineCallbacks
+    def test_claims_locks(self):
+        # with locks, builds are chosen and claimed one at a time
+        self.bldr.config.locks = ['lock']
+        calls = []
+        old_claimBuildRequestGroups = \
+            self.master.db.buildrequests.claimBuildRequestGroups
+
+        def claimBuildRequestGroups(groups):
+            calls.append(groups)
+            return old_claimBuildRequestGroups(groups)
+        self.master.db.buildrequests.claimBuildRequestGroups = \
+            claimBuildRequestGroups
+
+        self.addSlaves({'test-slave1': 1, 'test-slave2': 1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="A"),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="A"),
+        ]
+        yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
+                                                     exp_claims=[10, 11],
+                                                     exp_builds=[('test-slave1', [10]),
+                                                                 ('test-slave2', [11])])
+        self.assertEqual(calls, [[[10]], [[11]]])
 
     # nextSlave
     @defer.inlineCallbacks
@@ -892,6 +1157,41 @@ class TestMaybeStartBuilds(unittest.TestCase):
             return lst[-1]
         return self.do_test_nextBuild(nextBuild, exp_choice=[13, 12, 11, 10])
 
+    @defer.inlineCallbacks
+    def test_nextBuild_bulk(self):
+        # the BuildRequests for nextBuild are constructed in one batch
+        calls = []
+        fromBrdicts = buildrequest.BuildRequest.fromBrdicts.im_func
+
+        def recordingFromBrdicts(cls, master, brdicts):
+            calls.append(sorted(brdict['brid'] for brdict in brdicts))
+            return fromBrdicts(cls, master, brdicts)
+        self.patch(buildrequest.BuildRequest, 'fromBrdicts',
+                   classmethod(recordingFromBrdicts))
+
+        def nextBuild(bldr, lst):
+            return lst[-1]
+        yield self.do_test_nextBuild(nextBuild, exp_choice=[13, 12, 11, 10])
+        self.assertEqual(calls, [[10, 11, 12, 13]])
+
+    @defer.inlineCallbacks
+    def test_request_latency_metric(self):
+        clock = task.Clock()
+        clock.advance(1200000030)
+        self.brd._reactor = clock
+        events = []
+        self.patch(metrics.MetricTimeEvent, 'log',
+                   classmethod(lambda cls, timer, elapsed:
+                               events.append((timer, elapsed))))
+        self.addSlaves({'test-slave1': 1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="A",
+                                submitted_at=1200000000),
+        ]
+        yield self.do_test_maybeStartBuildsOnBuilder(
+            rows=rows, exp_claims=[10], exp_builds=[('test-slave1', [10])])
+        self.assertIn(('BuildRequestDistributor.request_latency', 30), events)
+
     def test_nextBuild_deferred(self):
         def nextBuild(bldr, lst):
             self.assertIdentical(bldr, self.bldr)
@@ -974,6 +1274,58 @@ class TestMaybeStartBuilds(unittest.TestCase):
                                                          ('test-slave2', [20])
                                                      ])
 
+    @defer.inlineCallbacks
+    def test_sorted_by_priority(self):
+        self.master.config.mergeRequests = False
+        self.addSlaves({'test-slave1': 1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="A",
+                                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="A",
+                                submitted_at=135000, priority=1),
+        ]
+        yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
+                                                     exp_claims=[11], exp_builds=[('test-slave1', [11])])
+
+    @mock.patch('random.choice', nth_slave(0))
+    @defer.inlineCallbacks
+    def test_mergeRequests_default_by_key(self):
+        # with the default merge function, only requests for the same
+        # branch are compared
+        rows = []
+        for i, branch in enumerate(['trunk', 'stable', 'trunk', 'stable']):
+            rows += [
+                fakedb.SourceStampSet(id=240 + i),
+                fakedb.SourceStamp(id=240 + i, sourcestampsetid=240 + i,
+                                   branch=branch),
+                fakedb.Buildset(id=30 + i, sourcestampsetid=240 + i,
+                                reason='foo', submitted_at=1300305712 + i),
+                fakedb.BuildRequest(id=19 + i, buildsetid=30 + i,
+                                    buildername='A',
+                                    submitted_at=1300305712 + i),
+            ]
+        self.addSlaves({'test-slave1': 1, 'test-slave2': 1})
+
+        compared = []
+        real_canBeMergedWith = buildrequest.BuildRequest.canBeMergedWith
+
+        def canBeMergedWith(req1, req2):
+            compared.append((req1.id, req2.id))
+            return real_canBeMergedWith(req1, req2)
+        self.patch(buildrequest.BuildRequest, 'canBeMergedWith',
+                   canBeMergedWith)
+        # (the builder is a mock, so use the unbound function)
+        self.bldr.getMergeRequestsFn = \
+            lambda: builder.Builder._defaultMergeRequestFn.im_func
+
+        yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
+                                                     exp_claims=[19, 20, 21, 22],
+                                                     exp_builds=[
+                                                         ('test-slave1', [19, 21]),
+                                                         ('test-slave2', [20, 22]),
+                                                     ])
+        self.assertEqual(sorted(compared), [(19, 21), (20, 22)])
+
     @mock.patch('random.choice', nth_slave(0))
     @defer.inlineCallbacks
     def test_mergeRequest_no_other_request(self):
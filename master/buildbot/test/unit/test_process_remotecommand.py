@@ -14,11 +14,13 @@
 # Copyright Buildbot Team Members
 
 import mock
+import zlib
 
 from buildbot.process import remotecommand
 from buildbot.status.results import SUCCESS
 from buildbot.test.fake import remotecommand as fakeremotecommand
 from buildbot.test.util import interfaces
+from twisted.internet import defer
 from twisted.trial import unittest
 
 
@@ -53,6 +55,24 @@ class TestRemoteShellCommand(unittest.TestCase):
         self.assertEqual(cmd.command, command)
         self.assertEqual(cmd.fake_command, command)
 
+    def startCommand(self, slave_version):
+        cmd = remotecommand.RemoteShellCommand("build", "echo test")
+        cmd.step = mock.Mock(name='step')
+        cmd.step.slaveVersion.return_value = slave_version
+        cmd.step.slaveVersionIsOlderThan = \
+            lambda command, minversion: slave_version < minversion
+        self.patch(remotecommand.RemoteCommand, '_start', lambda self: None)
+        cmd._start()
+        return cmd
+
+    def test_start_compress(self):
+        cmd = self.startCommand("2.17")
+        self.assertEqual(cmd.args['compress'], 'zlib')
+
+    def test_start_compress_old_slave(self):
+        cmd = self.startCommand("2.16")
+        self.assertNotIn('compress', cmd.args)
+
 # NOTE:
 #
 # This interface is considered private to Buildbot and may change without
@@ -152,6 +172,44 @@ class TestRunCommand(unittest.TestCase, Tests):
         cmd.addHeader('some header')
         self.failUnlessEqual(log.header, 'some header')
 
+    def test_remoteUpdate_compressed(self):
+        cmd = self.makeRemoteCommand()
+        step = mock.Mock(name='step')
+        step.logobservers = []
+        stdio = fakeremotecommand.FakeLogFile('stdio', step)
+        cmd.useLog(stdio)
+        testlog = fakeremotecommand.FakeLogFile('test.log', step)
+        cmd.useLog(testlog)
+        cmd.remoteUpdate({'zlib': {'stdout': zlib.compress('some stdout')},
+                          'stderr': 'some stderr'})
+        cmd.remoteUpdate({'zlib': {'log': ('test.log',
+                                           zlib.compress('some log'))}})
+        self.failUnlessEqual(stdio.stdout, 'some stdout')
+        self.failUnlessEqual(stdio.stderr, 'some stderr')
+        self.failUnlessEqual(testlog.stdout, 'some log')
+        self.assertNotIn('zlib', cmd.updates)
+
+    def test_remote_update_batch_failure(self):
+        cmd = self.makeRemoteCommand()
+        cmd.buildslave = mock.Mock(name='buildslave')
+        cmd.deferred = defer.Deferred()
+        cmd.active = True
+        received = []
+
+        def remoteUpdate(update):
+            received.append(update)
+            if 'bad' in update:
+                raise RuntimeError('oh noes')
+        cmd.remoteUpdate = remoteUpdate
+        cmd.remoteComplete = lambda failure: None
+
+        acknum = cmd.remote_update([[{'stdout': 'a'}, 0], [{'bad': 1}, 1],
+                                    [{'stdout': 'b'}, 2]])
+        # the updates after the failing one are skipped, but acknowledged
+        self.assertEqual(received, [{'stdout': 'a'}, {'bad': 1}])
+        self.assertEqual(acknum, 2)
+        self.assertFalse(cmd.active)
+
 
 class TestFakeRunCommand(unittest.TestCase, Tests):
 
@@ -19,6 +19,11 @@ import mock
 import os
 
 from buildbot import config as config_module
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status import buildhistory
+from buildbot.status.build import BuildStatus
+from buildbot.status.builder import BuilderStatus
+from cPickle import dump
 from buildbot.db import connector
 from buildbot.db import model
 from buildbot.scripts import upgrade_master
@@ -68,6 +73,10 @@ class TestUpgradeMaster(dirs.DirsMixin, misc.StdoutAssertionsMixin,
             self.calls.append('upgradeDatabase')
         self.patch(upgrade_master, 'upgradeDatabase', upgradeDatabase)
 
+        def upgradeBuildHistory(config, master_cfg):
+            self.calls.append('upgradeBuildHistory')
+        self.patch(upgrade_master, 'upgradeBuildHistory', upgradeBuildHistory)
+
     # tests
 
     def test_upgradeMaster_success(self):
@@ -78,6 +87,9 @@ class TestUpgradeMaster(dirs.DirsMixin, misc.StdoutAssertionsMixin,
         def check(rv):
             self.assertEqual(rv, 0)
             self.assertInStdout('upgrade complete')
+            self.assertEqual(self.calls, ['checkBasedir', 'loadConfig',
+                                          'upgradeFiles', 'upgradeDatabase',
+                                          'upgradeBuildHistory'])
         return d
 
     def test_upgradeMaster_quiet(self):
@@ -283,3 +295,36 @@ class TestUpgradeMasterFunctions(dirs.DirsMixin, misc.StdoutAssertionsMixin,
         setup.asset_called_with(check_version=False, verbose=False)
         upgrade.assert_called_with()
         self.assertWasQuiet()
+
+    def test_upgradeBuildHistory_not_configured(self):
+        upgrade_master.upgradeBuildHistory(mkconfig(),
+                                           config_module.MasterConfig())
+        self.assertWasQuiet()
+
+    def test_upgradeBuildHistory(self):
+        os.mkdir(os.path.join('test', 'bldr'))
+        bldr = BuilderStatus('bldr', None, mock.Mock(), '')
+        for number in [3, 4]:
+            build = BuildStatus(bldr, None, number)
+            build.setSourceStamps([SourceStamp(branch='br')])
+            with open(os.path.join('test', 'bldr', str(number)), 'wb') as f:
+                dump(build, f, -1)
+        self.writeFile(os.path.join('test', 'bldr', '4-stdio'), 'log')
+        self.writeFile(os.path.join('test', 'bldr', '6'), 'not a pickle')
+
+        master_cfg = config_module.MasterConfig()
+        master_cfg.builders = [mock.Mock(builddir='bldr')]
+        master_cfg.builders[0].name = 'bldr'
+        master_cfg.buildHistory = history = buildhistory.SQLBuildHistory()
+        upgrade_master.upgradeBuildHistory(mkconfig(), master_cfg)
+
+        history.start('test')
+        try:
+            self.assertEqual(
+                [s.number for s in history.getBuildSummaries('bldr')],
+                [4, 3])
+            self.assertEqual(history.getFirstBuildNumber('bldr'), 3)
+        finally:
+            history.stop()
+        self.assertInStdout('unable to load build 6')
+        self.assertInStdout('bldr: imported 2 builds')
@@ -54,6 +54,7 @@ class TestBuildStatus(unittest.TestCase):
         builds = []
         for i in xrange(5):
             build = b.newBuild()
+            build.setSourceStamps([])
             build.setProperty('propkey', 'propval%d' % i, 'test')
             builds.append(build)
             build.buildStarted(build)
@@ -0,0 +1,427 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import mock
+import os
+
+from cPickle import load
+
+from buildbot import interfaces
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status import builder
+from buildbot.status import buildhistory
+from buildbot.status.results import FAILURE
+from buildbot.status.results import SUCCESS
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import dirs
+from twisted.trial import unittest
+from zope.interface import verify
+
+
+def mkSummary(number, branch='master', results=SUCCESS):
+    return buildhistory.BuildSummary(
+        number=number, started=number * 10.0,
+        finished=number * 10.0 + 5, results=results,
+        branches=[branch], revisions=['rev%d' % number],
+        slavename='slave', text=['build', 'successful'])
+
+
+class TestSQLBuildHistory(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.history = buildhistory.SQLBuildHistory()
+        self.history.start(self.basedir)
+
+    def tearDown(self):
+        self.history.stop()
+        self.tearDownDirs()
+
+    def addBuilds(self, summaries, buildername='bldr'):
+        for summary in summaries:
+            self.history.addBuild(buildername, summary)
+
+    def numbers(self, summaries):
+        return [s.number for s in summaries]
+
+    def test_implements(self):
+        verify.verifyObject(interfaces.IBuildHistory, self.history)
+        verify.verifyClass(interfaces.IBuildHistory,
+                           buildhistory.SQLBuildHistory)
+
+    def test_file_in_basedir(self):
+        self.assertTrue(os.path.exists(
+            os.path.join(self.basedir, 'build_history.sqlite')))
+
+    def test_getBuildSummary(self):
+        self.addBuilds([mkSummary(3)])
+        self.assertEqual(self.history.getBuildSummary('bldr', 3),
+                         mkSummary(3))
+        self.assertEqual(self.history.getBuildSummary('bldr', 4), None)
+        self.assertEqual(self.history.getBuildSummary('other', 3), None)
+
+    def test_addBuild_replaces(self):
+        self.addBuilds([mkSummary(3), mkSummary(3, results=FAILURE)])
+        self.assertEqual(self.history.getBuildSummary('bldr', 3).results,
+                         FAILURE)
+        self.assertEqual(
+            self.numbers(self.history.getBuildSummaries('bldr')), [3])
+
+    def test_getBuildSummaries_order_and_limit(self):
+        self.addBuilds([mkSummary(n) for n in [2, 0, 3, 1]])
+        self.assertEqual(
+            self.numbers(self.history.getBuildSummaries('bldr')),
+            [3, 2, 1, 0])
+        self.assertEqual(
+            self.numbers(self.history.getBuildSummaries('bldr', limit=2)),
+            [3, 2])
+
+    def test_getBuildSummaries_filters(self):
+        self.addBuilds([mkSummary(0, branch='a'),
+                        mkSummary(1, branch=None),
+                        mkSummary(2, branch='b', results=FAILURE),
+                        mkSummary(3, branch='a', results=FAILURE),
+                        mkSummary(4, branch='a')])
+
+        def get(**kw):
+            return self.numbers(self.history.getBuildSummaries('bldr', **kw))
+        self.assertEqual(get(branches=['a']), [4, 3, 0])
+        self.assertEqual(get(branches=[None]), [1])
+        self.assertEqual(get(branches=['b', None]), [2, 1])
+        self.assertEqual(get(results=[FAILURE]), [3, 2])
+        self.assertEqual(get(min_buildnum=1, max_buildnum=3), [3, 2, 1])
+        self.assertEqual(get(finished_before=26), [2, 1, 0])
+        self.assertEqual(get(branches=['a'], results=[SUCCESS], limit=1),
+                         [4])
+
+    def test_multiple_sourcestamps(self):
+        summary = buildhistory.BuildSummary(
+            number=0, started=1, finished=2, results=SUCCESS,
+            branches=['a', 'b'], revisions=['r1', 'r2'])
+        self.addBuilds([summary])
+        self.assertEqual(self.history.getBuildSummaries('bldr',
+                                                        branches=['b']),
+                         [summary])
+
+    def test_firstBuildNumber(self):
+        self.assertEqual(self.history.getFirstBuildNumber('bldr'), None)
+        self.addBuilds([mkSummary(7), mkSummary(6)])
+        self.assertEqual(self.history.getFirstBuildNumber('bldr'), 7)
+        self.history.setFirstBuildNumber('bldr', 2)
+        self.assertEqual(self.history.getFirstBuildNumber('bldr'), 2)
+        self.history.setFirstBuildNumber('other', 5)
+        self.assertEqual(self.history.getFirstBuildNumber('other'), 5)
+
+    def test_removeBuilds(self):
+        self.addBuilds([mkSummary(n) for n in range(5)])
+        self.addBuilds([mkSummary(0)], buildername='other')
+        self.history.removeBuilds('bldr', 3)
+        self.assertEqual(
+            self.numbers(self.history.getBuildSummaries('bldr')), [4, 3])
+        self.assertEqual(
+            self.numbers(self.history.getBuildSummaries('other')), [0])
+
+    def test_persistent(self):
+        self.addBuilds([mkSummary(1)])
+        self.history.stop()
+        self.history = buildhistory.SQLBuildHistory()
+        self.history.start(self.basedir)
+        self.assertEqual(self.history.getBuildSummary('bldr', 1),
+                         mkSummary(1))
+
+    def test_compare(self):
+        self.assertEqual(buildhistory.SQLBuildHistory(),
+                         buildhistory.SQLBuildHistory())
+        self.assertNotEqual(buildhistory.SQLBuildHistory(),
+                            buildhistory.SQLBuildHistory('sqlite:///x'))
+
+
+class TestBuildSummary(unittest.TestCase):
+
+    def test_fromBuildStatus(self):
+        build = mock.Mock()
+        build.getTimes.return_value = (10, 20)
+        build.getNumber.return_value = 13
+        build.getResults.return_value = FAILURE
+        build.getSlavename.return_value = 'sl'
+        build.getText.return_value = ['failed', 'test']
+        build.getSourceStamps.return_value = [
+            SourceStamp(branch='br', revision='abc')]
+        summary = buildhistory.BuildSummary.fromBuildStatus(build)
+        build.getSourceStamps.assert_called_with(absolute=True)
+        self.assertEqual(summary, buildhistory.BuildSummary(
+            number=13, started=10, finished=20, results=FAILURE,
+            branches=['br'], revisions=['abc'], slavename='sl',
+            text=['failed', 'test']))
+
+
+class TestBuildSummaryIndex(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.filename = os.path.join(self.basedir, 'summaries')
+        self.index = buildhistory.BuildSummaryIndex(self.filename)
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def numbers(self, summaries):
+        return [s.number for s in summaries]
+
+    def test_empty(self):
+        self.assertEqual(self.index.firstNumber, None)
+        self.assertEqual(self.index.getBuildSummaries(), [])
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_getBuildSummaries(self):
+        for number, branch, results in [(0, 'a', SUCCESS), (1, None, SUCCESS),
+                                        (2, 'b', FAILURE), (3, 'a', FAILURE),
+                                        (4, 'a', SUCCESS)]:
+            self.index.addBuild(mkSummary(number, branch, results))
+
+        def get(**kw):
+            return self.numbers(self.index.getBuildSummaries(**kw))
+        self.assertEqual(get(), [4, 3, 2, 1, 0])
+        self.assertEqual(get(branches=['a']), [4, 3, 0])
+        self.assertEqual(get(branches=['b', None]), [2, 1])
+        self.assertEqual(get(results=[FAILURE]), [3, 2])
+        self.assertEqual(get(min_buildnum=1, max_buildnum=3), [3, 2, 1])
+        self.assertEqual(get(finished_before=26), [2, 1, 0])
+        self.assertEqual(get(branches=['a'], limit=2), [4, 3])
+
+    def test_persistent(self):
+        for number in [5, 7, 6]:
+            self.index.addBuild(mkSummary(number))
+        index = buildhistory.BuildSummaryIndex(self.filename)
+        self.assertEqual(index.firstNumber, 5)
+        self.assertEqual(index.getBuildSummaries(),
+                         [mkSummary(7), mkSummary(6), mkSummary(5)])
+
+    def test_replaced_summary(self):
+        self.index.addBuild(mkSummary(1))
+        self.index.addBuild(mkSummary(1, results=FAILURE))
+        index = buildhistory.BuildSummaryIndex(self.filename)
+        self.assertEqual(index.getBuildSummaries(),
+                         [mkSummary(1, results=FAILURE)])
+
+    def test_truncated_line(self):
+        for number in [1, 2]:
+            self.index.addBuild(mkSummary(number))
+        with open(self.filename, 'a') as f:
+            f.write('[3, 30.0, 3')
+        index = buildhistory.BuildSummaryIndex(self.filename)
+        self.assertEqual(self.numbers(index.getBuildSummaries()), [2, 1])
+
+    def test_removeBuilds(self):
+        for number in range(5):
+            self.index.addBuild(mkSummary(number))
+        self.index.removeBuilds(3)
+        self.assertEqual(self.index.firstNumber, 3)
+        index = buildhistory.BuildSummaryIndex(self.filename)
+        self.assertEqual(index.firstNumber, 3)
+        self.assertEqual(self.numbers(index.getBuildSummaries()), [4, 3])
+
+
+class BuilderStatusSummariesMixin(dirs.DirsMixin):
+
+    def setUpBuilder(self):
+        self.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        m = fakemaster.make_master()
+        self.bldr = builder.BuilderStatus('bldr', None, m, '')
+        self.bldr.basedir = self.basedir
+        self.bldr.determineNextBuildNumber()
+        self.bldr.currentBigState = 'idle'
+        self.bldr.status = mock.Mock()
+        self.bldr.status.buildHistory = None
+
+    def runBuild(self, branch='master', results=SUCCESS):
+        build = self.bldr.newBuild()
+        build.setSourceStamps([SourceStamp(branch=branch)])
+        build.buildStarted(build)
+        build.setResults(results)
+        build.buildFinished()
+        return build
+
+    def interruptBuild(self):
+        # start a build, and save the builder as the master does when it
+        # shuts down while the build runs
+        build = self.bldr.newBuild()
+        build.setSourceStamps([SourceStamp(branch='master')])
+        build.buildStarted(build)
+        self.bldr.saveYourself()
+
+    def restartBuilder(self):
+        # a new BuilderStatus, with nothing cached, as after a restart
+        status = self.bldr.status
+        self.bldr = builder.BuilderStatus('bldr', None, self.bldr.master, '')
+        self.bldr.basedir = self.basedir
+        self.bldr.determineNextBuildNumber()
+        self.bldr.status = status
+
+    def numbers(self, builds):
+        return [b.getNumber() for b in builds]
+
+    def test_generateFinishedBuilds(self):
+        for i in range(6):
+            self.runBuild(branch=['a', 'b'][i % 2],
+                          results=[SUCCESS, FAILURE][i // 3])
+        gen = self.bldr.generateFinishedBuilds
+        self.assertEqual(self.numbers(gen()), [5, 4, 3, 2, 1, 0])
+        self.assertEqual(self.numbers(gen(branches=['a'])), [4, 2, 0])
+        self.assertEqual(self.numbers(gen(results=[FAILURE],
+                                          num_builds=2)), [5, 4])
+        self.assertEqual(self.numbers(gen(max_buildnum=2, max_search=5)),
+                         [2, 1])
+        self.assertEqual(
+            self.numbers(gen(filter_fn=lambda b: b.getNumber() % 3 == 0,
+                             num_builds=1)), [3])
+
+    def test_generateFinishedBuilds_loads_only_matches(self):
+        for i in range(4):
+            self.runBuild(branch=['a', 'b'][i % 2])
+        self.restartBuilder()
+        loaded = []
+        self.patch(self.bldr, 'loadBuildFromFile',
+                   lambda n, load=self.bldr.loadBuildFromFile:
+                   loaded.append(n) or load(n))
+        list(self.bldr.generateFinishedBuilds(branches=['b'], num_builds=1))
+        self.assertEqual(loaded, [3])
+
+    def test_generateFinishedBuildSummaries_no_pickles(self):
+        for i in range(4):
+            self.runBuild(branch=['a', 'b'][i % 2])
+        self.restartBuilder()
+        self.patch(self.bldr, 'loadBuildFromFile', mock.Mock())
+        summaries = list(self.bldr.generateFinishedBuildSummaries(
+            branches=['a']))
+        self.assertEqual([s.number for s in summaries], [2, 0])
+        self.assertEqual([s.branches for s in summaries], [('a',), ('a',)])
+        self.assertFalse(self.bldr.loadBuildFromFile.called)
+
+
+class TestBuilderStatusIndex(BuilderStatusSummariesMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpBuilder()
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def test_buildFinished_records_summary(self):
+        self.runBuild(branch='br', results=FAILURE)
+        index = buildhistory.BuildSummaryIndex(
+            os.path.join(self.basedir, 'summaries'))
+        self.assertEqual(index.firstNumber, 0)
+        summary = index.getBuildSummary(0)
+        self.assertEqual((summary.branches, summary.results),
+                         (('br',), FAILURE))
+
+    def test_generateFinishedBuilds_falls_back_to_pickles(self):
+        for i in range(3):
+            self.runBuild()
+        os.unlink(os.path.join(self.basedir, 'summaries'))
+        self.restartBuilder()
+        for i in range(2):
+            self.runBuild()
+        self.assertEqual(self.bldr.getSummaryIndex().firstNumber, 3)
+        self.assertEqual(
+            self.numbers(self.bldr.generateFinishedBuilds()),
+            [4, 3, 2, 1, 0])
+
+    def test_prune_removes_summaries(self):
+        self.bldr.master.config.buildHorizon = 2
+        for i in range(4):
+            self.runBuild()
+        self.assertEqual(
+            [s.number for s in self.bldr.getSummaryIndex().getBuildSummaries()],
+            [3, 2])
+
+    def test_interrupted_build_reloaded(self):
+        for i in range(2):
+            self.runBuild()
+        self.interruptBuild()
+        self.assertEqual(self.bldr.getSummaryIndex().numbers, [0, 1, 2])
+
+        # load the builder saved at shutdown, as the master does on start
+        with open(os.path.join(self.basedir, 'builder'), 'rb') as f:
+            bldr = load(f)
+        bldr.master = self.bldr.master
+        bldr.basedir = self.basedir
+        bldr.status = self.bldr.status
+        bldr.determineNextBuildNumber()
+        self.assertEqual(bldr.getCurrentBuilds(), [])
+        self.assertEqual(self.numbers(bldr.generateFinishedBuilds()),
+                         [2, 1, 0])
+
+    def test_summaryIndex_not_pickled(self):
+        self.runBuild()
+        self.bldr.getSummaryIndex()
+        self.assertNotIn('summaryIndex', self.bldr.__getstate__())
+
+
+class TestBuilderStatusHistory(BuilderStatusSummariesMixin,
+                               unittest.TestCase):
+
+    def setUp(self):
+        self.setUpBuilder()
+        self.history = buildhistory.SQLBuildHistory()
+        self.history.start(self.basedir)
+        self.bldr.status.buildHistory = self.history
+
+    def tearDown(self):
+        self.history.stop()
+        self.tearDownDirs()
+
+    def test_buildFinished_records_summary(self):
+        self.runBuild(branch='br', results=FAILURE)
+        summary = self.history.getBuildSummary('bldr', 0)
+        self.assertEqual((summary.branches, summary.results),
+                         (('br',), FAILURE))
+        self.assertEqual(self.history.getFirstBuildNumber('bldr'), 0)
+
+    def test_interrupted_build_records_summary(self):
+        for i in range(2):
+            self.runBuild()
+        self.interruptBuild()
+        self.assertEqual(self.history.getBuildSummary('bldr', 2).results,
+                         None)
+        self.restartBuilder()
+        self.assertEqual(self.numbers(self.bldr.generateFinishedBuilds()),
+                         [2, 1, 0])
+
+    def test_generateFinishedBuilds_falls_back_to_pickles(self):
+        self.bldr.status.buildHistory = None
+        for i in range(3):
+            self.runBuild()
+        self.bldr.status.buildHistory = self.history
+        for i in range(2):
+            self.runBuild()
+        self.assertEqual(self.history.getFirstBuildNumber('bldr'), 3)
+        self.assertEqual(
+            self.numbers(self.bldr.generateFinishedBuilds()),
+            [4, 3, 2, 1, 0])
+
+    def test_prune_removes_summaries(self):
+        self.bldr.master.config.buildHorizon = 2
+        for i in range(4):
+            self.runBuild()
+        self.assertEqual(
+            [s.number for s in self.history.getBuildSummaries('bldr')],
+            [3, 2])
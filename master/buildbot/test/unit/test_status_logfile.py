@@ -23,6 +23,7 @@ import os
 from buildbot import config
 from buildbot.status import logfile
 from buildbot.test.util import dirs
+from buildbot.util import framedfile
 from twisted.internet import defer
 from twisted.trial import unittest
 
@@ -337,10 +338,137 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         self.config.logCompressionMethod = 'bz2'
         return self.do_test_compressLog('.bz2')
 
+    def test_compressLog_framed(self):
+        self.config.logCompressionMethod = 'framed'
+        return self.do_test_compressLog('.framed')
+
+    def test_hasContents_framed(self):
+        self.delete_logfile()
+        with open(os.path.join(self.basedir, '123-stdio.framed'), "w") as f:
+            f.write("hi")
+        self.assertTrue(self.logfile.hasContents())
+
+    def test_ranges_framed(self):
+        def prepare():
+            self.config.logCompressionMethod = 'framed'
+            d = self.logfile.compressLog()
+
+            @d.addCallback
+            def check(_):
+                self.assertFalse(os.path.exists(self.logfile.getFilename()))
+                self.assertIsInstance(self.logfile.getFile(),
+                                      framedfile.FramedFile)
+            return d
+        return self.do_test_ranges(prepare)
+
     def test_compressLog_none(self):
         self.config.logCompressionMethod = None
         return self.do_test_compressLog('', expect_comp=False)
 
+    def addLines(self, n, channel=0):
+        for i in range(n):
+            self.logfile.addEntry(channel, 'line %d\n' % i)
+
+    def test_index_written(self):
+        self.logfile.chunkSize = 11
+        self.logfile.addEntry(0, 'abc\ndef\nghi\n')
+        self.logfile.addEntry(2, 'hdr\n')
+        self.logfile.finish()
+        idx = logfile.LogIndex.load(self.logfile.getFilename() + '.idx')
+        self.assertEqual(idx.offsets, [0, 16, 21])
+        self.assertEqual(idx.channels, [0, 0, 2])
+        self.assertEqual(idx.textOffsets, [0, 11, 12])
+        self.assertEqual(idx.lineNumbers, [0, 2, 3])
+        self.assertEqual(idx.getTotals(), (16, 4))
+        self.assertEqual(idx.getTotals([0]), (12, 3))
+        self.assertEqual(idx.fileSize, 29)
+
+    def test_index_unfinished_not_loaded(self):
+        self.addLines(3)
+        self.logfile._merge()
+        self.logfile.index.indexfile.flush()
+        self.assertEqual(
+            logfile.LogIndex.load(self.logfile.getFilename() + '.idx'), None)
+
+    def test_getIndex_pickled(self):
+        self.addLines(3)
+        self.logfile.finish()
+        self.pickle_and_restore()
+        self.assertEqual(self.logfile.getIndex().getTotals(), (21, 3))
+
+    def test_getIndex_missing(self):
+        self.addLines(3)
+        self.logfile.finish()
+        self.pickle_and_restore()
+        os.unlink(self.logfile.getFilename() + '.idx')
+        self.assertEqual(self.logfile.getIndex(), None)
+
+    def do_test_ranges(self, prepare=None):
+        self.logfile.chunkSize = 20
+        self.addLines(10)
+        self.logfile.addEntry(2, 'header\n')
+        self.logfile.addEntry(1, 'err\nno newline')
+        self.logfile.finish()
+        d = defer.succeed(None)
+        if prepare:
+            d.addCallback(lambda _: prepare())
+        d.addCallback(lambda _: self.check_ranges())
+        return d
+
+    def check_ranges(self):
+        lf = self.logfile
+        self.assertEqual(''.join(lf.getChunksByLine(3, 5, [0], True)),
+                         'line 3\nline 4\n')
+        self.assertEqual(''.join(lf.getChunksByLine(9, None, [0, 1], True)),
+                         'line 9\nerr\nno newline')
+        self.assertEqual(list(lf.getChunksByLine(10, 12)),
+                         [(2, 'header\n'), (1, 'err\n')])
+        self.assertEqual(''.join(lf.getChunksByOffset(5, 16, [0], True)),
+                         '0\nline 1\nli')
+        self.assertEqual(''.join(lf.getChunksByOffset(69, None, [0, 1],
+                                                      True)),
+                         '\nerr\nno newline')
+        self.assertEqual(lf.getTextLength([0, 1]), 84)
+        self.assertEqual(lf.getLineCount([0]), 10)
+        self.assertEqual(lf.getLineCount([0, 1]), 12)
+        self.assertEqual(lf.getLineCount(), 13)
+        self.assertEqual(list(lf.readlines())[-2:], ['line 8\n', 'line 9\n'])
+
+    def test_ranges_indexed(self):
+        return self.do_test_ranges()
+
+    def test_ranges_unindexed(self):
+        def prepare():
+            self.pickle_and_restore()
+            os.unlink(self.logfile.getFilename() + '.idx')
+        return self.do_test_ranges(prepare)
+
+    def test_ranges_indexed_seek(self):
+        # ranged reads should not parse the blocks before the one they need,
+        # so corrupting the first block does not affect them
+        self.logfile.chunkSize = 20
+        self.addLines(10)
+        self.logfile.finish()
+        with open(self.logfile.getFilename(), 'r+') as f:
+            f.write('XXXX')
+        self.assertEqual(
+            ''.join(self.logfile.getChunksByLine(8, 9, [0], True)),
+            'line 8\n')
+        self.assertEqual(
+            ''.join(self.logfile.getChunksByOffset(50, 54, [0], True)),
+            'ine ')
+
+    def test_ranges_unfinished(self):
+        self.logfile.chunkSize = 20
+        self.addLines(5)
+        self.logfile._merge()
+        self.addLines(2, channel=1)
+        self.assertEqual(
+            ''.join(self.logfile.getChunksByLine(4, 6, [0, 1], True)),
+            'line 4\nline 0\n')
+        self.assertEqual(self.logfile.getLineCount([0, 1]), 7)
+        self.assertEqual(self.logfile.getTextLength([1]), 14)
+
 
 class TestHTMLLogFile(unittest.TestCase, dirs.DirsMixin):
 
@@ -16,6 +16,7 @@
 import mock
 
 from buildbot.status import base
+from buildbot.status import buildhistory
 from buildbot.status import master
 from buildbot.test.fake import fakedb
 from twisted.internet import defer
@@ -53,6 +54,73 @@ class TestStatus(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def makeBuilder(self, name, finished):
+        bldr = mock.Mock(name=name)
+        bldr.nextBuildNumber = len(finished)
+        summaries = [buildhistory.BuildSummary(number=i, started=0,
+                                               finished=f, results=0)
+                     for i, f in enumerate(finished)]
+        bldr.read = []
+
+        def generateFinishedBuildSummaries(branches, **kwargs):
+            bldr.kwargs = kwargs
+            for summary in reversed(summaries):
+                bldr.read.append(summary.number)
+                yield summary
+        bldr.generateFinishedBuildSummaries = generateFinishedBuildSummaries
+        bldr.getBuild = lambda number: (name, number)
+        return bldr
+
+    def test_generateFinishedBuilds(self):
+        s = self.makeStatus()
+        builders = dict(a=self.makeBuilder('a', [10, 20, 50]),
+                        b=self.makeBuilder('b', [15, 30, 40]))
+        s.getBuilderNames = lambda: sorted(builders)
+        s.getBuilder = builders.get
+        self.assertEqual(list(s.generateFinishedBuilds()),
+                         [('a', 2), ('b', 2), ('b', 1), ('a', 1),
+                          ('b', 0), ('a', 0)])
+        self.assertEqual(list(s.generateFinishedBuilds(builders=['b'],
+                                                       num_builds=2)),
+                         [('b', 2), ('b', 1)])
+
+    def test_generateFinishedBuilds_loads_only_yielded(self):
+        s = self.makeStatus()
+        builders = dict(a=self.makeBuilder('a', [10, 20, 50]),
+                        b=self.makeBuilder('b', [15, 30, 40]))
+        s.getBuilderNames = lambda: sorted(builders)
+        s.getBuilder = builders.get
+        for bldr in builders.values():
+            bldr.getBuild = mock.Mock(wraps=bldr.getBuild)
+        self.assertEqual(list(s.generateFinishedBuilds(num_builds=1)),
+                         [('a', 2)])
+        self.assertFalse(builders['b'].getBuild.called)
+
+    def test_generateFinishedBuilds_pushdown(self):
+        s = self.makeStatus()
+        builders = dict(a=self.makeBuilder('a', [10, 20, 50]),
+                        b=self.makeBuilder('b', [15, 30, 40]))
+        s.getBuilderNames = lambda: sorted(builders)
+        s.getBuilder = builders.get
+        list(s.generateFinishedBuilds(num_builds=2, finished_before=100,
+                                      max_search=10))
+        self.assertEqual(builders['a'].kwargs,
+                         dict(num_builds=2, finished_before=100,
+                              max_search=10))
+
+    def test_generateFinishedBuilds_bounded_lookahead(self):
+        s = self.makeStatus()
+        builders = dict((bn, self.makeBuilder(bn, range(i, 100, 10)))
+                        for i, bn in enumerate('abcdefghij'))
+        s.getBuilderNames = lambda: sorted(builders)
+        s.getBuilder = builders.get
+        gen = s.generateFinishedBuilds()
+        self.assertEqual([gen.next() for _ in range(3)],
+                         [('j', 9), ('i', 9), ('h', 9)])
+        # one summary from each builder, plus the next from the builders of
+        # the first two builds, which have been consumed
+        self.assertEqual(sum(len(b.read) for b in builders.values()), 12)
+
     @defer.inlineCallbacks
     def test_reconfigService(self):
         m = mock.Mock(name='master')
@@ -98,3 +166,33 @@ class TestStatus(unittest.TestCase):
         self.assertIdentical(sr0.master, None)
         self.assertIdentical(sr1.master, None)
         self.assertIdentical(sr2.master, None)
+
+    @defer.inlineCallbacks
+    def test_reconfigService_buildHistory(self):
+        m = mock.Mock(name='master')
+        m.basedir = '/basedir'
+        status = master.Status(m)
+        status.startService()
+
+        config = mock.Mock()
+        config.status = []
+        config.buildHistory = h1 = mock.Mock(name='h1')
+        yield status.reconfigService(config)
+        h1.start.assert_called_with('/basedir')
+        self.assertIdentical(status.buildHistory, h1)
+
+        # an unchanged store is left running
+        yield status.reconfigService(config)
+        self.assertEqual(h1.start.call_count, 1)
+        self.assertFalse(h1.stop.called)
+
+        config.buildHistory = None
+        yield status.reconfigService(config)
+        h1.stop.assert_called_with()
+        self.assertIdentical(status.buildHistory, None)
+
+        config.buildHistory = h2 = mock.Mock(name='h2')
+        yield status.reconfigService(config)
+        yield status.stopService()
+        h2.stop.assert_called_with()
+        self.assertIdentical(status.buildHistory, None)
@@ -0,0 +1,152 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+import os
+
+from buildbot import config
+from buildbot.status import logfile
+from buildbot.status.web import logs
+from buildbot.test.fake.web import FakeRequest
+from buildbot.test.util import dirs
+from twisted.internet import defer
+from twisted.trial import unittest
+
+
+class TestTextLog(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        step = mock.Mock(name='build_step_status')
+        self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.logfile = logfile.LogFile(step, 'stdio', '123-stdio')
+        self.logfile.master = mock.Mock()
+        self.logfile.master.config = config.MasterConfig()
+        self.logfile.chunkSize = 20
+        self.logfile.addHeader('running\n')
+        for i in range(1, 11):
+            self.logfile.addStdout('line %d\n' % i)
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def makeRequest(self, args={}, range=None):
+        req = FakeRequest(args)
+        req.getHeader = lambda name: range if name == 'range' else None
+        req.childLink = lambda name: name
+        return req
+
+    def render(self, args={}, range=None, asText=True, finish=True):
+        if finish:
+            self.logfile.finish()
+        resource = logs.TextLog(self.logfile)
+        resource.asText = asText
+        req = self.makeRequest(args, range)
+        d = req.test_render(resource)
+        d.addCallback(lambda _: req)
+        return d
+
+    def assertHeader(self, req, name, value):
+        req.setHeader.assert_any_call(name, value)
+
+    @defer.inlineCallbacks
+    def test_text(self):
+        req = yield self.render()
+        self.assertEqual(req.written,
+                         ''.join('line %d\n' % i for i in range(1, 11)))
+        self.assertHeader(req, 'content-length', 71)
+        self.assertHeader(req, 'accept-ranges', 'bytes')
+
+    @defer.inlineCallbacks
+    def test_text_unfinished(self):
+        d = self.render(finish=False)
+        self.logfile.finish()
+        req = yield d
+        self.assertEqual(req.written[:7], 'line 1\n')
+        self.assertFalse([c for c in req.setHeader.call_args_list
+                          if c[0][0] == 'content-length'])
+
+    @defer.inlineCallbacks
+    def test_text_tail(self):
+        req = yield self.render({'tail': ['2']})
+        self.assertEqual(req.written, 'line 9\nline 10\n')
+
+    @defer.inlineCallbacks
+    def test_text_tail_more_than_log(self):
+        req = yield self.render({'tail': ['200']})
+        self.assertEqual(req.written[:7], 'line 1\n')
+
+    @defer.inlineCallbacks
+    def test_text_lines(self):
+        req = yield self.render({'lines': ['3-4']})
+        self.assertEqual(req.written, 'line 3\nline 4\n')
+
+    @defer.inlineCallbacks
+    def test_text_lines_open(self):
+        req = yield self.render({'lines': ['9-']})
+        self.assertEqual(req.written, 'line 9\nline 10\n')
+
+    @defer.inlineCallbacks
+    def test_text_lines_invalid(self):
+        req = yield self.render({'lines': ['4-3']})
+        req.setResponseCode.assert_called_with(400)
+
+    @defer.inlineCallbacks
+    def test_html_tail(self):
+        req = yield self.render({'tail': ['1']}, asText=False)
+        self.assertIn('line 10', req.written)
+        self.assertNotIn('line 9', req.written)
+        self.assertIn('</html>', req.written)
+
+    @defer.inlineCallbacks
+    def test_html_lines_include_headers(self):
+        req = yield self.render({'lines': ['1-1']}, asText=False)
+        self.assertIn('running', req.written)
+        self.assertNotIn('line 1', req.written)
+
+    @defer.inlineCallbacks
+    def test_text_range(self):
+        req = yield self.render(range='bytes=7-13')
+        self.assertEqual(req.written, 'line 2\n')
+        req.setResponseCode.assert_called_with(206)
+        self.assertHeader(req, 'content-range', 'bytes 7-13/71')
+        self.assertHeader(req, 'content-length', 7)
+
+    @defer.inlineCallbacks
+    def test_text_range_suffix(self):
+        req = yield self.render(range='bytes=-8')
+        self.assertEqual(req.written, 'line 10\n')
+        self.assertHeader(req, 'content-range', 'bytes 63-70/71')
+
+    @defer.inlineCallbacks
+    def test_text_range_unsatisfiable(self):
+        req = yield self.render(range='bytes=100-')
+        self.assertEqual(req.written, '')
+        req.setResponseCode.assert_called_with(416)
+        self.assertHeader(req, 'content-range', 'bytes */71')
+
+    @defer.inlineCallbacks
+    def test_text_range_multiple_ignored(self):
+        req = yield self.render(range='bytes=0-1,5-6')
+        self.assertEqual(len(req.written), 71)
+        self.assertFalse(req.setResponseCode.called)
+
+    def test_head(self):
+        self.logfile.finish()
+        resource = logs.TextLog(self.logfile)
+        resource.asText = True
+        req = self.makeRequest()
+        self.assertEqual(resource.render_HEAD(req), '')
+        self.assertHeader(req, 'content-length', 71)
@@ -15,12 +15,14 @@
 
 from __future__ import with_statement
 
+import hashlib
 import os
 import shutil
 import stat
 import tarfile
 import tempfile
 
+from twisted.internet import defer
 from twisted.trial import unittest
 
 from mock import Mock
@@ -65,6 +67,42 @@ def uploadTarFile(filename, **members):
     return behavior
 
 
+def streamTarFile(filename, blocksize=100, **members):
+    def behavior(command):
+        f = StringIO()
+        archive = tarfile.TarFile(fileobj=f, name=filename, mode='w')
+        for name, content in members.iteritems():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, StringIO(content))
+        archive.close()
+        data = f.getvalue()
+        writer = command.args['writer']
+        for i in range(0, len(data), blocksize):
+            writer.remote_write(data[i:i + blocksize])
+        return writer.remote_unpack()
+    return behavior
+
+
+def uploadMultiple(**sources):
+    # stands for the slave's uploadMultiple command: each source is a
+    # (kind, data, rc) tuple, and is opened, written and done in turn; the
+    # writers of failed uploads are left open
+    def behavior(command):
+        writers = command.args['writers']
+        for source in command.args['slavesrcs']:
+            kind, data, rc = sources[source]
+            writer = writers.remote_open(source, kind)
+            writer.remote_write(data)
+            if rc == 0:
+                if kind == 'directory':
+                    writer.remote_unpack()
+                else:
+                    writer.remote_close()
+            writers.remote_done(source, rc)
+    return behavior
+
+
 class UploadError(object):
 
     def __init__(self, behavior):
@@ -118,6 +156,97 @@ class TestFileWriter(unittest.TestCase):
         mockedMkstemp.assert_called_once_with(dir=absdir)
         mockedFdopen.assert_called_once_with(7, 'wb')
 
+
+class TestStreamingDirectoryWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.destdir = os.path.abspath('destdir')
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+        os.makedirs(self.destdir)
+
+    def tearDown(self):
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    def makeTar(self, mode='w', **members):
+        f = StringIO()
+        archive = tarfile.open(fileobj=f, mode=mode)
+        for name, content in members.iteritems():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, StringIO(content))
+        archive.close()
+        return f.getvalue()
+
+    @defer.inlineCallbacks
+    def test_unpack(self, compress=None):
+        mode = 'w:' + (compress or '')
+        data = self.makeTar(mode, a='A' * 5000, b='B' * 3)
+        writer = transfer._StreamingDirectoryWriter(self.destdir, None,
+                                                    compress)
+        for i in range(0, len(data), 512):
+            yield writer.remote_write(data[i:i + 512])
+        yield writer.remote_unpack()
+        self.assertEqual(open(os.path.join(self.destdir, 'a')).read(),
+                         'A' * 5000)
+        self.assertEqual(open(os.path.join(self.destdir, 'b')).read(), 'B' * 3)
+
+    def test_unpack_gz(self):
+        return self.test_unpack('gz')
+
+    def test_unpack_bz2(self):
+        return self.test_unpack('bz2')
+
+    @defer.inlineCallbacks
+    def test_unpack_corrupt(self):
+        writer = transfer._StreamingDirectoryWriter(self.destdir, None, 'gz')
+        yield writer.remote_write('not a tarball' * 10)
+        d = writer.remote_unpack()
+        yield self.assertFailure(d, tarfile.ReadError)
+        # once unpacking has failed, writes fail too
+        d = writer.remote_write('more')
+        yield self.assertFailure(d, tarfile.ReadError)
+
+    @defer.inlineCallbacks
+    def test_maxsize(self):
+        data = self.makeTar(a='A' * 5000)
+        writer = transfer._StreamingDirectoryWriter(self.destdir, 1024, None)
+        for i in range(0, len(data), 512):
+            yield writer.remote_write(data[i:i + 512])
+        d = writer.remote_unpack()
+        yield self.assertFailure(d, tarfile.ReadError)
+
+    @defer.inlineCallbacks
+    def test_cancel(self):
+        data = self.makeTar(a='A' * 5000)
+        writer = transfer._StreamingDirectoryWriter(self.destdir, None, None)
+        yield writer.remote_write(data[:1024])
+        writer.cancel()
+        d = writer.remote_unpack()
+        yield self.assertFailure(d, IOError)
+
+    @defer.inlineCallbacks
+    def test_unpack_pool_bounded(self):
+        # with a single unpacking thread, a second upload waits for the first
+        transfer._stopUnpackPool()
+        self.addCleanup(transfer._stopUnpackPool)
+        self.patch(transfer, 'MAX_STREAMING_UNPACKS', 1)
+        data_a = self.makeTar(a='A' * 5000)
+        data_b = self.makeTar(b='B' * 5000)
+        writer_a = transfer._StreamingDirectoryWriter(self.destdir, None, None)
+        yield writer_a.remote_write(data_a[:1024])
+        writer_b = transfer._StreamingDirectoryWriter(self.destdir, None, None)
+        d_b = writer_b.remote_write(data_b[:1024])
+        yield writer_a.remote_write(data_a[1024:])
+        self.assertFalse(d_b.called)
+        yield writer_a.remote_unpack()
+        yield d_b
+        yield writer_b.remote_write(data_b[1024:])
+        yield writer_b.remote_unpack()
+        self.assertEqual(sorted(os.listdir(self.destdir)), ['a', 'b'])
+
+
 # Test buildbot.steps.transfer._TransferBuildStep class.
 
 
@@ -184,6 +313,121 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    def testConstructorWindow(self):
+        self.assertRaises(config.ConfigErrors, lambda:
+                          transfer.FileUpload(slavesrc=__file__, masterdest='xyz', window=0))
+        self.assertRaises(config.ConfigErrors, lambda:
+                          transfer.FileUpload(slavesrc=__file__, masterdest='xyz',
+                                              maxblocksize=1024 * 1024))
+
+    def testWindow(self):
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                window=8, maxblocksize=256 * 1024))
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                window=8, maxblocksize=256 * 1024,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        d = self.runStep()
+        return d
+
+    def testWindowOldSlave(self):
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                window=8, maxblocksize=256 * 1024),
+            slave_version={'*': "2.16"})
+
+        # the window is left out for slaves that do not know about it
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        d = self.runStep()
+        return d
+
+    def testChecksum(self):
+        with open(self.destfile, 'wb') as f:
+            f.write("Hello world!\n")
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                checksum=True))
+
+        tmpnames = []
+
+        def unchanged(command):
+            writer = command.args['writer']
+            tmpnames.append(writer.tmpname)
+            writer.remote_unchanged()
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                checksum=hashlib.sha1("Hello world!\n").hexdigest(),
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(unchanged)
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            with open(self.destfile, 'rb') as f:
+                self.assertEqual(f.read(), "Hello world!\n")
+            self.assertFalse(os.path.exists(tmpnames[0]))
+        return d
+
+    def testChecksumNoDest(self):
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                checksum=True))
+
+        # there is nothing to compare with
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        d = self.runStep()
+        return d
+
+    def testChecksumOldSlave(self):
+        with open(self.destfile, 'wb') as f:
+            f.write("Hello world!\n")
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                checksum=True),
+            slave_version={'*': "2.16"})
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        d = self.runStep()
+        return d
+
     def testTimestamp(self):
         self.setupStep(
             transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile, keepstamp=True))
@@ -311,6 +555,47 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    def testStream(self):
+        self.setupStep(
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir,
+                                     stream=True))
+
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress=None, maxsize=None, stream=True,
+                writer=ExpectRemoteRef(transfer._StreamingDirectoryWriter)))
+            + Expect.behavior(streamTarFile('fake.tar', test="Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(open(os.path.join(self.destdir, 'test')).read(),
+                             "Hello world!")
+        return d
+
+    def testStreamOldSlave(self):
+        self.setupStep(
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir,
+                                     stream=True),
+            slave_version={'*': "2.16"})
+
+        # the slave is not asked to stream, but the master still unpacks the
+        # archive as it arrives
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress=None, maxsize=None,
+                writer=ExpectRemoteRef(transfer._StreamingDirectoryWriter)))
+            + Expect.behavior(streamTarFile('fake.tar', test="Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
+        return self.runStep()
+
     def testFailure(self):
         self.setupStep(
             transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir))
@@ -495,6 +780,129 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
 
         return d
 
+    def testConstructorMaxParallel(self):
+        self.assertRaises(config.ConfigErrors, lambda:
+                          transfer.MultipleFileUpload(slavesrcs=["srcfile"],
+                                                      masterdest='xyz',
+                                                      maxParallel=0))
+
+    def testParallel(self):
+        sources = ["src1", "src2", "src3"]
+        self.setupStep(
+            transfer.MultipleFileUpload(slavesrcs=sources,
+                                        masterdest=self.destdir,
+                                        maxParallel=2))
+
+        self.expectCommands(
+            Expect('uploadMultiple', dict(
+                slavesrcs=sources, workdir='wkdir', maxParallel=2,
+                blocksize=16384, maxsize=None, keepstamp=False,
+                compress=None, stream=False,
+                writers=ExpectRemoteRef(transfer._MultipleUploadWriters)))
+            + Expect.behavior(uploadMultiple(
+                src1=('file', 'src1\n', 0),
+                src2=('file', 'src2\n', 0),
+                src3=('file', 'src3\n', 0)))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "3 files"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            for source in sources:
+                with open(os.path.join(self.destdir, source)) as f:
+                    self.assertEqual(f.read(), source + "\n")
+        return d
+
+    def testParallelDirectory(self):
+        self.setupStep(
+            transfer.MultipleFileUpload(slavesrcs=["srcfile", "srcdir"],
+                                        masterdest=self.destdir,
+                                        maxParallel=2))
+
+        f = StringIO()
+        archive = tarfile.TarFile(fileobj=f, name='fake.tar', mode='w')
+        archive.addfile(tarfile.TarInfo('test'), StringIO("Hello world!"))
+
+        self.expectCommands(
+            Expect('uploadMultiple', dict(
+                slavesrcs=["srcfile", "srcdir"], workdir='wkdir',
+                maxParallel=2, blocksize=16384, maxsize=None,
+                keepstamp=False, compress=None, stream=False,
+                writers=ExpectRemoteRef(transfer._MultipleUploadWriters)))
+            + Expect.behavior(uploadMultiple(
+                srcfile=('file', 'Hello world!', 0),
+                srcdir=('directory', f.getvalue(), 0)))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "2 files"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertTrue(
+                os.path.isdir(os.path.join(self.destdir, "srcdir")))
+        return d
+
+    def testParallelFailure(self):
+        class CustomStep(transfer.MultipleFileUpload):
+            uploadDone = Mock(return_value=None)
+
+        sources = ["src1", "src2"]
+        step = CustomStep(slavesrcs=sources, masterdest=self.destdir,
+                          maxParallel=2)
+        self.setupStep(step)
+
+        self.expectCommands(
+            Expect('uploadMultiple', dict(
+                slavesrcs=sources, workdir='wkdir', maxParallel=2,
+                blocksize=16384, maxsize=None, keepstamp=False,
+                compress=None, stream=False,
+                writers=ExpectRemoteRef(transfer._MultipleUploadWriters)))
+            + Expect.behavior(uploadMultiple(
+                src1=('file', 'src1\n', 1),
+                src2=('file', 'src2\n', 0)))
+            + 1)
+
+        self.expectOutcome(result=FAILURE, status_text=["uploading", "2 files"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(step.uploadDone.call_args_list, [
+                ((FAILURE, "src1", os.path.join(self.destdir, "src1")), {}),
+                ((SUCCESS, "src2", os.path.join(self.destdir, "src2")), {}),
+            ])
+            self.assertFalse(
+                os.path.exists(os.path.join(self.destdir, "src1")))
+        return d
+
+    def testParallelOldSlave(self):
+        # a slave without the uploadMultiple command uploads the sources one
+        # at a time
+        self.setupStep(
+            transfer.MultipleFileUpload(slavesrcs=["srcfile"],
+                                        masterdest=self.destdir,
+                                        maxParallel=2),
+            slave_version={'*': "2.16"})
+
+        self.expectCommands(
+            Expect('stat', dict(file="srcfile",
+                                workdir='wkdir'))
+            + Expect.update('stat', [stat.S_IFREG, 99, 99])
+            + 0,
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "1 file"])
+        d = self.runStep()
+        return d
+
     def testSubclass(self):
         class CustomStep(transfer.MultipleFileUpload):
             uploadDone = Mock(return_value=None)
@@ -544,6 +952,56 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
         return d
 
 
+class TestFileDownload(steps.BuildStepMixin, unittest.TestCase):
+
+    def setUp(self):
+        fd, self.srcfile = tempfile.mkstemp()
+        os.write(fd, "Hello world!\n")
+        os.close(fd)
+        return self.setUpBuildStep()
+
+    def tearDown(self):
+        if os.path.exists(self.srcfile):
+            os.unlink(self.srcfile)
+        return self.tearDownBuildStep()
+
+    def testChecksum(self):
+        self.setupStep(
+            transfer.FileDownload(mastersrc=self.srcfile, slavedest='dstfile',
+                                  checksum=True))
+
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                slavedest="dstfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, mode=None,
+                checksum=hashlib.sha1("Hello world!\n").hexdigest(),
+                reader=ExpectRemoteRef(transfer._FileReader)))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS,
+                           status_text=["downloading", "to", "dstfile"])
+        d = self.runStep()
+        return d
+
+    def testChecksumOldSlave(self):
+        self.setupStep(
+            transfer.FileDownload(mastersrc=self.srcfile, slavedest='dstfile',
+                                  checksum=True),
+            slave_version={'*': "2.16"})
+
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                slavedest="dstfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, mode=None,
+                reader=ExpectRemoteRef(transfer._FileReader)))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS,
+                           status_text=["downloading", "to", "dstfile"])
+        d = self.runStep()
+        return d
+
+
 class TestStringDownload(unittest.TestCase):
 
     # check that ConfigErrors is raised on invalid 'mode' argument
@@ -580,6 +1038,29 @@ class TestStringDownload(unittest.TestCase):
         else:
             self.assert_(False, "No downloadFile command found")
 
+    def testWindow(self):
+        s = transfer.StringDownload("Hello World", "hello.txt", window=4)
+        s.build = Mock()
+        s.build.getProperties.return_value = Properties()
+        s.build.getSlaveCommandVersion.return_value = "2.17"
+
+        s._step_status = Mock()
+        s.buildslave = Mock()
+        s.remote = Mock()
+
+        s.start()
+
+        for c in s.remote.method_calls:
+            name, command, args = c
+            commandName = command[3]
+            kwargs = command[-1]
+            if commandName == 'downloadFile':
+                self.assertEquals(kwargs['window'], 4)
+                self.assertNotIn('maxblocksize', kwargs)
+                break
+        else:
+            self.assert_(False, "No downloadFile command found")
+
 
 class TestJSONStringDownload(unittest.TestCase):
 
@@ -0,0 +1,91 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import zlib
+
+from buildbot.test.util import dirs
+from buildbot.util import framedfile
+from twisted.trial import unittest
+
+
+class FramedFile(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        self.setUpDirs('basedir')
+        self.filename = os.path.join('basedir', 'file.framed')
+        self.data = ''.join('line %d\n' % i for i in range(1000))
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def writeFile(self, pieces, framesize=100):
+        f = framedfile.FramedFile(self.filename, 'w', framesize=framesize)
+        for piece in pieces:
+            f.write(piece)
+        f.close()
+        return framedfile.FramedFile(self.filename, 'r')
+
+    def test_roundtrip(self):
+        f = self.writeFile([self.data])
+        self.assertEqual(f.read(), self.data)
+        self.assertEqual(f.tell(), len(self.data))
+        self.assertEqual(f.read(), '')
+
+    def test_roundtrip_small_writes(self):
+        f = self.writeFile([self.data[i:i + 7]
+                            for i in range(0, len(self.data), 7)])
+        self.assertEqual(len(f.offsets), (len(self.data) + 99) // 100)
+        self.assertEqual(f.read(), self.data)
+
+    def test_empty(self):
+        f = self.writeFile([])
+        self.assertEqual(f.read(), '')
+        self.assertEqual(f.offsets, [])
+
+    def test_seek_and_read(self):
+        f = self.writeFile([self.data])
+        f.seek(5000)
+        self.assertEqual(f.read(250), self.data[5000:5250])
+        f.seek(-10, 2)
+        self.assertEqual(f.read(), self.data[-10:])
+        f.seek(95)
+        f.seek(10, 1)
+        self.assertEqual(f.read(10), self.data[105:115])
+
+    def test_seek_decompresses_one_frame(self):
+        f = self.writeFile([self.data])
+        decompressed = []
+        real_decompress = zlib.decompress
+
+        def decompress(data):
+            decompressed.append(data)
+            return real_decompress(data)
+        self.patch(framedfile.zlib, 'decompress', decompress)
+        f.seek(4321)
+        f.read(10)
+        self.assertEqual(len(decompressed), 1)
+
+    def test_not_framed(self):
+        with open(self.filename, 'w') as f:
+            f.write('hello, world' * 10)
+        self.assertRaises(IOError,
+                          lambda: framedfile.FramedFile(self.filename, 'r'))
+
+    def test_missing(self):
+        self.assertRaises(IOError,
+                          lambda: framedfile.FramedFile(self.filename, 'r'))
@@ -26,8 +26,8 @@ class ChangeSourceMixin(object):
     This class is used for testing change sources, and handles a few things:
 
      - starting and stopping a ChangeSource service
-     - a fake C{self.master.addChange}, which adds its args
-       to the list C{self.changes_added}
+     - fake C{self.master.addChange} and C{self.master.addChanges}, which
+       add their args to the list C{self.changes_added}
     """
 
     changesource = None
@@ -48,8 +48,13 @@ class ChangeSourceMixin(object):
                             "non-ascii string for key '%s': %r" % (k, v))
             self.changes_added.append(kwargs)
             return defer.succeed(mock.Mock())
+
+        def addChanges(changes):
+            return defer.gatherResults([addChange(**kwargs)
+                                        for kwargs in changes])
         self.master = make_master(testcase=self, wantDb=True)
         self.master.addChange = addChange
+        self.master.addChanges = addChanges
         return defer.succeed(None)
 
     def tearDownChangeSource(self):
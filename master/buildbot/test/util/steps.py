@@ -337,6 +337,7 @@ class BuildStepIntegrationMixin(object):
         self.master = fakemaster.make_master(testcase=self, wantDb=True)
         self.builder = builder.Builder('test', _addServices=False)
         self.builder.master = self.master
+        self.builder.botmaster = self.master.botmaster
         yield self.builder.startService()
 
         self.factory = factory.BuildFactory()  # will have steps added later
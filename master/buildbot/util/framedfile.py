@@ -0,0 +1,176 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+A seekable compressed file format.
+
+The data is split into frames of C{framesize} uncompressed bytes, and each
+frame is compressed independently with zlib.  The frames are followed by an
+index giving the uncompressed and compressed offset of each frame, and a
+fixed-size footer locating the index.  A reader can therefore seek to any
+uncompressed offset by decompressing just the frame that contains it,
+where a gzip or bzip2 stream has to be decompressed from the beginning.
+"""
+
+import bisect
+import struct
+import zlib
+
+MAGIC = 'BBFRAMED'
+FRAMESIZE = 64 * 1024
+
+# uncompressed offset, compressed offset
+_ENTRY = struct.Struct('!QQ')
+# index offset, number of frames, uncompressed size, magic
+_FOOTER = struct.Struct('!QQQ8s')
+
+
+class FramedFile(object):
+
+    """
+    A file-like object for reading (mode C{'r'}) or writing (mode C{'w'})
+    a framed file, similar to L{bz2.BZ2File} and L{gzip.GzipFile}.  Reading
+    supports C{seek} and C{tell} in terms of uncompressed offsets.
+    """
+
+    def __init__(self, filename, mode='r', framesize=FRAMESIZE, level=6):
+        self.mode = mode
+        if mode == 'r':
+            self.fileobj = open(filename, 'rb')
+            try:
+                self._readIndex()
+            except:
+                self.fileobj.close()
+                raise
+            self.pos = 0
+            self._frame = None
+            self._frameData = ''
+        elif mode == 'w':
+            self.fileobj = open(filename, 'wb')
+            self.framesize = framesize
+            self.level = level
+            self.offsets = []
+            self.compressedOffsets = []
+            self.size = 0
+            self._buffer = []
+            self._buffered = 0
+        else:
+            raise ValueError("mode must be 'r' or 'w'")
+
+    def _readIndex(self):
+        f = self.fileobj
+        f.seek(0, 2)
+        end = f.tell()
+        if end < _FOOTER.size:
+            raise IOError("not a framed file")
+        f.seek(end - _FOOTER.size)
+        indexOffset, frames, self.size, magic = \
+            _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise IOError("not a framed file")
+        f.seek(indexOffset)
+        data = f.read(frames * _ENTRY.size)
+        if len(data) != frames * _ENTRY.size:
+            raise IOError("truncated framed file")
+        self.offsets = []
+        self.compressedOffsets = []
+        for i in xrange(frames):
+            offset, compressedOffset = _ENTRY.unpack_from(data,
+                                                          i * _ENTRY.size)
+            self.offsets.append(offset)
+            self.compressedOffsets.append(compressedOffset)
+        # the end of the last frame is the start of the index
+        self.compressedOffsets.append(indexOffset)
+
+    # writing
+
+    def write(self, data):
+        assert self.mode == 'w', "file is not open for writing"
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.framesize:
+            data = ''.join(self._buffer)
+            start = 0
+            while len(data) - start >= self.framesize:
+                self._writeFrame(data[start:start + self.framesize])
+                start += self.framesize
+            self._buffer = [data[start:]]
+            self._buffered = len(data) - start
+
+    def _writeFrame(self, data):
+        self.offsets.append(self.size)
+        self.compressedOffsets.append(self.fileobj.tell())
+        self.fileobj.write(zlib.compress(data, self.level))
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+    # reading
+
+    def _getFrame(self, frame):
+        if frame != self._frame:
+            start = self.compressedOffsets[frame]
+            self.fileobj.seek(start)
+            compressed = self.fileobj.read(
+                self.compressedOffsets[frame + 1] - start)
+            self._frameData = zlib.decompress(compressed)
+            self._frame = frame
+        return self._frameData
+
+    def read(self, size=-1):
+        assert self.mode == 'r', "file is not open for reading"
+        if size < 0:
+            size = self.size - self.pos
+        result = []
+        while size > 0 and self.pos < self.size:
+            frame = bisect.bisect_right(self.offsets, self.pos) - 1
+            data = self._getFrame(frame)
+            start = self.pos - self.offsets[frame]
+            piece = data[start:start + size]
+            result.append(piece)
+            self.pos += len(piece)
+            size -= len(piece)
+        return ''.join(result)
+
+    def seek(self, offset, whence=0):
+        assert self.mode == 'r', "file is not open for reading"
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, offset)
+
+    def tell(self):
+        if self.mode == 'w':
+            return self.size + self._buffered
+        return self.pos
+
+    def close(self):
+        if self.fileobj is None:
+            return
+        if self.mode == 'w':
+            data = ''.join(self._buffer)
+            if data:
+                self._writeFrame(data)
+            self._buffer = []
+            self._buffered = 0
+            indexOffset = self.fileobj.tell()
+            for entry in zip(self.offsets, self.compressedOffsets):
+                self.fileobj.write(_ENTRY.pack(*entry))
+            self.fileobj.write(_FOOTER.pack(indexOffset, len(self.offsets),
+                                            self.size, MAGIC))
+        self.fileobj.close()
+        self.fileobj = None
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# Measure the throughput of file uploads and downloads between a slave and
+# the master, as done by the FileUpload and FileDownload steps, over a
+# loopback link with an added delay, for several transfer windows.  The
+# slave's transfer commands talk over PB to the master's _FileWriter and
+# _FileReader, through a proxy that delays the data in each direction.
+#
+# The slave side is run in this process, so buildslave must be importable.
+# Run from the master directory with both on PYTHONPATH:
+#
+#   PYTHONPATH=.:../slave python contrib/benchmarks/file_transfer.py \
+#       --latency 40 --size 8 --windows 1,4,16
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.python import usage
+from twisted.spread import pb
+
+from buildbot.steps.transfer import _FileReader
+from buildbot.steps.transfer import _FileWriter
+from buildslave.commands import transfer
+
+
+class Options(usage.Options):
+    optParameters = [
+        ("latency", "l", 40, "round-trip time to add, in ms", int),
+        ("size", "s", 4, "size of the file to transfer, in MB", int),
+        ("blocksize", "b", 16 * 1024, "initial block size, in bytes", int),
+        ("maxblocksize", "m", 256 * 1024,
+         "size blocks may grow to, with a window above 1", int),
+        ("windows", "w", "1,4,16",
+         "comma-separated transfer windows to try"),
+    ]
+
+
+class DelayingProxy(protocol.Protocol):
+
+    # forwards data between a client and the server, after half of the
+    # round-trip time in each direction
+
+    def __init__(self, delay, peer=None):
+        self.delay = delay
+        self.peer = peer
+        self.buffered = []
+
+    def connectionMade(self):
+        if self.peer is None:
+            # a client connection; connect to the server
+            server = protocol.ClientCreator(reactor, DelayingProxy,
+                                            self.delay, self)
+            d = server.connectTCP('127.0.0.1', self.factory.serverPort)
+
+            @d.addCallback
+            def connected(peer):
+                self.peer = peer
+                for data in self.buffered:
+                    peer.transport.write(data)
+                self.buffered = []
+
+    def dataReceived(self, data):
+        reactor.callLater(self.delay, self.forward, data)
+
+    def forward(self, data):
+        if self.peer and self.peer.transport:
+            self.peer.transport.write(data)
+        else:
+            self.buffered.append(data)
+
+    def connectionLost(self, reason):
+        if self.peer and self.peer.transport:
+            self.peer.transport.loseConnection()
+
+
+class Root(pb.Root):
+
+    def remote_writer(self, path):
+        return _FileWriter(path, None, None)
+
+    def remote_reader(self, path):
+        return _FileReader(open(path, 'rb'))
+
+
+class FakeSlaveBuilder(object):
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+    def sendUpdate(self, data):
+        if 'stderr' in data:
+            print "slave: %s" % (data['stderr'],)
+
+
+@defer.inlineCallbacks
+def timeCommand(cmdclass, basedir, args):
+    cmd = cmdclass(FakeSlaveBuilder(basedir), 'benchmark', args)
+    start = time.time()
+    yield cmd.doStart()
+    defer.returnValue(time.time() - start)
+
+
+@defer.inlineCallbacks
+def benchmark(_, config):
+    basedir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(basedir, 'source')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(config['size'] * 1024 * 1024))
+
+        server = reactor.listenTCP(0, pb.PBServerFactory(Root()),
+                                   interface='127.0.0.1')
+        proxyFactory = protocol.Factory()
+        proxyFactory.protocol = lambda: DelayingProxy(
+            config['latency'] / 2000.0)
+        proxyFactory.serverPort = server.getHost().port
+        proxy = reactor.listenTCP(0, proxyFactory, interface='127.0.0.1')
+
+        client = pb.PBClientFactory()
+        reactor.connectTCP('127.0.0.1', proxy.getHost().port, client)
+        root = yield client.getRootObject()
+
+        print "%dMB over %dms round trips" % (config['size'],
+                                              config['latency'])
+        print "%8s %14s %14s" % ('window', 'upload KB/s', 'download KB/s')
+        for window in [int(w) for w in config['windows'].split(',')]:
+            maxblocksize = config['maxblocksize'] if window > 1 else None
+            dest = os.path.join(basedir, 'uploaded')
+            writer = yield root.callRemote('writer', dest)
+            upload = yield timeCommand(transfer.SlaveFileUploadCommand,
+                                       basedir,
+                                       dict(workdir='.', slavesrc='source',
+                                            writer=writer, maxsize=None,
+                                            blocksize=config['blocksize'],
+                                            keepstamp=False, window=window,
+                                            maxblocksize=maxblocksize))
+            os.unlink(dest)
+
+            reader = yield root.callRemote('reader', source)
+            download = yield timeCommand(transfer.SlaveFileDownloadCommand,
+                                         basedir,
+                                         dict(workdir='.',
+                                              slavedest='downloaded',
+                                              reader=reader, maxsize=None,
+                                              blocksize=config['blocksize'],
+                                              mode=None, window=window,
+                                              maxblocksize=maxblocksize))
+            os.unlink(os.path.join(basedir, 'downloaded'))
+
+            kb = config['size'] * 1024
+            print "%8d %14.0f %14.0f" % (window, kb / upload, kb / download)
+
+        client.disconnect()
+        yield proxy.stopListening()
+        yield server.stopListening()
+    finally:
+        shutil.rmtree(basedir)
+
+
+def main():
+    config = Options()
+    try:
+        config.parseOptions()
+    except usage.error, e:
+        print "%s: %s" % (sys.argv[0], e)
+        print
+        c = Options()
+        print str(c)
+        sys.exit(1)
+
+    task.react(benchmark, [config])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Measure how Status.generateFinishedBuilds, which merges the finished
+# builds of all builders by finish time (for the waterfall, feeds and
+# one-line-per-build pages), scales with the number of builders.  The
+# current heap-based merge is compared with the previous approach, which
+# re-sorted one candidate per builder for every build it produced.
+#
+# Builders are simulated in memory, so this measures the merge alone.
+#
+# Run from the master directory, or with buildbot on PYTHONPATH:
+#
+#   python contrib/benchmarks/finished_builds_merge.py --builders 10,100,300
+
+import random
+import sys
+import time
+
+from twisted.python import usage
+
+from buildbot.status import master
+from buildbot.status.buildhistory import BuildSummary
+
+
+class Options(usage.Options):
+    optParameters = [
+        ("builders", "b", "10,30,100,300",
+         "comma-separated numbers of builders to try"),
+        ("builds", "n", 200, "finished builds per builder", int),
+        ("num-builds", None, 100, "builds to produce from each merge", int),
+        ("repeat", "r", 20, "merges to time for each builder count", int),
+    ]
+
+
+class FakeBuilder(object):
+
+    def __init__(self, rand, builds):
+        self.summaries = []
+        finished = 0
+        for number in range(builds):
+            finished += rand.randint(60, 3600)
+            self.summaries.append(BuildSummary(number, finished - 60,
+                                               finished, 0))
+        self.summaries.reverse()
+
+    def generateFinishedBuildSummaries(self, branches=[], num_builds=None,
+                                       finished_before=None, max_search=200,
+                                       **kwargs):
+        return iter(self.summaries[:max_search])
+
+    def getBuild(self, number):
+        return number
+
+
+class FakeStatus(master.Status):
+
+    def __init__(self, builders):
+        self.builders = builders
+
+    def getBuilderNames(self):
+        return sorted(self.builders)
+
+    def getBuilder(self, name):
+        return self.builders[name]
+
+
+def sortMerge(status, num_builds):
+    # the merge as it was before the heap: refill a candidate from each
+    # builder, sort the candidates, and take the most recent
+    builders = [status.getBuilder(bn) for bn in status.getBuilderNames()]
+    sources = [b.generateFinishedBuildSummaries() for b in builders]
+    next_build = [None] * len(sources)
+    got = 0
+    while True:
+        for i, g in enumerate(sources):
+            if next_build[i] or not g:
+                continue
+            try:
+                next_build[i] = g.next()
+            except StopIteration:
+                sources[i] = None
+        candidates = [(i, b, b.finished)
+                      for i, b in enumerate(next_build)
+                      if b is not None]
+        candidates.sort(lambda x, y: cmp(x[2], y[2]))
+        if not candidates:
+            return
+        i, summary, _ = candidates[-1]
+        next_build[i] = None
+        got += 1
+        yield builders[i].getBuild(summary.number)
+        if got >= num_builds:
+            return
+
+
+def heapMerge(status, num_builds):
+    return status.generateFinishedBuilds(num_builds=num_builds)
+
+
+def timeMerge(merge, status, config):
+    start = time.time()
+    for _ in range(config['repeat']):
+        for _ in merge(status, config['num-builds']):
+            pass
+    return (time.time() - start) / config['repeat']
+
+
+def benchmark(config):
+    print "%8s %14s %14s %8s" % ('builders', 'sort merge ms', 'heap merge ms',
+                                 'speedup')
+    for count in [int(c) for c in config['builders'].split(',')]:
+        rand = random.Random(count)
+        status = FakeStatus(dict(('builder%d' % i,
+                                  FakeBuilder(rand, config['builds']))
+                                 for i in range(count)))
+        sortTime = timeMerge(sortMerge, status, config)
+        heapTime = timeMerge(heapMerge, status, config)
+        print "%8d %14.2f %14.2f %8.1f" % (count, sortTime * 1000,
+                                           heapTime * 1000,
+                                           sortTime / heapTime)
+
+
+def main():
+    config = Options()
+    try:
+        config.parseOptions()
+    except usage.error, e:
+        print "%s: %s" % (sys.argv[0], e)
+        print
+        c = Options()
+        print str(c)
+        sys.exit(1)
+
+    benchmark(config)
+
+if __name__ == '__main__':
+    main()
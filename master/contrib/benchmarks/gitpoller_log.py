@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Measure how long GitPoller takes to read the details of the new commits in
+# a poll, for several numbers of commits.  The current single, streamed
+# `git log` is compared with the previous approach, which ran four git
+# commands (timestamp, author, files and comments) for each commit.
+#
+# A synthetic repository is made in a temporary directory with git
+# fast-import, so git must be on the PATH; the changes are given to a fake
+# master, so this measures reading the commits alone.
+#
+# Run from the master directory, or with buildbot on PYTHONPATH:
+#
+#   python contrib/benchmarks/gitpoller_log.py --commits 100,1000
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.internet import utils
+from twisted.python import usage
+
+from buildbot.changes import gitpoller
+
+
+class Options(usage.Options):
+    optParameters = [
+        ("commits", "c", "10,100,1000",
+         "comma-separated numbers of new commits to try"),
+        ("files", "f", 5, "files changed by each commit", int),
+    ]
+
+
+class FakeMaster(object):
+
+    def __init__(self):
+        self.changes = []
+
+    def addChanges(self, changes):
+        self.changes.extend(changes)
+        return defer.succeed(changes)
+
+
+def makeRepository(path, commits, files):
+    # one root commit, followed by the given number of commits
+    subprocess.check_call(['git', 'init', '--quiet', '--bare', path])
+    stream = []
+    for number in range(commits + 1):
+        message = 'commit %d\n\nchanging %d files\n' % (number, files)
+        stream.append('commit refs/heads/master\n'
+                      'committer A U Thor <author@example.com> %d +0000\n'
+                      'data %d\n%s' % (1273258009 + number, len(message),
+                                       message))
+        for f in range(files):
+            content = '%d\n' % number
+            stream.append('M 644 inline dir%d/file%d\ndata %d\n%s'
+                          % (f % 3, (number + f) % (files * 4), len(content),
+                             content))
+        stream.append('\n')
+    importer = subprocess.Popen(['git', 'fast-import', '--quiet'],
+                                cwd=path, stdin=subprocess.PIPE)
+    importer.communicate(''.join(stream))
+    revs = subprocess.check_output(['git', 'rev-list', '--reverse', 'master'],
+                                   cwd=path).split()
+    return revs[0], revs[-1]
+
+
+@defer.inlineCallbacks
+def perCommitLog(poller, lastRev, newRev):
+    # the extraction as it was before the single git log: list the new
+    # commits, then run four git commands for each
+    def git(*args):
+        d = utils.getProcessOutputAndValue(poller.gitbin, args,
+                                           path=poller.workdir,
+                                           env=os.environ)
+        d.addCallback(lambda res: res[0].strip())
+        return d
+
+    revs = yield git('log', '--format=%H', '%s..%s' % (lastRev, newRev), '--')
+    changes = []
+    for rev in reversed(revs.split()):
+        results = yield defer.gatherResults([
+            git('log', '--no-walk', '--format=%ct', rev, '--'),
+            git('log', '--no-walk', '--format=%aN <%aE>', rev, '--'),
+            git('log', '--name-only', '--no-walk', '--format=%n', rev, '--'),
+            git('log', '--no-walk', '--format=%s%n%b', rev, '--'),
+        ])
+        timestamp, author, files, comments = results
+        changes.append((rev, float(timestamp), author,
+                        [f for f in files.splitlines() if f], comments))
+    defer.returnValue(len(changes))
+
+
+@defer.inlineCallbacks
+def singleLog(poller, lastRev, newRev):
+    poller.master = FakeMaster()
+    poller.lastRev = {'master': lastRev}
+    yield poller._process_changes(newRev, 'master')
+    defer.returnValue(len(poller.master.changes))
+
+
+@defer.inlineCallbacks
+def timeExtraction(extract, poller, lastRev, newRev):
+    start = time.time()
+    count = yield extract(poller, lastRev, newRev)
+    defer.returnValue((count, time.time() - start))
+
+
+@defer.inlineCallbacks
+def benchmark(_, config):
+    print "%8s %16s %16s %8s" % ('commits', 'per-commit ms', 'single log ms',
+                                 'speedup')
+    for count in [int(c) for c in config['commits'].split(',')]:
+        basedir = tempfile.mkdtemp()
+        try:
+            repo = os.path.join(basedir, 'repo.git')
+            lastRev, newRev = makeRepository(repo, count, config['files'])
+            poller = gitpoller.GitPoller(repo, workdir=repo)
+
+            perCommit = yield timeExtraction(perCommitLog, poller,
+                                             lastRev, newRev)
+            single = yield timeExtraction(singleLog, poller, lastRev, newRev)
+            assert perCommit[0] == single[0] == count
+            print "%8d %16.0f %16.0f %8.1f" % (count, perCommit[1] * 1000,
+                                               single[1] * 1000,
+                                               perCommit[1] / single[1])
+        finally:
+            shutil.rmtree(basedir)
+
+
+def main():
+    config = Options()
+    try:
+        config.parseOptions()
+    except usage.error, e:
+        print "%s: %s" % (sys.argv[0], e)
+        print
+        c = Options()
+        print str(c)
+        sys.exit(1)
+
+    task.react(benchmark, [config])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Compare the log compression methods supported by the buildmaster
+# (c['logCompressionMethod']) on compression ratio, compression time, and
+# the latency of reading a small range at a random offset, which is what the
+# web status does when showing the tail or a slice of a compressed log.
+#
+# Run from the master directory, or with buildbot on PYTHONPATH:
+#
+#   python contrib/benchmarks/log_compression.py --size 50 --reads 20
+
+import bz2
+import gzip
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.python import usage
+
+from buildbot.util.framedfile import FramedFile
+
+
+class Options(usage.Options):
+    optParameters = [
+        ("size", "s", 20, "size of the synthetic log, in megabytes", int),
+        ("reads", "r", 20, "number of random reads to time", int),
+        ("readsize", None, 4096, "bytes to read at each offset", int),
+    ]
+
+
+def makeLog(filename, size):
+    # something resembling compiler output: repetitive, but not trivially so
+    rand = random.Random(0)
+    words = ['gcc', '-O2', '-Wall', '-c', 'src/module%d.c', '-o',
+             'build/module%d.o', 'warning:', 'unused variable', "'tmp%d'",
+             'In function', "'frob_widget'", 'note:', 'declared here']
+    f = open(filename, 'wb')
+    written = 0
+    while written < size:
+        line = ' '.join(w % rand.randint(0, 5000) if '%d' in w else w
+                        for w in rand.sample(words, 8)) + '\n'
+        chunk = '%d:0%s,' % (len(line) + 1, line)
+        f.write(chunk)
+        written += len(chunk)
+    f.close()
+    return written
+
+
+METHODS = [
+    ('bz2', lambda fn, mode: bz2.BZ2File(fn, mode)),
+    ('gz', lambda fn, mode: gzip.GzipFile(fn, mode)),
+    ('framed', lambda fn, mode: FramedFile(fn, mode)),
+]
+
+
+def benchmark(basedir, config):
+    raw = os.path.join(basedir, 'log')
+    size = makeLog(raw, config['size'] * 1024 * 1024)
+    rand = random.Random(1)
+    offsets = [rand.randint(0, size - config['readsize'])
+               for _ in range(config['reads'])]
+
+    print "%-8s %12s %8s %12s %16s" % ('method', 'bytes', 'ratio',
+                                       'compress s', 'random read ms')
+    print "%-8s %12d %8.2f %12s %16s" % ('none', size, 1.0, '-', '-')
+    for name, opener in METHODS:
+        compressed = raw + '.' + name
+        start = time.time()
+        infile = open(raw, 'rb')
+        cf = opener(compressed, 'w')
+        shutil.copyfileobj(infile, cf, 1024 * 1024)
+        cf.close()
+        infile.close()
+        compressTime = time.time() - start
+
+        # open a fresh reader for every read, as LogFile.getFile does
+        start = time.time()
+        for offset in offsets:
+            f = opener(compressed, 'r')
+            f.seek(offset)
+            f.read(config['readsize'])
+            f.close()
+        readTime = (time.time() - start) / len(offsets)
+
+        csize = os.path.getsize(compressed)
+        print "%-8s %12d %8.2f %12.2f %16.2f" % (
+            name, csize, float(size) / csize, compressTime, readTime * 1000)
+
+
+def main():
+    config = Options()
+    try:
+        config.parseOptions()
+    except usage.error, e:
+        print "%s: %s" % (sys.argv[0], e)
+        print
+        c = Options()
+        print str(c)
+        sys.exit(1)
+
+    basedir = tempfile.mkdtemp()
+    try:
+        benchmark(basedir, config)
+    finally:
+        shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    main()
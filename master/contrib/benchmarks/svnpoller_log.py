@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Measure how long SVNPoller takes to find the new revisions in an
+# `svn log --xml --verbose` output, and the memory it needs, for revisions
+# that change several numbers of paths.  The current streaming parser, which
+# stops at the last revision seen, is compared with the previous approach,
+# which built a minidom tree of the whole log and scanned it.
+#
+# The log is synthetic and is parsed in this process, so this measures the
+# parsing alone.  Each approach runs in a forked process, to measure its
+# peak memory use, so this needs a POSIX system.
+#
+# Run from the master directory, or with buildbot on PYTHONPATH:
+#
+#   python contrib/benchmarks/svnpoller_log.py --paths 100,1000,5000
+
+import os
+import resource
+import sys
+import time
+import xml.dom.minidom
+
+from twisted.internet import defer
+from twisted.python import usage
+
+from buildbot.changes import svnpoller
+
+
+class Options(usage.Options):
+    optParameters = [
+        ("paths", "p", "100,1000,5000",
+         "comma-separated numbers of paths changed by each revision"),
+        ("revisions", "r", 100, "revisions in the log, as with histmax",
+         int),
+        ("new", "n", 5, "revisions that are new since the last poll", int),
+    ]
+
+
+def makeLog(revisions, paths):
+    # newest first, as svn prints it
+    entries = []
+    for rev in range(revisions, 0, -1):
+        entries.append('<logentry revision="%d">\n'
+                       '<author>author%d</author>\n'
+                       '<date>2014-01-01T00:00:00.000000Z</date>\n'
+                       '<paths>\n' % (rev, rev % 7))
+        for p in range(paths):
+            entries.append('<path kind="file" action="M">'
+                           '/project/trunk/dir%d/file%d.c</path>\n'
+                           % (p % 50, (rev + p) % (paths * 2)))
+        entries.append('</paths>\n<msg>revision %d</msg>\n</logentry>\n'
+                       % (rev,))
+    return ('<?xml version="1.0"?>\n<log>\n%s</log>\n'
+            % (''.join(entries),))
+
+
+def minidomLog(output, last_change):
+    # the extraction as it was before the streaming parser: parse the whole
+    # log, then scan the entries down to the last change
+    doc = xml.dom.minidom.parseString(output)
+    new = []
+    for el in doc.getElementsByTagName("logentry"):
+        if int(el.getAttribute("revision")) == last_change:
+            break
+        paths = ["".join(t.data for t in p.childNodes)
+                 for p in el.getElementsByTagName("path")]
+        new.append((el.getAttribute("revision"), paths))
+    return len(new)
+
+
+def streamingLog(output, last_change):
+    poller = svnpoller.SVNPoller('file:///project/trunk',
+                                 split_file=svnpoller.split_file_branches)
+    poller._prefix = 'project'
+    poller.last_change = last_change
+
+    def getProcessLog(args, entryReceived):
+        # feed the log as it would arrive from svn
+        parser = svnpoller._SVNLogParser(entryReceived)
+        for i in range(0, len(output), 65536):
+            parser.feed(output[i:i + 65536])
+            if parser.stopped:
+                break
+        return defer.succeed(None)
+    poller.getProcessLog = getProcessLog
+
+    changes = []
+    d = poller.get_logs(None)
+    d.addCallback(poller.get_new_logentries)
+    d.addCallback(poller.create_changes)
+    d.addCallback(changes.extend)
+    return len(changes)
+
+
+def measure(extract, output, last_change):
+    # run in a child, to find the memory used by this extraction alone
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        count = extract(output, last_change)
+        elapsed = time.time() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+        os.write(w, '%d %f %d' % (count, elapsed, peak))
+        os._exit(0)
+    os.close(w)
+    result = os.read(r, 1024)
+    os.close(r)
+    os.waitpid(pid, 0)
+    count, elapsed, peak = result.split()
+    return int(count), float(elapsed), int(peak)
+
+
+def benchmark(config):
+    print "%8s %10s %12s %12s %12s %12s" % ('paths', 'log MB',
+                                            'minidom ms', 'minidom MB',
+                                            'stream ms', 'stream MB')
+    for paths in [int(p) for p in config['paths'].split(',')]:
+        output = makeLog(config['revisions'], paths)
+        last_change = config['revisions'] - config['new']
+        old = measure(minidomLog, output, last_change)
+        new = measure(streamingLog, output, last_change)
+        assert old[0] == new[0] == config['new']
+        # ru_maxrss is in kB on Linux
+        print "%8d %10.1f %12.0f %12.1f %12.0f %12.1f" % (
+            paths, len(output) / 1048576.0,
+            old[1] * 1000, old[2] / 1024.0,
+            new[1] * 1000, new[2] / 1024.0)
+
+
+def main():
+    config = Options()
+    try:
+        config.parseOptions()
+    except usage.error, e:
+        print "%s: %s" % (sys.argv[0], e)
+        print
+        c = Options()
+        print str(c)
+        sys.exit(1)
+
+    benchmark(config)
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,17 @@ class UnknownCommand(pb.Error):
     pass
 
 
+def _updateSize(data):
+    # the number of bytes of data in a status update, roughly
+    if isinstance(data, basestring):
+        return len(data)
+    if isinstance(data, dict):
+        data = data.values()
+    if isinstance(data, (list, tuple)):
+        return sum(_updateSize(v) for v in data)
+    return 0
+
+
 class SlaveBuilder(pb.Referenceable, service.Service):
 
     """This is the local representation of a single Builder: it handles a
@@ -58,6 +69,14 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # is running. We use it to implement the stopBuild method.
     command = None
 
+    # Status updates are sent to the master in batches, one at a time: while
+    # the master has not acknowledged a batch, later updates are queued, to
+    # be sent together in the next one.  A batch holds up to maxUpdateBytes
+    # of data (or a single larger update), and the producers registered by
+    # the running command are paused while more than that is queued, so that
+    # a chatty command cannot outrun a slow master.
+    maxUpdateBytes = 1024 * 1024
+
     # .remoteStep is a ref to the master-side BuildStep object, and is set
     # when the step is started
     remoteStep = None
@@ -65,6 +84,11 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def __init__(self, name):
         # service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self.updateQueue = []
+        self.queuedUpdateBytes = 0
+        self.updateInFlight = False
+        self.updateProducers = []
+        self.updatesPaused = False
 
     def __repr__(self):
         return "<SlaveBuilder '%s' at %d>" % (self.name, id(self))
@@ -112,6 +136,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self._dropUpdates()
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -136,6 +161,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         if self.command:
             log.msg("leftover command, dropping it")
             self.stopCommand()
+        self._dropUpdates()
 
         try:
             factory = registry.getFactory(command)
@@ -176,25 +202,85 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # sendUpdate is invoked by the Commands we spawn
     def sendUpdate(self, data):
         """This sends the status update to the master-side
-        L{buildbot.process.step.RemoteCommand} object, giving it a sequence
-        number in the process. It adds the update to a queue, and asks the
-        master to acknowledge the update so it can be removed from that
-        queue."""
+        L{buildbot.process.step.RemoteCommand} object. It adds the update to a
+        queue, which is sent to the master in batches, each acknowledged by
+        the master before the next is sent."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
             # service is running or not. If we aren't running, don't send any
             # status messages.
             return
-        # the update[1]=0 comes from the leftover 'updateNum', which the
-        # master still expects to receive. Provide it to avoid significant
-        # interoperability issues between new slaves and old masters.
         if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
-            d = self.remoteStep.callRemote("update", updates)
-            d.addCallback(self.ackUpdate)
-            d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+            size = _updateSize(data)
+            self.updateQueue.append((data, size))
+            self.queuedUpdateBytes += size
+            self._sendUpdates()
+            if self.queuedUpdateBytes > self.maxUpdateBytes:
+                self._pauseProducers()
+
+    def _sendUpdates(self, flush=False):
+        # send the next batch of queued updates, unless the previous one has
+        # not been acknowledged yet; with flush, send them all regardless
+        if not self.updateQueue or not self.remoteStep:
+            return
+        if self.updateInFlight and not flush:
+            return
+        updates = []
+        size = 0
+        while self.updateQueue:
+            data, datasize = self.updateQueue[0]
+            full = size + datasize > self.maxUpdateBytes
+            if updates and full and not flush:
+                break
+            del self.updateQueue[0]
+            # the update[1]=0 comes from the leftover 'updateNum', which the
+            # master still expects to receive. Provide it to avoid significant
+            # interoperability issues between new slaves and old masters.
+            updates.append([data, 0])
+            size += datasize
+        self.queuedUpdateBytes -= size
+        self.updateInFlight = True
+        d = self.remoteStep.callRemote("update", updates)
+        d.addCallback(self.ackUpdate)
+        d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+        d.addCallback(self._updatesSent)
+
+    def _updatesSent(self, _):
+        self.updateInFlight = False
+        self._sendUpdates()
+        if self.queuedUpdateBytes <= self.maxUpdateBytes / 2:
+            self._resumeProducers()
+
+    def _dropUpdates(self):
+        self.updateQueue = []
+        self.queuedUpdateBytes = 0
+        self._resumeProducers()
+
+    def registerUpdateProducer(self, producer):
+        """Register an L{IPushProducer} of status updates, such as a running
+        process, to be paused while the master is behind."""
+        self.updateProducers.append(producer)
+        if self.updatesPaused:
+            producer.pauseProducing()
+
+    def unregisterUpdateProducer(self, producer):
+        if producer in self.updateProducers:
+            self.updateProducers.remove(producer)
+
+    def _pauseProducers(self):
+        if self.updatesPaused:
+            return
+        self.updatesPaused = True
+        for producer in self.updateProducers:
+            producer.pauseProducing()
+
+    def _resumeProducers(self):
+        if not self.updatesPaused:
+            return
+        self.updatesPaused = False
+        for producer in self.updateProducers:
+            producer.resumeProducing()
 
     def ackUpdate(self, acknum):
         self.activity()  # update the "last activity" timer
@@ -223,6 +309,8 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             log.msg(" but we weren't running, quitting silently")
             return
         if self.remoteStep:
+            # send the updates still queued, ahead of the completion
+            self._sendUpdates(flush=True)
             self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
             d = self.remoteStep.callRemote("complete", failure)
             d.addCallback(self.ackComplete)
@@ -37,7 +37,7 @@ from buildslave.interfaces import ISlaveCommand
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "2.16"
+command_version = "2.17"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -72,6 +72,14 @@ command_version = "2.16"
 #  >= 2.16: 'sigtermTime' option is added to SlaveShellCommand
 #  >= 2.16: runprocess supports obfuscation via tuples (#1748)
 #  >= 2.16: listdir command added to read a directory
+#  >= 2.17: uploadFile, uploadDirectory and downloadFile accept 'window' and
+#           'maxblocksize'
+#  >= 2.17: uploadDirectory accepts 'stream'
+#  >= 2.17: uploadFile and downloadFile accept 'checksum', to skip unchanged
+#           files
+#  >= 2.17: shell accepts 'compress', to send log data compressed with zlib
+#  >= 2.17: uploadMultiple command added, to upload several files and
+#           directories at once
 
 
 class Command:
@@ -20,6 +20,7 @@ commandRegistry = {
     "shell": "buildslave.commands.shell.SlaveShellCommand",
     "uploadFile": "buildslave.commands.transfer.SlaveFileUploadCommand",
     "uploadDirectory": "buildslave.commands.transfer.SlaveDirectoryUploadCommand",
+    "uploadMultiple": "buildslave.commands.transfer.SlaveMultipleUploadCommand",
     "downloadFile": "buildslave.commands.transfer.SlaveFileDownloadCommand",
     "svn": "buildslave.commands.svn.SVN",
     "bk": "buildslave.commands.bk.BK",
@@ -42,6 +42,7 @@ class SlaveShellCommand(base.Command):
             logfiles=args.get('logfiles', {}),
             usePTY=args.get('usePTY', "slave-config"),
             logEnviron=args.get('logEnviron', True),
+            compress=args.get('compress'),
         )
         if args.get('interruptSignal'):
             c.interruptSignal = args['interruptSignal']
@@ -13,18 +13,112 @@
 #
 # Copyright Buildbot Team Members
 
+import collections
+import hashlib
 import os
 import tarfile
 import tempfile
+import threading
 
 from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import threads
 from twisted.python import log
 
 from buildslave.commands.base import Command
 
 
+def fileChecksum(path):
+    """Return the hex SHA1 digest of the contents of the file at C{path}"""
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(64 * 1024)
+            if not data:
+                break
+            h.update(data)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
 class TransferCommand(Command):
 
+    # the number of blocks to keep in flight, and the size the blocks may
+    # grow to; set from the 'window' and 'maxblocksize' args
+    window = 1
+    maxblocksize = None
+
+    def setupWindow(self, args):
+        self.window = max(args.get('window') or 1, 1)
+        self.maxblocksize = max(args.get('maxblocksize') or self.blocksize,
+                                self.blocksize)
+
+    def checkUnchanged(self, checksum):
+        """
+        Compare the file at C{self.path} with the C{checksum} the master sent,
+        hashing it in a thread as it may be large.  Fire with True if it
+        matches, so that the transfer can be skipped.
+        """
+        if checksum is None or not os.path.isfile(self.path):
+            return defer.succeed(False)
+        d = threads.deferToThread(fileChecksum, self.path)
+        d.addCallback(lambda digest: digest == checksum)
+
+        @d.addErrback
+        def failed(f):
+            # transfer the file as usual
+            log.msg("could not compute the checksum of '%s'" % (self.path,))
+            log.err(f)
+            return False
+        return d
+
+    def _loop(self, fire_when_done):
+        """
+        Call C{_transferBlock} until it returns, or fires with, a true value,
+        keeping up to C{window} calls in flight.  PB delivers the remote calls,
+        and their answers, in order, so the blocks are written in order.
+        """
+        self._fire_when_done = fire_when_done
+        self._in_flight = 0
+        self._last_block = False
+        self._filling = False
+        self._fill()
+
+    def _fill(self):
+        if self._filling:
+            # blocks finishing synchronously are picked up by the outer call
+            return
+        self._filling = True
+        while (self._fire_when_done and not self._last_block
+               and self._in_flight < self.window):
+            self._in_flight += 1
+            d = defer.maybeDeferred(self._transferBlock)
+            d.addCallbacks(self._blockDone, self._blockFailed)
+        self._filling = False
+
+        if self._fire_when_done and self._last_block and not self._in_flight:
+            d, self._fire_when_done = self._fire_when_done, None
+            d.callback(None)
+
+    def _blockDone(self, finished):
+        self._in_flight -= 1
+        if finished:
+            self._last_block = True
+        elif self.blocksize < self.maxblocksize:
+            # each block that gets through lets the next ones grow, as in TCP
+            # slow start
+            self.blocksize = min(self.blocksize * 2, self.maxblocksize)
+        self._fill()
+
+    def _blockFailed(self, why):
+        self._in_flight -= 1
+        # only the first failure is reported
+        if self._fire_when_done:
+            d, self._fire_when_done = self._fire_when_done, None
+            d.errback(why)
+
     def finished(self, res):
         if self.debug:
             log.msg('finished: stderr=%r, rc=%r' % (self.stderr, self.rc))
@@ -60,6 +154,11 @@ class SlaveFileUploadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['keepstamp']: whether to preserve file modified and accessed times
+        - ['window']:    number of blocks to send without waiting for the
+                         writer (default 1)
+        - ['maxblocksize']: size the blocks may grow to (default blocksize)
+        - ['checksum']:  SHA1 hex digest of the master's existing copy; if the
+                         file matches it, no data is sent
     """
     debug = False
     requiredArgs = ['workdir', 'slavesrc', 'writer', 'blocksize']
@@ -71,6 +170,9 @@ class SlaveFileUploadCommand(TransferCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.keepstamp = args.get('keepstamp', False)
+        self.checksum = args.get('checksum')
+        self.setupWindow(args)
+        self.unchanged = False
         self.stderr = None
         self.rc = 0
 
@@ -98,14 +200,28 @@ class SlaveFileUploadCommand(TransferCommand):
             if self.debug:
                 log.msg("Cannot open file '%s' for upload" % self.path)
 
-        self.sendStatus({'header': "sending %s" % self.path})
-
-        d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if self.fp is not None:
+            d = self.checkUnchanged(self.checksum)
+        else:
+            d = defer.succeed(False)
+
+        @d.addCallback
+        def _send(unchanged):
+            if unchanged:
+                self.unchanged = True
+                self.fp.close()
+                self.sendStatus({'header': "master already has %s" % self.path})
+                return
+            self.sendStatus({'header': "sending %s" % self.path})
+            d1 = defer.Deferred()
+            self._reactor.callLater(0, self._loop, d1)
+            return d1
 
         def _close_ok(res):
             self.fp = None
-            d1 = self.writer.callRemote("close")
+            # the writer keeps the master's copy if the file is unchanged
+            d1 = self.writer.callRemote(
+                "unchanged" if self.unchanged else "close")
 
             def _utime_ok(res):
                 return self.writer.callRemote("utime", accessed_modified)
@@ -130,19 +246,8 @@ class SlaveFileUploadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._writeBlock)
-
-        def _done(finished):
-            if finished:
-                fire_when_done.callback(None)
-            else:
-                self._loop(fire_when_done)
-
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
-        return None
+    def _transferBlock(self):
+        return self._writeBlock()
 
     def _writeBlock(self):
         """Write a block of data to the remote writer"""
@@ -180,7 +285,136 @@ class SlaveFileUploadCommand(TransferCommand):
         return d
 
 
+class _TarStream(object):
+
+    """
+    A tarball of a directory, made in a thread while it is read.  The thread
+    hands the tarball over in chunks of C{chunksize} bytes, and waits while
+    C{slots} chunks are left unread, so the memory used is bounded.
+    """
+
+    def __init__(self, path, mode, chunksize, slots):
+        self.path = path
+        self.mode = mode
+        self.chunksize = chunksize
+        self.slots = threading.Semaphore(slots)
+        self.aborted = False
+
+        # used by the thread
+        self.unsent = ''
+
+        # used in the reactor
+        self.chunks = collections.deque()
+        self.offset = 0
+        self.buffered = 0
+        self.reads = collections.deque()
+        self.finished = False
+        self.failure = None
+
+    def start(self):
+        d = threads.deferToThread(self._makeTar)
+        d.addCallbacks(self._tarDone, self._tarFailed)
+
+    def read(self, length):
+        """
+        Read the next C{length} bytes of the tarball, or the rest of it if
+        it is shorter, via Deferred.
+        """
+        d = defer.Deferred()
+        self.reads.append((length, d))
+        self._serve()
+        return d
+
+    def close(self):
+        # stop the thread, if it is still making the tarball
+        if not self.aborted:
+            self.aborted = True
+            self.slots.release()
+
+    # thread methods
+
+    def _makeTar(self):
+        archive = tarfile.open(mode=self.mode, fileobj=self)
+        archive.add(self.path, '')
+        archive.close()
+        if self.unsent:
+            self._send(self.unsent)
+
+    def write(self, data):
+        # called by tarfile with each piece of the (compressed) tarball
+        data = self.unsent + data
+        while len(data) >= self.chunksize:
+            self._send(data[:self.chunksize])
+            data = data[self.chunksize:]
+        self.unsent = data
+
+    def _send(self, chunk):
+        self.slots.acquire()
+        if self.aborted:
+            raise IOError("tarball no longer needed")
+        reactor.callFromThread(self._received, chunk)
+
+    # reactor methods
+
+    def _received(self, chunk):
+        self.chunks.append(chunk)
+        self.buffered += len(chunk)
+        self._serve()
+
+    def _tarDone(self, _):
+        self.finished = True
+        self._serve()
+
+    def _tarFailed(self, why):
+        self.finished = True
+        self.failure = why
+        self._serve()
+
+    def _serve(self):
+        while self.reads:
+            length, d = self.reads[0]
+            if self.failure:
+                self.reads.popleft()
+                d.errback(self.failure)
+            elif self.buffered >= length or self.finished:
+                self.reads.popleft()
+                d.callback(self._take(length))
+            else:
+                return
+
+    def _take(self, length):
+        parts = []
+        while length and self.chunks:
+            chunk = self.chunks[0]
+            part = chunk[self.offset:self.offset + length]
+            parts.append(part)
+            length -= len(part)
+            self.offset += len(part)
+            self.buffered -= len(part)
+            if self.offset == len(chunk):
+                # the thread may make another chunk in its place
+                self.chunks.popleft()
+                self.offset = 0
+                self.slots.release()
+        return ''.join(parts)
+
+
 class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
+
+    """
+    Upload a directory from slave to build master, as a tarball
+    Arguments:
+
+        - ['workdir']:   base directory to use
+        - ['slavesrc']:  name of the slave-side directory to read from
+        - ['writer']:    RemoteReference to a transfer._DirectoryWriter object
+        - ['maxsize']:   max size (in bytes) of the tarball to write
+        - ['blocksize']: max size for each data block
+        - ['compress']:  compression to use: None, 'gz' or 'bz2'
+        - ['window'], ['maxblocksize']: as for SlaveFileUploadCommand
+        - ['stream']:    if true, send the tarball as it is made, rather than
+                         writing it to a temporary file first
+    """
     debug = False
     requiredArgs = ['workdir', 'slavesrc', 'writer', 'blocksize']
 
@@ -191,6 +425,10 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.compress = args['compress']
+        self.stream = args.get('stream', False)
+        self.setupWindow(args)
+        self.tarname = None
+        self.eof = False
         self.stderr = None
         self.rc = 0
 
@@ -204,28 +442,47 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         if self.debug:
             log.msg("path: %r" % self.path)
 
-        # Create temporary archive
-        fd, self.tarname = tempfile.mkstemp()
-        fileobj = os.fdopen(fd, 'w')
-        if self.compress == 'bz2':
-            mode = 'w|bz2'
-        elif self.compress == 'gz':
-            mode = 'w|gz'
+        if self.stream:
+            # make the archive while it is sent, keeping the window full
+            mode = {'bz2': 'w|bz2', 'gz': 'w|gz'}.get(self.compress, 'w|')
+            self.fp = _TarStream(self.path, mode, self.maxblocksize,
+                                 self.window + 1)
+            self.fp.start()
         else:
-            mode = 'w'
-        archive = tarfile.open(name=self.tarname, mode=mode, fileobj=fileobj)
-        archive.add(self.path, '')
-        archive.close()
-        fileobj.close()
+            # Create temporary archive
+            fd, self.tarname = tempfile.mkstemp()
+            fileobj = os.fdopen(fd, 'w')
+            if self.compress == 'bz2':
+                mode = 'w|bz2'
+            elif self.compress == 'gz':
+                mode = 'w|gz'
+            else:
+                mode = 'w'
+            archive = tarfile.open(name=self.tarname, mode=mode,
+                                   fileobj=fileobj)
+            archive.add(self.path, '')
+            archive.close()
+            fileobj.close()
 
-        # Transfer it
-        self.fp = open(self.tarname, 'rb')
+            # Transfer it
+            self.fp = open(self.tarname, 'rb')
 
         self.sendStatus({'header': "sending %s" % self.path})
 
         d = defer.Deferred()
         self._reactor.callLater(0, self._loop, d)
 
+        def check_size(res):
+            # the stream is only read up to maxsize; if it had not ended by
+            # then, the tarball is truncated
+            if (self.stream and not self.eof and self.remaining is not None
+                    and self.remaining <= 0 and self.stderr is None):
+                self.stderr = "Maximum filesize reached, truncating " \
+                    "directory '%s'" % self.path
+                self.rc = 1
+            return res
+        d.addCallback(check_size)
+
         def unpack(res):
             d1 = self.writer.callRemote("unpack")
 
@@ -239,12 +496,164 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         d.addBoth(self.finished)
         return d
 
+    def _writeBlock(self):
+        if not self.stream:
+            return SlaveFileUploadCommand._writeBlock(self)
+
+        if self.interrupted or self.eof:
+            return True
+
+        length = self.blocksize
+        if self.remaining is not None:
+            length = min(length, self.remaining)
+            if length <= 0:
+                return True
+            # count the block against maxsize as soon as it is requested,
+            # as later blocks may be requested before it arrives
+            self.remaining -= length
+        d = self.fp.read(length)
+        d.addCallback(self._sendData)
+        return d
+
+    def _sendData(self, data):
+        if not data:
+            self.eof = True
+            return True
+        d = self.writer.callRemote('write', data)
+        d.addCallback(lambda res: False)
+        return d
+
     def finished(self, res):
         self.fp.close()
-        os.remove(self.tarname)
+        if self.tarname:
+            os.remove(self.tarname)
         return TransferCommand.finished(self, res)
 
 
+class _UploadStatus(object):
+
+    """
+    Stands in for the SlaveBuilder of each upload run by
+    L{SlaveMultipleUploadCommand}: the upload's headers and stderr are sent
+    on as the command's, and its rc is kept.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.basedir = command.builder.basedir
+        self.rc = None
+
+    def sendUpdate(self, status):
+        status = status.copy()
+        if 'rc' in status:
+            self.rc = status.pop('rc')
+        status.pop('elapsed', None)
+        if status:
+            self.command.sendStatus(status)
+
+
+class SlaveMultipleUploadCommand(Command):
+
+    """
+    Upload several files and directories from slave to build master, running
+    up to maxParallel of the uploads at once within this single command
+    Arguments:
+
+        - ['workdir']:   base directory to use
+        - ['slavesrcs']: names of the slave-side files and directories
+        - ['writers']:   RemoteReference to a transfer._MultipleUploadWriters
+                         object; see below
+        - ['maxParallel']: the most uploads to run at once (default 1)
+        - ['maxsize'], ['blocksize'], ['keepstamp'], ['window'],
+          ['maxblocksize']: as for SlaveFileUploadCommand, for each file
+        - ['compress'], ['stream']: as for SlaveDirectoryUploadCommand, for
+                         each directory
+
+    Each source is uploaded by a SlaveFileUploadCommand or
+    SlaveDirectoryUploadCommand, with the writer returned by
+    writers.open(slavesrc, kind), where kind is 'file' or 'directory'.  When
+    it is done, writers.done(slavesrc, rc) is called.  Once an upload fails,
+    no more are started.
+    """
+    debug = False
+    requiredArgs = ['workdir', 'slavesrcs', 'writers', 'blocksize']
+
+    def setup(self, args):
+        self.workdir = args['workdir']
+        self.slavesrcs = args['slavesrcs']
+        self.writers = args['writers']
+        self.maxParallel = max(args.get('maxParallel') or 1, 1)
+        self.uploads = []
+        self.rc = 0
+
+    def start(self):
+        remaining = iter(self.slavesrcs)
+
+        @defer.inlineCallbacks
+        def uploadSources():
+            for source in remaining:
+                if self.rc or self.interrupted:
+                    break
+                try:
+                    rc = yield self.upload(source)
+                except Exception:
+                    self.rc = 1
+                    raise
+                if rc:
+                    self.rc = rc
+
+        d = defer.DeferredList(
+            [uploadSources()
+             for _ in range(min(self.maxParallel, len(self.slavesrcs)))],
+            consumeErrors=True)
+
+        @d.addCallback
+        def finished(results):
+            # don't use self.sendStatus here, since we may no longer be
+            # running if we have been interrupted
+            self.builder.sendUpdate({'rc': self.rc})
+            for success, value in results:
+                if not success:
+                    return value
+        return d
+
+    @defer.inlineCallbacks
+    def upload(self, source):
+        path = os.path.join(self.builder.basedir, self.workdir,
+                            os.path.expanduser(source))
+        if os.path.isdir(path):
+            kind, factory = 'directory', SlaveDirectoryUploadCommand
+        elif os.path.isfile(path):
+            kind, factory = 'file', SlaveFileUploadCommand
+        else:
+            self.sendStatus({'stderr': "'%s' is neither a regular file, nor "
+                             "a directory\n" % path})
+            yield self.writers.callRemote('done', source, 1)
+            defer.returnValue(1)
+
+        writer = yield self.writers.callRemote('open', source, kind)
+        args = dict(self.args, slavesrc=source, writer=writer)
+        status = _UploadStatus(self)
+        upload = factory(status, self.stepId, args)
+        self.uploads.append(upload)
+        try:
+            yield upload.doStart()
+        finally:
+            self.uploads.remove(upload)
+        yield self.writers.callRemote('done', source, status.rc)
+        defer.returnValue(status.rc)
+
+    def interrupt(self):
+        if self.debug:
+            log.msg('interrupted')
+        if self.interrupted:
+            return
+        self.rc = 1
+        self.interrupted = True
+        for upload in list(self.uploads):
+            upload.doInterrupt()
+
+
 class SlaveFileDownloadCommand(TransferCommand):
 
     """
@@ -257,6 +666,11 @@ class SlaveFileDownloadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['mode']:      access mode for the new file
+        - ['window']:    number of blocks to request without waiting for the
+                         reader (default 1)
+        - ['maxblocksize']: size the blocks may grow to (default blocksize)
+        - ['checksum']:  SHA1 hex digest of the master's file; if the existing
+                         slave-side file matches it, no data is fetched
     """
     debug = False
     requiredArgs = ['workdir', 'slavedest', 'reader', 'blocksize']
@@ -268,6 +682,10 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.bytes_remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.mode = args['mode']
+        self.checksum = args.get('checksum')
+        self.setupWindow(args)
+        self.fp = None
+        self.eof = False
         self.stderr = None
         self.rc = 0
 
@@ -284,6 +702,26 @@ class SlaveFileDownloadCommand(TransferCommand):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        d = self.checkUnchanged(self.checksum)
+        d.addCallback(self._download)
+
+        def _close(res):
+            # close the file, but pass through any errors from _loop
+            d1 = self.reader.callRemote('close')
+            d1.addErrback(log.err, 'while trying to close reader')
+            d1.addCallback(lambda ignored: res)
+            return d1
+        d.addBoth(_close)
+        d.addBoth(self.finished)
+        return d
+
+    def _download(self, unchanged):
+        if unchanged:
+            self.sendStatus({'header': "%s is up to date" % self.path})
+            if self.mode is not None:
+                os.chmod(self.path, self.mode)
+            return
+
         try:
             self.fp = open(self.path, 'wb')
             if self.debug:
@@ -308,34 +746,26 @@ class SlaveFileDownloadCommand(TransferCommand):
         d = defer.Deferred()
         self._reactor.callLater(0, self._loop, d)
 
-        def _close(res):
-            # close the file, but pass through any errors from _loop
-            d1 = self.reader.callRemote('close')
-            d1.addErrback(log.err, 'while trying to close reader')
-            d1.addCallback(lambda ignored: res)
-            return d1
-        d.addBoth(_close)
-        d.addBoth(self.finished)
+        def _check_size(res):
+            # the reads stop at maxsize; if the reader had not reached the
+            # end of the file by then, the file is truncated
+            if (self.fp is not None and not self.eof
+                    and self.bytes_remaining is not None
+                    and self.bytes_remaining <= 0 and self.stderr is None):
+                self.stderr = "Maximum filesize reached, truncating file '%s'" \
+                    % self.path
+                self.rc = 1
+            return res
+        d.addCallback(_check_size)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._readBlock)
-
-        def _done(finished):
-            if finished:
-                fire_when_done.callback(None)
-            else:
-                self._loop(fire_when_done)
-
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
-        return None
+    def _transferBlock(self):
+        return self._readBlock()
 
     def _readBlock(self):
         """Read a block of data from the remote reader."""
 
-        if self.interrupted or self.fp is None:
+        if self.interrupted or self.fp is None or self.eof:
             if self.debug:
                 log.msg('SlaveFileDownloadCommand._readBlock(): end')
             return True
@@ -345,12 +775,12 @@ class SlaveFileDownloadCommand(TransferCommand):
             length = self.bytes_remaining
 
         if length <= 0:
-            if self.stderr is None:
-                self.stderr = "Maximum filesize reached, truncating file '%s'" \
-                    % self.path
-                self.rc = 1
             return True
         else:
+            # count the block against maxsize as soon as it is requested, as
+            # later blocks may be requested before it arrives
+            if self.bytes_remaining is not None:
+                self.bytes_remaining = self.bytes_remaining - length
             d = self.reader.callRemote('read', length)
             d.addCallback(self._writeData)
             return d
@@ -360,11 +790,9 @@ class SlaveFileDownloadCommand(TransferCommand):
             log.msg('SlaveFileDownloadCommand._readBlock(): readlen=%d' %
                     len(data))
         if len(data) == 0:
+            self.eof = True
             return True
 
-        if self.bytes_remaining is not None:
-            self.bytes_remaining = self.bytes_remaining - len(data)
-            assert self.bytes_remaining >= 0
         self.fp.write(data)
         return False
 
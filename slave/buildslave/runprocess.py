@@ -25,6 +25,7 @@ import subprocess
 import sys
 import traceback
 import types
+import zlib
 
 from collections import deque
 from tempfile import NamedTemporaryFile
@@ -249,6 +250,11 @@ class RunProcess:
     BUFFER_SIZE = 64 * 1024
     BUFFER_TIMEOUT = 5
 
+    # With compression, log data shorter than COMPRESS_MIN bytes is sent as
+    # is; longer data is compressed at COMPRESS_LEVEL, favouring speed
+    COMPRESS_MIN = 1024
+    COMPRESS_LEVEL = 1
+
     # For sending elapsed time:
     startTime = None
     elapsedTime = None
@@ -267,7 +273,7 @@ class RunProcess:
                  timeout=None, maxTime=None, sigtermTime=None,
                  initialStdin=None, keepStdout=False, keepStderr=False,
                  logEnviron=True, logfiles={}, usePTY="slave-config",
-                 useProcGroup=True):
+                 useProcGroup=True, compress=None):
         """
 
         @param keepStdout: if True, we keep a copy of all the stdout text
@@ -281,6 +287,9 @@ class RunProcess:
 
         @param useProcGroup: (default True) use a process group for non-PTY
             process invocations
+
+        @param compress: None, or 'zlib' to compress the log data sent to the
+            master
         """
 
         self.builder = builder
@@ -359,6 +368,7 @@ class RunProcess:
         self.logEnviron = logEnviron
         self.timeout = timeout
         self.ioTimeoutTimer = None
+        self.ioTimeoutPaused = False
         self.sigtermTime = sigtermTime
         self.maxTime = maxTime
         self.maxTimeoutTimer = None
@@ -392,6 +402,12 @@ class RunProcess:
             useProcGroup = True
         self.useProcGroup = useProcGroup
 
+        if compress not in (None, 'zlib'):
+            log.msg("unknown compression %r; sending logs uncompressed"
+                    % (compress,))
+            compress = None
+        self.compress = compress
+
         self.logFileWatchers = []
         for name, filevalue in self.logfiles.items():
             filename = filevalue
@@ -549,6 +565,9 @@ class RunProcess:
             self.workdir,
             usePTY=self.usePTY)
 
+        # stop reading output while the master is catching up with it
+        self.builder.registerUpdateProducer(self)
+
         # set up timeouts
 
         if self.timeout:
@@ -636,8 +655,35 @@ class RunProcess:
         if not msg:
             return
         msg = self._collapseMsg(msg)
+        if self.compress:
+            msg = self._compressMsg(msg)
         self.sendStatus(msg)
 
+    def _compressMsg(self, msg):
+        """
+        Move the log data in msg that is worth compressing under a 'zlib' key,
+        compressed, keeping the shape of the original message
+        """
+        compressed = {}
+        for key, value in msg.items():
+            if key == 'log':
+                logname, data = value
+            else:
+                data = value
+            if len(data) < self.COMPRESS_MIN:
+                continue
+            zdata = zlib.compress(data, self.COMPRESS_LEVEL)
+            if len(zdata) >= len(data):
+                continue
+            del msg[key]
+            if key == 'log':
+                compressed[key] = (logname, zdata)
+            else:
+                compressed[key] = zdata
+        if compressed:
+            msg['zlib'] = compressed
+        return msg
+
     def _bufferTimeout(self):
         self.sendBuffersTimer = None
         self._sendBuffers()
@@ -657,10 +703,9 @@ class RunProcess:
             # If this log is different than the last one, then we have to send
             # out the message so far.  This is because the message is
             # transferred as a dictionary, which makes the ordering of keys
-            # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
+            # unspecified.  The builder sends queued messages to the master
+            # together, in order, so interleaving logs does not cost a
+            # remote call for each switch.
             # On our first pass through this loop lastlog is None
             if lastlog is None:
                 lastlog = logname
@@ -742,6 +787,7 @@ class RunProcess:
             # this will send the final updates
             w.stop()
         self._sendBuffers()
+        self.builder.unregisterUpdateProducer(self)
         if sig is not None:
             rc = -1
         if self.sendRC:
@@ -760,6 +806,7 @@ class RunProcess:
 
     def failed(self, why):
         self._sendBuffers()
+        self.builder.unregisterUpdateProducer(self)
         log.msg("RunProcess.failed: command failed: %s" % (why,))
         self._cancelTimers()
         d = self.deferred
@@ -769,6 +816,26 @@ class RunProcess:
         else:
             log.msg("Hey, command %s finished twice" % self)
 
+    # IPushProducer methods, called by the builder
+
+    def pauseProducing(self):
+        if self.process:
+            self.process.pauseProducing()
+        # no output is read while paused, so it is not a sign of a hung
+        # command; suspend the timeout until the master has caught up
+        if self.ioTimeoutTimer:
+            self.ioTimeoutTimer.cancel()
+            self.ioTimeoutTimer = None
+            self.ioTimeoutPaused = True
+
+    def resumeProducing(self):
+        if self.process:
+            self.process.resumeProducing()
+        if self.ioTimeoutPaused:
+            self.ioTimeoutPaused = False
+            self.ioTimeoutTimer = self._reactor.callLater(self.timeout,
+                                                          self.doTimeout)
+
     def doTimeout(self):
         self.ioTimeoutTimer = None
         msg = "command timed out: %d seconds without output running %s" % (self.timeout, self.fake_command)
@@ -909,3 +976,4 @@ class RunProcess:
             if timer:
                 timer.cancel()
                 setattr(self, timerName, None)
+        self.ioTimeoutPaused = False
@@ -107,7 +107,8 @@ class FakeRunProcess:
                               sendStdout=True, sendStderr=True, sendRC=True,
                               timeout=None, maxTime=None, sigtermTime=None, initialStdin=None,
                               keepStdout=False, keepStderr=False,
-                              logEnviron=True, logfiles={}, usePTY="slave-config")
+                              logEnviron=True, logfiles={}, usePTY="slave-config",
+                              compress=None)
 
         if not self._expectations:
             raise AssertionError("unexpected instantiation: %s" % (kwargs,))
@@ -30,11 +30,19 @@ class FakeSlaveBuilder:
         self.basedir = basedir
         self.usePTY = usePTY
         self.unicode_encoding = 'utf-8'
+        self.producers = []
 
     def sendUpdate(self, data):
         if self.debug:
             print "FakeSlaveBuilder.sendUpdate", data
         self.updates.append(data)
 
+    def registerUpdateProducer(self, producer):
+        self.producers.append(producer)
+
+    def unregisterUpdateProducer(self, producer):
+        if producer in self.producers:
+            self.producers.remove(producer)
+
     def show(self):
         return pprint.pformat(self.updates)
@@ -205,6 +205,72 @@ class FakeStep(object):
         self.finished_d.callback(None)
 
 
+class SlowStep(FakeStep):
+
+    "A fake step that acknowledges updates only when told to."
+
+    def __init__(self):
+        FakeStep.__init__(self)
+        self.acks = []
+
+    def remote_update(self, updates):
+        FakeStep.remote_update(self, updates)
+        d = defer.Deferred()
+        self.acks.append(d)
+        return d
+
+    def ack(self):
+        self.acks.pop(0).callback(None)
+
+
+class FakeProducer(object):
+
+    def __init__(self):
+        self.paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+class FakeUploadWriters(object):
+
+    "A fake master-side writer factory for the uploadMultiple command."
+
+    def __init__(self):
+        self.events = []
+        self.data = {}
+        # the uploads writing at once, and the most there have been
+        self.writing = set()
+        self.max_writing = 0
+
+    def remote_open(self, source, kind):
+        self.events.append(('open', source, kind))
+        self.data[source] = ''
+        writers = self
+
+        class Writer(object):
+
+            def remote_write(self, data):
+                writers.data[source] += data
+                writers.writing.add(source)
+                writers.max_writing = max(writers.max_writing,
+                                          len(writers.writing))
+                # acknowledge the write a little later, as over a network
+                d = defer.Deferred()
+                reactor.callLater(0.01, d.callback, None)
+                return d
+
+            def remote_close(self):
+                writers.writing.discard(source)
+        return FakeRemote(Writer())
+
+    def remote_done(self, source, rc):
+        self.events.append(('done', source, rc))
+
+
 class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
 
     @defer.deferredGenerator
@@ -366,6 +432,41 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_startCommand_uploadMultiple(self):
+        # several uploads run at once within a single command, as the slave
+        # builder runs only one command at a time
+        st = FakeStep()
+        writers = FakeUploadWriters()
+        workdir = os.path.join(self.basedir, 'sb', 'workdir')
+        os.makedirs(workdir)
+        for name in 'a', 'b', 'c':
+            open(os.path.join(workdir, name), 'wb').write(name * 1000)
+
+        yield self.sb.callRemote("startCommand", FakeRemote(st),
+                                 "13", "uploadMultiple", dict(
+                                     workdir='workdir',
+                                     slavesrcs=['a', 'b', 'c'],
+                                     writers=FakeRemote(writers),
+                                     maxParallel=2,
+                                     maxsize=None,
+                                     blocksize=256,
+                                     compress=None,
+                                 ))
+        yield st.wait_for_finish()
+
+        self.assertEqual(writers.max_writing, 2)
+        self.assertEqual(sorted(writers.events),
+                         [('done', 'a', 0), ('done', 'b', 0), ('done', 'c', 0),
+                          ('open', 'a', 'file'), ('open', 'b', 'file'),
+                          ('open', 'c', 'file')])
+        self.assertEqual(writers.data,
+                         dict(a='a' * 1000, b='b' * 1000, c='c' * 1000))
+        updates = [u[0] for action in st.actions if action[0] == 'update'
+                   for u in action[1]]
+        self.assertEqual([u['rc'] for u in updates if 'rc' in u], [0])
+        self.assertEqual(st.actions[-1], ['complete', None])
+
     def test_startCommand_missing_args(self):
         # set up a fake step to receive updates
         st = FakeStep()
@@ -380,6 +481,81 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addErrback(lambda _: True)
         return d
 
+    def startSlowStep(self):
+        st = SlowStep()
+        sb = self.sb.original
+        sb.remoteStep = FakeRemote(st)
+        return sb, st
+
+    def test_sendUpdate_batched(self):
+        sb, st = self.startSlowStep()
+        sb.sendUpdate({'stdout': 'a'})
+        sb.sendUpdate({'stderr': 'b'})
+        sb.sendUpdate({'stdout': 'c'})
+        # the later updates wait for the first to be acknowledged
+        self.assertEqual(st.actions, [
+            ['update', [[{'stdout': 'a'}, 0]]],
+        ])
+        st.ack()
+        self.assertEqual(st.actions[1:], [
+            ['update', [[{'stderr': 'b'}, 0], [{'stdout': 'c'}, 0]]],
+        ])
+        st.ack()
+        self.assertFalse(sb.updateInFlight)
+        self.assertEqual(sb.updateQueue, [])
+
+    def test_sendUpdate_maxUpdateBytes(self):
+        sb, st = self.startSlowStep()
+        sb.maxUpdateBytes = 10
+        for data in ['a', 'bbbbbb', 'cccccc', 'ddddddddddddddd']:
+            sb.sendUpdate({'stdout': data})
+        st.ack()
+        st.ack()
+        st.ack()
+        self.assertEqual([a[1] for a in st.actions], [
+            [[{'stdout': 'a'}, 0]],
+            [[{'stdout': 'bbbbbb'}, 0]],
+            [[{'stdout': 'cccccc'}, 0]],
+            [[{'stdout': 'ddddddddddddddd'}, 0]],
+        ])
+
+    def test_sendUpdate_pauses_producers(self):
+        sb, st = self.startSlowStep()
+        sb.maxUpdateBytes = 10
+        producer = FakeProducer()
+        sb.registerUpdateProducer(producer)
+        sb.sendUpdate({'stdout': 'a'})
+        sb.sendUpdate({'stdout': 'bbbbbb'})
+        self.assertFalse(producer.paused)
+        sb.sendUpdate({'stdout': 'cccccc'})
+        self.assertTrue(producer.paused)
+        # producers registered while paused start paused
+        later = FakeProducer()
+        sb.registerUpdateProducer(later)
+        self.assertTrue(later.paused)
+        st.ack()
+        # 6 bytes are still queued, more than half of maxUpdateBytes
+        self.assertTrue(producer.paused)
+        st.ack()
+        self.assertFalse(producer.paused)
+        self.assertFalse(later.paused)
+        sb.unregisterUpdateProducer(producer)
+        sb.unregisterUpdateProducer(later)
+        self.assertEqual(sb.updateProducers, [])
+
+    def test_commandComplete_flushes_updates(self):
+        sb, st = self.startSlowStep()
+        sb.sendUpdate({'stdout': 'a'})
+        sb.sendUpdate({'stdout': 'b'})
+        sb.sendUpdate({'rc': 0})
+        sb.commandComplete(None)
+        self.assertEqual(st.actions, [
+            ['update', [[{'stdout': 'a'}, 0]]],
+            ['update', [[{'stdout': 'b'}, 0], [{'rc': 0}, 0]]],
+            ['complete', None],
+        ])
+        self.assertEqual(sb.updateQueue, [])
+
 
 class TestBotFactory(unittest.TestCase):
 
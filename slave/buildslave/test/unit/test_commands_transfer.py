@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import StringIO
+import hashlib
 import os
 import shutil
 import sys
@@ -53,6 +54,10 @@ class FakeMasterMethods(object):
         self.read = False
         self.data = ''
 
+        # the most delayed writes or reads outstanding at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+
     def remote_write(self, data):
         if self.write_out_of_space_at is not None:
             self.write_out_of_space_at -= len(data)
@@ -69,9 +74,19 @@ class FakeMasterMethods(object):
             self.data += data
 
         if self.delay_write:
-            d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, None)
-            return d
+            return self._delay(None)
+
+    def _delay(self, result):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        d = defer.Deferred()
+        reactor.callLater(0.01, d.callback, result)
+
+        @d.addCallback
+        def landed(result):
+            self.in_flight -= 1
+            return result
+        return d
 
     def remote_read(self, length):
         if self.count_reads:
@@ -85,9 +100,7 @@ class FakeMasterMethods(object):
 
         slice, self.data = self.data[:length], self.data[length:]
         if self.delay_read:
-            d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, slice)
-            return d
+            return self._delay(slice)
         else:
             return slice
 
@@ -102,6 +115,9 @@ class FakeMasterMethods(object):
     def remote_close(self):
         self.add_update('close')
 
+    def remote_unchanged(self):
+        self.add_update('unchanged')
+
 
 class TestUploadFile(CommandTestMixin, unittest.TestCase):
 
@@ -280,6 +296,135 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_window(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.delay_write = True
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=32,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 32', 'write 32', 'write 32', 'write 32', 'write 32',
+                'write 20', 'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(self.fakemaster.max_in_flight, 4)
+            self.assertEqual(self.fakemaster.data, "this is some data\n" * 10)
+        d.addCallback(check)
+        return d
+
+    def test_maxblocksize(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=16,
+            keepstamp=False,
+            maxblocksize=64,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 16', 'write 32', 'write 64', 'write 64', 'write 4',
+                'close',
+                {'rc': 0}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_window_out_of_space(self):
+        self.fakemaster.write_out_of_space_at = 70
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, RuntimeError)
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'close',
+                {'rc': 1}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_checksum_unchanged(self):
+        checksum = hashlib.sha1("this is some data\n" * 10).hexdigest()
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            checksum=checksum,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'master already has %s' % self.datafile},
+                'unchanged',
+                {'rc': 0}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_checksum_changed(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        checksum = hashlib.sha1("some other data\n").hexdigest()
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            checksum=checksum,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'write 64', 'write 52', 'close',
+                {'rc': 0}
+            ])
+        d.addCallback(check)
+        return d
+
 
 class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
@@ -374,10 +519,233 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
         return d
 
+    def test_stream(self, compress=None, **args):
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=compress,
+            stream=True,
+            **args
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'write(s)', 'unpack',
+                {'rc': 0}
+            ])
+            f = StringIO.StringIO(self.fakemaster.data)
+            a = tarfile.open(fileobj=f, name='check.tar')
+            got = dict((n.rstrip('/') or '.', a.extractfile(n).read())
+                       for n in a.getnames() if n.strip('./'))
+            self.assertEqual(got, {'aa': "lots of a" * 100,
+                                   'bb': "and a little b" * 17})
+            a.close()
+        d.addCallback(check)
+        return d
+
+    def test_stream_bz2(self):
+        return self.test_stream('bz2')
+
+    def test_stream_gz(self):
+        return self.test_stream('gz')
+
+    def test_stream_window(self):
+        self.fakemaster.delay_write = True
+        d = self.test_stream(window=3, maxblocksize=1024)
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.fakemaster.max_in_flight, 3)
+        return d
+
+    def test_stream_large(self):
+        # many more chunks than the stream holds at once
+        data = os.urandom(100 * 1024)
+        open(os.path.join(self.datadir, "aa"), "wb").write(data)
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=1000,
+            compress='gz',
+            stream=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            f = StringIO.StringIO(self.fakemaster.data)
+            a = tarfile.open(fileobj=f, name='check.tar')
+            self.assertEqual(a.extractfile('aa').read(), data)
+            a.close()
+        d.addCallback(check)
+        return d
+
+    def test_stream_truncated(self):
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=512,
+            compress=None,
+            stream=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'write(s)', 'unpack',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating directory "
+                 "'%s'" % self.datadir}
+            ])
+            self.assertEqual(len(self.fakemaster.data), 1000)
+        d.addCallback(check)
+        return d
+
     # this is just a subclass of SlaveUpload, so the remaining permutations
     # are already tested
 
 
+class FakeUploadWriters(object):
+    # a fake transfer._MultipleUploadWriters, opening a FakeMasterMethods
+    # writer for each source
+
+    def __init__(self, add_update):
+        self.add_update = add_update
+        self.writers = {}
+        self.delay_write = False
+
+    def remote_open(self, source, kind):
+        self.add_update('open %s %s' % (source, kind))
+        writer = FakeMasterMethods(lambda upd: None)
+        writer.keep_data = True
+        writer.delay_write = self.delay_write
+        self.writers[source] = writer
+        return FakeRemote(writer)
+
+    def remote_done(self, source, rc):
+        self.add_update('done %s %d' % (source, rc))
+
+
+class TestMultipleUpload(CommandTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpCommand()
+
+        self.writers = FakeUploadWriters(self.add_update)
+
+        # write files and a directory to upload
+        self.datadir = os.path.join(self.basedir, 'workdir')
+        os.makedirs(os.path.join(self.datadir, 'dir'))
+        for name in 'a', 'b', 'c', os.path.join('dir', 'd'):
+            open(os.path.join(self.datadir, name), "wb").write(
+                "%s data\n" % name * 100)
+
+    def tearDown(self):
+        self.tearDownCommand()
+
+    def make(self, slavesrcs, maxParallel):
+        self.make_command(transfer.SlaveMultipleUploadCommand, dict(
+            workdir='workdir',
+            slavesrcs=slavesrcs,
+            writers=FakeRemote(self.writers),
+            maxParallel=maxParallel,
+            maxsize=None,
+            blocksize=64,
+            compress=None,
+        ))
+
+    def test_simple(self):
+        self.make(['a', 'dir'], 1)
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'open a file',
+                {'header': 'sending %s' % os.path.join(self.datadir, 'a')},
+                'done a 0',
+                'open dir directory',
+                {'header': 'sending %s' % os.path.join(self.datadir, 'dir')},
+                'done dir 0',
+                {'rc': 0}
+            ])
+            self.assertEqual(self.writers.writers['a'].data, "a data\n" * 100)
+            f = StringIO.StringIO(self.writers.writers['dir'].data)
+            archive = tarfile.open(fileobj=f)
+            self.assertEqual(archive.extractfile('d').read(),
+                             "dir/d data\n" * 100)
+        d.addCallback(check)
+        return d
+
+    def test_parallel(self):
+        self.writers.delay_write = True
+        self.make(['a', 'b', 'c'], 2)
+        d = self.run_command()
+
+        def check(_):
+            events = [u for u in self.get_updates()
+                      if isinstance(u, str)]
+            # a and b are uploaded at once, and c once one of them is done
+            self.assertEqual(events[:2], ['open a file', 'open b file'])
+            self.assertEqual(events[3], 'open c file')
+            self.assertEqual(sorted(events),
+                             ['done a 0', 'done b 0', 'done c 0',
+                              'open a file', 'open b file', 'open c file'])
+            self.assertIn({'rc': 0}, self.get_updates())
+            for name in 'a', 'b', 'c':
+                self.assertEqual(self.writers.writers[name].data,
+                                 "%s data\n" % name * 100)
+        d.addCallback(check)
+        return d
+
+    def test_missing(self):
+        self.make(['missing', 'a'], 1)
+        d = self.run_command()
+
+        def check(_):
+            # no more uploads are started once one fails
+            self.assertUpdates([
+                {'stderr': "'%s' is neither a regular file, nor a "
+                 "directory\n" % os.path.join(self.datadir, 'missing')},
+                'done missing 1',
+                {'rc': 1}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_interrupted(self):
+        self.writers.delay_write = True
+        self.make(['a', 'b'], 2)
+        d = self.run_command()
+        self.cmd.doInterrupt()
+
+        def check(_):
+            self.assertIn({'rc': 1}, self.get_updates())
+            self.assertEqual(sorted(u for u in self.get_updates()
+                                    if isinstance(u, str)),
+                             ['done a 1', 'done b 1',
+                              'open a file', 'open b file'])
+        d.addCallback(check)
+        return d
+
+
 class TestDownloadFile(CommandTestMixin, unittest.TestCase):
 
     def setUp(self):
@@ -534,3 +902,168 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
             ])
         dl.addCallback(check)
         return dl
+
+    def test_window(self):
+        self.fakemaster.data = test_data = '1234' * 13
+        self.fakemaster.delay_read = True
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=16,
+            mode=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'read(s)', 'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(self.fakemaster.max_in_flight, 4)
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_window_truncated(self):
+        self.fakemaster.data = test_data = 'tenchars--' * 10
+        self.fakemaster.delay_read = True
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=50,
+            blocksize=16,
+            mode=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'read(s)', 'close',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'"
+                 % os.path.join(self.basedir, '.', 'data')}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data[:50])
+        d.addCallback(check)
+        return d
+
+    def test_window_under_maxsize(self):
+        # the reads in flight reach maxsize, but the file ends first
+        self.fakemaster.data = test_data = 'tenchars--' * 4
+        self.fakemaster.delay_read = True
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=64,
+            blocksize=16,
+            mode=None,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'read(s)', 'close',
+                {'rc': 0}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_maxblocksize(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data = '1234' * 13
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=8,
+            mode=None,
+            maxblocksize=32,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'read 8', 'read 16', 'read 32', 'read 32', 'close',
+                {'rc': 0}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_checksum_unchanged(self):
+        self.fakemaster.data = test_data = '1234' * 13
+        datafile = os.path.join(self.basedir, 'data')
+        open(datafile, 'wb').write(test_data)
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=0700,
+            checksum=hashlib.sha1(test_data).hexdigest(),
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': '%s is up to date'
+                 % os.path.join(self.basedir, '.', 'data')},
+                'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(open(datafile).read(), test_data)
+            if runtime.platformType != 'win32':
+                self.assertEqual(os.stat(datafile).st_mode & 0777, 0700)
+        d.addCallback(check)
+        return d
+
+    def test_checksum_changed(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data = '1234' * 13
+        datafile = os.path.join(self.basedir, 'data')
+        open(datafile, 'wb').write('an older version')
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            checksum=hashlib.sha1(test_data).hexdigest(),
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                'read 32', 'read 32', 'read 32', 'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
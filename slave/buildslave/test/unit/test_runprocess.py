@@ -18,6 +18,7 @@ import re
 import signal
 import sys
 import time
+import zlib
 
 from mock import Mock
 
@@ -108,6 +109,72 @@ class TestRunProcess(BasedirMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def testCompress(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello' * 1000),
+                                  self.basedir, compress='zlib')
+
+        d = s.start()
+
+        def check(ign):
+            compressed = [u['zlib']['stdout'] for u in b.updates
+                          if 'stdout' in u.get('zlib', {})]
+            self.assertEqual(len(compressed), 1, b.show())
+            self.assertEqual(zlib.decompress(compressed[0]),
+                             nl('hello' * 1000 + '\n'))
+            self.failIf([u for u in b.updates if 'stdout' in u], b.show())
+            self.failUnless({'rc': 0} in b.updates, b.show())
+        d.addCallback(check)
+        return d
+
+    def testCompressShort(self):
+        # short output is not worth compressing
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  compress='zlib')
+
+        d = s.start()
+
+        def check(ign):
+            self.failUnless({'stdout': nl('hello\n')} in b.updates, b.show())
+            self.failIf([u for u in b.updates
+                         if 'stdout' in u.get('zlib', {})], b.show())
+        d.addCallback(check)
+        return d
+
+    def testCompressUnknown(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  compress='lzma')
+        self.assertEqual(s.compress, None)
+
+    def testCompressLogfile(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  compress='zlib')
+        data = 'compressible\n' * 100
+        msg = s._compressMsg({'log': ('test.log', data)})
+        self.assertEqual(msg.keys(), ['zlib'])
+        logname, zdata = msg['zlib']['log']
+        self.assertEqual(logname, 'test.log')
+        self.assertEqual(zlib.decompress(zdata), data)
+
+    def testUpdateProducer(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+
+        d = s.start()
+        # the builder can pause the process while it is running
+        self.assertEqual(b.producers, [s])
+        s.pauseProducing()
+        s.resumeProducing()
+
+        def check(ign):
+            self.failUnless({'stdout': nl('hello\n')} in b.updates, b.show())
+            self.assertEqual(b.producers, [])
+        d.addCallback(check)
+        return d
+
     def testNoStdout(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir, sendStdout=False)
@@ -328,6 +395,30 @@ class TestRunProcess(BasedirMixin, unittest.TestCase):
         clock.advance(6)
         return d
 
+    def testCommandTimeoutPaused(self):
+        # the no-output timeout does not run while the builder has paused the
+        # process, and starts over when it is resumed
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, sleepCommand(10), self.basedir, timeout=5)
+        clock = task.Clock()
+        s._reactor = clock
+        d = s.start()
+
+        clock.advance(4)
+        s.pauseProducing()
+        clock.advance(10)
+        s.resumeProducing()
+        clock.advance(4)
+        self.failIf(d.called)
+        self.failIf([u for u in b.updates if 'timed out' in u.get('header', '')],
+                    b.show())
+
+        def check(ign):
+            self.failUnless({'rc': FATAL_RC} in b.updates, b.show())
+        d.addCallback(check)
+        clock.advance(2)
+        return d
+
     def testCommandMaxTime(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b, sleepCommand(10), self.basedir, maxTime=5)